@@ -0,0 +1,64 @@
+"""add employee current compensation projection
+
+Revision ID: 1c2d3e4f5a6b
+Revises: 8b1d2e3f4a5c
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "1c2d3e4f5a6b"
+down_revision: Union[str, Sequence[str], None] = "8b1d2e3f4a5c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "employee_current_compensation",
+        sa.Column("employee_id", sa.Integer(), sa.ForeignKey("employees.id"), nullable=False),
+        sa.Column("financial_record_id", sa.Integer(), sa.ForeignKey("financial_records.id"), nullable=False),
+        sa.Column("created_at", sa.String(), nullable=True),
+        sa.Column("last_raise_date", sa.String(), nullable=True),
+        sa.Column("created_at_dt", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("last_raise_date_dt", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("base_net", sa.Integer(), nullable=True),
+        sa.Column("base_gross", sa.Integer(), nullable=True),
+        sa.Column("kpi_net", sa.Integer(), nullable=True),
+        sa.Column("kpi_gross", sa.Integer(), nullable=True),
+        sa.Column("bonus_net", sa.Integer(), nullable=True),
+        sa.Column("bonus_gross", sa.Integer(), nullable=True),
+        sa.Column("total_net", sa.Integer(), nullable=True),
+        sa.Column("total_gross", sa.Integer(), nullable=True),
+        sa.Column("updated_at", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("employee_id"),
+    )
+    op.create_index(
+        "ix_employee_current_compensation_total_net",
+        "employee_current_compensation",
+        ["total_net"],
+    )
+
+    # Backfill from the latest financial record of every employee
+    op.execute(
+        "INSERT INTO employee_current_compensation ("
+        "employee_id, financial_record_id, created_at, last_raise_date, created_at_dt, last_raise_date_dt, "
+        "base_net, base_gross, kpi_net, kpi_gross, bonus_net, bonus_gross, total_net, total_gross, updated_at) "
+        "SELECT fr.employee_id, fr.id, fr.created_at, fr.last_raise_date, fr.created_at_dt, fr.last_raise_date_dt, "
+        "fr.base_net, fr.base_gross, fr.kpi_net, fr.kpi_gross, fr.bonus_net, fr.bonus_gross, fr.total_net, fr.total_gross, "
+        "CAST(CURRENT_TIMESTAMP AS VARCHAR) "
+        "FROM financial_records fr "
+        "JOIN (SELECT employee_id, MAX(id) AS max_id FROM financial_records "
+        "WHERE employee_id IS NOT NULL GROUP BY employee_id) latest ON fr.id = latest.max_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_employee_current_compensation_total_net", table_name="employee_current_compensation")
+    op.drop_table("employee_current_compensation")
@@ -0,0 +1,75 @@
+"""add compensation history intervals
+
+Revision ID: 2d3e4f5a6b7c
+Revises: 1c2d3e4f5a6b
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "2d3e4f5a6b7c"
+down_revision: Union[str, Sequence[str], None] = "1c2d3e4f5a6b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "compensation_history",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("employee_id", sa.Integer(), sa.ForeignKey("employees.id"), nullable=False),
+        sa.Column("financial_record_id", sa.Integer(), sa.ForeignKey("financial_records.id"), nullable=False),
+        sa.Column("valid_from", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("valid_to", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("base_net", sa.Integer(), nullable=True),
+        sa.Column("base_gross", sa.Integer(), nullable=True),
+        sa.Column("kpi_net", sa.Integer(), nullable=True),
+        sa.Column("kpi_gross", sa.Integer(), nullable=True),
+        sa.Column("bonus_net", sa.Integer(), nullable=True),
+        sa.Column("bonus_gross", sa.Integer(), nullable=True),
+        sa.Column("total_net", sa.Integer(), nullable=True),
+        sa.Column("total_gross", sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_compensation_history_id", "compensation_history", ["id"])
+    op.create_index("ix_compensation_history_valid_range", "compensation_history", ["valid_from", "valid_to"])
+    op.create_index(
+        "ix_compensation_history_employee_valid_from",
+        "compensation_history",
+        ["employee_id", "valid_from"],
+    )
+
+    # Backfill: every record is valid from its raise date, else its creation date, until the
+    # next record of the employee — the order of services.compensation_service.effective_from.
+    # created_at_dt/last_raise_date_dt were populated by b7c8d9e0f1a2.
+    op.execute(
+        "INSERT INTO compensation_history ("
+        "employee_id, financial_record_id, valid_from, valid_to, "
+        "base_net, base_gross, kpi_net, kpi_gross, bonus_net, bonus_gross, total_net, total_gross) "
+        "SELECT employee_id, id, valid_from, valid_to, "
+        "base_net, base_gross, kpi_net, kpi_gross, bonus_net, bonus_gross, total_net, total_gross "
+        "FROM ("
+        "  SELECT fr.*, COALESCE(fr.last_raise_date_dt, fr.created_at_dt) AS valid_from, "
+        "         LEAD(COALESCE(fr.last_raise_date_dt, fr.created_at_dt)) OVER ("
+        "             PARTITION BY fr.employee_id "
+        "             ORDER BY COALESCE(fr.last_raise_date_dt, fr.created_at_dt), fr.id"
+        "         ) AS valid_to "
+        "  FROM financial_records fr "
+        "  WHERE fr.employee_id IS NOT NULL "
+        "    AND COALESCE(fr.last_raise_date_dt, fr.created_at_dt) IS NOT NULL"
+        ") intervals "
+        "WHERE valid_to IS NULL OR valid_to > valid_from"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_compensation_history_employee_valid_from", table_name="compensation_history")
+    op.drop_index("ix_compensation_history_valid_range", table_name="compensation_history")
+    op.drop_index("ix_compensation_history_id", table_name="compensation_history")
+    op.drop_table("compensation_history")
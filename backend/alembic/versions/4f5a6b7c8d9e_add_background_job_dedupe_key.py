@@ -0,0 +1,29 @@
+"""add dedupe key to background jobs
+
+Revision ID: 4f5a6b7c8d9e
+Revises: 3e4f5a6b7c8d
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "4f5a6b7c8d9e"
+down_revision: Union[str, Sequence[str], None] = "3e4f5a6b7c8d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("background_jobs", sa.Column("dedupe_key", sa.String(), nullable=True))
+    op.create_index("ix_background_jobs_dedupe_key", "background_jobs", ["dedupe_key"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_background_jobs_dedupe_key", table_name="background_jobs")
+    op.drop_column("background_jobs", "dedupe_key")
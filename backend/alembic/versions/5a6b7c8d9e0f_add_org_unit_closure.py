@@ -0,0 +1,54 @@
+"""add org unit closure table
+
+Revision ID: 5a6b7c8d9e0f
+Revises: 4f5a6b7c8d9e
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5a6b7c8d9e0f"
+down_revision: Union[str, Sequence[str], None] = "4f5a6b7c8d9e"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "org_unit_closure",
+        sa.Column(
+            "ancestor_id", sa.Integer(),
+            sa.ForeignKey("organization_units.id", ondelete="CASCADE"), nullable=False,
+        ),
+        sa.Column(
+            "descendant_id", sa.Integer(),
+            sa.ForeignKey("organization_units.id", ondelete="CASCADE"), nullable=False,
+        ),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("ancestor_id", "descendant_id"),
+    )
+    op.create_index("ix_org_unit_closure_descendant", "org_unit_closure", ["descendant_id", "ancestor_id"])
+
+    # Backfill: every unit with itself and all its ancestors (depth bound guards against cycles)
+    op.execute(
+        "INSERT INTO org_unit_closure (ancestor_id, descendant_id, depth) "
+        "WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS ("
+        "SELECT id, id, 0 FROM organization_units "
+        "UNION ALL "
+        "SELECT tree.ancestor_id, ou.id, tree.depth + 1 FROM tree "
+        "JOIN organization_units ou ON ou.parent_id = tree.descendant_id "
+        "WHERE tree.depth < 64"
+        ") "
+        "SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_org_unit_closure_descendant", table_name="org_unit_closure")
+    op.drop_table("org_unit_closure")
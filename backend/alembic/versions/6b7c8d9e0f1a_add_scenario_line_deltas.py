@@ -0,0 +1,57 @@
+"""add copy-on-write scenario line deltas
+
+Revision ID: 6b7c8d9e0f1a
+Revises: 5a6b7c8d9e0f
+Create Date: 2026-10-17 20:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "6b7c8d9e0f1a"
+down_revision: Union[str, Sequence[str], None] = "5a6b7c8d9e0f"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing scenarios keep their full copies in planning_lines
+    op.add_column(
+        "scenarios",
+        sa.Column("storage", sa.String(), nullable=False, server_default="snapshot"),
+    )
+    op.create_table(
+        "scenario_line_deltas",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("scenario_id", sa.Integer(), sa.ForeignKey("scenarios.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("live_line_id", sa.Integer(), sa.ForeignKey("planning_lines.id", ondelete="CASCADE"), nullable=True),
+        sa.Column("op", sa.String(), nullable=False),
+        sa.Column("position_title", sa.String(), nullable=True),
+        sa.Column("branch_id", sa.Integer(), sa.ForeignKey("organization_units.id"), nullable=True),
+        sa.Column("department_id", sa.Integer(), sa.ForeignKey("organization_units.id"), nullable=True),
+        sa.Column("schedule", sa.String(), nullable=True),
+        sa.Column("count", sa.Integer(), nullable=True),
+        sa.Column("bonus_count", sa.Integer(), nullable=True),
+        sa.Column("base_net", sa.Integer(), nullable=True),
+        sa.Column("base_gross", sa.Integer(), nullable=True),
+        sa.Column("kpi_net", sa.Integer(), nullable=True),
+        sa.Column("kpi_gross", sa.Integer(), nullable=True),
+        sa.Column("bonus_net", sa.Integer(), nullable=True),
+        sa.Column("bonus_gross", sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("scenario_id", "live_line_id", name="uq_scenario_line_deltas_live_line"),
+    )
+    op.create_index("ix_scenario_line_deltas_id", "scenario_line_deltas", ["id"])
+    op.create_index("ix_scenario_line_deltas_scenario_id", "scenario_line_deltas", ["scenario_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_scenario_line_deltas_scenario_id", table_name="scenario_line_deltas")
+    op.drop_index("ix_scenario_line_deltas_id", table_name="scenario_line_deltas")
+    op.drop_table("scenario_line_deltas")
+    op.drop_column("scenarios", "storage")
@@ -0,0 +1,27 @@
+"""add employee hire_date index
+
+Revision ID: 8d9e0f1a2b3c
+Revises: 7c8d9e0f1a2b
+Create Date: 2026-10-17 23:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8d9e0f1a2b3c"
+down_revision: Union[str, Sequence[str], None] = "7c8d9e0f1a2b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keyset sort of /api/employees/page by hire date
+    op.create_index("ix_employees_hire_date", "employees", ["hire_date"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_employees_hire_date", table_name="employees")
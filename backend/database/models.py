@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, JSON, Boolean, DateTime, Index
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, JSON, Boolean, DateTime, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from .database import Base
@@ -52,6 +52,21 @@ class OrganizationUnit(Base):
     head_id = Column(Integer, ForeignKey("employees.id", use_alter=True, name="fk_organization_units_head_id"), nullable=True)
     head = relationship("Employee", foreign_keys=[head_id])
 
+class OrgUnitClosure(Base):
+    """
+    Closure table of the org hierarchy: one row per (ancestor, descendant) pair, including
+    (unit, unit, 0). Subtree rollups are a single JOIN ... GROUP BY ancestor_id.
+    Maintained by services/org_unit_service.py on every structure edit.
+    """
+    __tablename__ = "org_unit_closure"
+    __table_args__ = (
+        Index("ix_org_unit_closure_descendant", "descendant_id", "ancestor_id"),
+    )
+
+    ancestor_id = Column(Integer, ForeignKey("organization_units.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("organization_units.id", ondelete="CASCADE"), primary_key=True)
+    depth = Column(Integer, nullable=False, default=0)
+
 class Position(Base):
     __tablename__ = "positions"
     id = Column(Integer, primary_key=True, index=True)
@@ -69,6 +84,7 @@ class Employee(Base):
     __tablename__ = "employees"
     __table_args__ = (
         Index("ix_employees_org_unit_id", "org_unit_id"),
+        Index("ix_employees_hire_date", "hire_date"),
     )
 
     id = Column(Integer, primary_key=True, index=True)
@@ -123,6 +139,64 @@ class FinancialRecord(Base):
     
     employee = relationship("Employee", back_populates="financial_records")
 
+class EmployeeCurrentCompensation(Base):
+    """
+    Материализованная проекция: последняя FinancialRecord каждого сотрудника.
+    Заменяет `max(FinancialRecord.id) GROUP BY employee_id` в горячих отчётах.
+    Поддерживается services/compensation_service.py при каждой записи FinancialRecord.
+    """
+    __tablename__ = "employee_current_compensation"
+    __table_args__ = (
+        Index("ix_employee_current_compensation_total_net", "total_net"),
+    )
+
+    employee_id = Column(Integer, ForeignKey("employees.id"), primary_key=True)
+    financial_record_id = Column(Integer, ForeignKey("financial_records.id"), nullable=False)
+
+    created_at = Column(String, nullable=True)
+    last_raise_date = Column(String, nullable=True)
+    created_at_dt = Column(DateTime(timezone=True), nullable=True)
+    last_raise_date_dt = Column(DateTime(timezone=True), nullable=True)
+
+    base_net = Column(Integer, default=0)
+    base_gross = Column(Integer, default=0)
+    kpi_net = Column(Integer, default=0)
+    kpi_gross = Column(Integer, default=0)
+    bonus_net = Column(Integer, default=0)
+    bonus_gross = Column(Integer, default=0)
+    total_net = Column(Integer, default=0)
+    total_gross = Column(Integer, default=0)
+
+    updated_at = Column(String, default=now_iso)
+
+class CompensationHistory(Base):
+    """
+    Интервальная история компенсации: значения действуют в [valid_from, valid_to).
+    valid_to = NULL — текущий (открытый) интервал. Интервалы сотрудника не пересекаются,
+    поэтому срез "на дату" — это один range scan по ix_compensation_history_valid_range.
+    """
+    __tablename__ = "compensation_history"
+    __table_args__ = (
+        Index("ix_compensation_history_valid_range", "valid_from", "valid_to"),
+        Index("ix_compensation_history_employee_valid_from", "employee_id", "valid_from"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    employee_id = Column(Integer, ForeignKey("employees.id"), nullable=False)
+    financial_record_id = Column(Integer, ForeignKey("financial_records.id"), nullable=False)
+
+    valid_from = Column(DateTime(timezone=True), nullable=False)
+    valid_to = Column(DateTime(timezone=True), nullable=True)
+
+    base_net = Column(Integer, default=0)
+    base_gross = Column(Integer, default=0)
+    kpi_net = Column(Integer, default=0)
+    kpi_gross = Column(Integer, default=0)
+    bonus_net = Column(Integer, default=0)
+    bonus_gross = Column(Integer, default=0)
+    total_net = Column(Integer, default=0)
+    total_gross = Column(Integer, default=0)
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
     __table_args__ = (
@@ -167,9 +241,46 @@ class Scenario(Base):
     description = Column(String, nullable=True)
     status = Column(String, default="draft") # draft, approved, archived
     created_at = Column(String, default=lambda: datetime.now().isoformat())
+    # overlay: only ScenarioLineDelta rows against the live budget (copy-on-write)
+    # snapshot: full copy in planning_lines (auto-backups, scenarios created before overlays)
+    storage = Column(String, default="overlay", server_default="snapshot", nullable=False)
+    # Bumped on every change of the scenario's lines: versions its cached totals
+    revision = Column(Integer, default=0, server_default="0", nullable=False)
     
     # Relationship
     planning_positions = relationship("PlanningPosition", back_populates="scenario", cascade="all, delete-orphan")
+    line_deltas = relationship("ScenarioLineDelta", back_populates="scenario", cascade="all, delete-orphan")
+
+class ScenarioLineDelta(Base):
+    """
+    Изменение сценария относительно живого бюджета (copy-on-write).
+    op = 'update': копия живой строки live_line_id с изменёнными значениями;
+    op = 'add': новая строка (live_line_id = NULL); op = 'delete': строка live_line_id удалена.
+    """
+    __tablename__ = "scenario_line_deltas"
+    __table_args__ = (
+        UniqueConstraint("scenario_id", "live_line_id", name="uq_scenario_line_deltas_live_line"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    scenario_id = Column(Integer, ForeignKey("scenarios.id", ondelete="CASCADE"), nullable=False, index=True)
+    live_line_id = Column(Integer, ForeignKey("planning_lines.id", ondelete="CASCADE"), nullable=True)
+    op = Column(String, nullable=False)  # update, add, delete
+
+    position_title = Column(String, nullable=True)
+    branch_id = Column(Integer, ForeignKey("organization_units.id"), nullable=True)
+    department_id = Column(Integer, ForeignKey("organization_units.id"), nullable=True)
+    schedule = Column(String)
+    count = Column(Integer, nullable=True)
+    bonus_count = Column(Integer, nullable=True)
+    base_net = Column(Integer, nullable=True)
+    base_gross = Column(Integer, nullable=True)
+    kpi_net = Column(Integer, nullable=True)
+    kpi_gross = Column(Integer, nullable=True)
+    bonus_net = Column(Integer, nullable=True)
+    bonus_gross = Column(Integer, nullable=True)
+
+    scenario = relationship("Scenario", back_populates="line_deltas")
 
 # NEW: Planning Table Model
 class PlanningPosition(Base):
@@ -522,3 +633,34 @@ class WelcomePageConfig(Base):
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
     branch = relationship("OrganizationUnit", foreign_keys=[branch_id])
+
+
+class BackgroundJob(Base):
+    """
+    Долгая фоновая задача, выполняемая отдельным воркером (scripts/job_worker.py).
+    checkpoint — позиция, до которой работа уже закоммичена (коммитится в той же транзакции,
+    что и очередная порция данных), поэтому после рестарта воркера задача продолжается с неё.
+    heartbeat_at — аренда: running-задача с устаревшим heartbeat снова доступна для захвата.
+    """
+    __tablename__ = "background_jobs"
+    __table_args__ = (
+        Index("ix_background_jobs_status_kind", "status", "kind"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)                  # salary_recalc, xlsx_export, ...
+    status = Column(String, default="pending", nullable=False)  # pending, running, completed, failed, cancelled
+    params = Column(JSON, default=dict)
+    checkpoint = Column(JSON, default=dict)
+    progress = Column(JSON, default=dict)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    # Задачи с одинаковым ключом дают одинаковый результат (переиспользование артефактов)
+    dedupe_key = Column(String, nullable=True, index=True)
+
+    created_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(String, default=now_iso)
+    started_at = Column(String, nullable=True)
+    finished_at = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
@@ -1,9 +1,16 @@
 import os
+import json
+import time
 import redis
+import redis.asyncio
+import hashlib
 import logging
+import threading
 from datetime import datetime, timezone
 from typing import Optional
+from jose import JWTError, jwt
 from utils.env_loader import load_project_env
+from utils.redis_metrics import timed
 
 load_project_env()
 
@@ -26,9 +33,16 @@ def _get_positive_float_env(name: str, default: float) -> float:
 
 REDIS_CONNECT_TIMEOUT = _get_positive_float_env("REDIS_CONNECT_TIMEOUT", 2.0)
 REDIS_SOCKET_TIMEOUT = _get_positive_float_env("REDIS_SOCKET_TIMEOUT", 2.0)
+# Per client (sync / async) and per worker
+REDIS_MAX_CONNECTIONS = int(_get_positive_float_env("REDIS_MAX_CONNECTIONS", 50))
 
 logger = logging.getLogger("fot.redis")
 
+_BLACKLIST_JTI_PREFIX = "blacklist:jti:"
+BLACKLIST_CHANNEL = "blacklist:events"
+BLACKLIST_PING_SECONDS = 5
+BLACKLIST_SNAPSHOT_DEFAULT_TTL = 3600
+
 _REFRESH_CURRENT_PREFIX = "refresh:current:"
 _REFRESH_USED_PREFIX = "refresh:used:"
 _REFRESH_REVOKED_PREFIX = "refresh:revoked:"
@@ -41,19 +55,29 @@ _testing_refresh_revoked: dict[str, int] = {}
 # FIX #C1: Fail-CLOSED — если Redis недоступен, токены не проходят проверку
 # (пользователь будет вынужден перезайти, но отозванные токены не будут приняты)
 redis_client: Optional[redis.Redis] = None
+# Same server, for async code paths (middleware, async endpoints): never block the event loop
+async_redis_client: Optional[redis.asyncio.Redis] = None
 if ENVIRONMENT == "testing":
     logger.info("Skipping Redis connection in testing environment")
 else:
     try:
-        client = redis.from_url(
+        client = redis.Redis(connection_pool=redis.ConnectionPool.from_url(
             REDIS_URL,
             decode_responses=True,
             socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
             socket_timeout=REDIS_SOCKET_TIMEOUT,
-        )
-        if client is not None:
-            client.ping()
+            max_connections=REDIS_MAX_CONNECTIONS,
+        ))
+        client.ping()
         redis_client = client
+        # Connections are opened lazily, on the event loop that uses them
+        async_redis_client = redis.asyncio.Redis(connection_pool=redis.asyncio.ConnectionPool.from_url(
+            REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            max_connections=REDIS_MAX_CONNECTIONS,
+        ))
         logger.info("Redis connected successfully: %s", REDIS_URL)
     except Exception as e:
         logger.error(
@@ -64,13 +88,76 @@ else:
         redis_client = None
 
 
+async def close_async_redis() -> None:
+    if async_redis_client is not None:
+        await async_redis_client.aclose()
+
+
+def token_revocation_id(token: str) -> str:
+    """
+    Blacklist id of a token: its jti claim. Tokens issued before jti was added
+    fall back to a hash of the token (never the raw token as a key).
+    The claims are read unverified: the id only selects the entry, the signature is
+    verified by the caller as before.
+    """
+    try:
+        jti = jwt.get_unverified_claims(token).get("jti")
+    except JWTError:
+        jti = None
+    return str(jti) if jti else "sha256:" + hashlib.sha256(token.encode()).hexdigest()
+
+
+class _RevocationSet:
+    """
+    Per-worker copy of the blacklist: revocation id -> exp timestamp.
+    Trusted only while `synced`: the pub/sub listener is subscribed and has loaded the
+    snapshot taken after subscribing, so no revocation can fall between the two.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, int] = {}
+        self.synced = False
+
+    def add(self, revocation_id: str, exp: int) -> None:
+        with self._lock:
+            self._entries[revocation_id] = max(exp, self._entries.get(revocation_id, 0))
+
+    def contains(self, revocation_id: str) -> bool:
+        with self._lock:
+            exp = self._entries.get(revocation_id)
+        return exp is not None and exp > _now_ts()
+
+    def replace(self, entries: dict[str, int]) -> None:
+        with self._lock:
+            self._entries = dict(entries)
+            self.synced = True
+
+    def mark_unsynced(self) -> None:
+        with self._lock:
+            self.synced = False
+
+    def prune(self) -> None:
+        now = _now_ts()
+        with self._lock:
+            self._entries = {k: exp for k, exp in self._entries.items() if exp > now}
+
+
+_revocations = _RevocationSet()
+
+
 def blacklist_token(token: str, exp_timestamp: int):
     """
-    Store the token in Redis blacklist until it expires.
+    Store the token's jti in the Redis blacklist until it expires and announce it
+    to the other workers (BLACKLIST_CHANNEL).
     """
     if not token:
         return
 
+    revocation_id = token_revocation_id(token)
+    # This worker knows at once, whatever happens to Redis
+    _revocations.add(revocation_id, exp_timestamp)
+
     if not redis_client:
         logger.warning("Redis unavailable — cannot blacklist token (token will expire naturally)")
         return
@@ -79,7 +166,10 @@ def blacklist_token(token: str, exp_timestamp: int):
     ttl = exp_timestamp - now
     if ttl > 0:
         try:
-            redis_client.setex(f"blacklist:{token}", ttl, "revoked")
+            pipe = redis_client.pipeline()
+            pipe.setex(f"{_BLACKLIST_JTI_PREFIX}{revocation_id}", ttl, "revoked")
+            pipe.publish(BLACKLIST_CHANNEL, json.dumps({"id": revocation_id, "exp": exp_timestamp}))
+            pipe.execute()
         except Exception as e:
             logger.error("Failed to blacklist token: %s", e)
 
@@ -240,7 +330,10 @@ def is_refresh_session_revoked(session_id: str) -> bool:
 
 def is_token_blacklisted(token: str) -> bool:
     """
-    Check if token exists in the Redis blacklist.
+    Check if token is blacklisted.
+
+    Common case: answered from the worker's revocation set (no network round trip)
+    while the pub/sub listener keeps it in sync. Otherwise a Redis lookup.
 
     FIX #C1: Fail-CLOSED strategy:
     - Redis недоступен → возвращаем True (блокируем токен)
@@ -257,6 +350,10 @@ def is_token_blacklisted(token: str) -> bool:
     if isinstance(token, str) and token.lower() == "none":
         return False
 
+    revocation_id = token_revocation_id(token)
+    if _revocations.synced:
+        return _revocations.contains(revocation_id)
+
     if not redis_client:
         # FIX #C1: При недоступности Redis — fail-closed
         # Короткий TTL токена (30 мин) делает это приемлемым UX
@@ -264,7 +361,98 @@ def is_token_blacklisted(token: str) -> bool:
         return True
 
     try:
-        return redis_client.get(f"blacklist:{token}") is not None
+        # Legacy entries (before jti keys) are keyed by the raw token
+        with timed("blacklist_exists"):
+            return redis_client.exists(f"{_BLACKLIST_JTI_PREFIX}{revocation_id}", f"blacklist:{token}") > 0
     except Exception as e:
         logger.error("Failed to check token blacklist: %s — denying access (fail-closed)", e)
         return True  # FIX #C1: Ошибка проверки = блокируем
+
+
+def _load_blacklist_snapshot() -> dict[str, int]:
+    """All live blacklist entries as revocation id -> exp (SCAN; only on (re)connect)."""
+    now = _now_ts()
+    entries: dict[str, int] = {}
+    batch: list[str] = []
+
+    def flush():
+        pipe = redis_client.pipeline()
+        for key in batch:
+            pipe.ttl(key)
+        for key, ttl in zip(batch, pipe.execute()):
+            if ttl is None or ttl < 0:
+                ttl = BLACKLIST_SNAPSHOT_DEFAULT_TTL  # no expiry set: keep until the next resync
+            if key.startswith(_BLACKLIST_JTI_PREFIX):
+                revocation_id = key[len(_BLACKLIST_JTI_PREFIX):]
+            else:
+                revocation_id = token_revocation_id(key[len("blacklist:"):])
+            entries[revocation_id] = now + ttl
+        batch.clear()
+
+    for key in redis_client.scan_iter(match="blacklist:*", count=1000):
+        batch.append(key)
+        if len(batch) >= 1000:
+            flush()
+    if batch:
+        flush()
+    return entries
+
+
+def _listen_blacklist(stop: threading.Event) -> None:
+    backoff = 1.0
+    while not stop.is_set():
+        pubsub = None
+        try:
+            pubsub = redis_client.pubsub()
+            pubsub.subscribe(BLACKLIST_CHANNEL)
+            # Snapshot only after the subscription is confirmed: nothing slips in between
+            deadline = time.monotonic() + REDIS_SOCKET_TIMEOUT
+            while True:
+                message = pubsub.get_message(timeout=0.5)
+                if message and message["type"] == "subscribe":
+                    break
+                if time.monotonic() > deadline:
+                    raise ConnectionError("blacklist subscription not confirmed")
+            _revocations.replace(_load_blacklist_snapshot())
+            logger.info("Token blacklist synced: local revocation set active")
+            backoff = 1.0
+
+            last_ping = last_pong = last_prune = time.monotonic()
+            while not stop.is_set():
+                message = pubsub.get_message(timeout=1.0)
+                now = time.monotonic()
+                if message:
+                    if message["type"] == "message":
+                        data = json.loads(message["data"])
+                        _revocations.add(str(data["id"]), int(data["exp"]))
+                    elif message["type"] == "pong":
+                        last_pong = now
+                if now - last_ping >= BLACKLIST_PING_SECONDS:
+                    pubsub.ping()
+                    last_ping = now
+                if now - last_pong > 3 * BLACKLIST_PING_SECONDS:
+                    raise ConnectionError("blacklist subscription stopped answering")
+                if now - last_prune >= 60:
+                    _revocations.prune()
+                    last_prune = now
+        except Exception as e:
+            _revocations.mark_unsynced()
+            logger.warning("Token blacklist sync lost (%s); falling back to Redis lookups", e)
+            stop.wait(backoff)
+            backoff = min(backoff * 2, 30.0)
+        finally:
+            _revocations.mark_unsynced()
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+
+def start_blacklist_listener() -> Optional[threading.Event]:
+    """Start the per-worker sync thread; returns the event that stops it (None if not started)."""
+    if ENVIRONMENT == "testing" or not redis_client:
+        return None
+    stop = threading.Event()
+    threading.Thread(target=_listen_blacklist, args=(stop,), name="blacklist-sync", daemon=True).start()
+    return stop
@@ -6,6 +6,7 @@ from database.database import get_db
 from database.models import User
 from security import SECRET_KEY, ALGORITHM
 from database.redis_client import is_token_blacklisted
+from services.principal_cache import get_principal
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
@@ -42,8 +43,8 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
     except (JWTError, ValueError):
         raise credentials_exception
 
-    from sqlalchemy.orm import joinedload
-    user = db.query(User).options(joinedload(User.role_rel)).filter(User.id == user_id).first()
+    # Cached principal (Redis, keyed by the user's security version) or the DB row
+    user = get_principal(db, user_id)
     if user is None:
         raise credentials_exception
 
@@ -56,6 +57,28 @@ def get_current_active_user(user: User = Depends(get_current_user)):
     return user
 
 
+def get_current_active_user_short_session(
+    request: Request,
+    db: Session = Depends(get_db, scope="function"),
+):
+    """
+    get_current_active_user on a session closed when the endpoint returns, for streaming
+    responses: a request-scoped session would keep its pooled connection until the stream ends.
+    """
+    return get_current_active_user(get_current_user(request, db))
+
+
+def get_current_user_row(user: User = Depends(get_current_active_user), db: Session = Depends(get_db)):
+    """
+    The current user as a row of this session, for endpoints that modify it
+    (get_current_user may return a detached copy from the principal cache).
+    """
+    row = db.get(User, user.id)
+    if row is None:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    return row
+
+
 def require_admin(user: User = Depends(get_current_active_user)):
     # Check for Administrator role OR 'admin_access' permission
     is_admin = False
@@ -92,52 +115,10 @@ class PermissionChecker:
 
 def get_user_scope(db: Session = Depends(get_db), user: User = Depends(get_current_active_user)):
     """
-    Returns a list of allowed OrganizationUnit IDs for the current user.
+    Returns a frozenset of allowed OrganizationUnit IDs for the current user.
     If the user is an Admin or has 'admin_access', returns None (indicating Full Access).
+    Resolved from the cached OrgTree and cached per user / scope / structure version
+    (services/scope_service.py).
     """
-    # 1. Check Admin / Super Admin
-    is_super = False
-    if user.role_rel and user.role_rel.permissions and user.role_rel.permissions.get('admin_access'):
-        is_super = True
-
-    if is_super:
-        return None # All access
-
-    # 3. Simplify & Robustify Logic
-    # We want a set of allowed OrganizationUnit IDs to avoid duplicates.
-    allowed_ids = set()
-
-    user_dept_ids = {int(x) for x in user.scope_departments} if user.scope_departments else set()
-    user_branch_ids = {int(x) for x in user.scope_branches} if user.scope_branches else set()
-
-    # Always allow explicitly assigned departments
-    for d_id in user_dept_ids:
-         allowed_ids.add(d_id)
-
-    if user_branch_ids:
-        from database.models import OrganizationUnit
-
-        for b_id in user_branch_ids:
-            # Fetch all departments of this branch
-            branch_depts = db.query(OrganizationUnit).filter_by(parent_id=b_id, type="department").all()
-            branch_dept_ids = {d.id for d in branch_depts}
-
-            intersection = user_dept_ids.intersection(branch_dept_ids)
-
-            if intersection:
-                # User has specific departments selected in THIS branch.
-                # Strictly limit to these departments. DO NOT ADD the branch itself (so they don't see branch directors).
-                # (The structure.py API will automatically load parent branches for the UI tree instead).
-                pass
-            elif not user_dept_ids:
-                # User has NO specific departments selected anywhere. Thus, they get FULL access to this branch.
-                allowed_ids.add(b_id)
-                allowed_ids.update(branch_dept_ids)
-            else:
-                # User has specific departments, but NONE of them are in this branch.
-                # Assuming this means they get FULL access to this branch, and restricted access to others.
-                allowed_ids.add(b_id)
-                allowed_ids.update(branch_dept_ids)
-
-    # Note: if a user ONLY has departments and no branches, those departments are granted via user_dept_ids above.
-    return list(allowed_ids)
+    from services.scope_service import resolve_user_scope
+    return resolve_user_scope(db, user)
@@ -1,6 +1,7 @@
 import sys
 import os
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 # 1. Add current directory to path so python sees 'routers', 'database', etc.
@@ -24,6 +25,8 @@ import uvicorn
 # 2. Import Database & Models
 from database.database import engine, Base
 from database import models  # Ensure models are loaded
+from database.redis_client import close_async_redis, start_blacklist_listener
+from services.simulation_service import shutdown_simulation_pool
 
 # 3. Create Tables (Deprecated: Use Alembic migrations instead)
 # Base.metadata.create_all(bind=engine)
@@ -33,7 +36,7 @@ from routers import (
     auth, roles, users, structure, employees,
     admin, planning, requests, market, analytics,
     positions, workflow, scenarios, job_offers,
-    job_offer_templates, welcome_pages, recruiting
+    job_offer_templates, welcome_pages, recruiting, exports
 )
 from routers.salary_config import router as salary_config_router
 from routers import integrations
@@ -44,7 +47,19 @@ def _is_csrf_exempt_path(path: str) -> bool:
         return True
     return path.startswith("/api/offers/public/")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Per-worker token blacklist kept in sync over Redis pub/sub
+    blacklist_stop = start_blacklist_listener()
+    yield
+    if blacklist_stop is not None:
+        blacklist_stop.set()
+    shutdown_simulation_pool()
+    await close_async_redis()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="HR & Payroll Hub",
     version="0.2.0",
     docs_url="/docs" if os.environ.get("ENVIRONMENT") != "production" else None,
@@ -138,28 +153,35 @@ async def add_security_headers(request: Request, call_next):
     return response
 
 # --- Rate Limiting Middleware (NEW-3 FIX: Redis-based, работает в multi-worker) ---
-import time
-from utils.rate_limiter import check_rate_limit
+import math
+from utils.rate_limiter import hit_async, match_route
 from utils.network import get_client_ip, TRUSTED_PROXY_IPS
 
-RATE_LIMIT_MAX = int(os.environ.get("RATE_LIMIT_MAX", "10"))
-RATE_LIMIT_WINDOW = 300  # 5 minutes
-
 
 @app.middleware("http")
-async def rate_limit_login(request: Request, call_next):
-    if request.url.path == "/api/auth/login" and request.method == "POST":
-        env = os.environ.get("ENVIRONMENT", "development")
-        if env == "testing":
-            return await call_next(request)
-
+async def rate_limit_routes(request: Request, call_next):
+    # Policies per route: utils.rate_limiter.ROUTE_POLICIES
+    matched = match_route(request.method, request.url.path)
+    # Test suites log in far more often than the login policy allows; every other policy stays on
+    if matched is not None and matched[0].name == "login" and os.environ.get("ENVIRONMENT", "development") == "testing":
+        matched = None
+    if matched is not None:
+        policy, subject = matched
         client_ip = get_client_ip(request)
-        # NEW-3: Redis sliding window rate limit — общий для всех воркеров
-        if check_rate_limit(f"login:{client_ip}", RATE_LIMIT_MAX, RATE_LIMIT_WINDOW):
-            logger.warning(f"Rate limit exceeded for {client_ip} on /api/auth/login")
+        # NEW-3: Redis GCRA rate limit — общий для всех воркеров
+        # (async client: a slow Redis must not stall the event loop)
+        result = await hit_async(policy, subject or client_ip)
+        if not result.allowed:
+            logger.warning(f"Rate limit '{policy.name}' exceeded for {client_ip} on {request.url.path}")
+            detail = (
+                "Слишком много попыток входа. Попробуйте позже."
+                if policy.name == "login"
+                else "Слишком много попыток. Попробуйте позже."
+            )
             return JSONResponse(
                 status_code=429,
-                content={"detail": "Слишком много попыток входа. Попробуйте через 5 минут."},
+                content={"detail": detail},
+                headers={"Retry-After": str(max(1, math.ceil(result.retry_after)))},
             )
 
     response = await call_next(request)
@@ -184,6 +206,7 @@ all_routers = [
     job_offer_templates.router,
     welcome_pages.router,
     recruiting.router,
+    exports.router,
 ]
 
 for r in all_routers:
@@ -3,8 +3,10 @@ from sqlalchemy.orm import Session
 from database.database import get_db
 from sqlalchemy.sql import func, desc
 from datetime import datetime
-from database.models import Employee, User, OrganizationUnit, FinancialRecord, SalaryRequest, AuditLog, Role
+from database.models import Employee, User, OrganizationUnit, EmployeeCurrentCompensation, SalaryRequest, AuditLog, Role
 from dependencies import require_admin
+from database import redis_client as redis_module
+from utils import redis_metrics
 
 router = APIRouter(prefix="/api/admin", tags=["admin"], dependencies=[Depends(require_admin)])
 
@@ -19,10 +21,10 @@ def get_admin_stats(db: Session = Depends(get_db)):
     # 2. Financial Overview (Quick snapshot)
     # Use optimized query from analytics or simple aggregation here
     # Total Active Employees Budget
-    max_ids_query = db.query(func.max(FinancialRecord.id)).group_by(FinancialRecord.employee_id)
-    budget_query = db.query(func.sum(FinancialRecord.total_net)).join(Employee).filter(
-        Employee.status != 'Dismissed',
-        FinancialRecord.id.in_(max_ids_query)
+    budget_query = db.query(func.sum(EmployeeCurrentCompensation.total_net)).join(
+        Employee, Employee.id == EmployeeCurrentCompensation.employee_id
+    ).filter(
+        Employee.status != 'Dismissed'
     )
     total_budget = budget_query.scalar() or 0
     avg_salary = total_budget / total_employees if total_employees > 0 else 0
@@ -281,3 +283,19 @@ def get_login_logs(
         "limit": limit,
         "total_pages": (total + limit - 1) // limit
     }
+
+
+@router.get("/redis-metrics")
+def get_redis_metrics():
+    """Redis latency/errors per operation and connection pool usage of this worker."""
+    return {
+        **redis_metrics.snapshot(),
+        "pools": {
+            "sync": redis_metrics.pool_stats(
+                redis_module.redis_client.connection_pool if redis_module.redis_client else None
+            ),
+            "async": redis_metrics.pool_stats(
+                redis_module.async_redis_client.connection_pool if redis_module.async_redis_client else None
+            ),
+        },
+    }
@@ -6,17 +6,16 @@ from fastapi import APIRouter, Depends, Query
 from sqlalchemy.orm import Session
 from typing import Optional
 from datetime import datetime, timedelta, timezone
-import json
-import threading
 import logging
 
 from dependencies import get_db, get_current_active_user, require_admin
-from database.models import Employee, PlanningPosition, OrganizationUnit, User, FinancialRecord, Position, AnalyticsConfig
-from sqlalchemy import func, and_, or_, desc
+from database.models import Employee, PlanningPosition, OrganizationUnit, OrgUnitClosure, User, Position, AnalyticsConfig
+from sqlalchemy import func, or_, desc
 from sqlalchemy.orm import joinedload
 from dateutil.relativedelta import relativedelta
 from database.models import MarketData
-from services.org_unit_service import build_children_map, get_unit_with_descendants
+from services.compensation_service import compensation_totals_at, latest_compensation
+from database.models import EmployeeCurrentCompensation
 from schemas import (
     RetentionRiskItem, RetentionDashboardResponse, 
     ESGReportResponse, PayEquityItem
@@ -32,16 +31,17 @@ from schemas import (
 router = APIRouter(prefix="/api/analytics", tags=["analytics"])
 logger = logging.getLogger("fot.analytics")
 
-CACHE_DURATION = 300  # 5 minutes (seconds)
-
-# FIX #H1: Redis-based cache (shared across all workers/processes in Docker)
-# Fallback: in-memory per-process cache if Redis is unavailable
-from database.redis_client import redis_client
-
-# In-memory fallback (used only when Redis is unavailable)
-_local_cache: dict = {}
-_local_cache_ttl: dict = {}
-_local_cache_lock = threading.Lock()
+# FIX #H1: Redis-based cache (shared across all workers/processes in Docker),
+# keyed by scope hash + params and invalidated by dependency tags
+from services.analytics_cache import (
+    TAG_FINANCIALS,
+    TAG_MARKET,
+    TAG_ORG_UNIT,
+    TAG_PLANNING,
+    build_cache_key,
+    get_cached_or_compute,
+    invalidate_analytics_cache,
+)
 
 
 def _parse_iso_datetime(value):
@@ -61,69 +61,6 @@ def _to_utc_aware(dt: datetime) -> datetime:
     return dt.astimezone(timezone.utc)
 
 
-def get_cached_or_compute(key: str, compute_fn, ttl: int = CACHE_DURATION):
-    """
-    FIX #H1: Redis-based cache shared across all worker processes.
-    Falls back to in-memory if Redis is unavailable.
-    """
-    redis_key = f"analytics:{key}"
-
-    # --- Try Redis first ---
-    if redis_client:
-        try:
-            cached = redis_client.get(redis_key)
-            if cached:
-                return json.loads(cached)
-        except Exception as e:
-            logger.warning("Redis get failed for key %s: %s", redis_key, e)
-
-    # --- Compute fresh value ---
-    result = compute_fn()
-
-    # --- Store in Redis ---
-    if redis_client:
-        try:
-            redis_client.setex(redis_key, ttl, json.dumps(result, default=str))
-        except Exception as e:
-            logger.warning("Redis set failed for key %s: %s", redis_key, e)
-    else:
-        # Fallback: in-memory cache
-        with _local_cache_lock:
-            _local_cache[key] = result
-            _local_cache_ttl[key] = datetime.now()
-            # Purge stale entries if dict grows too large
-            if len(_local_cache) > 500:
-                stale = [
-                    k for k, t in _local_cache_ttl.items()
-                    if (datetime.now() - t).total_seconds() > ttl
-                ]
-                for k in stale:
-                    _local_cache.pop(k, None)
-                    _local_cache_ttl.pop(k, None)
-
-    return result
-
-
-def invalidate_analytics_cache(pattern: str = "*"):
-    """
-    FIX #H1: Инвалидация кэша через Redis (работает для всех воркеров).
-    pattern: суффикс ключа для точечной инвалидации, '*' — сбросить всё.
-    """
-    if redis_client:
-        try:
-            keys = list(redis_client.scan_iter(f"analytics:{pattern}"))
-            if keys:
-                redis_client.delete(*keys)
-                logger.info("Invalidated %d analytics cache keys (pattern: %s)", len(keys), pattern)
-        except Exception as e:
-            logger.warning("Redis cache invalidation failed: %s", e)
-    else:
-        # Fallback: clear local cache
-        with _local_cache_lock:
-            _local_cache.clear()
-            _local_cache_ttl.clear()
-
-
 def get_allowed_unit_ids(db: Session, user: User):
     """
     Get list of OrganizationUnit IDs visible to the user using the shared dependency.
@@ -133,6 +70,18 @@ def get_allowed_unit_ids(db: Session, user: User):
     return get_user_scope(db, user)
 
 
+def _subtree_totals(query, unit_column, allowed_ids=None) -> dict:
+    """
+    query selects (OrgUnitClosure.ancestor_id, <aggregate>). Joined to org_unit_closure on
+    unit_column, every row counts for its unit and all ancestors: one GROUP BY gives subtree totals.
+    With allowed_ids only the visible part of each subtree is counted.
+    """
+    query = query.join(OrgUnitClosure, OrgUnitClosure.descendant_id == unit_column)
+    if allowed_ids is not None:
+        query = query.filter(OrgUnitClosure.descendant_id.in_(allowed_ids))
+    return {ancestor_id: total or 0 for ancestor_id, total in query.group_by(OrgUnitClosure.ancestor_id)}
+
+
 @router.get("/summary", response_model=AnalyticsSummaryResponse)
 def get_analytics_summary(
     date: Optional[str] = Query(None, description="Time travel date"),
@@ -147,27 +96,15 @@ def get_analytics_summary(
     allowed_ids = get_allowed_unit_ids(db, current_user)
     
     def compute():
-        # 1. Fact totals (use DB aggregation from FinancialRecords)
-        # Get latest financial record for each active employee
-        fact_subquery_base = db.query(
-            FinancialRecord.employee_id,
-            func.max(FinancialRecord.id).label('max_id')
-        )
-        if date: fact_subquery_base = fact_subquery_base.filter(FinancialRecord.created_at <= date)
-        fact_subquery = fact_subquery_base.group_by(FinancialRecord.employee_id).subquery()
+        # 1. Fact totals (use DB aggregation over the latest compensation per employee)
+        comp = latest_compensation(db, date)
         
         fact_query = db.query(
             func.count(Employee.id).label('count'),
-            func.sum(FinancialRecord.total_net).label('total_net')
-        ).join(
-            fact_subquery,
-            and_(
-                FinancialRecord.employee_id == fact_subquery.c.employee_id,
-                FinancialRecord.id == fact_subquery.c.max_id
-            )
-        ).join(
+            func.sum(comp.c.total_net).label('total_net')
+        ).select_from(comp).join(
             Employee,
-            Employee.id == FinancialRecord.employee_id
+            Employee.id == comp.c.employee_id
         ).filter(or_(Employee.status != 'Dismissed', Employee.status == None))
         
         if allowed_ids is not None:
@@ -223,7 +160,10 @@ def get_analytics_summary(
             'cached_at': datetime.now().isoformat()
         }
     
-    return get_cached_or_compute(f'summary_{current_user.id}_{date}', compute)
+    return get_cached_or_compute(
+        build_cache_key('summary', allowed_ids, date), compute,
+        tags=(TAG_ORG_UNIT, TAG_PLANNING, TAG_FINANCIALS),
+    )
 
 
 @router.get("/branch-comparison", response_model=BranchComparisonResponse)
@@ -241,79 +181,38 @@ def get_branch_comparison(
     allowed_ids = get_allowed_unit_ids(db, current_user)
     
     def compute():
-        # FIX B1: Pre-build hierarchy map ONCE instead of N+1 recursive queries
-        children_map = build_children_map(db)
-
         # Get ALL organizational units (head_office, branches, departments)
         query = db.query(OrganizationUnit)
         if allowed_ids is not None:
             query = query.filter(OrganizationUnit.id.in_(allowed_ids))
         all_units = query.all()
 
-        # FIX #L4: Вынести fact-агрегацию ИЗ цикла — один запрос вместо N
-        # Строим subquery для последних финансовых записей каждого сотрудника
-        fact_sub_base = db.query(
-            FinancialRecord.employee_id,
-            func.max(FinancialRecord.id).label('max_id')
-        )
-        if date:
-            fact_sub_base = fact_sub_base.filter(FinancialRecord.created_at <= date)
-        fact_subquery = fact_sub_base.group_by(FinancialRecord.employee_id).subquery()
-
-        # Один агрегирующий запрос: total_net per org_unit_id
-        fact_rows = db.query(
-            Employee.org_unit_id,
-            func.sum(FinancialRecord.total_net).label('total_net')
-        ).join(
-            fact_subquery,
-            and_(
-                FinancialRecord.employee_id == fact_subquery.c.employee_id,
-                FinancialRecord.id == fact_subquery.c.max_id
-            )
-        ).join(
-            Employee,
-            Employee.id == FinancialRecord.employee_id
-        ).filter(
-            or_(Employee.status != 'Dismissed', Employee.status == None)
-        ).group_by(Employee.org_unit_id).all()
-
-        # Карта: org_unit_id -> fact_total (только прямые, без иерархии)
-        fact_direct_map: dict[int, float] = {
-            row.org_unit_id: float(row.total_net or 0)
-            for row in fact_rows
-            if row.org_unit_id is not None
-        }
+        # Последняя компенсация каждого сотрудника (проекция или as-of срез)
+        comp = latest_compensation(db, date)
 
-        # FIX #L4: Аналогично для plan — тоже один запрос
-        plan_rows = db.query(
-            PlanningPosition.branch_id,
-            PlanningPosition.department_id,
-            func.sum(
+        # Subtree totals in SQL via org_unit_closure: one GROUP BY ancestor_id for fact, one for plan
+        fact_map = _subtree_totals(
+            db.query(OrgUnitClosure.ancestor_id, func.sum(comp.c.total_net))
+            .select_from(comp)
+            .join(Employee, Employee.id == comp.c.employee_id)
+            .filter(or_(Employee.status != 'Dismissed', Employee.status == None)),
+            Employee.org_unit_id, allowed_ids,
+        )
+        # Plan row belongs to its most specific unit: department, else branch
+        plan_map = _subtree_totals(
+            db.query(OrgUnitClosure.ancestor_id, func.sum(
                 (PlanningPosition.base_net + PlanningPosition.kpi_net) * PlanningPosition.count +
                 PlanningPosition.bonus_net * func.coalesce(PlanningPosition.bonus_count, PlanningPosition.count)
-            ).label('total_net')
-        ).filter(
-            PlanningPosition.scenario_id == None
-        ).group_by(PlanningPosition.branch_id, PlanningPosition.department_id).all()
-
-        # Карта: target_unit_id -> plan_total
-        plan_direct_map: dict[int, float] = {}
-        for row in plan_rows:
-            target_id = row.department_id if row.department_id else row.branch_id
-            if target_id:
-                plan_direct_map[target_id] = plan_direct_map.get(target_id, 0) + float(row.total_net or 0)
+            ))
+            .select_from(PlanningPosition)
+            .filter(PlanningPosition.scenario_id == None),
+            func.coalesce(PlanningPosition.department_id, PlanningPosition.branch_id), allowed_ids,
+        )
 
         results = []
         for unit in all_units:
-            unit_ids_list = get_unit_with_descendants(unit.id, children_map)
-            if allowed_ids is not None:
-                unit_ids_list = [uid for uid in unit_ids_list if uid in allowed_ids]
-            if not unit_ids_list:
-                continue
-
-            # Суммируем из карт (O(descendants) вместо SQL-запроса)
-            plan_total = sum(plan_direct_map.get(uid, 0) for uid in unit_ids_list)
-            fact_total = sum(fact_direct_map.get(uid, 0) for uid in unit_ids_list)
+            plan_total = float(plan_map.get(unit.id, 0))
+            fact_total = float(fact_map.get(unit.id, 0))
 
             if plan_total > 0 or fact_total > 0:
                 results.append({
@@ -339,8 +238,8 @@ def get_branch_comparison(
             'cached_at': datetime.now().isoformat()
         }
 
-    cache_key = f'branch_comparison_{current_user.id}_{limit}_{date}'
-    return get_cached_or_compute(cache_key, compute)
+    cache_key = build_cache_key('branch_comparison', allowed_ids, limit, date)
+    return get_cached_or_compute(cache_key, compute, tags=(TAG_ORG_UNIT, TAG_PLANNING, TAG_FINANCIALS))
 
 
 @router.get("/top-employees", response_model=TopEmployeesResponse)
@@ -358,13 +257,8 @@ def get_top_employees(
     allowed_ids = get_allowed_unit_ids(db, current_user)
     
     def compute():
-        # Get latest financial record for each employee
-        fact_sub_base = db.query(
-            FinancialRecord.employee_id,
-            func.max(FinancialRecord.id).label('max_id')
-        )
-        if date: fact_sub_base = fact_sub_base.filter(FinancialRecord.created_at <= date)
-        fact_subquery = fact_sub_base.group_by(FinancialRecord.employee_id).subquery()
+        # Latest compensation for each employee
+        comp = latest_compensation(db, date)
         
         # Join and get top employees
         query = db.query(
@@ -372,13 +266,10 @@ def get_top_employees(
             Employee.full_name,
             Position.title.label('position'),
             OrganizationUnit.name.label('branch_name'),
-            FinancialRecord.total_net
-        ).join(
-            fact_subquery,
-            FinancialRecord.employee_id == fact_subquery.c.employee_id
-        ).join(
+            comp.c.total_net
+        ).select_from(comp).join(
             Employee,
-            Employee.id == FinancialRecord.employee_id
+            Employee.id == comp.c.employee_id
         ).join(
             Position,
             Employee.position_id == Position.id,
@@ -388,17 +279,14 @@ def get_top_employees(
             Employee.org_unit_id == OrganizationUnit.id,
             isouter=True
         ).filter(
-            and_(
-                FinancialRecord.id == fact_subquery.c.max_id,
-                or_(Employee.status != 'Dismissed', Employee.status == None)
-            )
+            or_(Employee.status != 'Dismissed', Employee.status == None)
         )
         
         if allowed_ids is not None:
              query = query.filter(Employee.org_unit_id.in_(allowed_ids))
 
         employees = query.order_by(
-            FinancialRecord.total_net.desc()
+            comp.c.total_net.desc()
         ).limit(limit).all()
         
         return {
@@ -415,8 +303,8 @@ def get_top_employees(
             'cached_at': datetime.now().isoformat()
         }
     
-    cache_key = f'top_employees_{current_user.id}_{limit}_{date}'
-    return get_cached_or_compute(cache_key, compute)
+    cache_key = build_cache_key('top_employees', allowed_ids, limit, date)
+    return get_cached_or_compute(cache_key, compute, tags=(TAG_ORG_UNIT, TAG_FINANCIALS))
 
 
 @router.get("/cost-distribution", response_model=CostDistributionResponse)
@@ -433,9 +321,6 @@ def get_cost_distribution(
     allowed_ids = get_allowed_unit_ids(db, current_user)
     
     def compute():
-        # FIX B1: Pre-build hierarchy map ONCE instead of N+1 recursive queries
-        children_map = build_children_map(db)
-        
         # Get all top-level units (branches and head_office)
         query = db.query(OrganizationUnit).filter(OrganizationUnit.type.in_(['branch', 'head_office']))
         if allowed_ids is not None:
@@ -443,49 +328,22 @@ def get_cost_distribution(
             
         top_units = query.all()
         
-        # Get latest financial record for each employee
-        fact_sub_base = db.query(
-            FinancialRecord.employee_id,
-            func.max(FinancialRecord.id).label('max_id')
-        )
-        if date: fact_sub_base = fact_sub_base.filter(FinancialRecord.created_at <= date)
-        fact_subquery = fact_sub_base.group_by(FinancialRecord.employee_id).subquery()
+        # Latest compensation for each employee
+        comp = latest_compensation(db, date)
         
-        # FIX N5: aggregate fact once, then reuse in-memory map per unit
-        fact_rows = db.query(
-            Employee.org_unit_id,
-            func.sum(FinancialRecord.total_net).label('total_net')
-        ).join(
-            fact_subquery,
-            and_(
-                FinancialRecord.employee_id == fact_subquery.c.employee_id,
-                FinancialRecord.id == fact_subquery.c.max_id
-            )
-        ).join(
-            Employee,
-            Employee.id == FinancialRecord.employee_id
-        ).filter(
-            or_(Employee.status != 'Dismissed', Employee.status == None)
-        ).group_by(Employee.org_unit_id).all()
-
-        fact_direct_map = {
-            row.org_unit_id: float(row.total_net or 0)
-            for row in fact_rows
-            if row.org_unit_id is not None
-        }
+        # FIX N5: subtree totals in one closure GROUP BY instead of per-unit sums
+        fact_map = _subtree_totals(
+            db.query(OrgUnitClosure.ancestor_id, func.sum(comp.c.total_net))
+            .select_from(comp)
+            .join(Employee, Employee.id == comp.c.employee_id)
+            .filter(or_(Employee.status != 'Dismissed', Employee.status == None)),
+            Employee.org_unit_id, allowed_ids,
+        )
 
         results = []
 
         for unit in top_units:
-            # Use pre-built map instead of recursive db.query
-            unit_ids_list = get_unit_with_descendants(unit.id, children_map)
-            if allowed_ids is not None:
-                unit_ids_list = [uid for uid in unit_ids_list if uid in allowed_ids]
-                
-            if not unit_ids_list:
-                continue
-
-            total = sum(fact_direct_map.get(uid, 0) for uid in unit_ids_list)
+            total = float(fact_map.get(unit.id, 0))
 
             if total > 0:
                 results.append({
@@ -498,7 +356,10 @@ def get_cost_distribution(
             'cached_at': datetime.now().isoformat()
         }
     
-    return get_cached_or_compute(f'cost_distribution_{current_user.id}_{date}', compute)
+    return get_cached_or_compute(
+        build_cache_key('cost_distribution', allowed_ids, date), compute,
+        tags=(TAG_ORG_UNIT, TAG_FINANCIALS),
+    )
 
 
 @router.get("/employees")
@@ -515,13 +376,8 @@ def get_analytics_employees(
     """
     allowed_ids = get_allowed_unit_ids(db, current_user)
     
-    # 1. Latest financial records subquery (respecting date)
-    fact_subquery_base = db.query(
-        FinancialRecord.employee_id,
-        func.max(FinancialRecord.id).label('max_id')
-    )
-    if date: fact_subquery_base = fact_subquery_base.filter(FinancialRecord.created_at <= date)
-    fact_subquery = fact_subquery_base.group_by(FinancialRecord.employee_id).subquery()
+    # 1. Latest compensation per employee (respecting date)
+    comp = latest_compensation(db, date)
 
     # 2. Main Query
     query = db.query(
@@ -529,16 +385,10 @@ def get_analytics_employees(
         Employee.full_name,
         Position.title.label('position'),
         OrganizationUnit.name.label('unit_name'),
-        FinancialRecord.total_net
+        comp.c.total_net
     ).join(
-        fact_subquery,
-        Employee.id == fact_subquery.c.employee_id
-    ).join(
-        FinancialRecord,
-        and_(
-            FinancialRecord.employee_id == fact_subquery.c.employee_id,
-            FinancialRecord.id == fact_subquery.c.max_id
-        )
+        comp,
+        Employee.id == comp.c.employee_id
     ).join(
         Position, Employee.position_id == Position.id, isouter=True
     ).join(
@@ -551,10 +401,10 @@ def get_analytics_employees(
     
     # 4. Unit Filtering (with hierarchy)
     if unit_id:
-        from services.org_unit_service import build_children_map
-        children_map = build_children_map(db)
-        desc_ids = get_unit_with_descendants(unit_id, children_map)
-        query = query.filter(Employee.org_unit_id.in_(desc_ids))
+        # Subtree membership as an indexed join on org_unit_closure
+        query = query.join(
+            OrgUnitClosure, OrgUnitClosure.descendant_id == Employee.org_unit_id
+        ).filter(OrgUnitClosure.ancestor_id == unit_id)
         
     if position:
         query = query.filter(Position.title == position)
@@ -608,21 +458,13 @@ def get_budget_trend(
         for i in range(6, -1, -1):
             months.append((now - relativedelta(months=i)).replace(day=1))
             
+        # One scan over the compensation intervals for all historical points
+        fact_filters = [or_(Employee.status != 'Dismissed', Employee.status == None)]
+        if allowed_ids: fact_filters.append(Employee.org_unit_id.in_(allowed_ids))
+        totals = compensation_totals_at(db, [m.replace(day=28) for m in months], fact_filters)
+
         history = []
-        for m in months:
-            # Reuse logic from summary but simplified
-            fact_sub = db.query(
-                FinancialRecord.employee_id,
-                func.max(FinancialRecord.id).label('max_id')
-            ).filter(FinancialRecord.created_at <= m.replace(day=28).isoformat()).group_by(FinancialRecord.employee_id).subquery()
-            
-            fact_query = db.query(func.sum(FinancialRecord.total_net)).join(
-                fact_sub, FinancialRecord.id == fact_sub.c.max_id
-            ).join(Employee, Employee.id == FinancialRecord.employee_id).filter(or_(Employee.status != 'Dismissed', Employee.status == None))
-            
-            if allowed_ids: fact_query = fact_query.filter(Employee.org_unit_id.in_(allowed_ids))
-            
-            total = fact_query.scalar() or 0
+        for m, total in zip(months, totals):
             history.append({
                 "month": m.strftime("%b %Y"),
                 "value": float(total),
@@ -649,7 +491,10 @@ def get_budget_trend(
             return history + forecast
         return history
 
-    return get_cached_or_compute(f'budget_trend_{current_user.id}', compute)
+    return get_cached_or_compute(
+        build_cache_key('budget_trend', allowed_ids), compute,
+        tags=(TAG_PLANNING, TAG_FINANCIALS),
+    )
 
 @router.get("/config")
 def get_analytics_config(
@@ -722,19 +567,8 @@ def get_retention_risk(
             
         employees = query.all()
         
-        # 2. Bulk Fetch Latest Financials
-        fact_subquery = db.query(
-            FinancialRecord.employee_id,
-            func.max(FinancialRecord.id).label('max_id')
-        ).group_by(FinancialRecord.employee_id).subquery()
-        
-        fin_records = db.query(FinancialRecord).join(
-            fact_subquery,
-            and_(
-                FinancialRecord.employee_id == fact_subquery.c.employee_id,
-                FinancialRecord.id == fact_subquery.c.max_id
-            )
-        ).all()
+        # 2. Bulk Fetch Latest Financials (materialized projection)
+        fin_records = db.query(EmployeeCurrentCompensation).all()
         fin_map = {fr.employee_id: fr for fr in fin_records}
         
         # 3. Bulk Fetch Market Data
@@ -814,7 +648,10 @@ def get_retention_risk(
             "cached_at": now.isoformat()
         }
 
-    return get_cached_or_compute(f'retention_{current_user.id}', compute)
+    return get_cached_or_compute(
+        build_cache_key('retention', allowed_ids), compute,
+        tags=(TAG_ORG_UNIT, TAG_FINANCIALS, TAG_MARKET),
+    )
 
 
 @router.get("/esg/pay-equity", response_model=ESGReportResponse)
@@ -834,10 +671,9 @@ def get_esg_metrics(
         
         employees = query.all()
         
-        # Latest financials map
-        fact_subquery = db.query(FinancialRecord.employee_id, func.max(FinancialRecord.id).label('max_id')).group_by(FinancialRecord.employee_id).subquery()
-        fin_records = db.query(FinancialRecord).join(fact_subquery, and_(FinancialRecord.employee_id == fact_subquery.c.employee_id, FinancialRecord.id == fact_subquery.c.max_id)).all()
-        fin_map = {fr.employee_id: fr.total_net for fr in fin_records}
+        # Latest financials map (materialized projection)
+        fin_rows = db.query(EmployeeCurrentCompensation.employee_id, EmployeeCurrentCompensation.total_net).all()
+        fin_map = {row.employee_id: row.total_net for row in fin_rows}
 
         gender_stats = {} # Gender -> [salaries]
         age_stats = {}    # Bucket -> [salaries]
@@ -892,7 +728,10 @@ def get_esg_metrics(
             "cached_at": now.isoformat()
         }
 
-    return get_cached_or_compute(f'esg_{current_user.id}', compute)
+    return get_cached_or_compute(
+        build_cache_key('esg', allowed_ids), compute,
+        tags=(TAG_ORG_UNIT, TAG_FINANCIALS),
+    )
 
 @router.get("/turnover")
 def get_turnover_analytics(
@@ -915,9 +754,7 @@ def get_turnover_analytics(
         gaps_data = []
         
         # FIX B2: Pre-fetch all data to avoid N+1 queries
-        children_map = build_children_map(db)
-        
-        # Bulk fetch plan counts per unit
+        # Bulk fetch direct plan counts per unit and position
         plan_rows = db.query(
             PlanningPosition.branch_id,
             PlanningPosition.department_id,
@@ -928,18 +765,15 @@ def get_turnover_analytics(
         ).group_by(PlanningPosition.branch_id, PlanningPosition.department_id, PlanningPosition.position_title).all()
         
         # Build plan count map: (unit_id, position_title) -> direct_plan_count
-        # AND unit_id -> direct_plan_count
         plan_pos_map = {}
-        plan_map = {}
         for row in plan_rows:
             # target_id is the most specific unit
             target_id = row.department_id or row.branch_id
             if target_id:
-                plan_map[target_id] = plan_map.get(target_id, 0) + (row.total_count or 0)
                 key = (target_id, row.position_title or "Без должности")
                 plan_pos_map[key] = plan_pos_map.get(key, 0) + (row.total_count or 0)
         
-        # Bulk fetch fact counts per unit
+        # Bulk fetch direct fact counts per unit and position
         fact_rows = db.query(
             Employee.org_unit_id,
             Position.title.label('position_title'),
@@ -954,22 +788,31 @@ def get_turnover_analytics(
         ).group_by(Employee.org_unit_id, Position.title).all()
         
         fact_pos_map = {}
-        fact_map = {}
         for row in fact_rows:
             uid = row.org_unit_id
             if uid:
-                fact_map[uid] = fact_map.get(uid, 0) + (row.emp_count or 0)
                 key = (uid, row.position_title or "Без должности")
                 fact_pos_map[key] = fact_pos_map.get(key, 0) + (row.emp_count or 0)
         
+        # Plan and fact for each unit AND all descendants: closure GROUP BY ancestor_id
+        agg_plan_map = _subtree_totals(
+            db.query(OrgUnitClosure.ancestor_id, func.sum(PlanningPosition.count))
+            .select_from(PlanningPosition)
+            .filter(PlanningPosition.scenario_id == None),
+            func.coalesce(PlanningPosition.department_id, PlanningPosition.branch_id),
+        )
+        agg_fact_map = _subtree_totals(
+            db.query(OrgUnitClosure.ancestor_id, func.count(Employee.id))
+            .select_from(Employee)
+            .filter(or_(Employee.status != 'Dismissed', Employee.status == None)),
+            Employee.org_unit_id,
+        )
+
         pos_id_counter = 1000000  # Offset to avoid collision with unit IDs
 
         for u in units:
-            # Aggregate plan and fact for this unit AND all descendants
-            desc_ids = get_unit_with_descendants(u.id, children_map)
-            
-            agg_plan = sum(plan_map.get(uid, 0) for uid in desc_ids)
-            agg_fact = sum(fact_map.get(uid, 0) for uid in desc_ids)
+            agg_plan = agg_plan_map.get(u.id, 0)
+            agg_fact = agg_fact_map.get(u.id, 0)
             
             gap = agg_plan - agg_fact
             # We include all units that have some data or are part of the hierarchy that has gaps
@@ -1055,4 +898,7 @@ def get_turnover_analytics(
             "cached_at": datetime.now().isoformat()
         }
 
-    return get_cached_or_compute(f'turnover_{current_user.id}_{days}', compute)
+    return get_cached_or_compute(
+        build_cache_key('turnover', allowed_ids, days), compute,
+        tags=(TAG_ORG_UNIT, TAG_PLANNING, TAG_FINANCIALS),
+    )
@@ -4,6 +4,8 @@ import os
 from typing import Any, cast
 
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 
@@ -19,7 +21,7 @@ from database.redis_client import (
     register_refresh_session,
     revoke_refresh_session,
 )
-from dependencies import get_current_active_user
+from dependencies import get_current_active_user, get_current_active_user_short_session, get_current_user_row
 from schemas import (
     ChangePasswordRequest,
     CurrentUserResponse,
@@ -38,6 +40,15 @@ from security import (
     generate_csrf_token,
 )
 from services.auth_service import AuthService, _write_login_log
+from services.notification_stream import (
+    adjust_unread_count,
+    get_unread_count,
+    hub,
+    notification_stream,
+    replay_since,
+    reset_unread_count,
+)
+from services.principal_cache import bump_security_version
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 logger = logging.getLogger("fot.auth")
@@ -222,9 +233,11 @@ def refresh_token(request: Request, response: Response, db: Session = Depends(ge
 def change_password(
     data: ChangePasswordRequest,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user),
+    current_user: User = Depends(get_current_user_row),
 ):
-    return AuthService.change_password(db, current_user, data.old_password, data.new_password)
+    result = AuthService.change_password(db, current_user, data.old_password, data.new_password)
+    bump_security_version(current_user.id)
+    return result
 
 
 @router.post("/logout", response_model=LogoutResponse)
@@ -257,6 +270,8 @@ def logout(
             except JWTError:
                 logger.debug("Skipping blacklist for invalid token during logout")
 
+    bump_security_version(current_user.id)
+
     _write_login_log(
         db,
         "logout",
@@ -321,6 +336,44 @@ def get_notifications(db: Session = Depends(get_db), current_user: User = Depend
     return unread + read
 
 
+@router.get("/notifications/unread-count")
+def get_notifications_unread_count(db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
+    """Badge counter: served from Redis, recounted from the database only when not cached."""
+    return {"unread": get_unread_count(db, current_user.id)}
+
+
+@router.get("/notifications/stream")
+async def stream_notifications(
+    request: Request,
+    # Function scope: the session is closed before the (long-lived) stream starts
+    db: Session = Depends(get_db, scope="function"),
+    current_user: User = Depends(get_current_active_user_short_session),
+):
+    """
+    Server-Sent Events: new notifications as they are created (event id = notification id).
+    On reconnect the browser sends Last-Event-ID and the missed rows are replayed first.
+    """
+    raw_last_id = request.headers.get("Last-Event-ID") or request.query_params.get("last_event_id")
+    try:
+        last_event_id = max(0, int(raw_last_id)) if raw_last_id else 0
+    except ValueError:
+        last_event_id = 0
+
+    # Subscribe before reading the replay: nothing created in between is lost
+    sub = hub.subscribe(current_user.id)
+    try:
+        await hub.wait_ready()
+        replay = await run_in_threadpool(replay_since, db, current_user.id, last_event_id) if last_event_id else []
+    except BaseException:
+        hub.unsubscribe(sub)
+        raise
+    return StreamingResponse(
+        notification_stream(sub, replay, last_event_id, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.patch("/notifications/{id}/read", response_model=StatusResponse)
 def mark_read(id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
     from database.models import Notification
@@ -330,8 +383,11 @@ def mark_read(id: int, db: Session = Depends(get_db), current_user: User = Depen
         raise HTTPException(404, "Notification not found")
     if note_row.user_id != current_user.id:
         raise HTTPException(404, "Notification not found")
+    was_unread = not note_row.is_read
     setattr(note_row, "is_read", True)
     db.commit()
+    if was_unread:
+        adjust_unread_count(current_user.id, -1)
     return {"status": "ok"}
 
 
@@ -343,6 +399,7 @@ def mark_all_read(db: Session = Depends(get_db), current_user: User = Depends(ge
         {Notification.is_read: True}
     )
     db.commit()
+    reset_unread_count(current_user.id)
     return {"status": "ok"}
 
 
@@ -352,4 +409,5 @@ def delete_all_notifications(db: Session = Depends(get_db), current_user: User =
 
     db.query(Notification).filter(Notification.user_id == current_user.id).delete()
     db.commit()
+    reset_unread_count(current_user.id)
     return {"status": "ok"}
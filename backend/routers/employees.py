@@ -1,19 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import Response
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import select
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import FrozenSet, List, Optional
 from datetime import datetime
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from io import BytesIO
 from utils.date_utils import to_iso_utc
 
 from database.database import get_db
-from database.models import User, AuditLog, Employee, OrganizationUnit, Position, FinancialRecord
+from database.models import User, AuditLog, Employee
 from schemas import EmployeeCreate, FinancialUpdate, EmployeeUpdate, EmpDetailsUpdate
 from dependencies import get_current_active_user, get_user_scope, PermissionChecker
 from services.employee_service import EmployeeService
+from services.analytics_cache import TAG_FINANCIALS, TAG_ORG_UNIT, invalidate_analytics_cache
+from services.export_service import EMPLOYEE_COLUMNS, EMPLOYEE_SHEET_TITLE, employee_export_rows, submit_export
+from services.xlsx_stream import iter_xlsx, xlsx_streaming_response
+from routers.exports import serialize_export_job
 
 router = APIRouter(prefix="/api", tags=["employees"])
 
@@ -22,9 +21,11 @@ def create_employee(
     data: EmployeeCreate,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
-    scope: Optional[List[int]] = Depends(get_user_scope)
+    scope: Optional[FrozenSet[int]] = Depends(get_user_scope)
 ):
-    return EmployeeService.create_employee(db, current_user, data, scope)
+    result = EmployeeService.create_employee(db, current_user, data, scope)
+    invalidate_analytics_cache(TAG_ORG_UNIT, TAG_FINANCIALS)
+    return result
 
 @router.put("/employees/{emp_id}", dependencies=[Depends(PermissionChecker('edit_employees'))])
 def update_employee(
@@ -32,9 +33,11 @@ def update_employee(
     data: EmployeeUpdate,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
-    scope: Optional[List[int]] = Depends(get_user_scope)
+    scope: Optional[FrozenSet[int]] = Depends(get_user_scope)
 ):
-    return EmployeeService.update_employee(db, current_user, emp_id, data, scope)
+    result = EmployeeService.update_employee(db, current_user, emp_id, data, scope)
+    invalidate_analytics_cache(TAG_ORG_UNIT, TAG_FINANCIALS)
+    return result
 
 from schemas import EmployeeCreate, FinancialUpdate, EmployeeUpdate, EmpDetailsUpdate, DismissEmployeeRequest
 
@@ -44,20 +47,45 @@ def dismiss_employee(
     data: DismissEmployeeRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
-    scope: Optional[List[int]] = Depends(get_user_scope)
+    scope: Optional[FrozenSet[int]] = Depends(get_user_scope)
 ):
-    return EmployeeService.dismiss_employee(db, current_user, emp_id, data.reason, data.date, scope)
+    result = EmployeeService.dismiss_employee(db, current_user, emp_id, data.reason, data.date, scope)
+    invalidate_analytics_cache(TAG_ORG_UNIT, TAG_FINANCIALS)
+    return result
 
 
 @router.get("/employees")
 def get_employees(
     db: Session = Depends(get_db), 
     current_user: User = Depends(get_current_active_user),
-    scope: Optional[List[int]] = Depends(get_user_scope),
+    scope: Optional[FrozenSet[int]] = Depends(get_user_scope),
     q: Optional[str] = None
 ):
     return EmployeeService.get_employees(db, current_user, scope, q)
 
+@router.get("/employees/page")
+def get_employees_page(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+    scope: Optional[FrozenSet[int]] = Depends(get_user_scope),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    sort: str = "full_name",
+    order: str = "asc",
+    branch_id: Optional[int] = None,
+    department_id: Optional[int] = None,
+    status: Optional[str] = None,
+    min_salary: Optional[int] = None,
+    max_salary: Optional[int] = None,
+    q: Optional[str] = None,
+):
+    """Keyset-paginated listing: pass next_cursor from the previous page to get the next one."""
+    return EmployeeService.get_employees_page(
+        db, scope, cursor=cursor, limit=limit, sort=sort, order=order,
+        branch_id=branch_id, department_id=department_id, status=status,
+        min_salary=min_salary, max_salary=max_salary, q=q,
+    )
+
 # ... (Skipping standard CRUD for brevity, focus on Export Optimization) ...
 
 from pydantic import BaseModel
@@ -69,130 +97,22 @@ def export_employees_excel(
     req: ExportRequest,
     db: Session = Depends(get_db), 
     current_user: User = Depends(get_current_active_user),
-    scope: Optional[List[int]] = Depends(get_user_scope)
+    scope: Optional[FrozenSet[int]] = Depends(get_user_scope)
 ):
-    # Optimized Export: Use joinedload/selectinload to fetch relations in single query
-    # instead of inside the loop relying on lazy loading.
-    
-    # We will build query manually here for max performance
-    query = select(Employee).options(
-        joinedload(Employee.position), 
-        joinedload(Employee.org_unit),
-        # Optimizing financial record fetching is tricky with joinedload on 'latest' 
-        # usually requires selectinload on collection + logic, or a subquery join.
-        # But standard relationship is 'financial_records'.
-    ).filter(Employee.status != "Dismissed")
-    
-    if scope:
-        query = query.filter(Employee.org_unit_id.in_(scope))
-        
-    if req.ids is not None:
-        query = query.filter(Employee.id.in_(req.ids))
-        
-    employees = db.scalars(query).all()
-    
-    # Batch fetch latest financials to avoid N+1
-    # Strategy: Fetch all financial records for these employees, group by emp_id, take latest.
-    emp_ids = [e.id for e in employees]
-    financials_map = {}
-    
-    if emp_ids:
-        # Window function or simply fetching all and sorting in python (if dataset not huge)
-        # For huge datasets, subquery is better.
-        # Subquery for max id per employee
-        from sqlalchemy import func
-        subq = select(
-            FinancialRecord.employee_id, 
-            func.max(FinancialRecord.id).label('max_id')
-        ).where(FinancialRecord.employee_id.in_(emp_ids)).group_by(FinancialRecord.employee_id).subquery()
-        
-        # Join to get full record
-        stmt = select(FinancialRecord).join(
-            subq, 
-            (FinancialRecord.employee_id == subq.c.employee_id) & 
-            (FinancialRecord.id == subq.c.max_id)
-        )
-        fin_records = db.scalars(stmt).all()
-        financials_map = {r.employee_id: r for r in fin_records}
-
-    # Pre-fetch unit map
-    org_units = db.scalars(select(OrganizationUnit)).all()
-    unit_map = {u.id: u for u in org_units}
-
-    # Create workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Сотрудники"
-    
-    header_fill = PatternFill(start_color="1F2937", end_color="1F2937", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True, size=11)
-    
-    headers = [
-        "ФИО", "Должность", "Филиал", "Отдел", "Статус",
-        "Оклад (Нет)", "Оклад (Брут)", "KPI (Нет)", "KPI (Брут)",
-        "Бонус (Нет)", "Бонус (Брут)", "Всего (Нет)", "Всего (Брут)"
-    ]
-    
-    for col, h in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=h)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-
-    for row_idx, emp in enumerate(employees, 2):
-        fin = financials_map.get(emp.id)
-        
-        branch_name = "-"
-        dept_name = "-"
-        
-        if emp.org_unit_id and emp.org_unit_id in unit_map:
-            u = unit_map[emp.org_unit_id]
-            if u.type in ['branch', 'head_office']:
-                branch_name = u.name
-            else:
-                dept_name = u.name
-                p = unit_map.get(u.parent_id)
-                while p:
-                    if p.type in ['branch', 'head_office']:
-                        branch_name = p.name
-                        break
-                    p = unit_map.get(p.parent_id)
-        
-        # Financials
-        b_n = fin.base_net if fin else 0
-        b_g = fin.base_gross if fin else 0
-        k_n = fin.kpi_net if fin else 0
-        k_g = fin.kpi_gross if fin else 0
-        bo_n = fin.bonus_net if fin else 0
-        bo_g = fin.bonus_gross if fin else 0
-        t_n = fin.total_net if fin else 0
-        t_g = fin.total_gross if fin else 0
-
-        row_data = [
-            emp.full_name,
-            emp.position.title if emp.position else "-",
-            branch_name, # Simplified for now, ideally use map
-            dept_name,
-            emp.status,
-            b_n, b_g, k_n, k_g, bo_n, bo_g, t_n, t_g
-        ]
-        
-        for col_idx, val in enumerate(row_data, 1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=val)
-            if col_idx >= 6: 
-                cell.number_format = '#,##0'
-                
-    # Save
-    out = BytesIO()
-    wb.save(out)
-    out.seek(0)
-    
+    # Streaming export: rows come from a server-side cursor and go out as xlsx chunks
+    chunks = iter_xlsx(EMPLOYEE_SHEET_TITLE, EMPLOYEE_COLUMNS, employee_export_rows(db, scope, req.ids))
     filename = f"Employees_{datetime.now().strftime('%Y%m%d')}.xlsx"
-    return Response(
-        content=out.getvalue(), 
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
+    return xlsx_streaming_response(chunks, filename)
+
+@router.post("/employees/export/jobs", dependencies=[Depends(PermissionChecker('edit_employees'))])
+def submit_employees_export(
+    req: ExportRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+    scope: Optional[FrozenSet[int]] = Depends(get_user_scope)
+):
+    # Large exports: built by the job worker, fetched later via /api/exports/{id}/download
+    return serialize_export_job(submit_export(db, "employees", current_user, scope, req.ids))
 
 @router.get("/audit-logs/{emp_id}")
 def get_employee_history(
@@ -0,0 +1,65 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+
+from database.database import get_db
+from database.models import BackgroundJob, User
+from dependencies import get_current_active_user, get_user_scope
+from services.analytics_cache import scope_fingerprint
+from services.export_service import EXPORT_JOB, STATUS_EXPIRED, artifact_path, can_export
+from services.job_service import STATUS_COMPLETED, serialize_job
+from services.xlsx_stream import XLSX_MEDIA_TYPE
+
+router = APIRouter(prefix="/api/exports", tags=["exports"])
+
+
+def serialize_export_job(job: BackgroundJob) -> dict:
+    data = serialize_job(job)
+    # The artifact's file name stays internal: downloads only go through the API
+    if job.result:
+        data["result"] = {k: v for k, v in job.result.items() if k != "file"}
+    data["export"] = (job.params or {}).get("export")
+    data["download_url"] = f"/api/exports/{job.id}/download" if job.status == STATUS_COMPLETED else None
+    return data
+
+
+def _get_export_job(job_id: int, db: Session, user: User) -> BackgroundJob:
+    """
+    Artifacts are shared by users with the same resolved scope, so access is checked
+    against the job's scope and the export permission, not against who submitted it.
+    """
+    job = db.get(BackgroundJob, job_id)
+    if not job or job.kind != EXPORT_JOB:
+        raise HTTPException(status_code=404, detail="Export not found")
+    params = job.params or {}
+    if not can_export(user, params.get("export")):
+        raise HTTPException(status_code=403, detail="Permission denied")
+    if params.get("scope_fp") != scope_fingerprint(get_user_scope(db, user)):
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job
+
+
+@router.get("/{job_id}")
+def get_export_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    return serialize_export_job(_get_export_job(job_id, db, current_user))
+
+
+@router.get("/{job_id}/download")
+def download_export(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user),
+):
+    job = _get_export_job(job_id, db, current_user)
+    if job.status == STATUS_EXPIRED:
+        raise HTTPException(status_code=410, detail="Export file expired, please export again")
+    if job.status != STATUS_COMPLETED:
+        raise HTTPException(status_code=409, detail=f"Export is {job.status}")
+    path = artifact_path(job)
+    if path is None:
+        raise HTTPException(status_code=410, detail="Export file expired, please export again")
+    return FileResponse(path, media_type=XLSX_MEDIA_TYPE, filename=job.result.get("download_name") or path.name)
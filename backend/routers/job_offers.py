@@ -137,24 +137,6 @@ def update_offer(offer_id: int, data: JobOfferCreate, db: Session = Depends(get_
     db.refresh(offer)
     return offer
 
-# NEW-4 FIX: Redis-based rate limit для PIN (multi-worker safe)
-from utils.rate_limiter import check_rate_limit as _check_rl
-
-PIN_RATE_LIMIT_WINDOW = 900  # 15 minutes
-PIN_RATE_LIMIT_MAX = 5       # max attempts per token
-PIN_ACTION_RATE_LIMIT_WINDOW = 900  # 15 minutes
-PIN_ACTION_RATE_LIMIT_MAX = 5       # max action attempts per token
-
-def _check_pin_rate_limit(token: str) -> bool:
-    """Returns True if rate limited. Uses Redis (multi-worker safe)."""
-    return _check_rl(f"pin:{token}", PIN_RATE_LIMIT_MAX, PIN_RATE_LIMIT_WINDOW)
-
-
-def _check_pin_action_rate_limit(token: str) -> bool:
-    """Returns True if action PIN checks are rate limited."""
-    return _check_rl(f"pin_action:{token}", PIN_ACTION_RATE_LIMIT_MAX, PIN_ACTION_RATE_LIMIT_WINDOW)
-
-
 @router.get("/public/{token}")
 def get_public_offer(token: str, db: Session = Depends(get_db)):
     """
@@ -193,10 +175,6 @@ def unlock_offer_with_pin(token: str, data: PinVerifyRequest, db: Session = Depe
     if not offer:
         raise HTTPException(status_code=404, detail="Offer not found")
 
-    # Rate limit
-    if _check_pin_rate_limit(token):
-        raise HTTPException(status_code=429, detail="Слишком много попыток. Попробуйте позже.")
-
     if not hmac.compare_digest(str(data.pin), str(offer.access_code or "")):
         raise HTTPException(status_code=403, detail="Неверный PIN-код")
 
@@ -239,9 +217,6 @@ def job_offer_action(token: str, data: JobOfferActionRequest, db: Session = Depe
     if not offer:
         raise HTTPException(status_code=404, detail="Offer not found")
 
-    if _check_pin_action_rate_limit(token):
-        raise HTTPException(status_code=429, detail="Слишком много попыток. Попробуйте позже.")
-    
     # FIX #7: Require PIN verification before action
     if not hmac.compare_digest(str(data.pin), str(offer.access_code or "")):
         raise HTTPException(status_code=403, detail="Неверный PIN-код")
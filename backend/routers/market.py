@@ -10,6 +10,7 @@ from schemas import MarketDataCreate, MarketDataUpdate, MarketEntryCreate, Marke
 from dependencies import get_current_active_user
 from utils.date_utils import now_iso, to_iso_utc, to_utc_datetime
 from utils.outbound_http import async_get_with_retry
+from services.analytics_cache import TAG_MARKET, invalidate_analytics_cache
 
 router = APIRouter(prefix="/api/market", tags=["market"])
 logger = logging.getLogger("fot.market")
@@ -194,6 +195,7 @@ def create_market_data(data: MarketDataCreate, db: Session = Depends(get_db), cu
     )
     db.add(new_data)
     db.commit()
+    invalidate_analytics_cache(TAG_MARKET)
     db.refresh(new_data)
     return {
         "id": new_data.id,
@@ -226,6 +228,7 @@ def add_market_entry(entry: MarketEntryCreate, db: Session = Depends(get_db), cu
     )
     db.add(new_entry)
     db.commit()
+    invalidate_analytics_cache(TAG_MARKET)
     db.refresh(new_entry)
     
     # Recalculate
@@ -251,6 +254,7 @@ def delete_market_entry(id: int, db: Session = Depends(get_db), current_user: Us
     m_id = entry.market_id
     db.delete(entry)
     db.commit()
+    invalidate_analytics_cache(TAG_MARKET)
     
     recalculate_stats(db, m_id)
     return {"status": "deleted"}
@@ -267,6 +271,7 @@ def delete_market_data(id: int, db: Session = Depends(get_db), current_user: Use
     
     db.delete(item)
     db.commit()
+    invalidate_analytics_cache(TAG_MARKET)
     return {"status": "deleted"}
 
 @router.post("/{id}/sync-hh")
@@ -363,6 +368,7 @@ async def sync_market_with_hh(id: int, db: Session = Depends(get_db), current_us
         
     if count_added > 0:
         db.commit()
+        invalidate_analytics_cache(TAG_MARKET)
         recalculate_stats(db, id)
     
     return {"message": "Synced successfully", "count": count_added}
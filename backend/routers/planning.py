@@ -1,18 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from typing import List, Optional
 from datetime import datetime
 from database.database import get_db
-from database.models import PlanningPosition, User, OrganizationUnit, AuditLog
+from database.models import PlanningPosition, User, AuditLog
 from dependencies import get_current_active_user, get_user_scope
 from pydantic import BaseModel
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from io import BytesIO
 import logging
 from utils.date_utils import now_iso, to_iso_utc
+from services.analytics_cache import TAG_FINANCIALS, TAG_PLANNING, invalidate_analytics_cache
+from services.export_service import (
+    PLANNING_COLUMNS, PLANNING_SHEET_TITLE, can_export, planning_export_rows, submit_export,
+)
+from services.xlsx_stream import iter_xlsx, xlsx_streaming_response
+from routers.exports import serialize_export_job
 
 logger = logging.getLogger("fot.planning")
 
@@ -171,6 +173,7 @@ def create_plan(plan: PlanCreate, db: Session = Depends(get_db), current_user: U
     )
     db.add(audit)
     db.commit()
+    invalidate_analytics_cache(TAG_PLANNING)
     
     return {"status": "success", "id": new_plan.id}
 
@@ -226,6 +229,10 @@ def update_plan(plan_id: int, plan: PlanUpdate, db: Session = Depends(get_db), c
             logger.info("Auto-synced %d employees for plan %d", synced, plan_id)
 
         db.commit()
+        if synced > 0:
+            invalidate_analytics_cache(TAG_PLANNING, TAG_FINANCIALS)
+        else:
+            invalidate_analytics_cache(TAG_PLANNING)
         
     return {"status": "updated"}
 
@@ -248,6 +255,7 @@ def delete_plan(plan_id: int, db: Session = Depends(get_db), current_user: User
     
     db.delete(db_plan)
     db.commit()
+    invalidate_analytics_cache(TAG_PLANNING)
     
     return {"status": "deleted"}
 
@@ -290,105 +298,21 @@ def export_planning_excel(req: ExportRequest, db: Session = Depends(get_db), cur
         raise HTTPException(403, "Permission 'manage_planning' required")
 
     try:
-        # Optimized: Pre-fetch Organization Units to avoid N+1 queries
-        from sqlalchemy import select
-        units = db.scalars(select(OrganizationUnit)).all()
-        unit_map = {u.id: u for u in units}
-        
-        # Get planning data with scope filtering
-        query = db.query(PlanningPosition).filter(PlanningPosition.scenario_id == None)
-        query = filter_by_scope(query, current_user, db)
-        if req.ids is not None:
-            query = query.filter(PlanningPosition.id.in_(req.ids))
-        plans = query.all()
-        
-        logger.info("Found %d planning positions to export", len(plans))
-        
-        # Create workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "ФОТ Планирование"
-        
-        # Header styling
-        header_fill = PatternFill(start_color="1F2937", end_color="1F2937", fill_type="solid")
-        header_font = Font(color="FFFFFF", bold=True, size=11)
-        
-        # Headers
-        headers = [
-            "Позиция", "Филиал", "Отдел", "График", "Кол-во",
-            "Оклад (Нет)", "Оклад (Брут)", "KPI (Нет)", "KPI (Брут)",
-            "Бонус (Нет)", "Бонус (Брут)", "Кол-во доплат", "Всего (Нет)", "Всего (Брут)"
-        ]
-        
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num, value=header)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-        
-        # Data rows
-        for row_num, plan in enumerate(plans, 2):
-            branch_name = "-"
-            dept_name = "-"
-            
-            # Lookup from pre-fetched map (O(1)) instead of DB query (O(N))
-            if plan.branch_id:
-                branch = unit_map.get(plan.branch_id)
-                if branch: branch_name = branch.name
-            
-            if plan.department_id:
-                dept = unit_map.get(plan.department_id)
-                if dept: dept_name = dept.name
-            
-            actual_bonus_count = plan.bonus_count if plan.bonus_count is not None else plan.count
-            total_net = (plan.base_net + plan.kpi_net) * plan.count + (plan.bonus_net * actual_bonus_count)
-            total_gross = (plan.base_gross + plan.kpi_gross) * plan.count + (plan.bonus_gross * actual_bonus_count)
-            
-            data = [
-                plan.position_title,
-                branch_name,
-                dept_name,
-                plan.schedule or "-",
-                plan.count,
-                plan.base_net,
-                plan.base_gross,
-                plan.kpi_net,
-                plan.kpi_gross,
-                plan.bonus_net,
-                plan.bonus_gross,
-                actual_bonus_count,
-                total_net,
-                total_gross
-            ]
-            
-            for col_num, value in enumerate(data, 1):
-                cell = ws.cell(row=row_num, column=col_num, value=value)
-                if col_num >= 5:  # Number columns
-                    cell.number_format = '#,##0'
-                cell.alignment = Alignment(horizontal="left" if col_num <= 4 else "right")
-        
-        # Column widths
-        ws.column_dimensions['A'].width = 30
-        ws.column_dimensions['B'].width = 20
-        ws.column_dimensions['C'].width = 20
-        ws.column_dimensions['D'].width = 12
-        for col in ['E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M']:
-            ws.column_dimensions[col].width = 14
-        
-        # Save to BytesIO
-        excel_file = BytesIO()
-        wb.save(excel_file)
-        excel_content = excel_file.getvalue()
-        
-        logger.info("Excel file size: %d bytes", len(excel_content))
-        
+        # Streaming export: rows come from a server-side cursor and go out as xlsx chunks;
+        # the first chunk is built here, so query errors still produce a clean 500.
+        allowed_ids = get_user_scope(db, current_user)
+        chunks = iter_xlsx(PLANNING_SHEET_TITLE, PLANNING_COLUMNS, planning_export_rows(db, allowed_ids, req.ids))
         filename = f"FOT_Planning_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        
-        return Response(
-            content=excel_content,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return xlsx_streaming_response(chunks, filename)
     except Exception:
         logger.exception("Error exporting planning")
         raise HTTPException(status_code=500, detail="Export failed. Please try again later.")
+
+
+@router.post("/planning/export/jobs")
+def submit_planning_export(req: ExportRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
+    if not can_export(current_user, "planning"):
+        raise HTTPException(403, "Permission 'manage_planning' required")
+    # Large exports: built by the job worker, fetched later via /api/exports/{id}/download
+    job = submit_export(db, "planning", current_user, get_user_scope(db, current_user), req.ids)
+    return serialize_export_job(job)
@@ -6,6 +6,7 @@ from database.database import get_db
 from database.models import Position, User
 from schemas import PositionCreate, PositionUpdate, PositionResponse
 from dependencies import get_current_active_user, PermissionChecker
+from services.analytics_cache import TAG_ORG_UNIT, invalidate_analytics_cache
 
 router = APIRouter(prefix="/api/positions", tags=["positions"])
 
@@ -51,6 +52,8 @@ def update_position(pos_id: int, data: PositionUpdate, db: Session = Depends(get
     pos.grade = data.grade
     db.commit()
     db.refresh(pos)
+    # Titles appear in exports/analytics keyed by org_unit data version
+    invalidate_analytics_cache(TAG_ORG_UNIT)
     return pos
 
 @router.delete("/{pos_id}", dependencies=[Depends(PermissionChecker('edit_positions'))])
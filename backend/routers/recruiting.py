@@ -17,6 +17,7 @@ from schemas import (
     VacancyStatusUpdate,
     VacancyUpdate,
 )
+from services.notification_service import NotificationBatch
 
 
 router = APIRouter(prefix="/api", tags=["recruiting"])
@@ -441,15 +442,11 @@ def notify_customer_about_candidate(
         content=f"Уведомление заказчику от {author_name}: {data.message}",
     )
 
-    # In-app notification for customer
-    from database.models import Notification
+    # In-app notification for customer (pushed to open notification streams on commit)
     notification_msg = f"Рекрутер {author_name} сообщает по кандидату '{candidate.first_name} {candidate.last_name}' (заявка '{vacancy.title}'): {data.message}"
-    notification = Notification(
-        user_id=customer_id,
-        message=notification_msg,
-        link=f"/job-requests?vacancy_id={vacancy.id}"
-    )
-    db.add(notification)
+    NotificationBatch().add(
+        notification_msg, link=f"/job-requests?vacancy_id={vacancy.id}", user_ids=[customer_id]
+    ).dispatch(db)
     
     # Visible comment on vacancy so customer sees it in their discussion tab
     # Not system - so it appears as a real message from the recruiter
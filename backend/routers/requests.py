@@ -4,6 +4,8 @@ from database.database import get_db
 from database.models import SalaryRequest, User, Employee
 from schemas import SalaryRequestCreate, SalaryRequestUpdate
 from dependencies import get_current_active_user, require_admin
+from services.notification_service import NotificationBatch
+from services.org_unit_service import get_org_tree
 from utils.date_utils import now_iso, to_iso_utc, to_utc_datetime
 
 def check_step_condition(step, req_data) -> bool:
@@ -78,26 +80,22 @@ def create_request(data: SalaryRequestCreate, db: Session = Depends(get_db), cur
         created_at_dt=to_utc_datetime(req_created_at)
     )
     db.add(log)
-    db.commit()
-    
-    # Notify first step approver
+
+    # Notify first step approver (user or every member of the role), then
+    # ALL OTHER steps that a request is created (Visibility req)
+    notifications = NotificationBatch()
     if first_step:
-        if first_step.user_id:
-            _notify(db, first_step.user_id, f"Новая заявка на согласование: {emp.full_name}", link="/requests")
-        elif first_step.role_id:
-            users = db.query(User).filter(User.role_id == first_step.role_id).all()
-            for u in users:
-                _notify(db, u.id, f"Новая заявка на согласование: {emp.full_name}", link="/requests")
-                
-    # Also notify ALL OTHER steps that a request is created (Visibility req)
-    other_steps = db.query(ApprovalStep).filter(ApprovalStep.id != current_step_id).all()
-    for s in other_steps:
-         if s.user_id:
-            _notify(db, s.user_id, f"Создана новая заявка (Ожидает {first_step.label if first_step else '?'})", link="/requests")
-         elif s.role_id:
-            users = db.query(User).filter(User.role_id == s.role_id).all()
-            for u in users:
-                _notify(db, u.id, f"Создана новая заявка (Ожидает {first_step.label if first_step else '?'})", link="/requests")
+        notifications.add(
+            f"Новая заявка на согласование: {emp.full_name}", link="/requests",
+            user_ids=[first_step.user_id], role_ids=[] if first_step.user_id else [first_step.role_id],
+        )
+    other_steps = [s for s in all_steps if s.id != current_step_id] if current_step_id else []
+    notifications.add(
+        f"Создана новая заявка (Ожидает {first_step.label if first_step else '?'})", link="/requests",
+        user_ids=[s.user_id for s in other_steps],
+        role_ids=[s.role_id for s in other_steps if not s.user_id],
+    )
+    notifications.send(db, current_user.id)
 
     db.commit()
     
@@ -169,9 +167,8 @@ def get_requests(
         .all()
     )
     
-    # Pre-fetch all OrgUnits for scope lookups (replaces db.get() in loop)
-    all_units = db.query(OrganizationUnit).all()
-    unit_map = {u.id: u for u in all_units}
+    # Shared cached OrgTree for scope lookups (replaces db.get() in loop)
+    unit_map = get_org_tree(db).nodes
     
     res = []
     for r in requests:
@@ -380,44 +377,30 @@ def update_status(req_id: int, data: SalaryRequestUpdate, db: Session = Depends(
                 response_data = {"status": "approved_fallback"}
 
         # --- Notifications ---
+        notifications = NotificationBatch()
         if req.status == 'approved':
-              # Notify requester
-              _notify(db, req.requester_id, f"Ваша заявка на {req.employee.full_name} была полностью одобрена!", link="/requests")
-              
-              # Notify those who should be notified on completion
+              # Notify requester, then those who should be notified on completion
+              notifications.add(f"Ваша заявка на {req.employee.full_name} была полностью одобрена!", link="/requests", user_ids=[req.requester_id])
               notify_steps = db.query(ApprovalStep).filter(ApprovalStep.notify_on_completion == True).all()
-              for ns in notify_steps:
-                  users_to_notify = db.query(User).filter(User.role_id == ns.role_id).all()
-                  for u in users_to_notify:
-                      _notify(db, u.id, f"Заявка на {req.employee.full_name} успешно утверждена.", link="/requests")
+              notifications.add(
+                  f"Заявка на {req.employee.full_name} успешно утверждена.", link="/requests",
+                  role_ids=[ns.role_id for ns in notify_steps],
+              )
          
         elif req.current_step_id:
             # Notify people in the NEW current step
               new_step = db.get(ApprovalStep, req.current_step_id)
               if new_step:
-                  if new_step.user_id:
-                      _notify(db, new_step.user_id, f"Заявка согласована предыдущим этапом. Теперь ваша очередь: {req.employee.full_name}", link="/requests")
-                  elif new_step.role_id:
-                      users_to_notify = db.query(User).filter(User.role_id == new_step.role_id).all()
-                      for u in users_to_notify:
-                         _notify(db, u.id, f"Заявка согласована предыдущим этапом. Теперь ваша очередь: {req.employee.full_name}", link="/requests")
+                  notifications.add(
+                      f"Заявка согласована предыдущим этапом. Теперь ваша очередь: {req.employee.full_name}", link="/requests",
+                      user_ids=[new_step.user_id], role_ids=[] if new_step.user_id else [new_step.role_id],
+                  )
+        notifications.send(db, current_user.id)
 
         db.commit()
          
         return response_data
 
-def _notify(db: Session, user_id: int, message: str, link: str = None):
-    from database.models import Notification
-    created_at = now_iso()
-    note = Notification(
-        user_id=user_id,
-        message=message,
-        created_at=created_at,
-        created_at_dt=to_utc_datetime(created_at),
-        link=link
-    )
-    db.add(note)
-
 @router.delete("/{req_id}")
 def delete_request(req_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_active_user)):
     req = db.get(SalaryRequest, req_id)
@@ -473,8 +456,8 @@ def get_request_analytics(req_id: int, db: Session = Depends(get_db), current_us
     }
     
     if r.employee:
-        from database.models import MarketData, FinancialRecord, Employee, PlanningPosition, OrganizationUnit, Position
-        from sqlalchemy import func, and_
+        from database.models import MarketData, EmployeeCurrentCompensation, Employee, PlanningPosition, OrganizationUnit, Position
+        from sqlalchemy import func
         
         # Identify Branch ID for market data (Branch Level)
         branch_id = None
@@ -505,12 +488,6 @@ def get_request_analytics(req_id: int, db: Session = Depends(get_db), current_us
                 
         # 2. Internal Stats (Same Position in Same Unit/Branch)
         if branch_id and r.employee.position:
-            # Subquery for latest financial record
-            fact_sub = db.query(
-                FinancialRecord.employee_id,
-                func.max(FinancialRecord.id).label('max_id')
-            ).group_by(FinancialRecord.employee_id).subquery()
-            
             # Get average salary for this position in this branch
             unit_ids = [branch_id]
             # Add departments
@@ -518,13 +495,10 @@ def get_request_analytics(req_id: int, db: Session = Depends(get_db), current_us
             unit_ids.extend([d.id for d in depts])
             
             stats = db.query(
-                func.avg(FinancialRecord.total_net),
-                func.count(FinancialRecord.employee_id)
+                func.avg(EmployeeCurrentCompensation.total_net),
+                func.count(EmployeeCurrentCompensation.employee_id)
             ).join(
-                fact_sub, 
-                and_(FinancialRecord.employee_id == fact_sub.c.employee_id, FinancialRecord.id == fact_sub.c.max_id)
-            ).join(
-                Employee, Employee.id == FinancialRecord.employee_id
+                Employee, Employee.id == EmployeeCurrentCompensation.employee_id
             ).join(
                 Position, Employee.position_id == Position.id
             ).filter(
@@ -548,21 +522,15 @@ def get_request_analytics(req_id: int, db: Session = Depends(get_db), current_us
                 )
             ).filter(PlanningPosition.branch_id == branch_id).scalar() or 0
             
-            # Fact Sum 
-            fact_sub_b = db.query(
-                FinancialRecord.employee_id,
-                func.max(FinancialRecord.id).label('max_id')
-            ).group_by(FinancialRecord.employee_id).subquery()
-            
+            # Fact Sum (latest compensation from the materialized projection)
             # Safe re-definition of units
             unit_ids = [branch_id]
             depts = db.query(OrganizationUnit).filter(OrganizationUnit.parent_id == branch_id).all()
             unit_ids.extend([d.id for d in depts])
             
-            fact_sum = db.query(func.sum(FinancialRecord.total_net)).join(
-                fact_sub_b,
-                and_(FinancialRecord.employee_id == fact_sub_b.c.employee_id, FinancialRecord.id == fact_sub_b.c.max_id)
-            ).join(Employee).filter(
+            fact_sum = db.query(func.sum(EmployeeCurrentCompensation.total_net)).join(
+                Employee, Employee.id == EmployeeCurrentCompensation.employee_id
+            ).filter(
                 Employee.org_unit_id.in_(unit_ids), 
                 Employee.status != 'Dismissed'
             ).scalar() or 0
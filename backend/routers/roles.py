@@ -5,6 +5,7 @@ from database.models import Role, User
 from schemas import RoleCreate
 
 from dependencies import require_admin
+from services.principal_cache import bump_role_security_version
 
 router = APIRouter(prefix="/api/roles", tags=["roles"], dependencies=[Depends(require_admin)])
 
@@ -29,6 +30,7 @@ def update_role(role_id: int, role_data: RoleCreate, db: Session = Depends(get_d
     role.name = role_data.name
     role.permissions = role_data.permissions
     db.commit()
+    bump_role_security_version(db, role_id)
     return {"status": "updated"}
 
 @router.delete("/{role_id}")
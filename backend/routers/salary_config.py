@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from datetime import datetime
 from pydantic import BaseModel
@@ -6,7 +6,7 @@ from typing import Optional
 import logging
 
 from dependencies import get_db, require_admin, get_current_active_user
-from database.models import SalaryConfiguration, User, AuditLog, PlanningPosition, Employee, FinancialRecord
+from database.models import BackgroundJob, User, AuditLog
 from utils.date_utils import now_iso, to_iso_utc, to_utc_datetime
 
 router = APIRouter(prefix="/api/salary-config", tags=["salary-config"])
@@ -57,94 +57,17 @@ class SalaryBreakdown(BaseModel):
     
     # Details
     deduction_applied: float
+    config_version: Optional[str] = None
 
 # --- Helpers ---
 
-def get_or_create_config(db: Session) -> SalaryConfiguration:
-    config = db.query(SalaryConfiguration).first()
-    if not config:
-        now = now_iso()
-        config = SalaryConfiguration(
-            mrp=4325,
-            mzp=85000,
-            opv_rate=0.1,
-            opvr_rate=0.025,
-            vosms_rate=0.02,
-            vosms_employer_rate=0.03,
-            so_rate=0.035,
-            sn_rate=0.095,
-            ipn_rate=0.1,
-            opv_limit_mzp=50,
-            opvr_limit_mzp=50,
-            vosms_limit_mzp=10,
-            ipn_deduction_mrp=14,
-            updated_at=now,
-            updated_at_dt=to_utc_datetime(now),
-        )
-        db.add(config)
-        db.commit()
-    return config
+# Config row access and the cached snapshot live in services/salary_config_service.py
+from services.salary_config_service import get_config_snapshot, get_or_create_config, invalidate_config_snapshot
 
 # FIX #26: Single source of truth — import from salary_service instead of duplicating
 from services.salary_service import calculate_taxes, solve_gross_from_net
-
-# --- Background Task ---
-
-def recalculate_database(config_id: int, user_id: int):
-    """
-    Heavy background task to recalculate all salaries based on new config.
-    FIX #3: Creates its own DB session — the request-scoped session is closed after response.
-    """
-    from database.database import SessionLocal
-    import logging
-    bg_logger = logging.getLogger("fot.background")
-
-    db = SessionLocal()
-    try:
-        bg_logger.info(f"Starting background recalculation for config {config_id}")
-        config = db.get(SalaryConfiguration, config_id)
-        if not config:
-            bg_logger.error(f"Config {config_id} not found in background task")
-            return
-
-        # 1. Update Planning Positions
-        planning_rows = db.query(PlanningPosition).all()
-        count = 0
-        for row in planning_rows:
-            old_gross = row.base_gross + row.kpi_gross + row.bonus_gross
-            
-            row.base_gross = int(round(solve_gross_from_net(row.base_net, config)))
-            row.kpi_gross = int(round(solve_gross_from_net(row.kpi_net, config)))
-            row.bonus_gross = int(round(solve_gross_from_net(row.bonus_net, config)))
-            
-            new_gross = row.base_gross + row.kpi_gross + row.bonus_gross
-            if abs(old_gross - new_gross) > 1:
-                count += 1
-                
-        # 2. Update Employees
-        employees = db.query(Employee).filter(Employee.status != "Dismissed").all()
-        emp_count = 0
-        for emp in employees:
-            fin = db.query(FinancialRecord).filter_by(employee_id=emp.id).order_by(FinancialRecord.id.desc()).first()
-            if fin:
-                old_gross = fin.total_gross
-                
-                fin.base_gross = int(round(solve_gross_from_net(fin.base_net, config)))
-                fin.kpi_gross = int(round(solve_gross_from_net(fin.kpi_net, config)))
-                fin.bonus_gross = int(round(solve_gross_from_net(fin.bonus_net, config)))
-                
-                fin.total_gross = fin.base_gross + fin.kpi_gross + fin.bonus_gross
-                
-                if abs(old_gross - fin.total_gross) > 1:
-                    emp_count += 1
-                    
-        db.commit()
-        bg_logger.info(f"Recalculation complete. Updated {count} plans and {emp_count} employees.")
-    except Exception as e:
-        bg_logger.error(f"Background recalculation failed: {e}", exc_info=True)
-        db.rollback()
-    finally:
-        db.close()
+from services.job_service import serialize_job
+from services.recalculation_service import SALARY_RECALC_JOB, enqueue_salary_recalculation
 
 # --- Endpoints ---
 
@@ -158,7 +81,6 @@ def get_config(
 @router.post("/")
 def update_config(
     update: SalaryConfigUpdate, 
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db), 
     current_user: User = Depends(require_admin)
 ):
@@ -186,14 +108,41 @@ def update_config(
             old_values={k: v['old'] for k,v in changes.items()},
             new_values={k: v['new'] for k,v in changes.items()}
         ))
-        
+
+        # Heavy recalculation runs in the job worker (scripts/job_worker.py), not in this process.
+        # Queued in the same transaction: a config change never lands without its job.
+        enqueue_salary_recalculation(db, config.id, current_user.id, commit=False)
         db.commit()
-        
-        # Offload heavyweight recalculation to background task
-        background_tasks.add_task(recalculate_database, config.id, current_user.id)
+        invalidate_config_snapshot()
         
     return config
 
+@router.get("/jobs/latest")
+def get_latest_recalculation_job(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_admin),
+):
+    job = (
+        db.query(BackgroundJob)
+        .filter(BackgroundJob.kind == SALARY_RECALC_JOB)
+        .order_by(BackgroundJob.id.desc())
+        .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="No recalculation jobs")
+    return serialize_job(job)
+
+@router.get("/jobs/{job_id}")
+def get_recalculation_job(
+    job_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_admin),
+):
+    job = db.get(BackgroundJob, job_id)
+    if not job or job.kind != SALARY_RECALC_JOB:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return serialize_job(job)
+
 @router.get("/history")
 def get_config_history(
     db: Session = Depends(get_db),
@@ -223,7 +172,7 @@ def calculate_salary(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user),
 ):
-    config = get_or_create_config(db)
+    config = get_config_snapshot(db)
     gross = 0.0
     if input.type.lower() == 'gross':
         gross = input.amount
@@ -235,5 +184,6 @@ def calculate_salary(
         "gross": result['gross'], "net": result['net'],
         "opv": result['opv'], "vosms": result['vosms'], "ipn": result['ipn'],
         "osms": result['osms'], "so": result['so'], "sn": result['sn'],
-        "opvr": result['opvr'], "deduction_applied": result['deduction']
+        "opvr": result['opvr'], "deduction_applied": result['deduction'],
+        "config_version": result['config_version'],
     }
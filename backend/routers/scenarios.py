@@ -1,15 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, Body
 from sqlalchemy.orm import Session
-from sqlalchemy import func, case
-from datetime import datetime
 from database.database import get_db
-from database.models import Scenario, PlanningPosition, SalaryConfiguration, User, AuditLog
+from database.models import Scenario, User
 from routers.auth import get_current_active_user  # noqa: F401 — kept for backward compat
 from dependencies import get_current_active_user  # NEW-5: правильный источник
-from services.salary_service import calculate_taxes, solve_gross_from_net, sync_employee_financials
-from pydantic import BaseModel
+from services.scenario_service import (
+    STORAGE_OVERLAY, bump_revision, commit_scenario_to_live, filter_lines, mass_update_preview,
+    plan_mass_update, resolve_scenario_lines, write_line_values,
+)
+from services.scenario_totals import adjust_scenario_totals, compare_with_live
+from services.simulation_service import run_simulation
+from services.salary_config_service import get_config_snapshot
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional, List, Literal
 from utils.date_utils import now_iso
+from services.analytics_cache import TAG_FINANCIALS, TAG_PLANNING, invalidate_analytics_cache
 
 router = APIRouter(prefix="/api/scenarios", tags=["scenarios"])
 
@@ -51,6 +56,58 @@ class MassUpdateInput(BaseModel):
     field: Literal['base_net', 'base_gross', 'kpi_net', 'kpi_gross', 'bonus_net', 'bonus_gross']
     change_type: Literal['percent', 'fixed_add', 'fixed_set']
     value: float
+    # Compute the changes and the preview without writing them
+    dry_run: bool = False
+
+class DistributionInput(BaseModel):
+    """Percentage distribution: fixed(value), uniform(low, high), normal(mean, std[, low, high]), triangular(low, mode, high)."""
+    kind: Literal['fixed', 'uniform', 'normal', 'triangular'] = 'fixed'
+    value: Optional[float] = None
+    low: Optional[float] = None
+    high: Optional[float] = None
+    mode: Optional[float] = None
+    mean: Optional[float] = None
+    std: Optional[float] = Field(None, ge=0)
+
+    @model_validator(mode="after")
+    def check_params(self):
+        required = {
+            'fixed': ('value',),
+            'uniform': ('low', 'high'),
+            'normal': ('mean', 'std'),
+            'triangular': ('low', 'mode', 'high'),
+        }[self.kind]
+        missing = [name for name in required if getattr(self, name) is None]
+        if missing:
+            raise ValueError(f"{self.kind} distribution requires: {', '.join(missing)}")
+        if self.kind in ('uniform', 'triangular') and self.low > self.high:
+            raise ValueError("low must not exceed high")
+        if self.kind == 'triangular' and not self.low <= self.mode <= self.high:
+            raise ValueError("mode must be between low and high")
+        return self
+
+class SimulationRuleInput(BaseModel):
+    branch_id: Optional[int] = None
+    department_id: Optional[int] = None
+    position_filter: Optional[str] = None
+
+    raise_percent: Optional[DistributionInput] = None
+    attrition_percent: Optional[DistributionInput] = None
+    hiring_percent: Optional[DistributionInput] = None
+
+class SimulationInput(BaseModel):
+    # Lines matching no rule stay as they are; the first matching rule applies
+    rules: List[SimulationRuleInput] = Field(default_factory=list, max_length=50)
+    iterations: int = Field(1000, ge=100, le=20000)
+    percentiles: List[float] = Field(default_factory=lambda: [5, 25, 50, 75, 95], min_length=1, max_length=20)
+    seed: Optional[int] = None
+    scenario_id: Optional[int] = None  # None = live budget
+
+    @model_validator(mode="after")
+    def check_percentiles(self):
+        if any(p < 0 or p > 100 for p in self.percentiles):
+            raise ValueError("percentiles must be between 0 and 100")
+        return self
 
 # --- Endpoints ---
 
@@ -62,6 +119,33 @@ def list_scenarios(
     _require_scenarios_view_permission(current_user)
     return db.query(Scenario).filter(Scenario.status != 'archived').all()
 
+@router.post("/simulation")
+def simulate_budget(
+    input: SimulationInput,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Monte Carlo simulation of the monthly budget (gross + employer contributions):
+    percentile bands instead of a single point estimate. Runs in the simulation
+    process pool; results are cached per parameter hash until the budget changes.
+    """
+    _require_scenarios_view_permission(current_user)
+    scenario = None
+    if input.scenario_id is not None:
+        scenario = db.get(Scenario, input.scenario_id)
+        if not scenario: raise HTTPException(404, "Scenario not found")
+
+    return run_simulation(
+        db,
+        get_config_snapshot(db),
+        [rule.model_dump(exclude_none=True) for rule in input.rules],
+        input.iterations,
+        input.percentiles,
+        seed=input.seed,
+        scenario=scenario,
+    )
+
 @router.post("/")
 def create_scenario(
     input: ScenarioCreate, 
@@ -69,42 +153,19 @@ def create_scenario(
     current_user: User = Depends(get_current_active_user)
 ):
     _require_scenarios_write_permission(current_user)
-    # 1. Create Scenario Record
+    # Copy-on-write: the scenario starts as an empty overlay of the live budget,
+    # live lines are copied into deltas only when the scenario changes them
     scenario = Scenario(
         name=input.name,
         description=input.description,
         status="draft",
+        storage=STORAGE_OVERLAY,
         created_at=now_iso()
     )
     db.add(scenario)
     db.commit()
     db.refresh(scenario)
-    
-    # 2. Clone Live Budget
-    live_positions = db.query(PlanningPosition).filter(PlanningPosition.scenario_id == None).all()
-    
-    cloned_count = 0
-    for pos in live_positions:
-        new_pos = PlanningPosition(
-            scenario_id=scenario.id,
-            position_title=pos.position_title,
-            branch_id=pos.branch_id,
-            department_id=pos.department_id,
-            schedule=pos.schedule,
-            count=pos.count,
-            base_net=pos.base_net,
-            base_gross=pos.base_gross,
-            kpi_net=pos.kpi_net,
-            kpi_gross=pos.kpi_gross,
-            bonus_net=pos.bonus_net,
-            bonus_gross=pos.bonus_gross,
-            bonus_count=pos.bonus_count
-        )
-        db.add(new_pos)
-        cloned_count += 1
-        
-    db.commit()
-    return {"id": scenario.id, "cloned_positions": cloned_count}
+    return {"id": scenario.id, "storage": scenario.storage, "cloned_positions": 0}
 
 @router.delete("/{id}")
 def delete_scenario(
@@ -129,81 +190,13 @@ def compare_scenario(
 ):
     _require_scenarios_view_permission(current_user)
     """
-    Compare Scenario vs Live
+    Compare Scenario vs Live.
+    Totals are cached per scenario revision and kept up to date by apply-change;
+    per-line tax results are cached by (line content, config version).
     """
-    # Helper to aggregate
-    def aggregate(scenario_id):
-        return db.query(
-            func.sum(PlanningPosition.count).label('headcount'),
-            func.sum(
-                (PlanningPosition.base_net + PlanningPosition.kpi_net) * PlanningPosition.count + \
-                PlanningPosition.bonus_net * func.coalesce(PlanningPosition.bonus_count, PlanningPosition.count)
-            ).label('total_net'),
-            func.sum(
-                (PlanningPosition.base_gross + PlanningPosition.kpi_gross) * PlanningPosition.count + \
-                PlanningPosition.bonus_gross * func.coalesce(PlanningPosition.bonus_count, PlanningPosition.count)
-            ).label('total_gross')
-        ).filter(PlanningPosition.scenario_id == scenario_id).first()
-
-    live_agg = aggregate(None)
-    scenario_agg = aggregate(id)
-    
-    # Detailed tax calculation for totals?
-    # Simple Estimate: Total Gross - Total Net = Taxes (roughly)
-    # For accurate taxes, we'd need to sum calculated taxes per line.
-    
-    # Let's do a smarter aggregation for taxes using Python for accuracy (piecewise logic hard in SQL without stored procs)
-    def calc_detailed(scenario_id):
-        rows = db.query(PlanningPosition).filter(PlanningPosition.scenario_id == scenario_id).all()
-        config = db.query(SalaryConfiguration).first()
-        
-        total_taxes = 0
-        total_net = 0
-        total_gross = 0
-        
-        for r in rows:
-            # We assume stored Gross is correct. 
-            # Total Cost for Company = Gross + Employer Taxes
-            # Taxes = (Gross - Net) [Employee Side] + Employer Side
-            
-            # Recalc line tax to be sure?
-            line_gross = r.base_gross + r.kpi_gross
-            line_net = r.base_net + r.kpi_net
-            # we also need the full per-person line info to calculate taxes correctly...
-            # This logic is tricky, let's keep it simple: multiply by count
-            actual_bonus_count = r.bonus_count if r.bonus_count is not None else r.count
-            line_total_net = line_net * r.count + r.bonus_net * actual_bonus_count
-            line_total_gross = line_gross * r.count + r.bonus_gross * actual_bonus_count
-            
-            # Rough employer tax calc (we have to apply it proportionally if sizes differ, but this is an estimate anyway)
-            res = calculate_taxes(line_total_gross / r.count if r.count else 0, config) 
-            employer_taxes_per_emp = res['osms'] + res['so'] + res['sn'] + res['opvr']
-            
-            line_total_cost = line_total_gross + (employer_taxes_per_emp * r.count) 
-            
-            total_net += line_total_net
-            total_gross += line_total_gross
-            total_taxes += (line_total_cost - line_total_net)
-            
-        return {
-            "total_net": total_net,
-            "total_gross": total_gross,
-            "total_taxes": total_taxes,
-            "total_budget": total_net + total_taxes
-        }
-        
-    stats_live = calc_detailed(None)
-    stats_scenario = calc_detailed(id)
-    
-    return {
-        "live": stats_live,
-        "scenario": stats_scenario,
-        "delta": {
-            "net": stats_scenario["total_net"] - stats_live["total_net"],
-            "budget": stats_scenario["total_budget"] - stats_live["total_budget"],
-            "percent": ((stats_scenario["total_budget"] - stats_live["total_budget"]) / stats_live["total_budget"] * 100) if stats_live["total_budget"] else 0
-        }
-    }
+    scenario = db.get(Scenario, id)
+    if not scenario: raise HTTPException(404, "Scenario not found")
+    return compare_with_live(db, scenario, get_config_snapshot(db))
 
 @router.post("/{id}/apply-change")
 def mass_update_scenario(
@@ -216,67 +209,37 @@ def mass_update_scenario(
     """
     Mass update rows in a scenario.
     Example: Increase base_net by 10% for Department X.
+    Returns the number of changed lines and a preview of the first changes;
+    dry_run=true only computes them.
     """
     scenario = db.get(Scenario, id)
     if not scenario: raise HTTPException(404, "Scenario not found")
     
-    query = db.query(PlanningPosition).filter(PlanningPosition.scenario_id == id)
-    
-    if input.target_branch_id:
-        query = query.filter(PlanningPosition.branch_id == input.target_branch_id)
-        
-    if input.target_department_id:
-        query = query.filter(PlanningPosition.department_id == input.target_department_id)
-        
-    if input.position_filter:
-        # FIX #12: Escape SQL LIKE wildcards in user input
-        safe_filter = input.position_filter.replace('%', r'\%').replace('_', r'\_')
-        query = query.filter(PlanningPosition.position_title.ilike(f"%{safe_filter}%"))
-        
-    positions = query.all()
-    config = db.query(SalaryConfiguration).first()
-    
-    updated_count = 0
-    
-    for pos in positions:
-        current_val = getattr(pos, input.field)
-        new_val = current_val
-        
-        if input.change_type == 'percent':
-            new_val = current_val * (1 + input.value / 100.0)
-        elif input.change_type == 'fixed_add':
-            new_val = current_val + input.value
-        elif input.change_type == 'fixed_set':
-            new_val = input.value
-            
-        new_val = int(round(new_val))
-        
-        if new_val != current_val:
-            setattr(pos, input.field, new_val)
-            
-            # Recalculate Logic
-            # If we changed NET, solve GROSS. If GROSS, solve NET.
-            # Assuming standard fields: base, kpi, bonus
-            
-            prefix = input.field.split('_')[0] # base, kpi, bonus
-            suffix = input.field.split('_')[1] # net, gross
-            
-            other_suffix = 'gross' if suffix == 'net' else 'net'
-            other_field = f"{prefix}_{other_suffix}"
-            
-            if suffix == 'net':
-                # Recalc Gross
-                new_gross = solve_gross_from_net(new_val, config)
-                setattr(pos, other_field, int(round(new_gross)))
-            else:
-                # Recalc Net
-                res = calculate_taxes(new_val, config)
-                setattr(pos, other_field, int(round(res['net'])))
-                
-            updated_count += 1
-            
-    db.commit()
-    return {"updated": updated_count}
+    # Resolved lines (live + overlay): touched live lines are copied into deltas on write
+    positions = filter_lines(
+        resolve_scenario_lines(db, scenario),
+        input.target_branch_id, input.target_department_id, input.position_filter,
+    )
+    config = get_config_snapshot(db)
+    # Net -> gross (or gross -> net) solved for all lines in one batch pass
+    changes = plan_mass_update(positions, input.field, input.change_type, input.value, config)
+    result = {
+        "updated": len(changes),
+        "matched": len(positions),
+        "dry_run": input.dry_run,
+        "preview": mass_update_preview(changes),
+    }
+    if input.dry_run:
+        return result
+
+    if changes:
+        old_revision = scenario.revision or 0
+        updated = write_line_values(db, scenario, changes)
+        new_revision = bump_revision(db, scenario)
+        db.commit()
+        # Cached comparison totals move by the changed lines only
+        adjust_scenario_totals(id, config, old_revision, new_revision, [pos for pos, _ in changes], updated)
+    return result
 
 @router.post("/{id}/commit")
 def commit_scenario(
@@ -293,133 +256,10 @@ def commit_scenario(
     """
     scenario = db.get(Scenario, id)
     if not scenario: raise HTTPException(404, "Scenario not found")
-    
-    # 1. Backup Live (Clone existing live to backup scenario)
-    backup_name = f"Backup {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    backup_scenario = Scenario(name=backup_name, status="archived", description="Auto-backup before commit")
-    db.add(backup_scenario)
-    db.flush()
-    
-    # Clone current Live rows to Backup (preserving data snapshot)
-    live_rows = db.query(PlanningPosition).filter(PlanningPosition.scenario_id == None).all()
-    for live in live_rows:
-        backup_pos = PlanningPosition(
-            scenario_id=backup_scenario.id,
-            position_title=live.position_title,
-            branch_id=live.branch_id,
-            department_id=live.department_id,
-            schedule=live.schedule,
-            count=live.count,
-            base_net=live.base_net, base_gross=live.base_gross,
-            kpi_net=live.kpi_net, kpi_gross=live.kpi_gross,
-            bonus_net=live.bonus_net, bonus_gross=live.bonus_gross,
-            bonus_count=live.bonus_count
-        )
-        db.add(backup_pos)
-    
-    # 2. Smart Merge Scenario to Live
-    scenario_rows = db.query(PlanningPosition).filter(PlanningPosition.scenario_id == id).all()
-    now_ts = now_iso()
-    sync_total = 0
-    
-    # Map existing live positions by a unique key to identify updates vs news
-    # Key: (position_title, branch_id, department_id, schedule)
-    # We assume this tuple defines a unique "Planning Slot"
-    live_map = {}
-    for r in live_rows:
-        key = (r.position_title, r.branch_id, r.department_id, r.schedule)
-        if key not in live_map: live_map[key] = []
-        live_map[key].append(r) 
-        # Note: If multiple rows have same key, we pop them one by one.
-
-    processed_live_ids = set()
 
-    for row in scenario_rows:
-        key = (row.position_title, row.branch_id, row.department_id, row.schedule)
-        
-        target_live = None
-        if key in live_map and live_map[key]:
-            target_live = live_map[key].pop(0) # Take one match
-            processed_live_ids.add(target_live.id)
-            
-            # Update Logic
-            changes = {}
-            def update_if_diff(field, val):
-                old = getattr(target_live, field)
-                if old != val:
-                    changes[field] = {'old': old, 'new': val}
-                    setattr(target_live, field, val)
-            
-            update_if_diff('count', row.count)
-            update_if_diff('base_net', row.base_net)
-            update_if_diff('base_gross', row.base_gross)
-            update_if_diff('kpi_net', row.kpi_net)
-            update_if_diff('kpi_gross', row.kpi_gross)
-            update_if_diff('bonus_net', row.bonus_net)
-            update_if_diff('bonus_gross', row.bonus_gross)
-            update_if_diff('bonus_count', row.bonus_count)
-            
-            if changes:
-                # Audit Log for Preservation
-                db.add(AuditLog(
-                    user_id=current_user.id,
-                    target_entity="planning",
-                    target_entity_id=target_live.id,
-                    timestamp=now_ts,
-                    old_values={k: v['old'] for k,v in changes.items()},
-                    new_values={k: v['new'] for k,v in changes.items()}
-                ))
-                
-                # Sync Employees
-                # We interpret changes as applied to employees
-                dummy_changes_for_sync = {k: v['new'] for k,v in changes.items() if k in ['base_net', 'base_gross', 'kpi_net', 'kpi_gross', 'bonus_net', 'bonus_gross']}
-                if dummy_changes_for_sync:
-                     sync_count = sync_employee_financials(db, target_live, dummy_changes_for_sync, current_user, now_ts)
-                     sync_total += sync_count
-
-        else:
-            # Create New
-            new_live = PlanningPosition(
-                scenario_id=None,
-                position_title=row.position_title,
-                branch_id=row.branch_id,
-                department_id=row.department_id,
-                schedule=row.schedule,
-                count=row.count,
-                base_net=row.base_net, base_gross=row.base_gross,
-                kpi_net=row.kpi_net, kpi_gross=row.kpi_gross,
-                bonus_net=row.bonus_net, bonus_gross=row.bonus_gross,
-                bonus_count=row.bonus_count
-            )
-            db.add(new_live)
-            db.flush()
-            
-            # Audit Creation
-            db.add(AuditLog(
-                user_id=current_user.id,
-                target_entity="planning",
-                target_entity_id=new_live.id,
-                timestamp=now_ts,
-                old_values=None,
-                new_values={"Событие": "Создано из сценария", "Название": row.position_title}
-            ))
-
-    # 3. Clean up deleted rows (Live rows not in scenario)
-    for live in live_rows:
-        if live.id not in processed_live_ids:
-            # This position was deleted in scenario
-            # Audit Deletion
-            db.add(AuditLog(
-                user_id=current_user.id,
-                target_entity="planning",
-                target_entity_id=live.id,
-                timestamp=now_ts,
-                old_values={"Событие": "Удалено сценарием", "Название": live.position_title},
-                new_values=None
-            ))
-            db.delete(live)
-
-    scenario.status = "committed"
+    # Set-based engine: INSERT ... SELECT backup, one diff, batched writes
+    result = commit_scenario_to_live(db, scenario, current_user)
     db.commit()
-    
-    return {"status": "committed", "backup_id": backup_scenario.id, "synced_employees": sync_total, "updated_rows": len(processed_live_ids)}
+    invalidate_analytics_cache(TAG_PLANNING, TAG_FINANCIALS)
+
+    return result
@@ -5,11 +5,15 @@ from sqlalchemy.sql import func as sql_func
 from typing import List, Optional, Set, Dict
 
 from database.database import get_db
-from database.models import OrganizationUnit, Employee, User, FinancialRecord
+from database.models import OrganizationUnit, OrgUnitClosure, Employee, User
 from schemas import OrgUnitCreate, OrgUnitUpdate
 
 from dependencies import get_current_active_user, PermissionChecker
-from services.org_unit_service import build_children_map, get_all_descendant_ids
+from services.org_unit_service import (
+    OrgTree, closure_add_unit, closure_move_unit, closure_remove_unit, get_org_tree, invalidate_org_tree,
+)
+from services.compensation_service import latest_compensation
+from services.analytics_cache import TAG_ORG_UNIT, invalidate_analytics_cache
 
 router = APIRouter(prefix="/api/structure", tags=["structure"])
 
@@ -22,7 +26,8 @@ def get_structure(db: Session = Depends(get_db), current_user: User = Depends(ge
     if perms.get('admin_access'): is_admin = True
     if perms.get('view_structure'): is_admin = True # Allow view access
     
-    branches = db.query(OrganizationUnit).filter(OrganizationUnit.type.in_(['branch', 'head_office'])).all()
+    tree = get_org_tree(db)
+    branches = tree.of_type('branch', 'head_office')
     
     if is_admin or not current_user.scope_branches:
         pass 
@@ -33,14 +38,9 @@ def get_structure(db: Session = Depends(get_db), current_user: User = Depends(ge
             except (ValueError, TypeError): pass
         branches = [b for b in branches if b.id in allowed_bids]
         
-    # Pre-fetch ALL units and use shared hierarchy service
-    all_units = db.query(OrganizationUnit).all()
-    unit_map = {u.id: u for u in all_units}
-    children_map_ids = build_children_map(db)
-
+    # Shared cached hierarchy: a subtree is a contiguous slice of the DFS order
     def get_all_descendants(unit_id):
-        desc_ids = get_all_descendant_ids(unit_id, children_map_ids)
-        return [unit_map[uid] for uid in desc_ids if uid in unit_map]
+        return [tree.nodes[uid] for uid in tree.subtree_ids(unit_id)[1:]]
 
     result = []
     user_dept_ids = set()
@@ -99,108 +99,53 @@ def get_structure_flat(
     head_ids = [u.head_id for u in units if u.head_id]
     head_salaries = {}
     
-    if head_ids and has_finance_acc:
-        # Subquery to identify the latest financial record ID for each head
-        base_sub = db.query(
-            FinancialRecord.employee_id,
-            sql_func.max(FinancialRecord.id).label('max_id')
-        ).filter(FinancialRecord.employee_id.in_(head_ids))
-        
-        if date:
-             base_sub = base_sub.filter(FinancialRecord.created_at <= date)
+    # Latest compensation per employee: materialized projection, or as-of slice for 'date'
+    comp = latest_compensation(db, date) if has_finance_acc else None
 
-        head_latest_sub = base_sub.group_by(FinancialRecord.employee_id).subquery()
-
-        # Fetch the actual total_net from those records
+    if head_ids and has_finance_acc:
         head_salary_query = db.query(
-            FinancialRecord.employee_id,
-            FinancialRecord.total_net
-        ).join(
-            head_latest_sub,
-            (FinancialRecord.employee_id == head_latest_sub.c.employee_id) &
-            (FinancialRecord.id == head_latest_sub.c.max_id)
-        ).all()
+            comp.c.employee_id,
+            comp.c.total_net
+        ).filter(comp.c.employee_id.in_(head_ids)).all()
         
         head_salaries = {r[0]: r[1] for r in head_salary_query}
 
-    # 4. Get total salaries per unit (sum of total_net from latest financial records for ALL employees)
-    direct_salaries = {}
+    # 4. Subtree totals (employees and salaries of the unit AND all descendants):
+    #    one GROUP BY ancestor_id over org_unit_closure instead of a recursive walk
+    total_counts = {r[0]: r[1] for r in db.query(
+        OrgUnitClosure.ancestor_id, func.count(Employee.id)
+    ).join(
+        OrgUnitClosure, OrgUnitClosure.descendant_id == Employee.org_unit_id
+    ).filter(Employee.status != 'Dismissed').group_by(OrgUnitClosure.ancestor_id).all()}
+
+    total_salaries = {}
     if has_finance_acc:
-        base_sub_all = db.query(
-            FinancialRecord.employee_id,
-            sql_func.max(FinancialRecord.id).label('max_id')
-        )
-        if date:
-            base_sub_all = base_sub_all.filter(FinancialRecord.created_at <= date)
-            
-        latest_finance = base_sub_all.group_by(FinancialRecord.employee_id).subquery()
-        
         salary_query = db.query(
-            Employee.org_unit_id,
-            sql_func.sum(FinancialRecord.total_net).label('total_salary')
+            OrgUnitClosure.ancestor_id,
+            sql_func.sum(comp.c.total_net).label('total_salary')
+        ).select_from(Employee).join(
+            comp, Employee.id == comp.c.employee_id
         ).join(
-            FinancialRecord, Employee.id == FinancialRecord.employee_id
-        ).join(
-            latest_finance, 
-            (FinancialRecord.employee_id == latest_finance.c.employee_id) & 
-            (FinancialRecord.id == latest_finance.c.max_id)
+            OrgUnitClosure, OrgUnitClosure.descendant_id == Employee.org_unit_id
         ).filter(
             Employee.status != 'Dismissed'
-        ).group_by(Employee.org_unit_id).all()
-        
-        direct_salaries = {r[0]: int(r[1]) if r[1] else 0 for r in salary_query}
+        ).group_by(OrgUnitClosure.ancestor_id).all()
+
+        total_salaries = {r[0]: int(r[1]) if r[1] else 0 for r in salary_query}
 
     # Determine allowed scope
     from dependencies import get_user_scope
     allowed_ids = get_user_scope(db, current_user)
 
-    # 5. Build hierarchy map and parent resolution
-    children_map = {}
-    parent_map = {}
-    for u in units:
-        parent_map[u.id] = u.parent_id
-        if u.parent_id:
-            if u.parent_id not in children_map: children_map[u.parent_id] = []
-            children_map[u.parent_id].append(u.id)
-            
-    # Filter visible units
-    visible_unit_ids = set()
+    # 5. Visible units: allowed ones plus their ancestors (structural shells), from the closure
     if allowed_ids is not None:
-        allowed_set = set(allowed_ids)
-        for uid in allowed_set:
-            if uid in parent_map: # ensuring it exists
-                visible_unit_ids.add(uid)
-                # Resolve parents
-                curr_parent = parent_map[uid]
-                while curr_parent:
-                    visible_unit_ids.add(curr_parent)
-                    curr_parent = parent_map.get(curr_parent)
+        visible_unit_ids = {r[0] for r in db.query(OrgUnitClosure.ancestor_id).filter(
+            OrgUnitClosure.descendant_id.in_(allowed_ids)
+        ).distinct()}
     else:
         visible_unit_ids = {u.id for u in units}
 
-    # 6. Recursive count and salary functions with Memoization
-    memo_counts = {}
-    memo_salaries = {}
-
-    def get_total_count(uid):
-        if uid in memo_counts: return memo_counts[uid]
-        count = direct_counts.get(uid, 0)
-        children = children_map.get(uid, [])
-        for child_id in children:
-            count += get_total_count(child_id)
-        memo_counts[uid] = count
-        return count
-    
-    def get_total_salary(uid):
-        if uid in memo_salaries: return memo_salaries[uid]
-        salary = direct_salaries.get(uid, 0)
-        children = children_map.get(uid, [])
-        for child_id in children:
-            salary += get_total_salary(child_id)
-        memo_salaries[uid] = salary
-        return salary
-
-    # 7. Build Result
+    # 6. Build Result
     result = []
     for u in units:
         if u.id not in visible_unit_ids:
@@ -228,9 +173,9 @@ def get_structure_flat(
             "parent_id": u.parent_id,
             "head_id": u.head_id,
             "head": head_info,
-            "employee_count": get_total_count(u.id) if is_authorized else 0,
+            "employee_count": total_counts.get(u.id, 0) if is_authorized else 0,
             "direct_count": direct_counts.get(u.id, 0) if is_authorized else 0,
-            "total_salary": get_total_salary(u.id) if is_authorized else 0
+            "total_salary": total_salaries.get(u.id, 0) if is_authorized else 0
         })
     return result
 
@@ -239,7 +184,11 @@ def create_head_office(item: OrgUnitCreate, db: Session = Depends(get_db)):
     """Create a Head Office (top-level organizational unit)"""
     org = OrganizationUnit(name=item.name, type="head_office", parent_id=None, head_id=item.head_id)
     db.add(org)
+    db.flush()
+    closure_add_unit(db, org.id, org.parent_id)
     db.commit()
+    invalidate_org_tree()
+    invalidate_analytics_cache(TAG_ORG_UNIT)
     db.refresh(org)
     return {"status": "ok", "id": org.id}
 
@@ -248,7 +197,11 @@ def create_branch(item: OrgUnitCreate, db: Session = Depends(get_db)):
     """Create a Branch (can be under head_office or standalone)"""
     org = OrganizationUnit(name=item.name, type="branch", parent_id=item.parent_id, head_id=item.head_id)
     db.add(org)
+    db.flush()
+    closure_add_unit(db, org.id, org.parent_id)
     db.commit()
+    invalidate_org_tree()
+    invalidate_analytics_cache(TAG_ORG_UNIT)
     db.refresh(org)
     return {"status": "ok", "id": org.id}
 
@@ -256,7 +209,11 @@ def create_branch(item: OrgUnitCreate, db: Session = Depends(get_db)):
 def create_department(item: OrgUnitCreate, db: Session = Depends(get_db)):
     org = OrganizationUnit(name=item.name, type="department", parent_id=item.parent_id, head_id=item.head_id)
     db.add(org)
+    db.flush()
+    closure_add_unit(db, org.id, org.parent_id)
     db.commit()
+    invalidate_org_tree()
+    invalidate_analytics_cache(TAG_ORG_UNIT)
     db.refresh(org)
     return {"status": "ok", "id": org.id}
 
@@ -274,19 +231,21 @@ def update_unit(id: int, item: OrgUnitUpdate, db: Session = Depends(get_db)):
         if item.parent_id == id:
              raise HTTPException(status_code=400, detail="Cannot be parent to itself")
              
-        # Check 2: Advanced Circular Dependency — use shared service
-        children_map = build_children_map(db)
-        descendant_ids = get_all_descendant_ids(id, children_map)
-
-        if item.parent_id in descendant_ids:
+        # Check 2: Advanced Circular Dependency — validated against a fresh read, not the cache
+        if OrgTree.load(db).is_descendant(item.parent_id, id):
              raise HTTPException(status_code=400, detail="Circular dependency detected: Cannot move unit under its own descendant")
 
-        unit.parent_id = item.parent_id
+        if unit.parent_id != item.parent_id:
+            unit.parent_id = item.parent_id
+            db.flush()
+            closure_move_unit(db, unit.id, item.parent_id)
 
     if item.head_id is not None:
         unit.head_id = item.head_id if item.head_id > 0 else None
 
     db.commit()
+    invalidate_org_tree()
+    invalidate_analytics_cache(TAG_ORG_UNIT)
     db.refresh(unit)
     return {"status": "updated", "id": unit.id}
 
@@ -302,6 +261,9 @@ def delete_unit(id: int, db: Session = Depends(get_db)):
     emps = db.query(Employee).filter_by(org_unit_id=id).first()
     if emps: raise HTTPException(400, "Cannot delete unit with assigned employees")
 
+    closure_remove_unit(db, unit.id)
     db.delete(unit)
     db.commit()
+    invalidate_org_tree()
+    invalidate_analytics_cache(TAG_ORG_UNIT)
     return {"status": "deleted"}
@@ -6,11 +6,14 @@ import os
 import uuid
 
 from database.database import get_db
-from database.models import User, OrganizationUnit
+from database.models import User
 from schemas import UserCreate, UserUpdate, UserProfileUpdate
-from dependencies import require_admin, get_current_active_user
+from dependencies import require_admin, get_current_active_user, get_current_user_row
 from security import get_password_hash  # Single source of truth
 from services.auth_service import AuthService  # FIX A4/A5: Password validation
+from services.org_unit_service import get_org_tree
+from services.principal_cache import bump_security_version, bump_security_version_async
+from services.scope_service import invalidate_user_scope
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
@@ -106,9 +109,8 @@ def get_users(db: Session = Depends(get_db)):
     
     res = []
     
-    # Pre-fetch units for name resolution
-    units = db.scalars(select(OrganizationUnit)).all()
-    unit_map = {u.id: u.name for u in units}
+    # Unit names from the shared cached OrgTree
+    unit_map = {uid: node.name for uid, node in get_org_tree(db).nodes.items()}
     
     for u in users:
         scope_str = "Все филиалы"
@@ -171,13 +173,14 @@ def create_user(u: UserCreate, db: Session = Depends(get_db)):
 def update_my_profile(
     payload: UserProfileUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user),
+    current_user: User = Depends(get_current_user_row),
 ):
     current_user.full_name = payload.full_name.strip()
     current_user.job_title = payload.job_title.strip() if payload.job_title else None
     current_user.contact_email = payload.contact_email.strip() if payload.contact_email else None
     current_user.phone = payload.phone.strip() if payload.phone else None
     db.commit()
+    bump_security_version(current_user.id)
     db.refresh(current_user)
     return _serialize_auth_user(current_user)
 
@@ -185,11 +188,12 @@ def update_my_profile(
 @router.delete("/me/avatar")
 def delete_my_avatar(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user),
+    current_user: User = Depends(get_current_user_row),
 ):
     previous_avatar = current_user.avatar_url
     current_user.avatar_url = None
     db.commit()
+    bump_security_version(current_user.id)
 
     if previous_avatar and previous_avatar.startswith("/uploads/avatars/"):
         uploads_dir = _resolve_uploads_dir()
@@ -208,9 +212,10 @@ def delete_my_avatar(
 async def upload_my_avatar(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user),
+    current_user: User = Depends(get_current_user_row),
 ):
     await _save_avatar_for_user(file=file, user=current_user, db=db)
+    await bump_security_version_async(current_user.id)
 
     db.refresh(current_user)
     return _serialize_auth_user(current_user)
@@ -227,6 +232,7 @@ async def upload_user_avatar_by_admin(
         raise HTTPException(404, "User not found")
 
     await _save_avatar_for_user(file=file, user=user, db=db)
+    await bump_security_version_async(user.id)
 
     db.refresh(user)
     return {"status": "updated", "avatar_url": user.avatar_url}
@@ -241,6 +247,7 @@ def delete_user_avatar_by_admin(user_id: int, db: Session = Depends(get_db)):
     previous_avatar = user.avatar_url
     user.avatar_url = None
     db.commit()
+    bump_security_version(user_id)
 
     _delete_local_avatar_if_possible(previous_avatar)
 
@@ -271,6 +278,8 @@ def update_user(user_id: int, u: UserUpdate, db: Session = Depends(get_db)):
         user.hashed_password = get_password_hash(u.password)
     
     db.commit()
+    bump_security_version(user_id)
+    invalidate_user_scope(user_id)
     return {"status": "updated"}
 
 
@@ -282,6 +291,8 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
 
     db.delete(user)
     db.commit()
+    bump_security_version(user_id)
+    invalidate_user_scope(user_id)
     return {"status": "deleted"}
 
 @router.patch("/{user_id}/toggle_block", dependencies=[Depends(require_admin)])
@@ -290,4 +301,5 @@ def toggle_block_user(user_id: int, db: Session = Depends(get_db)):
     if not user: raise HTTPException(404, "User not found")
     user.is_active = not user.is_active
     db.commit()
+    bump_security_version(user_id)
     return {"status": "updated", "is_active": user.is_active}
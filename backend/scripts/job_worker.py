@@ -0,0 +1,78 @@
+"""
+Background job worker: runs persisted jobs (background_jobs table) outside the API process.
+
+Jobs commit their progress per chunk, so a worker killed mid-job is harmless: the next
+worker picks the job up once its heartbeat expires and resumes from the checkpoint.
+Expired export artifacts (EXPORTS_DIR) are swept every CLEANUP_INTERVAL_SECONDS.
+
+Usage:
+    python scripts/job_worker.py                  # poll forever
+    python scripts/job_worker.py --once           # drain the queue and exit
+    python scripts/job_worker.py --kind salary_recalc --poll-interval 5
+"""
+import sys
+import time
+import signal
+import logging
+import argparse
+from pathlib import Path
+
+backend_root = Path(__file__).resolve().parents[1]
+if str(backend_root) not in sys.path:
+    sys.path.append(str(backend_root))
+
+from database.database import SessionLocal
+from services.export_service import cleanup_expired_exports
+from services.job_service import load_job_handlers, run_pending_jobs
+
+logger = logging.getLogger("fot.jobs")
+
+CLEANUP_INTERVAL_SECONDS = 600  # TTL sweep of export artifacts
+
+_stopping = False
+
+
+def _stop(signum, frame):
+    global _stopping
+    _stopping = True
+    logger.info("Stop requested, finishing current job")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run background jobs")
+    parser.add_argument("--once", action="store_true", help="Run claimable jobs and exit")
+    parser.add_argument("--kind", action="append", help="Only run jobs of this kind (repeatable)")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between queue polls")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    load_job_handlers()
+
+    next_cleanup = 0.0
+    while not _stopping:
+        db = SessionLocal()
+        try:
+            if time.monotonic() >= next_cleanup:
+                removed = cleanup_expired_exports(db)
+                if removed:
+                    logger.info("Removed %d expired export file(s)", removed)
+                next_cleanup = time.monotonic() + CLEANUP_INTERVAL_SECONDS
+            # One job per iteration so a stop request is honoured between jobs
+            done = run_pending_jobs(db, kinds=args.kind, max_jobs=1)
+        except Exception as e:
+            logger.error("Worker iteration failed: %s", e, exc_info=True)
+            done = 0
+        finally:
+            db.close()
+
+        if args.once and not done:
+            break
+        if not done:
+            time.sleep(args.poll_interval)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
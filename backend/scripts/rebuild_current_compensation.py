@@ -0,0 +1,64 @@
+"""
+Backfill / rebuild / verify the employee_current_compensation projection
+and the compensation_history intervals.
+
+Usage:
+    python scripts/rebuild_current_compensation.py            # full rebuild
+    python scripts/rebuild_current_compensation.py --history  # also rebuild history from financial_records
+    python scripts/rebuild_current_compensation.py --check    # consistency check only
+"""
+import sys
+import argparse
+from pathlib import Path
+
+backend_root = Path(__file__).resolve().parents[1]
+if str(backend_root) not in sys.path:
+    sys.path.append(str(backend_root))
+
+from database.database import SessionLocal
+from services.compensation_service import (
+    find_compensation_drift,
+    rebuild_compensation_history,
+    refresh_current_compensation,
+)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rebuild or verify employee_current_compensation")
+    parser.add_argument("--check", action="store_true", help="Only report drift, do not rebuild")
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="Rebuild compensation_history from financial_records (drops tracked in-place changes)",
+    )
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.check:
+            problems = find_compensation_drift(db)
+            for p in problems[:50]:
+                print(f"employee {p['employee_id']}: {p['issue']} {p.get('fields', '')}")
+            if problems:
+                print(f"Drift detected: {len(problems)} employee(s). Run without --check to rebuild.")
+                return 1
+            print("Projection is consistent.")
+            return 0
+
+        if args.history:
+            intervals = rebuild_compensation_history(db)
+            print(f"Rebuilt compensation_history: {intervals} interval(s).")
+
+        count = refresh_current_compensation(db)
+        db.commit()
+        print(f"Rebuilt employee_current_compensation: {count} row(s).")
+        return 0
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+Rebuild / verify the org_unit_closure table from organization_units.
+
+Usage:
+    python scripts/rebuild_org_closure.py          # full rebuild
+    python scripts/rebuild_org_closure.py --check  # consistency check only
+"""
+import sys
+import argparse
+from pathlib import Path
+
+backend_root = Path(__file__).resolve().parents[1]
+if str(backend_root) not in sys.path:
+    sys.path.append(str(backend_root))
+
+from database.database import SessionLocal
+from services.org_unit_service import find_closure_drift, invalidate_org_tree, rebuild_org_closure
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rebuild or verify org_unit_closure")
+    parser.add_argument("--check", action="store_true", help="Only report drift, do not rebuild")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if args.check:
+            problems = find_closure_drift(db)
+            for ancestor_id, descendant_id, expected, stored in problems[:50]:
+                print(f"({ancestor_id}, {descendant_id}): expected depth {expected}, stored {stored}")
+            if problems:
+                print(f"Drift detected: {len(problems)} row(s). Run without --check to rebuild.")
+                return 1
+            print("Closure table is consistent.")
+            return 0
+
+        count = rebuild_org_closure(db)
+        db.commit()
+        invalidate_org_tree()
+        print(f"Rebuilt org_unit_closure: {count} row(s).")
+        return 0
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+Analytics cache shared by all workers (Redis), with an in-memory fallback.
+
+Keys are built from a hash of the user's resolved scope (get_user_scope result) and the
+request parameters, so users with identical scopes share one entry.
+
+Every entry depends on a set of tags (org_unit, planning, financials, market). Each tag has a
+version counter in Redis and the current versions are part of the key: invalidating a tag is a
+single INCR, stale entries simply stop being addressed and expire by TTL — no keyspace scan.
+
+Stampede protection: an entry stores its logical expiry and how long it took to compute.
+Only the worker holding the per-key lease (SET NX PX) recomputes; the others are served the
+stale value, or wait for the fresh one on a cold miss. Hot keys are refreshed ahead of expiry
+with probability growing as expiry approaches (XFetch), so the TTL never expires for everyone at once.
+"""
+import hashlib
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from database.redis_client import redis_client
+
+logger = logging.getLogger("fot.analytics")
+
+CACHE_DURATION = 300  # 5 minutes (seconds)
+
+TAG_ORG_UNIT = "org_unit"
+TAG_PLANNING = "planning"
+TAG_FINANCIALS = "financials"
+TAG_MARKET = "market"
+ALL_TAGS = (TAG_ORG_UNIT, TAG_PLANNING, TAG_FINANCIALS, TAG_MARKET)
+
+_TAG_VERSION_KEY = "analytics:tagver:{}"
+
+LOCK_LEASE_SECONDS = 30      # recompute lease; expires by itself if the holder dies
+LOCK_WAIT_SECONDS = 10       # cold miss: how long to wait for the lease holder
+LOCK_POLL_SECONDS = 0.05
+STALE_GRACE_FACTOR = 1       # expired entries stay servable for another ttl * factor
+XFETCH_BETA = 1.0            # >1 refreshes earlier, <1 later
+
+_RELEASE_LOCK_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# In-memory fallback (used only when Redis is unavailable)
+_local_cache: dict = {}
+_local_cache_ttl: dict = {}
+_local_tag_versions: dict = {}
+_local_cache_lock = threading.Lock()
+
+
+def scope_fingerprint(allowed_ids: Optional[Iterable[int]]) -> str:
+    """Stable short hash of a resolved scope; None (full access) is 'all'."""
+    if allowed_ids is None:
+        return "all"
+    raw = ",".join(str(uid) for uid in sorted(set(allowed_ids)))
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def build_cache_key(name: str, allowed_ids: Optional[Iterable[int]], *params) -> str:
+    return ":".join([name, scope_fingerprint(allowed_ids), *(str(p) for p in params)])
+
+
+def _tag_versions(tags: Sequence[str]) -> Optional[List[str]]:
+    if redis_client:
+        try:
+            values = redis_client.mget([_TAG_VERSION_KEY.format(t) for t in tags])
+            return [v or "0" for v in values]
+        except Exception as e:
+            logger.warning("Redis tag version lookup failed: %s", e)
+            return None
+    with _local_cache_lock:
+        return [str(_local_tag_versions.get(t, 0)) for t in tags]
+
+
+def shared_tag_versions(tags: Iterable[str]) -> Optional[List[str]]:
+    """
+    Versions of tags as seen by every process, for keys outside this cache (export artifacts).
+    None without Redis: local counters are per worker and cannot prove data is unchanged.
+    """
+    if not redis_client:
+        return None
+    return _tag_versions(sorted(set(tags)))
+
+
+def _read_entry(redis_key: str) -> Optional[dict]:
+    try:
+        cached = redis_client.get(redis_key)
+    except Exception as e:
+        logger.warning("Redis get failed for key %s: %s", redis_key, e)
+        return None
+    if not cached:
+        return None
+    try:
+        entry = json.loads(cached)
+    except (TypeError, ValueError):
+        return None
+    return entry if isinstance(entry, dict) and "exp" in entry else None
+
+
+def _write_entry(redis_key: str, value, ttl: int, compute_seconds: float) -> None:
+    entry = {"value": value, "exp": time.time() + ttl, "delta": compute_seconds}
+    try:
+        redis_client.setex(
+            redis_key,
+            int(ttl * (1 + STALE_GRACE_FACTOR)),
+            json.dumps(entry, default=str),
+        )
+    except Exception as e:
+        logger.warning("Redis set failed for key %s: %s", redis_key, e)
+
+
+def _should_refresh(entry: dict) -> bool:
+    """XFetch: refresh early with probability rising as now approaches exp."""
+    now = time.time()
+    if now >= entry["exp"]:
+        return True
+    delta = float(entry.get("delta") or 0)
+    if delta <= 0:
+        return False
+    return now - delta * XFETCH_BETA * math.log(random.random() or 1e-12) >= entry["exp"]
+
+
+def _try_lock(lock_key: str) -> Tuple[bool, Optional[str]]:
+    """Returns (may_compute, token). Redis errors fail open: compute without a lease."""
+    token = uuid.uuid4().hex
+    try:
+        if redis_client.set(lock_key, token, nx=True, px=int(LOCK_LEASE_SECONDS * 1000)):
+            return True, token
+        return False, None
+    except Exception as e:
+        logger.warning("Redis lock failed for key %s: %s", lock_key, e)
+        return True, None
+
+
+def _release_lock(lock_key: str, token: Optional[str]) -> None:
+    if token is None:
+        return
+    try:
+        redis_client.eval(_RELEASE_LOCK_LUA, 1, lock_key, token)
+    except Exception as e:
+        logger.warning("Redis unlock failed for key %s: %s", lock_key, e)
+
+
+def _wait_for_entry(redis_key: str, lock_key: str) -> Optional[dict]:
+    deadline = time.monotonic() + LOCK_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_SECONDS)
+        entry = _read_entry(redis_key)
+        if entry is not None:
+            return entry
+        try:
+            if not redis_client.exists(lock_key):
+                return None  # holder gave up without storing a value
+        except Exception:
+            return None
+    return None
+
+
+def _compute_and_store(redis_key: str, compute_fn, ttl: int):
+    started = time.monotonic()
+    result = compute_fn()
+    _write_entry(redis_key, result, ttl, time.monotonic() - started)
+    return result
+
+
+def _stamped_key(key: str, tags: Iterable[str]) -> Optional[str]:
+    tags = sorted(set(tags))
+    versions = _tag_versions(tags)
+    if versions is None:
+        return None
+    stamp = ".".join(f"{t}{v}" for t, v in zip(tags, versions))
+    return f"analytics:{key}:{stamp}"
+
+
+def get_cached_or_compute(key: str, compute_fn, ttl: int = CACHE_DURATION, tags: Iterable[str] = ALL_TAGS):
+    """
+    FIX #H1: Redis-based cache shared across all worker processes.
+    Falls back to in-memory if Redis is unavailable.
+    tags — data the result depends on; the entry is dropped when any of them is invalidated.
+    """
+    redis_key = _stamped_key(key, tags)
+    if redis_key is None:
+        return compute_fn()
+
+    if not redis_client:
+        result = compute_fn()
+        # Fallback: in-memory cache
+        with _local_cache_lock:
+            _local_cache[redis_key] = result
+            _local_cache_ttl[redis_key] = datetime.now()
+            # Purge stale entries if dict grows too large
+            if len(_local_cache) > 500:
+                stale = [
+                    k for k, t in _local_cache_ttl.items()
+                    if (datetime.now() - t).total_seconds() > ttl
+                ]
+                for k in stale:
+                    _local_cache.pop(k, None)
+                    _local_cache_ttl.pop(k, None)
+        return result
+
+    entry = _read_entry(redis_key)
+    if entry is not None and not _should_refresh(entry):
+        return entry["value"]
+
+    # Single-flight: only the lease holder recomputes
+    lock_key = f"{redis_key}:lock"
+    may_compute, token = _try_lock(lock_key)
+    if may_compute:
+        try:
+            return _compute_and_store(redis_key, compute_fn, ttl)
+        finally:
+            _release_lock(lock_key, token)
+
+    if entry is not None:
+        # Someone else is refreshing — serve the stale value meanwhile
+        return entry["value"]
+
+    entry = _wait_for_entry(redis_key, lock_key)
+    if entry is not None:
+        return entry["value"]
+    return _compute_and_store(redis_key, compute_fn, ttl)
+
+
+def get_cached(key: str, tags: Iterable[str] = ALL_TAGS):
+    """
+    Current value of an entry written by store_cached(), or None.
+    Redis only: local tag counters are per worker and cannot prove the data is unchanged.
+    """
+    if not redis_client:
+        return None
+    redis_key = _stamped_key(key, tags)
+    if redis_key is None:
+        return None
+    entry = _read_entry(redis_key)
+    if entry is None or time.time() >= entry["exp"]:
+        return None
+    return entry["value"]
+
+
+def store_cached(key: str, value, ttl: int = CACHE_DURATION, tags: Iterable[str] = ALL_TAGS) -> None:
+    """
+    Write an entry computed outside get_cached_or_compute() (e.g. adjusted incrementally).
+    The key must identify the data version (tags cover the rest).
+    """
+    if not redis_client:
+        return
+    redis_key = _stamped_key(key, tags)
+    if redis_key is not None:
+        _write_entry(redis_key, value, ttl, 0)
+
+
+def invalidate_analytics_cache(*tags: str):
+    """
+    Инвалидация по тегам: INCR версии тега (работает для всех воркеров, без SCAN).
+    Без аргументов — сбросить все теги.
+    """
+    tags = tags or ALL_TAGS
+    if redis_client:
+        try:
+            pipe = redis_client.pipeline()
+            for tag in tags:
+                pipe.incr(_TAG_VERSION_KEY.format(tag))
+            pipe.execute()
+            logger.info("Invalidated analytics cache tags: %s", ", ".join(tags))
+        except Exception as e:
+            logger.warning("Redis cache invalidation failed: %s", e)
+    else:
+        with _local_cache_lock:
+            for tag in tags:
+                _local_tag_versions[tag] = _local_tag_versions.get(tag, 0) + 1
+            _local_cache.clear()
+            _local_cache_ttl.clear()
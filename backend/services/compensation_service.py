@@ -0,0 +1,352 @@
+"""
+Materialized "current compensation" projection.
+
+`employee_current_compensation` holds a copy of the latest FinancialRecord of every
+employee, so hot readers (analytics, structure, admin, requests, export) no longer
+rebuild `max(FinancialRecord.id) GROUP BY employee_id` on every call.
+
+`compensation_history` keeps the same values as non-overlapping [valid_from, valid_to)
+intervals per employee, so "as of <date>" readers do an index range scan instead of a
+full-history group-by.
+
+Every code path that writes a FinancialRecord must call sync_current_compensation()
+(single record) or refresh_current_compensation() (set-based writes); both keep
+the projection and the history in step.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException
+from sqlalchemy import and_, case, delete, func, insert, literal, or_, select
+from sqlalchemy.orm import Session
+
+from database.models import CompensationHistory, Employee, EmployeeCurrentCompensation, FinancialRecord
+from utils.date_utils import now_iso, parse_date_flexible, to_utc_datetime
+
+# Columns copied verbatim from FinancialRecord into the projection
+COMPENSATION_FIELDS = (
+    "created_at", "last_raise_date", "created_at_dt", "last_raise_date_dt",
+    "base_net", "base_gross", "kpi_net", "kpi_gross",
+    "bonus_net", "bonus_gross", "total_net", "total_gross",
+)
+
+# Money columns carried by the history intervals
+MONEY_FIELDS = COMPENSATION_FIELDS[4:]
+
+# Fields compared by the consistency checker
+_CHECKED_FIELDS = ("financial_record_id",) + MONEY_FIELDS
+
+
+def effective_from(fin) -> Optional[datetime]:
+    """
+    Момент, с которого действуют значения записи (FinancialRecord или строки проекции):
+    дата повышения, иначе дата создания. Единый порядок для живой синхронизации,
+    rebuild_compensation_history и бэкфилла 2d3e4f5a6b7c (COALESCE(last_raise_date_dt, created_at_dt)).
+    """
+    return (
+        to_utc_datetime(fin.last_raise_date_dt)
+        or to_utc_datetime(fin.created_at_dt)
+        or parse_date_flexible(fin.last_raise_date)
+        or parse_date_flexible(fin.created_at)
+    )
+
+
+def _effective_at(fin: FinancialRecord) -> datetime:
+    return effective_from(fin) or datetime.now(timezone.utc)
+
+
+def _open_interval(db: Session, employee_id: int) -> Optional[CompensationHistory]:
+    return (
+        db.query(CompensationHistory)
+        .filter(CompensationHistory.employee_id == employee_id, CompensationHistory.valid_to.is_(None))
+        .order_by(CompensationHistory.valid_from.desc())
+        .first()
+    )
+
+
+def _apply_interval(
+    db: Session,
+    current: Optional[CompensationHistory],
+    employee_id: int,
+    financial_record_id: int,
+    values: Dict[str, int],
+    effective_at: datetime,
+) -> Optional[dict]:
+    """
+    Append a change to the history of one employee. Returns the interval to insert, if any
+    (the caller adds it, so set-based paths can insert all of them in one statement).
+    - same values: nothing to do;
+    - change effective at/before the open interval start: correction of the open interval;
+    - later change: close the open interval at effective_at and open a new one.
+    """
+    if current is not None:
+        if current.financial_record_id > financial_record_id:
+            return None
+        if current.financial_record_id == financial_record_id and all(
+            getattr(current, f) == values[f] for f in MONEY_FIELDS
+        ):
+            return None
+        if effective_at <= to_utc_datetime(current.valid_from):
+            current.financial_record_id = financial_record_id
+            for field in MONEY_FIELDS:
+                setattr(current, field, values[field])
+            return None
+        current.valid_to = effective_at
+
+    return {
+        "employee_id": employee_id,
+        "financial_record_id": financial_record_id,
+        "valid_from": effective_at,
+        "valid_to": None,
+        **values,
+    }
+
+
+def sync_current_compensation(db: Session, fin: FinancialRecord) -> EmployeeCurrentCompensation:
+    """
+    Upsert the projection row of fin.employee_id from a just-written FinancialRecord.
+    Does not commit — the caller's transaction owns the write.
+    """
+    if fin.id is None:
+        db.flush()
+
+    row = db.get(EmployeeCurrentCompensation, fin.employee_id)
+    if row is None:
+        row = EmployeeCurrentCompensation(employee_id=fin.employee_id)
+        db.add(row)
+    elif row.financial_record_id is not None and row.financial_record_id > fin.id:
+        # A newer record is already projected — an older one must not overwrite it
+        return row
+
+    row.financial_record_id = fin.id
+    for field in COMPENSATION_FIELDS:
+        setattr(row, field, getattr(fin, field))
+    row.updated_at = now_iso()
+
+    interval = _apply_interval(
+        db, _open_interval(db, fin.employee_id), fin.employee_id, fin.id,
+        {f: getattr(fin, f) or 0 for f in MONEY_FIELDS}, _effective_at(fin),
+    )
+    if interval:
+        db.add(CompensationHistory(**interval))
+    return row
+
+
+def _latest_ids_subquery(employee_ids: Optional[Iterable[int]] = None):
+    stmt = select(
+        FinancialRecord.employee_id,
+        func.max(FinancialRecord.id).label("max_id"),
+    ).where(FinancialRecord.employee_id.isnot(None))
+    if employee_ids is not None:
+        stmt = stmt.where(FinancialRecord.employee_id.in_(list(employee_ids)))
+    return stmt.group_by(FinancialRecord.employee_id).subquery()
+
+
+def refresh_current_compensation(db: Session, employee_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Set-based rebuild of the projection (all employees, or only employee_ids).
+    Used by the backfill command and by bulk UPDATE paths that bypass the ORM.
+    Differences against the open history intervals are recorded as changes effective now.
+    Returns the number of projected rows.
+    """
+    ids = list(employee_ids) if employee_ids is not None else None
+    if ids is not None and not ids:
+        return 0
+
+    latest = _latest_ids_subquery(ids)
+    clear = delete(EmployeeCurrentCompensation)
+    if ids is not None:
+        clear = clear.where(EmployeeCurrentCompensation.employee_id.in_(ids))
+    db.execute(clear)
+
+    target_cols = ["employee_id", "financial_record_id", *COMPENSATION_FIELDS, "updated_at"]
+    source = select(
+        FinancialRecord.employee_id,
+        FinancialRecord.id,
+        *[getattr(FinancialRecord, f) for f in COMPENSATION_FIELDS],
+        literal(now_iso()),
+    ).join(latest, FinancialRecord.id == latest.c.max_id)
+    db.execute(insert(EmployeeCurrentCompensation).from_select(target_cols, source))
+    _history_from_projection(db, ids)
+
+    count_stmt = select(func.count()).select_from(EmployeeCurrentCompensation)
+    if ids is not None:
+        count_stmt = count_stmt.where(EmployeeCurrentCompensation.employee_id.in_(ids))
+    return db.execute(count_stmt).scalar() or 0
+
+
+def _history_from_projection(db: Session, ids: Optional[List[int]]) -> None:
+    now = datetime.now(timezone.utc)
+    proj_stmt = select(EmployeeCurrentCompensation)
+    open_stmt = db.query(CompensationHistory).filter(CompensationHistory.valid_to.is_(None))
+    if ids is not None:
+        proj_stmt = proj_stmt.where(EmployeeCurrentCompensation.employee_id.in_(ids))
+        open_stmt = open_stmt.filter(CompensationHistory.employee_id.in_(ids))
+    open_by_emp = {h.employee_id: h for h in open_stmt.all()}
+
+    new_intervals = []
+    for row in db.execute(proj_stmt).scalars():
+        interval = _apply_interval(
+            db, open_by_emp.get(row.employee_id), row.employee_id, row.financial_record_id,
+            {f: getattr(row, f) or 0 for f in MONEY_FIELDS}, now,
+        )
+        if interval:
+            new_intervals.append(interval)
+    if new_intervals:
+        # Closed intervals first, then one executemany INSERT (no per-row ORM flush)
+        db.flush()
+        db.execute(insert(CompensationHistory), new_intervals)
+
+
+def rebuild_compensation_history(db: Session, employee_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Rebuild compensation_history from FinancialRecord (backfill).
+    Each record is valid from effective_from() (raise date, else creation date) until the
+    next record of the same employee — the same dates the live sync uses. Values changed in
+    place before the history existed are lost: only the latest values of a record are known.
+    Returns the number of intervals written.
+    """
+    ids = list(employee_ids) if employee_ids is not None else None
+    if ids is not None and not ids:
+        return 0
+
+    clear = delete(CompensationHistory)
+    records = db.query(FinancialRecord).filter(FinancialRecord.employee_id.isnot(None))
+    if ids is not None:
+        clear = clear.where(CompensationHistory.employee_id.in_(ids))
+        records = records.filter(FinancialRecord.employee_id.in_(ids))
+    db.execute(clear)
+
+    per_employee: Dict[int, list] = {}
+    for fin in records.order_by(FinancialRecord.employee_id, FinancialRecord.id).yield_per(1000):
+        valid_from = effective_from(fin)
+        if valid_from is None:
+            continue
+        per_employee.setdefault(fin.employee_id, []).append(
+            (valid_from, fin.id, {f: getattr(fin, f) or 0 for f in MONEY_FIELDS})
+        )
+
+    rows = []
+    for emp_id, items in per_employee.items():
+        items.sort(key=lambda item: (item[0], item[1]))
+        for idx, (valid_from, fin_id, values) in enumerate(items):
+            valid_to = items[idx + 1][0] if idx + 1 < len(items) else None
+            if valid_to is not None and valid_to <= valid_from:
+                continue  # superseded at the same instant by a newer record
+            rows.append({
+                "employee_id": emp_id,
+                "financial_record_id": fin_id,
+                "valid_from": valid_from,
+                "valid_to": valid_to,
+                **values,
+            })
+
+    if rows:
+        db.execute(insert(CompensationHistory), rows)
+    return len(rows)
+
+
+def find_compensation_drift(db: Session) -> List[dict]:
+    """
+    Consistency checker: compares the projection with the latest FinancialRecord
+    per employee. Returns a list of problems (empty list = consistent).
+    """
+    latest = _latest_ids_subquery()
+    expected_rows = db.execute(
+        select(
+            FinancialRecord.employee_id,
+            FinancialRecord.id.label("financial_record_id"),
+            *[getattr(FinancialRecord, f) for f in COMPENSATION_FIELDS[4:]],
+        ).join(latest, FinancialRecord.id == latest.c.max_id)
+    ).all()
+    expected = {r.employee_id: r for r in expected_rows}
+    actual = {r.employee_id: r for r in db.query(EmployeeCurrentCompensation).all()}
+
+    problems = []
+    for emp_id, exp in expected.items():
+        act = actual.get(emp_id)
+        if act is None:
+            problems.append({"employee_id": emp_id, "issue": "missing"})
+            continue
+        diff = {
+            f: {"expected": getattr(exp, f), "actual": getattr(act, f)}
+            for f in _CHECKED_FIELDS
+            if getattr(exp, f) != getattr(act, f)
+        }
+        if diff:
+            problems.append({"employee_id": emp_id, "issue": "mismatch", "fields": diff})
+
+    for emp_id in actual.keys() - expected.keys():
+        problems.append({"employee_id": emp_id, "issue": "orphan"})
+
+    # The open history interval must carry the projected values
+    open_intervals = {
+        h.employee_id: h
+        for h in db.query(CompensationHistory).filter(CompensationHistory.valid_to.is_(None)).all()
+    }
+    for emp_id, act in actual.items():
+        current = open_intervals.get(emp_id)
+        if current is None or any(getattr(current, f) != getattr(act, f) for f in MONEY_FIELDS):
+            problems.append({"employee_id": emp_id, "issue": "history"})
+
+    return problems
+
+
+def _parse_as_of(as_of) -> datetime:
+    point = to_utc_datetime(as_of)
+    if point is None:
+        raise HTTPException(status_code=400, detail=f"Некорректная дата: {as_of}")
+    return point
+
+
+def _valid_at(point: datetime):
+    return and_(
+        CompensationHistory.valid_from <= point,
+        or_(CompensationHistory.valid_to.is_(None), CompensationHistory.valid_to > point),
+    )
+
+
+def latest_compensation(db: Session, as_of: Optional[str] = None):
+    """
+    Selectable with the latest compensation per employee (`.c.employee_id`, `.c.total_net`, ...).
+    Without as_of it is the materialized projection; with as_of it is the slice of
+    compensation_history whose interval contains the date.
+    """
+    if not as_of:
+        return EmployeeCurrentCompensation.__table__
+
+    point = _parse_as_of(as_of)
+    return select(
+        CompensationHistory.employee_id,
+        CompensationHistory.financial_record_id,
+        CompensationHistory.valid_from,
+        CompensationHistory.valid_to,
+        *[getattr(CompensationHistory, f) for f in MONEY_FIELDS],
+    ).where(_valid_at(point)).subquery()
+
+
+def compensation_totals_at(
+    db: Session,
+    points: Sequence,
+    employee_filters: Sequence = (),
+    field: str = "total_net",
+) -> List[int]:
+    """
+    Sum of `field` as of every date in points, in one scan over the intervals
+    overlapping [min(points), max(points)]. employee_filters are applied to Employee.
+    """
+    if not points:
+        return []
+    parsed = [_parse_as_of(p) for p in points]
+    column = getattr(CompensationHistory, field)
+
+    query = db.query(*[
+        func.sum(case((_valid_at(point), column), else_=0)) for point in parsed
+    ]).select_from(CompensationHistory).join(
+        Employee, Employee.id == CompensationHistory.employee_id
+    ).filter(
+        CompensationHistory.valid_from <= max(parsed),
+        or_(CompensationHistory.valid_to.is_(None), CompensationHistory.valid_to > min(parsed)),
+        *employee_filters,
+    )
+    return [int(total or 0) for total in query.one()]
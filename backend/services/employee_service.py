@@ -1,24 +1,171 @@
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import desc, or_
+import base64
+import json
+
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, desc, or_
 from fastapi import HTTPException
 from datetime import datetime
-from typing import List, Optional, Any
+from typing import Any, Collection, List, Optional
 from utils.date_utils import now_iso
 
-from database.models import Employee, FinancialRecord, Position, OrganizationUnit, AuditLog, User
+from database.models import Employee, EmployeeCurrentCompensation, FinancialRecord, Position, OrganizationUnit, AuditLog, User
+from services.compensation_service import sync_current_compensation
+from services.org_unit_service import OrgTree, get_org_tree
 from schemas import EmployeeCreate, FinancialUpdate, EmployeeUpdate, EmpDetailsUpdate
 
+PAGE_DEFAULT_LIMIT = 50
+PAGE_MAX_LIMIT = 200
+
+# Keyset sort keys: raw indexed columns (ix_employees_full_name, ix_employees_hire_date,
+# ix_employee_current_compensation_total_net). NULLs sort after every value, as in a
+# PostgreSQL btree, and are handled in the cursor predicate (_after_cursor).
+PAGE_SORT_KEYS = {
+    "full_name": lambda: Employee.full_name,
+    "total_net": lambda: EmployeeCurrentCompensation.total_net,
+    "hire_date": lambda: Employee.hire_date,
+}
+
+
+def _encode_cursor(value, last_id: int, sort: str, order: str) -> str:
+    raw = json.dumps([value, last_id, sort, order], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str, sort: str, order: str):
+    try:
+        value, last_id, cursor_sort, cursor_order = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        last_id = int(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise HTTPException(status_code=400, detail="Курсор получен для другой сортировки")
+    return value, last_id
+
+
+def _after_cursor(sort_key, value, last_id: int, order: str):
+    """Rows past (value, last_id) in ORDER BY sort_key NULLS LAST, id (reversed for desc)."""
+    if order == "asc":
+        if value is None:
+            return and_(sort_key.is_(None), Employee.id > last_id)
+        return or_(sort_key > value, and_(sort_key == value, Employee.id > last_id), sort_key.is_(None))
+    if value is None:
+        return or_(and_(sort_key.is_(None), Employee.id < last_id), sort_key.is_not(None))
+    return or_(sort_key < value, and_(sort_key == value, Employee.id < last_id))
+
+
+def _listing_query(db: Session):
+    """
+    Employee + position title + latest FinancialRecord, one row per employee.
+    The projection only points at the latest record id (no max(id) GROUP BY, no history load).
+    """
+    return (
+        db.query(Employee, Position.title, FinancialRecord)
+        .outerjoin(Position, Position.id == Employee.position_id)
+        .outerjoin(EmployeeCurrentCompensation, EmployeeCurrentCompensation.employee_id == Employee.id)
+        .outerjoin(FinancialRecord, FinancialRecord.id == EmployeeCurrentCompensation.financial_record_id)
+    )
+
+
+def _search_filter(q: str):
+    search_query = f"%{q}%"
+    return or_(Employee.full_name.ilike(search_query), Position.title.ilike(search_query))
+
+
+def _serialize_listing(db: Session, rows) -> List[dict]:
+    """rows: (Employee, position title, latest FinancialRecord | None)."""
+    if not rows:
+        return []
+
+    # Shared cached hierarchy, branch of every unit is precomputed
+    tree = get_org_tree(db)
+
+    # Linked users in one query (first linked user per employee, as before)
+    users_map = {}
+    emp_ids = [emp.id for emp, _, _ in rows]
+    for linked in db.query(User).filter(User.employee_id.in_(emp_ids)).order_by(User.id.desc()):
+        users_map[linked.employee_id] = linked
+
+    resolved = {}
+    results = []
+    for emp, position_title, fin in rows:
+        if emp.org_unit_id not in resolved:
+            resolved[emp.org_unit_id] = _resolve_branch(tree, emp.org_unit_id)
+        branch_id, branch_name, department_id, dept_name = resolved[emp.org_unit_id]
+
+        base_n = fin.base_net if fin else 0
+        base_g = fin.base_gross if fin else 0
+        kpi_n = fin.kpi_net if fin else 0
+        kpi_g = fin.kpi_gross if fin else 0
+        bonus_n = fin.bonus_net if fin else 0
+        bonus_g = fin.bonus_gross if fin else 0
+
+        # Calculate Totals on the fly
+        total_n = base_n + kpi_n + bonus_n
+        total_g = base_g + kpi_g + bonus_g
+
+        linked_user = users_map.get(emp.id)
+
+        results.append({
+            "id": emp.id,
+            "org_unit_id": emp.org_unit_id,
+            "branch_id": branch_id,
+            "department_id": department_id,
+            "full_name": emp.full_name,
+            "position": position_title or "Не указано",
+            "branch": branch_name,
+            "department": dept_name,
+            "base": {"net": base_n, "gross": base_g},
+            "kpi": {"net": kpi_n, "gross": kpi_g},
+            "bonus": {"net": bonus_n, "gross": bonus_g},
+            "total": {"net": total_n, "gross": total_g},
+            "status": emp.status or "Активен",
+            "hire_date": emp.hire_date,
+            "gender": emp.gender,
+            "dob": emp.dob,
+            "linked_user_email": linked_user.email if linked_user else None,
+            "linked_user_contact_email": linked_user.contact_email if linked_user else None,
+            "linked_user_phone": linked_user.phone if linked_user else None,
+            "linked_user_avatar": linked_user.avatar_url if linked_user else None,
+            "last_raise_date": (
+                (fin.last_raise_date or fin.created_at).split('T')[0]
+                if fin and (fin.last_raise_date or fin.created_at)
+                else None
+            )
+        })
+    return results
+
+
+def _resolve_branch(tree: OrgTree, org_unit_id: Optional[int]):
+    """(branch_id, branch_name, department_id, department_name) of an employee's org unit."""
+    branch_name = "Неизвестно"
+    dept_name = "-"
+    branch_id = None
+    department_id = None
+
+    current = tree.get(org_unit_id)
+    if current:
+        # If assigned directly to a department, capture it
+        if current.type == 'department':
+            dept_name = current.name
+            department_id = current.id
+
+        # Nearest Branch or Head Office (Root) above the unit
+        branch = tree.branch_of(current.id)
+        if branch:
+            branch_name = branch.name
+            branch_id = branch.id
+    return branch_id, branch_name, department_id, dept_name
+
+
 class EmployeeService:
     @staticmethod
-    def get_employees(db: Session, current_user: User, scope_ids: Optional[List[int]], q: Optional[str] = None) -> List[Any]:
+    def get_employees(db: Session, current_user: User, scope_ids: Optional[Collection[int]], q: Optional[str] = None) -> List[Any]:
         """
-        Retrieves employees with optimizations (joinedload) and scope filtering.
+        Full list (legacy payload of /api/employees). Reads the latest compensation from the
+        current-compensation projection in the same query and loads linked users in one batch.
+        Large organisations should use get_employees_page.
         """
-        query = db.query(Employee).options(
-            joinedload(Employee.financial_records),
-            joinedload(Employee.org_unit),
-            joinedload(Employee.position)
-        )
+        query = _listing_query(db).order_by(Employee.id)
 
         # Apply Scope Filter
         if scope_ids is not None:
@@ -26,116 +173,89 @@ class EmployeeService:
 
         # Apply Search Filter (Performance Optimization #1)
         if q:
-            search_query = f"%{q}%"
-            query = query.join(Position, isouter=True).filter(
-                or_(
-                    Employee.full_name.ilike(search_query),
-                    Position.title.ilike(search_query)
-                )
-            ).limit(15)
-
-        employees = query.all()
-        results = []
-        
-        # We need to pre-fetch Organization structure to resolve parent names efficiently
-        # Or we can rely on lazy loading since we reduced valid queries to N, but let's try to be efficient.
-        # Although Employee.org_unit is joined loaded, we might need parent of org_unit.
-        # Let's trust joinedload(Employee.org_unit) for now, and if we need parent name, 
-        # accessing org.parent might trigger lazy load. 
-        # To avoid N+1 for org parents, we could eager load org_unit.parent too? 
-        # options(joinedload(Employee.org_unit).joinedload(OrganizationUnit.parent)) isn't directly possibly easily 
-        # if using self-referential without clear relationship name in model.
-        # Let's stick to simple logic for now, much better than loop over financials.
-
-        # Pre-fetch all OrgUnits to resolve hierarchy efficiently in memory
-        all_units = db.query(OrganizationUnit).all()
-        unit_map = {u.id: u for u in all_units}
-
-        for emp in employees:
-            # Financials: In One-to-Many, we usually want the LATEST record.
-            fin = None
-            if emp.financial_records:
-                fin = sorted(emp.financial_records, key=lambda x: x.id, reverse=True)[0]
-            
-            pos_name = emp.position.title if emp.position else "Не указано"
-            
-            # Resolve Branch/Dept from hierarchical org_unit
-            branch_name = "Неизвестно"
-            dept_name = "-"
-            branch_id = None
-            department_id = None
-            
-            if emp.org_unit_id and emp.org_unit_id in unit_map:
-                current = unit_map[emp.org_unit_id]
-                
-                # If assigned directly to a department, capture it
-                if current.type == 'department':
-                    dept_name = current.name
-                    department_id = current.id
-                
-                # Traverse up to find the Branch or Head Office (Root)
-                cursor = current
-                while cursor:
-                    # Check for both branch and head_office types
-                    if cursor.type in ('branch', 'head_office'):
-                        branch_name = cursor.name
-                        branch_id = cursor.id
-                        break 
-                    
-                    if cursor.parent_id and cursor.parent_id in unit_map:
-                        cursor = unit_map[cursor.parent_id]
-                    else:
-                        # Reached top or missing parent, stop.
-                        # If we started at a department and never found a branch, 
-                        # maybe the top-level department IS the logical branch context?
-                        # For now, adhere to strict 'branch' or 'head_office' type check.
-                        break
-
-            base_n = fin.base_net if fin else 0
-            base_g = fin.base_gross if fin else 0
-            kpi_n = fin.kpi_net if fin else 0
-            kpi_g = fin.kpi_gross if fin else 0
-            bonus_n = fin.bonus_net if fin else 0
-            bonus_g = fin.bonus_gross if fin else 0
-
-            # Calculate Totals on the fly
-            total_n = base_n + kpi_n + bonus_n
-            total_g = base_g + kpi_g + bonus_g
-
-            # Get linked user
-            linked_user = db.query(User).filter(User.employee_id == emp.id).first()
-
-            results.append({
-                "id": emp.id,
-                "org_unit_id": emp.org_unit_id,
-                "branch_id": branch_id,
-                "department_id": department_id,
-                "full_name": emp.full_name,
-                "position": pos_name,
-                "branch": branch_name,
-                "department": dept_name,
-                "base": {"net": base_n, "gross": base_g},
-                "kpi": {"net": kpi_n, "gross": kpi_g},
-                "bonus": {"net": bonus_n, "gross": bonus_g},
-                "total": {"net": total_n, "gross": total_g},
-                "status": emp.status or "Активен",
-                "hire_date": emp.hire_date,
-                "gender": emp.gender,
-                "dob": emp.dob,
-                "linked_user_email": linked_user.email if linked_user else None,
-                "linked_user_contact_email": linked_user.contact_email if linked_user else None,
-                "linked_user_phone": linked_user.phone if linked_user else None,
-                "linked_user_avatar": linked_user.avatar_url if linked_user else None,
-                "last_raise_date": (
-                    (fin.last_raise_date or fin.created_at).split('T')[0]
-                    if fin and (fin.last_raise_date or fin.created_at)
-                    else None
-                )
-            })
-        return results
+            query = query.filter(_search_filter(q)).limit(15)
+
+        rows = query.all()
+        return _serialize_listing(db, rows)
+
+    @staticmethod
+    def get_employees_page(
+        db: Session,
+        scope_ids: Optional[Collection[int]],
+        cursor: Optional[str] = None,
+        limit: int = PAGE_DEFAULT_LIMIT,
+        sort: str = "full_name",
+        order: str = "asc",
+        branch_id: Optional[int] = None,
+        department_id: Optional[int] = None,
+        status: Optional[str] = None,
+        min_salary: Optional[int] = None,
+        max_salary: Optional[int] = None,
+        q: Optional[str] = None,
+    ) -> dict:
+        """
+        Keyset-paginated listing: WHERE (sort_key, id) is past the cursor ORDER BY sort_key, id LIMIT n.
+        Cost per page does not depend on the page number or on the organisation size.
+        Salary range filters apply to total net of the latest financial record.
+        """
+        if sort not in PAGE_SORT_KEYS:
+            raise HTTPException(status_code=400, detail=f"Unsupported sort: {sort}")
+        if order not in ("asc", "desc"):
+            raise HTTPException(status_code=400, detail=f"Unsupported order: {order}")
+        limit = max(1, min(limit, PAGE_MAX_LIMIT))
+        sort_key = PAGE_SORT_KEYS[sort]()
+
+        query = _listing_query(db)
+        if scope_ids is not None:
+            query = query.filter(Employee.org_unit_id.in_(scope_ids))
+
+        if branch_id is not None or department_id is not None:
+            tree = get_org_tree(db)
+            for root_id in (branch_id, department_id):
+                if root_id is not None:
+                    query = query.filter(Employee.org_unit_id.in_(tree.subtree_ids(root_id)))
+        if status:
+            if status == "Активен":
+                # NULL status is shown as "Активен"
+                query = query.filter(or_(Employee.status == status, Employee.status.is_(None)))
+            else:
+                query = query.filter(Employee.status == status)
+        # No financial record counts as a total of 0
+        total_net = EmployeeCurrentCompensation.total_net
+        if min_salary is not None:
+            at_least = total_net >= min_salary
+            query = query.filter(or_(at_least, total_net.is_(None)) if min_salary <= 0 else at_least)
+        if max_salary is not None:
+            at_most = total_net <= max_salary
+            query = query.filter(or_(at_most, total_net.is_(None)) if max_salary >= 0 else at_most)
+        if q:
+            query = query.filter(_search_filter(q))
+
+        if cursor:
+            value, last_id = _decode_cursor(cursor, sort, order)
+            query = query.filter(_after_cursor(sort_key, value, last_id, order))
+
+        if order == "asc":
+            query = query.order_by(sort_key.asc().nulls_last(), Employee.id.asc())
+        else:
+            query = query.order_by(sort_key.desc().nulls_first(), Employee.id.desc())
+
+        rows = query.add_columns(sort_key.label("sort_value")).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        next_cursor = None
+        if has_more:
+            last = rows[-1]
+            next_cursor = _encode_cursor(last.sort_value, last[0].id, sort, order)
+        return {
+            "items": _serialize_listing(db, [row[:3] for row in rows]),
+            "next_cursor": next_cursor,
+            "limit": limit,
+        }
 
     @staticmethod
-    def create_employee(db: Session, user: User, data: EmployeeCreate, scope_ids: Optional[List[int]]) -> dict:
+    def create_employee(db: Session, user: User, data: EmployeeCreate, scope_ids: Optional[Collection[int]]) -> dict:
         target_org_id = data.department_id if data.department_id else data.branch_id
         if not target_org_id:
             raise HTTPException(400, "Branch or Department is required")
@@ -195,6 +315,7 @@ class EmployeeService:
             base_salary=data.base_net, kpi_amount=data.kpi_net, total_payment=total_n
         )
         db.add(fin)
+        sync_current_compensation(db, fin)
 
         # Assign as Head Logic
         assigned_head = False
@@ -222,7 +343,7 @@ class EmployeeService:
         return {"status": "success", "id": new_emp.id}
 
     @staticmethod
-    def update_financials(db: Session, user: User, emp_id: int, update: FinancialUpdate, scope_ids: Optional[List[int]]) -> dict:
+    def update_financials(db: Session, user: User, emp_id: int, update: FinancialUpdate, scope_ids: Optional[Collection[int]]) -> dict:
         emp = db.query(Employee).get(emp_id)
         if not emp: raise HTTPException(404, "Employee not found")
 
@@ -262,13 +383,14 @@ class EmployeeService:
                  'old': prev_raise_date.split('T')[0] if prev_raise_date else None,
                  'new': fin_record.last_raise_date.split('T')[0]
              }
+             sync_current_compensation(db, fin_record)
              EmployeeService._log_changes_dict(db, user, emp_id, changes)
              db.commit()
              
         return {"status": "updated"}
 
     @staticmethod
-    def update_employee(db: Session, user: User, emp_id: int, data: EmployeeUpdate, scope_ids: Optional[List[int]]):
+    def update_employee(db: Session, user: User, emp_id: int, data: EmployeeUpdate, scope_ids: Optional[Collection[int]]):
         emp = db.query(Employee).get(emp_id)
         if not emp: raise HTTPException(404, "Employee not found")
 
@@ -375,13 +497,14 @@ class EmployeeService:
                      fin.last_raise_date_dt = None
 
         if changes:
+             sync_current_compensation(db, fin)
              EmployeeService._log_changes_dict(db, user, emp_id, changes)
              db.commit()
 
         return {"status": "updated"}
 
     @staticmethod
-    def update_details(db: Session, user: User, emp_id: int, data: EmpDetailsUpdate, scope_ids: Optional[List[int]]):
+    def update_details(db: Session, user: User, emp_id: int, data: EmpDetailsUpdate, scope_ids: Optional[Collection[int]]):
         emp = db.query(Employee).get(emp_id)
         if not emp: raise HTTPException(404, "Not found")
         
@@ -414,7 +537,7 @@ class EmployeeService:
         return {"status": "details_updated"}
 
     @staticmethod
-    def dismiss_employee(db: Session, user: User, emp_id: int, reason: str, date: str, scope_ids: Optional[List[int]]):
+    def dismiss_employee(db: Session, user: User, emp_id: int, reason: str, date: str, scope_ids: Optional[Collection[int]]):
         emp = db.query(Employee).get(emp_id)
         if not emp: raise HTTPException(404, "Not found")
         
@@ -0,0 +1,276 @@
+"""
+Excel exports (employees, planning): row sources and export jobs.
+
+Rows are read with yield_per (server-side cursor on PostgreSQL), so neither the ORM
+objects nor the workbook are ever held in memory as a whole; services/xlsx_stream.py
+turns the row iterators into .xlsx bytes.
+
+Large exports run as background jobs (xlsx_export) in the job worker, which writes the
+file to EXPORTS_DIR (backend/exports by default). Finished files are reused for EXPORT_TTL_SECONDS by every
+request with the same export, scope, id filter and data version (the Redis tag versions
+that analytics invalidation already bumps on every relevant write), then deleted.
+EXPORTS_DIR must stay outside UPLOADS_DIR (served statically at /uploads): artifacts
+are only downloaded through the API, which checks the scope and the export permission.
+"""
+import hashlib
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Collection, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from database.models import (
+    BackgroundJob, Employee, EmployeeCurrentCompensation, PlanningPosition, Position, User,
+)
+from services.analytics_cache import (
+    TAG_FINANCIALS, TAG_ORG_UNIT, TAG_PLANNING, scope_fingerprint, shared_tag_versions,
+)
+from services.job_service import STATUS_COMPLETED, enqueue_job, find_reusable_job, job_handler
+from services.org_unit_service import OrgTree, get_org_tree
+from services.xlsx_stream import STYLE_NUMBER, XlsxColumn, write_xlsx
+
+logger = logging.getLogger("fot.export")
+
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_JOB = "xlsx_export"
+EXPORT_TTL_SECONDS = 3600
+STATUS_EXPIRED = "expired"
+
+EMPLOYEE_SHEET_TITLE = "Сотрудники"
+EMPLOYEE_COLUMNS = [
+    XlsxColumn("ФИО", 30), XlsxColumn("Должность", 25), XlsxColumn("Филиал", 20),
+    XlsxColumn("Отдел", 20), XlsxColumn("Статус", 12),
+    *(XlsxColumn(title, 14, STYLE_NUMBER) for title in (
+        "Оклад (Нет)", "Оклад (Брут)", "KPI (Нет)", "KPI (Брут)",
+        "Бонус (Нет)", "Бонус (Брут)", "Всего (Нет)", "Всего (Брут)",
+    )),
+]
+
+PLANNING_SHEET_TITLE = "ФОТ Планирование"
+PLANNING_COLUMNS = [
+    XlsxColumn("Позиция", 30), XlsxColumn("Филиал", 20), XlsxColumn("Отдел", 20), XlsxColumn("График", 12),
+    *(XlsxColumn(title, 14, STYLE_NUMBER) for title in (
+        "Кол-во", "Оклад (Нет)", "Оклад (Брут)", "KPI (Нет)", "KPI (Брут)",
+        "Бонус (Нет)", "Бонус (Брут)", "Кол-во доплат", "Всего (Нет)", "Всего (Брут)",
+    )),
+]
+
+_MONEY = ("base_net", "base_gross", "kpi_net", "kpi_gross", "bonus_net", "bonus_gross", "total_net", "total_gross")
+
+
+def _branch_and_department(unit_id: Optional[int], tree: OrgTree) -> Tuple[str, str]:
+    """(branch, department) names for an employee's org unit."""
+    u = tree.get(unit_id)
+    if not u:
+        return "-", "-"
+    branch = tree.branch_of(unit_id)
+    branch_name = branch.name if branch else "-"
+    dept_name = "-" if u.type in ("branch", "head_office") else u.name
+    return branch_name, dept_name
+
+
+def employee_export_rows(
+    db: Session, scope: Optional[Collection[int]], ids: Optional[List[int]] = None
+) -> Iterator[list]:
+    tree = get_org_tree(db)
+    memo: Dict[int, Tuple[str, str]] = {}
+    stmt = (
+        select(
+            Employee.full_name, Position.title, Employee.org_unit_id, Employee.status,
+            *(getattr(EmployeeCurrentCompensation, f) for f in _MONEY),
+        )
+        .outerjoin(Position, Position.id == Employee.position_id)
+        .outerjoin(EmployeeCurrentCompensation, EmployeeCurrentCompensation.employee_id == Employee.id)
+        .where(Employee.status != "Dismissed")
+        .order_by(Employee.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    if scope:
+        stmt = stmt.where(Employee.org_unit_id.in_(scope))
+    if ids is not None:
+        stmt = stmt.where(Employee.id.in_(ids))
+
+    for full_name, title, unit_id, status, *money in db.execute(stmt):
+        if unit_id not in memo:
+            memo[unit_id] = _branch_and_department(unit_id, tree)
+        branch_name, dept_name = memo[unit_id]
+        yield [full_name, title or "-", branch_name, dept_name, status, *(m or 0 for m in money)]
+
+
+def planning_export_rows(
+    db: Session, allowed_ids: Optional[Collection[int]], ids: Optional[List[int]] = None
+) -> Iterator[list]:
+    tree = get_org_tree(db)
+    stmt = (
+        select(PlanningPosition)
+        .where(PlanningPosition.scenario_id.is_(None))
+        .order_by(PlanningPosition.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    if allowed_ids is not None:
+        stmt = stmt.where(or_(
+            PlanningPosition.branch_id.in_(allowed_ids),
+            PlanningPosition.department_id.in_(allowed_ids),
+        ))
+    if ids is not None:
+        stmt = stmt.where(PlanningPosition.id.in_(ids))
+
+    for plan in db.scalars(stmt):
+        branch = tree.get(plan.branch_id)
+        dept = tree.get(plan.department_id)
+        actual_bonus_count = plan.bonus_count if plan.bonus_count is not None else plan.count
+        total_net = (plan.base_net + plan.kpi_net) * plan.count + (plan.bonus_net * actual_bonus_count)
+        total_gross = (plan.base_gross + plan.kpi_gross) * plan.count + (plan.bonus_gross * actual_bonus_count)
+        yield [
+            plan.position_title,
+            branch.name if branch else "-",
+            dept.name if dept else "-",
+            plan.schedule or "-",
+            plan.count,
+            plan.base_net, plan.base_gross,
+            plan.kpi_net, plan.kpi_gross,
+            plan.bonus_net, plan.bonus_gross,
+            actual_bonus_count,
+            total_net, total_gross,
+        ]
+
+
+# export name -> (sheet title, columns, row source, data tags, permissions, download file prefix)
+EXPORTS = {
+    "employees": (
+        EMPLOYEE_SHEET_TITLE, EMPLOYEE_COLUMNS, employee_export_rows,
+        (TAG_ORG_UNIT, TAG_FINANCIALS), ("edit_employees",), "Employees",
+    ),
+    "planning": (
+        PLANNING_SHEET_TITLE, PLANNING_COLUMNS, planning_export_rows,
+        (TAG_ORG_UNIT, TAG_PLANNING), ("manage_planning", "view_financial_reports"), "FOT_Planning",
+    ),
+}
+
+
+def exports_dir() -> Path:
+    configured = os.environ.get("EXPORTS_DIR")
+    path = Path(configured) if configured else Path(__file__).resolve().parents[1] / "exports"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def can_export(user: User, export: str) -> bool:
+    perms = (user.role_rel.permissions or {}) if user.role_rel else {}
+    return bool(perms.get("admin_access") or any(perms.get(p) for p in EXPORTS[export][4]))
+
+
+def export_cache_key(export: str, scope: Optional[Collection[int]], ids: Optional[List[int]]) -> Optional[str]:
+    """Artifact key: export, scope hash, id filter and data version. None when data version is unknown."""
+    versions = shared_tag_versions(EXPORTS[export][3])
+    if versions is None:
+        return None
+    raw = json.dumps(
+        [export, scope_fingerprint(scope), sorted(set(ids)) if ids is not None else None, versions]
+    )
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _cutoff_iso() -> str:
+    return (datetime.now(timezone.utc) - timedelta(seconds=EXPORT_TTL_SECONDS)).isoformat()
+
+
+def submit_export(
+    db: Session, export: str, user: User, scope: Optional[Collection[int]], ids: Optional[List[int]] = None
+) -> BackgroundJob:
+    """Queue an export, or return a queued/finished job producing the very same file."""
+    cache_key = export_cache_key(export, scope, ids)
+    if cache_key:
+        job = find_reusable_job(db, EXPORT_JOB, cache_key, _cutoff_iso())
+        if job and (job.status != STATUS_COMPLETED or artifact_path(job)):
+            return job
+    params = {
+        "export": export,
+        "scope": sorted(scope) if scope is not None else None,
+        "scope_fp": scope_fingerprint(scope),
+        "ids": ids,
+    }
+    return enqueue_job(db, EXPORT_JOB, params, user.id, dedupe_key=cache_key)
+
+
+def artifact_path(job: BackgroundJob) -> Optional[Path]:
+    """Path of the finished file, None if the job has none (yet) or it was cleaned up."""
+    name = (job.result or {}).get("file")
+    if job.status != STATUS_COMPLETED or not name:
+        return None
+    path = exports_dir() / Path(name).name
+    return path if path.is_file() else None
+
+
+@job_handler(EXPORT_JOB)
+def run_export(db: Session, job: BackgroundJob) -> dict:
+    params = job.params or {}
+    export = params.get("export")
+    if export not in EXPORTS:
+        raise ValueError(f"Unknown export: {export}")
+    title, columns, row_source, _, _, prefix = EXPORTS[export]
+
+    cleanup_expired_exports(db)
+
+    directory = exports_dir()
+    name = f"{uuid.uuid4().hex}.xlsx"
+    tmp_path = directory / f".{name}.part"
+    counter = {"rows": 0}
+
+    def counted(rows):
+        for row in rows:
+            counter["rows"] += 1
+            yield row
+
+    try:
+        with open(tmp_path, "wb") as f:
+            write_xlsx(f, title, columns, counted(row_source(db, params.get("scope"), params.get("ids"))))
+        os.replace(tmp_path, directory / name)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    logger.info("Export job %s (%s): %d rows written to %s", job.id, export, counter["rows"], name)
+    return {
+        "file": name,
+        "rows": counter["rows"],
+        "size": (directory / name).stat().st_size,
+        "download_name": f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+    }
+
+
+def cleanup_expired_exports(db: Session) -> int:
+    """Delete export files older than the TTL (and orphaned files); returns files removed."""
+    cutoff = _cutoff_iso()
+    directory = exports_dir()
+    removed = 0
+    expired = (
+        db.query(BackgroundJob)
+        .filter(
+            BackgroundJob.kind == EXPORT_JOB,
+            BackgroundJob.status == STATUS_COMPLETED,
+            BackgroundJob.finished_at < cutoff,
+        )
+        .all()
+    )
+    for job in expired:
+        name = (job.result or {}).get("file")
+        if name and (directory / Path(name).name).is_file():
+            (directory / Path(name).name).unlink()
+            removed += 1
+        job.status = STATUS_EXPIRED
+    db.commit()
+
+    # Files without a live job (worker crashed before commit): sweep by mtime
+    stale_before = datetime.now(timezone.utc).timestamp() - 2 * EXPORT_TTL_SECONDS
+    for path in directory.iterdir():
+        if path.is_file() and path.stat().st_mtime < stale_before:
+            path.unlink()
+            removed += 1
+    return removed
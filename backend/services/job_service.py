@@ -0,0 +1,240 @@
+"""
+Persisted background jobs executed by a separate worker process (scripts/job_worker.py),
+not inside the request-serving uvicorn workers.
+
+A job is a row in background_jobs. Handlers process their work in chunks and call
+save_checkpoint() after every chunk: the checkpoint and progress are committed in the
+same transaction as the chunk's data, so a job resumed after a crash continues from the
+last committed chunk and never applies a chunk twice.
+
+Claiming is a conditional UPDATE (pending, or running with an expired heartbeat), so
+several workers can poll the same table without picking up the same job.
+"""
+import importlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Optional
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from database.models import BackgroundJob
+from utils.date_utils import now_iso
+
+logger = logging.getLogger("fot.jobs")
+
+JOB_LEASE_SECONDS = 300  # running job without a heartbeat this long is considered abandoned
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+
+# Modules that register handlers; imported by the worker on startup
+HANDLER_MODULES = ("services.recalculation_service", "services.export_service", "services.notification_service")
+
+_handlers: Dict[str, Callable[[Session, BackgroundJob], Optional[dict]]] = {}
+
+
+class JobCancelled(Exception):
+    """Raised from save_checkpoint when the job was cancelled or superseded meanwhile."""
+
+
+def job_handler(kind: str):
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def load_job_handlers() -> None:
+    for module in HANDLER_MODULES:
+        importlib.import_module(module)
+
+
+def enqueue_job(
+    db: Session,
+    kind: str,
+    params: Optional[dict] = None,
+    created_by: Optional[int] = None,
+    supersede: bool = False,
+    dedupe_key: Optional[str] = None,
+    commit: bool = True,
+) -> BackgroundJob:
+    """
+    Persist a new pending job. supersede=True cancels pending/running jobs of the same kind:
+    their result would be overwritten by this one anyway.
+    dedupe_key marks jobs that produce the same result (see find_reusable_job).
+    commit=False only flushes, so the job is committed with the caller's own changes.
+    """
+    if supersede:
+        db.query(BackgroundJob).filter(
+            BackgroundJob.kind == kind,
+            BackgroundJob.status.in_(ACTIVE_STATUSES),
+        ).update({"status": STATUS_CANCELLED, "finished_at": now_iso()}, synchronize_session=False)
+
+    job = BackgroundJob(
+        kind=kind,
+        status=STATUS_PENDING,
+        params=params or {},
+        checkpoint={},
+        progress={},
+        attempts=0,
+        created_by=created_by,
+        created_at=now_iso(),
+        dedupe_key=dedupe_key,
+    )
+    db.add(job)
+    if not commit:
+        db.flush()
+        return job
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def find_reusable_job(db: Session, kind: str, dedupe_key: str, finished_after: str) -> Optional[BackgroundJob]:
+    """
+    Newest job with the same dedupe_key that is still queued/running, or completed after
+    finished_after (ISO UTC). Lets identical requests share one run and its result.
+    """
+    return (
+        db.query(BackgroundJob)
+        .filter(
+            BackgroundJob.kind == kind,
+            BackgroundJob.dedupe_key == dedupe_key,
+            or_(
+                BackgroundJob.status.in_(ACTIVE_STATUSES),
+                and_(BackgroundJob.status == STATUS_COMPLETED, BackgroundJob.finished_at >= finished_after),
+            ),
+        )
+        .order_by(BackgroundJob.id.desc())
+        .first()
+    )
+
+
+def _claimable():
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=JOB_LEASE_SECONDS)
+    return or_(
+        BackgroundJob.status == STATUS_PENDING,
+        and_(
+            BackgroundJob.status == STATUS_RUNNING,
+            or_(BackgroundJob.heartbeat_at.is_(None), BackgroundJob.heartbeat_at < stale_before),
+        ),
+    )
+
+
+def claim_next_job(db: Session, kinds: Optional[Iterable[str]] = None) -> Optional[BackgroundJob]:
+    """Oldest claimable job, marked running by this worker; None when the queue is empty."""
+    stmt = select(BackgroundJob.id).where(_claimable())
+    if kinds:
+        stmt = stmt.where(BackgroundJob.kind.in_(list(kinds)))
+    candidates = db.scalars(stmt.order_by(BackgroundJob.id).limit(10)).all()
+
+    for job_id in candidates:
+        claimed = db.execute(
+            update(BackgroundJob)
+            .where(BackgroundJob.id == job_id, _claimable())
+            .values(
+                status=STATUS_RUNNING,
+                heartbeat_at=datetime.now(timezone.utc),
+                started_at=func.coalesce(BackgroundJob.started_at, now_iso()),
+                attempts=func.coalesce(BackgroundJob.attempts, 0) + 1,
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.commit()
+        if claimed:
+            return db.get(BackgroundJob, job_id)
+    return None
+
+
+def save_checkpoint(db: Session, job: BackgroundJob, checkpoint: dict, progress: Optional[dict] = None) -> None:
+    """
+    Commit the current chunk together with the position reached and the counters.
+    Raises JobCancelled if the job stopped being ours (cancelled or superseded); the
+    chunk is then rolled back, so a superseded job never writes values of an old config.
+    """
+    values = {"checkpoint": dict(checkpoint), "heartbeat_at": datetime.now(timezone.utc)}
+    if progress is not None:
+        values["progress"] = dict(progress)
+    # Conditional UPDATE in the chunk's transaction: the row lock orders it against a
+    # concurrent cancel/supersede, which then either wins here or lands after our commit
+    saved = db.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job.id, BackgroundJob.status == STATUS_RUNNING)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not saved:
+        db.rollback()
+        raise JobCancelled(f"Job {job.id} is {job.status}")
+    db.commit()
+
+
+def run_job(db: Session, job: BackgroundJob) -> BackgroundJob:
+    handler = _handlers.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job kind: {job.kind}")
+        result = handler(db, job)
+    except JobCancelled as e:
+        db.rollback()
+        logger.info("%s", e)
+        return job
+    except Exception as e:
+        logger.error("Job %s (%s) failed: %s", job.id, job.kind, e, exc_info=True)
+        db.rollback()
+        _finish(db, job, status=STATUS_FAILED, error=str(e)[:1000], finished_at=now_iso())
+        return job
+
+    _finish(
+        db, job,
+        status=STATUS_COMPLETED, result=result,
+        finished_at=now_iso(), heartbeat_at=datetime.now(timezone.utc),
+    )
+    return job
+
+
+def _finish(db: Session, job: BackgroundJob, **values) -> None:
+    """Final status, only while the job is still ours: a cancel/supersede in between wins."""
+    finished = db.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job.id, BackgroundJob.status == STATUS_RUNNING)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if not finished:
+        logger.info("Job %s was %s before it finished", job.id, job.status)
+
+
+def run_pending_jobs(db: Session, kinds: Optional[Iterable[str]] = None, max_jobs: Optional[int] = None) -> int:
+    """Run claimable jobs one after another until the queue is empty. Returns the number run."""
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        job = claim_next_job(db, kinds)
+        if job is None:
+            break
+        logger.info("Running job %s (%s), attempt %s", job.id, job.kind, job.attempts)
+        run_job(db, job)
+        done += 1
+    return done
+
+
+def serialize_job(job: BackgroundJob) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress or {},
+        "checkpoint": job.checkpoint or {},
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
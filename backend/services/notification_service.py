@@ -0,0 +1,135 @@
+"""
+Notification fan-out.
+
+Callers collect messages in a NotificationBatch: each message goes to explicit users
+and/or every member of some roles. dispatch() resolves all recipients of the batch in
+one query, drops duplicates (a user gets only the first message of the batch addressed
+to them) and writes the rows with multi-row INSERTs.
+
+NOTIFICATION_DISPATCH=outbox defers the fan-out: the batch is stored as a background
+job committed together with the caller's changes, and scripts/job_worker.py writes the
+notifications. The approver's request then costs one row whatever the number of
+recipients. Default "inline" writes them in the caller's transaction.
+"""
+import os
+from typing import Iterable, List, Optional
+
+from sqlalchemy import insert, or_, select
+from sqlalchemy.orm import Session
+
+from database.models import BackgroundJob, Notification, User
+from services.job_service import enqueue_job, job_handler
+from services.notification_stream import queue_notification_events
+from utils.date_utils import now_iso, to_utc_datetime
+
+NOTIFICATION_JOB = "notifications"
+INSERT_CHUNK_SIZE = 1000
+
+DISPATCH_INLINE = "inline"
+DISPATCH_OUTBOX = "outbox"
+NOTIFICATION_DISPATCH = os.environ.get("NOTIFICATION_DISPATCH", DISPATCH_INLINE)
+
+
+class NotificationBatch:
+    def __init__(self):
+        self.messages: List[dict] = []
+
+    def add(
+        self,
+        message: str,
+        link: Optional[str] = None,
+        user_ids: Iterable[Optional[int]] = (),
+        role_ids: Iterable[Optional[int]] = (),
+    ) -> "NotificationBatch":
+        self.messages.append({
+            "message": message,
+            "link": link,
+            "user_ids": [uid for uid in user_ids if uid],
+            "role_ids": [rid for rid in role_ids if rid],
+        })
+        return self
+
+    def __bool__(self) -> bool:
+        return any(m["user_ids"] or m["role_ids"] for m in self.messages)
+
+    def dispatch(self, db: Session) -> int:
+        """Write the notifications in the current transaction (no commit). Returns rows written."""
+        return write_notifications(db, self.messages)
+
+    def send(self, db: Session, created_by: Optional[int] = None) -> None:
+        """Inline: write now (caller commits). Outbox: enqueue a job (commits the session)."""
+        if not self:
+            return
+        if NOTIFICATION_DISPATCH == DISPATCH_OUTBOX:
+            enqueue_job(db, NOTIFICATION_JOB, {"messages": self.messages}, created_by)
+        else:
+            self.dispatch(db)
+
+
+def _recipients_by_role(db: Session, user_ids: set, role_ids: set) -> tuple[set, dict]:
+    """Existing explicit recipients and role -> member ids, in one query."""
+    conditions = []
+    if user_ids:
+        conditions.append(User.id.in_(user_ids))
+    if role_ids:
+        conditions.append(User.role_id.in_(role_ids))
+    if not conditions:
+        return set(), {}
+
+    existing, members = set(), {}
+    for user_id, role_id in db.execute(select(User.id, User.role_id).where(or_(*conditions))):
+        if user_id in user_ids:
+            existing.add(user_id)
+        if role_id in role_ids:
+            members.setdefault(role_id, []).append(user_id)
+    return existing, members
+
+
+def write_notifications(db: Session, messages: List[dict]) -> int:
+    all_users = {uid for m in messages for uid in m["user_ids"]}
+    all_roles = {rid for m in messages for rid in m["role_ids"]}
+    existing, members = _recipients_by_role(db, all_users, all_roles)
+
+    created_at = now_iso()
+    created_at_dt = to_utc_datetime(created_at)
+    notified = set()
+    rows = []
+    for m in messages:
+        recipients = [uid for uid in m["user_ids"] if uid in existing]
+        for role_id in m["role_ids"]:
+            recipients.extend(sorted(members.get(role_id, ())))
+        for user_id in recipients:
+            if user_id in notified:
+                continue
+            notified.add(user_id)
+            rows.append({
+                "user_id": user_id,
+                "message": m["message"],
+                "link": m["link"],
+                "is_read": False,
+                "created_at": created_at,
+                "created_at_dt": created_at_dt,
+            })
+
+    events = []
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + INSERT_CHUNK_SIZE]
+        # RETURNING order of a multi-row INSERT is not guaranteed: read the columns back
+        inserted = db.execute(insert(Notification).values(chunk).returning(
+            Notification.id, Notification.user_id, Notification.message,
+            Notification.created_at, Notification.link,
+        ))
+        events.extend({
+            "id": r.id, "user_id": r.user_id, "message": r.message,
+            "is_read": False, "created_at": r.created_at, "link": r.link,
+        } for r in inserted)
+    # Pushed to open streams once the caller commits (services.notification_stream)
+    queue_notification_events(db, events)
+    return len(rows)
+
+
+@job_handler(NOTIFICATION_JOB)
+def dispatch_notification_job(db: Session, job: BackgroundJob) -> dict:
+    # Rows and job completion are committed together by run_job: a retry never duplicates
+    written = write_notifications(db, (job.params or {}).get("messages", []))
+    return {"notifications": written}
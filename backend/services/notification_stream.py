@@ -0,0 +1,309 @@
+"""
+Live notifications: Server-Sent Events instead of polling /api/auth/notifications.
+
+Publishing: notification_service queues an event per inserted row on the session;
+they are published on NOTIFICATION_CHANNEL only after the transaction commits
+(a rolled back row is never pushed). The per-user unread counter in Redis is
+adjusted at the same time.
+
+Delivery: every worker runs one NotificationHub (a single pub/sub subscription on the
+async client) that fans events out to the SSE connections of that worker. Without Redis
+the hub is fed directly in-process (single worker).
+
+Event ids are Notification.id. A reconnecting EventSource sends Last-Event-ID: the
+stream first replays newer rows of the user from the database, then continues live.
+A stream that falls behind or loses the subscription is closed, so the browser
+reconnects and replays instead of silently missing events.
+"""
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from database import redis_client as redis_module
+from database.models import Notification
+
+logger = logging.getLogger("fot.notifications")
+
+NOTIFICATION_CHANNEL = "notifications:events"
+UNREAD_KEY = "notifications:unread:{}"
+UNREAD_TTL_SECONDS = 300
+HEARTBEAT_SECONDS = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+REPLAY_LIMIT = 200
+
+_PENDING_EVENTS = "notification_events"
+
+# Adjust the counter only if it is cached: a missing key is recomputed from the database
+_INCR_IF_EXISTS_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+
+def serialize_event(note) -> dict:
+    return {
+        "id": note.id,
+        "user_id": note.user_id,
+        "message": note.message,
+        "is_read": bool(note.is_read),
+        "created_at": note.created_at,
+        "link": note.link,
+    }
+
+
+def queue_notification_events(db: Session, events: List[dict]) -> None:
+    """Publish these events once the session's transaction commits."""
+    db.info.setdefault(_PENDING_EVENTS, []).extend(events)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(session: Session) -> None:
+    events = session.info.pop(_PENDING_EVENTS, None)
+    if events:
+        publish_notification_events(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session) -> None:
+    session.info.pop(_PENDING_EVENTS, None)
+
+
+def publish_notification_events(events: List[dict]) -> None:
+    per_user: Dict[int, int] = {}
+    for e in events:
+        if not e.get("is_read"):
+            per_user[e["user_id"]] = per_user.get(e["user_id"], 0) + 1
+
+    client = redis_module.redis_client
+    if client:
+        try:
+            pipe = client.pipeline()
+            for user_id, count in per_user.items():
+                pipe.eval(_INCR_IF_EXISTS_LUA, 1, UNREAD_KEY.format(user_id), count)
+            for e in events:
+                pipe.publish(NOTIFICATION_CHANNEL, json.dumps(e))
+            pipe.execute()
+            return
+        except Exception as e:
+            logger.error("Failed to publish notifications: %s", e)
+            return
+    hub.deliver_threadsafe(events)
+
+
+# --- Unread counter ---
+
+def get_unread_count(db: Session, user_id: int) -> int:
+    key = UNREAD_KEY.format(user_id)
+    client = redis_module.redis_client
+    if client:
+        try:
+            cached = client.get(key)
+            if cached is not None:
+                return max(0, int(cached))
+        except Exception as e:
+            logger.warning("Unread counter read failed: %s", e)
+            client = None
+
+    count = db.query(func.count(Notification.id)).filter(
+        Notification.user_id == user_id, Notification.is_read == False
+    ).scalar() or 0
+    if client:
+        try:
+            # NX: a concurrent increment that created the key wins; TTL bounds any drift
+            client.set(key, count, ex=UNREAD_TTL_SECONDS, nx=True)
+        except Exception as e:
+            logger.warning("Unread counter write failed: %s", e)
+    return count
+
+
+def adjust_unread_count(user_id: int, delta: int) -> None:
+    client = redis_module.redis_client
+    if client:
+        try:
+            client.eval(_INCR_IF_EXISTS_LUA, 1, UNREAD_KEY.format(user_id), delta)
+        except Exception as e:
+            logger.warning("Unread counter update failed: %s", e)
+
+
+def reset_unread_count(user_id: int) -> None:
+    """Forget the cached counter (bulk changes): the next read recounts."""
+    client = redis_module.redis_client
+    if client:
+        try:
+            client.delete(UNREAD_KEY.format(user_id))
+        except Exception as e:
+            logger.warning("Unread counter reset failed: %s", e)
+
+
+# --- Per-worker hub ---
+
+class Subscription:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def offer(self, item: dict) -> None:
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self) -> None:
+        self.closed = True
+        # Wake the stream so it ends; the client reconnects with Last-Event-ID
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                return
+            except asyncio.QueueFull:
+                self.queue.get_nowait()
+
+
+class NotificationHub:
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    def subscribe(self, user_id: int) -> Subscription:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # New event loop (app restart, test client): subscriptions of the old one are gone
+            self._subscribers = {}
+            self._loop = loop
+            self._listener = None
+        if redis_module.async_redis_client and (self._listener is None or self._listener.done()):
+            self._ready = asyncio.Event()
+            self._listener = loop.create_task(self._listen())
+        sub = Subscription(user_id)
+        self._subscribers.setdefault(user_id, set()).add(sub)
+        return sub
+
+    async def wait_ready(self, timeout: float = 2.0) -> None:
+        """Wait until the worker's subscription is active (no-op without Redis)."""
+        if self._ready is None or self._ready.is_set():
+            return
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Notification subscription not ready; live events may be delayed")
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subscribers.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.user_id]
+
+    def deliver(self, events: List[dict]) -> None:
+        for e in events:
+            for sub in list(self._subscribers.get(e["user_id"], ())):
+                sub.offer(e)
+
+    def deliver_threadsafe(self, events: List[dict]) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self.deliver(events)
+        else:
+            loop.call_soon_threadsafe(self.deliver, events)
+
+    def _close_all(self) -> None:
+        for subs in list(self._subscribers.values()):
+            for sub in list(subs):
+                sub.close()
+
+    async def _listen(self) -> None:
+        backoff = 1.0
+        while self._subscribers:
+            pubsub = redis_module.async_redis_client.pubsub()
+            try:
+                await pubsub.subscribe(NOTIFICATION_CHANNEL)
+                self._ready.set()
+                backoff = 1.0
+                while self._subscribers:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=HEARTBEAT_SECONDS)
+                    if message and message["type"] == "message":
+                        self.deliver([json.loads(message["data"])])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Notification subscription lost: %s", e)
+                self._ready.clear()
+                self._close_all()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+hub = NotificationHub()
+
+
+def _sse(payload: dict) -> str:
+    return f"id: {payload['id']}\nevent: notification\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def notification_stream(
+    sub: Subscription,
+    replay: List[dict],
+    last_event_id: int,
+    is_disconnected,
+) -> AsyncIterator[str]:
+    """
+    SSE body: the replayed rows, then live events of the subscription. `sub` must be
+    subscribed before `replay` is read so nothing falls between the two; duplicates
+    are skipped by id.
+    """
+    last_id = last_event_id
+    try:
+        yield "retry: 3000\n\n"
+        for payload in replay:
+            last_id = max(last_id, payload["id"])
+            yield _sse(payload)
+        while not sub.closed or not sub.queue.empty():
+            try:
+                payload = await asyncio.wait_for(sub.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            if payload is None:
+                break
+            if payload["id"] <= last_id:
+                continue
+            last_id = payload["id"]
+            yield _sse(payload)
+    finally:
+        hub.unsubscribe(sub)
+
+
+def replay_since(db: Session, user_id: int, last_event_id: int) -> List[dict]:
+    """Rows created after Last-Event-ID (oldest first, bounded)."""
+    rows = (
+        db.query(Notification)
+        .filter(Notification.user_id == user_id, Notification.id > last_event_id)
+        .order_by(Notification.id.asc())
+        .limit(REPLAY_LIMIT)
+        .all()
+    )
+    return [serialize_event(n) for n in rows]
@@ -1,25 +1,279 @@
 """
 FIX C3: Shared organizational unit utilities.
 Provides reusable functions for hierarchy traversal, avoiding N+1 queries.
+
+The hierarchy itself is cached per process as an immutable OrgTree: parent/children
+maps, an Euler tour (every subtree is a contiguous slice of one DFS order, so
+"is descendant" is two integer comparisons) and the branch each unit belongs to.
+Workers notice structure edits through a version counter in Redis, bumped by the
+routers/structure.py mutators via invalidate_org_tree(); without Redis the counter
+is process-local.
+
+org_unit_closure stores the same hierarchy as (ancestor, descendant, depth) rows so
+subtree rollups and scope checks run in SQL; the closure_* helpers below keep it in
+step with organization_units (they do not commit, the caller's transaction does).
 """
-from sqlalchemy.orm import Session
-from database.models import OrganizationUnit
-from typing import Dict, List, Set, Optional
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, insert, literal, select, true
+from sqlalchemy.orm import Session, aliased
+
+from database.models import OrganizationUnit, OrgUnitClosure
+from database.redis_client import redis_client
+
+logger = logging.getLogger("fot.org_tree")
+
+ORG_TREE_VERSION_KEY = "org_tree:version"
+BRANCH_TYPES = ("branch", "head_office")
+
+_cache_lock = threading.Lock()
+_cached: dict = {"version": None, "tree": None}
+_local_version = 0
+
+
+@dataclass(frozen=True)
+class OrgNode:
+    id: int
+    name: str
+    type: Optional[str]
+    parent_id: Optional[int]
+    head_id: Optional[int]
+
+
+class OrgTree:
+    """Read-only index over all organization units. Build with OrgTree.load or get_org_tree."""
+
+    def __init__(self, nodes: Iterable[OrgNode]):
+        self.nodes: Dict[int, OrgNode] = {n.id: n for n in sorted(nodes, key=lambda n: n.id)}
+        grouped: Dict[int, List[int]] = {}
+        for node in self.nodes.values():
+            if node.parent_id is not None:
+                grouped.setdefault(node.parent_id, []).append(node.id)
+        self.children: Dict[int, Tuple[int, ...]] = {pid: tuple(ids) for pid, ids in grouped.items()}
+
+        # Euler tour: order[tin[u]:tout[u]] is u followed by all its descendants
+        self.order: List[int] = []
+        self.tin: Dict[int, int] = {}
+        self.tout: Dict[int, int] = {}
+        # Roots: no parent, or a parent that does not exist (dangling reference)
+        roots = [n.id for n in self.nodes.values() if n.parent_id not in self.nodes]
+        self._tour(roots)
+        # Units only reachable through a cycle: cut the cycle at the smallest id
+        for unit_id in self.nodes:
+            if unit_id not in self.tin:
+                self._tour([unit_id])
+
+        self._branch: Dict[int, Optional[int]] = {}
+        for unit_id in self.order:
+            node = self.nodes[unit_id]
+            if node.type in BRANCH_TYPES:
+                self._branch[unit_id] = unit_id
+            else:
+                parent = node.parent_id
+                visited = parent in self.tin and self.tin[parent] < self.tin[unit_id]
+                self._branch[unit_id] = self._branch.get(parent) if visited else None
+
+    def _tour(self, roots: List[int]) -> None:
+        for root in roots:
+            self.tin[root] = len(self.order)
+            self.order.append(root)
+            stack = [(root, iter(self.children.get(root, ())))]
+            while stack:
+                unit_id, it = stack[-1]
+                child = next(it, None)
+                if child is None:
+                    self.tout[unit_id] = len(self.order)
+                    stack.pop()
+                elif child not in self.tin:
+                    self.tin[child] = len(self.order)
+                    self.order.append(child)
+                    stack.append((child, iter(self.children.get(child, ()))))
+
+    @classmethod
+    def load(cls, db: Session) -> "OrgTree":
+        rows = db.query(
+            OrganizationUnit.id, OrganizationUnit.name, OrganizationUnit.type,
+            OrganizationUnit.parent_id, OrganizationUnit.head_id,
+        ).all()
+        return cls(OrgNode(*row) for row in rows)
+
+    def __contains__(self, unit_id) -> bool:
+        return unit_id in self.nodes
+
+    def get(self, unit_id: Optional[int]) -> Optional[OrgNode]:
+        return self.nodes.get(unit_id)
+
+    def name(self, unit_id: Optional[int], default=None):
+        node = self.nodes.get(unit_id)
+        return node.name if node else default
+
+    def is_descendant(self, unit_id: int, ancestor_id: int, include_self: bool = True) -> bool:
+        """O(1): unit_id lies in the subtree of ancestor_id."""
+        if unit_id not in self.tin or ancestor_id not in self.tin:
+            return False
+        if unit_id == ancestor_id:
+            return include_self
+        return self.tin[ancestor_id] < self.tin[unit_id] < self.tout[ancestor_id]
+
+    def subtree_ids(self, unit_id: int) -> List[int]:
+        """[unit_id] + all descendant ids, in DFS order. Unknown unit: just [unit_id]."""
+        if unit_id not in self.tin:
+            return [unit_id]
+        return self.order[self.tin[unit_id]:self.tout[unit_id]]
+
+    def descendant_ids(self, unit_id: int) -> Set[int]:
+        return set(self.subtree_ids(unit_id)[1:]) if unit_id in self.tin else set()
+
+    def ancestor_ids(self, unit_id: int) -> List[int]:
+        """Parents of unit_id from the nearest up to the root."""
+        result = []
+        node = self.nodes.get(unit_id)
+        while node and node.parent_id in self.nodes and self.is_descendant(unit_id, node.parent_id, False):
+            result.append(node.parent_id)
+            node = self.nodes[node.parent_id]
+        return result
+
+    def branch_of(self, unit_id: Optional[int]) -> Optional[OrgNode]:
+        """Nearest branch / head_office at or above the unit (precomputed)."""
+        branch_id = self._branch.get(unit_id)
+        return self.nodes[branch_id] if branch_id is not None else None
+
+    def of_type(self, *types: str) -> List[OrgNode]:
+        return [n for n in self.nodes.values() if n.type in types]
+
+    @property
+    def children_map(self) -> Dict[int, List[int]]:
+        """parent_id -> [child ids], the shape returned by build_children_map."""
+        return {pid: list(ids) for pid, ids in self.children.items()}
+
+
+def _current_version() -> Optional[str]:
+    if redis_client:
+        try:
+            return redis_client.get(ORG_TREE_VERSION_KEY) or "0"
+        except Exception as e:
+            logger.warning("Redis org tree version lookup failed: %s", e)
+            return None
+    return str(_local_version)
+
+
+def org_tree_version() -> Optional[str]:
+    """Current structure version (None if Redis is unreachable): part of cache keys derived from the tree."""
+    return _current_version()
+
+
+def get_org_tree(db: Session) -> OrgTree:
+    """Shared hierarchy index; hits the DB only after a structure change."""
+    version = _current_version()
+    with _cache_lock:
+        if version is not None and _cached["version"] == version:
+            return _cached["tree"]
+
+    tree = OrgTree.load(db)
+    if version is not None:
+        with _cache_lock:
+            _cached["version"] = version
+            _cached["tree"] = tree
+    return tree
+
+
+def invalidate_org_tree() -> None:
+    """Called after org units are created, moved, renamed or deleted: every worker rebuilds."""
+    global _local_version
+    with _cache_lock:
+        _local_version += 1
+        _cached["version"] = None
+        _cached["tree"] = None
+    if redis_client:
+        try:
+            redis_client.incr(ORG_TREE_VERSION_KEY)
+        except Exception as e:
+            logger.warning("Redis org tree version bump failed: %s", e)
+
+
+def closure_add_unit(db: Session, unit_id: int, parent_id: Optional[int]) -> None:
+    """New leaf: the (unit, unit, 0) row plus one row per ancestor of the parent."""
+    db.execute(insert(OrgUnitClosure).values(ancestor_id=unit_id, descendant_id=unit_id, depth=0))
+    if parent_id is not None:
+        db.execute(insert(OrgUnitClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(OrgUnitClosure.ancestor_id, literal(unit_id), OrgUnitClosure.depth + 1)
+            .where(OrgUnitClosure.descendant_id == parent_id),
+        ))
+
+
+def closure_move_unit(db: Session, unit_id: int, new_parent_id: Optional[int]) -> None:
+    """Re-hang the subtree of unit_id: drop links to its old ancestors, link it to the new ones."""
+    subtree = select(OrgUnitClosure.descendant_id).where(OrgUnitClosure.ancestor_id == unit_id)
+    subtree_ids = list(db.scalars(subtree))
+    db.execute(
+        delete(OrgUnitClosure)
+        .where(OrgUnitClosure.descendant_id.in_(subtree_ids), OrgUnitClosure.ancestor_id.notin_(subtree_ids))
+        .execution_options(synchronize_session=False)
+    )
+    if new_parent_id is not None:
+        above, below = aliased(OrgUnitClosure), aliased(OrgUnitClosure)
+        db.execute(insert(OrgUnitClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            # Every ancestor of the new parent x every node of the subtree (intended cross join)
+            select(above.ancestor_id, below.descendant_id, above.depth + below.depth + 1)
+            .select_from(above).join(below, true())
+            .where(above.descendant_id == new_parent_id, below.ancestor_id == unit_id),
+        ))
+
+
+def closure_remove_unit(db: Session, unit_id: int) -> None:
+    """Rows of a deleted leaf (explicit: SQLite does not enforce ON DELETE CASCADE by default)."""
+    db.execute(
+        delete(OrgUnitClosure)
+        .where((OrgUnitClosure.descendant_id == unit_id) | (OrgUnitClosure.ancestor_id == unit_id))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _closure_rows(tree: OrgTree) -> List[dict]:
+    rows = []
+    for unit_id in tree.nodes:
+        rows.append({"ancestor_id": unit_id, "descendant_id": unit_id, "depth": 0})
+        for depth, ancestor_id in enumerate(tree.ancestor_ids(unit_id), 1):
+            rows.append({"ancestor_id": ancestor_id, "descendant_id": unit_id, "depth": depth})
+    return rows
+
+
+def rebuild_org_closure(db: Session) -> int:
+    """Recompute org_unit_closure from organization_units. Returns the row count."""
+    rows = _closure_rows(OrgTree.load(db))
+    db.execute(delete(OrgUnitClosure).execution_options(synchronize_session=False))
+    if rows:
+        db.execute(insert(OrgUnitClosure), rows)
+    return len(rows)
+
+
+def find_closure_drift(db: Session) -> List[Tuple[int, int, Optional[int], Optional[int]]]:
+    """(ancestor_id, descendant_id, expected depth, stored depth) for every row that differs."""
+    expected = {(r["ancestor_id"], r["descendant_id"]): r["depth"] for r in _closure_rows(OrgTree.load(db))}
+    stored = {
+        (a, d): depth
+        for a, d, depth in db.execute(
+            select(OrgUnitClosure.ancestor_id, OrgUnitClosure.descendant_id, OrgUnitClosure.depth)
+        )
+    }
+    return [
+        (a, d, expected.get((a, d)), stored.get((a, d)))
+        for a, d in sorted(set(expected) | set(stored))
+        if expected.get((a, d)) != stored.get((a, d))
+    ]
 
 
 def build_children_map(db: Session) -> Dict[int, List[int]]:
     """
-    Pre-fetch ALL org units and build a parent->children map in memory.
+    Parent->children map of all org units (from the cached OrgTree).
     Call this ONCE per request, then use get_all_descendant_ids.
     """
-    rows = db.query(OrganizationUnit.id, OrganizationUnit.parent_id).all()
-    children_map: Dict[int, List[int]] = {}
-    for uid, pid in rows:
-        if pid is not None:
-            if pid not in children_map:
-                children_map[pid] = []
-            children_map[pid].append(uid)
-    return children_map
+    return get_org_tree(db).children_map
 
 
 def get_all_descendant_ids(unit_id: int, children_map: Dict[int, List[int]]) -> Set[int]:
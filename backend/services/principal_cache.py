@@ -0,0 +1,112 @@
+"""
+Short-lived cache of the authenticated principal (user row + role), shared through Redis.
+
+get_current_user used to run a User + Role query on every authenticated request. The
+cached entry carries the user's security version. Every change that affects
+authentication or authorization (role/permissions, block/unblock, password, scope,
+logout) bumps the version, so a stale entry is never served. The TTL only bounds
+memory and picks up edits made outside the API.
+
+Cache hit: one MGET (entry + version). The user is rebuilt as a detached User/Role
+pair: fine for reading, but endpoints that modify the current user must load the row
+(dependencies.get_current_user_row). hashed_password is never cached.
+
+Without Redis nothing is cached: a process-local copy could not see another worker's
+bump.
+"""
+import json
+import logging
+from typing import Iterable, Optional
+
+from sqlalchemy.orm import Session, joinedload
+
+from database.models import Role, User
+from database.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger("fot.auth")
+
+PRINCIPAL_TTL_SECONDS = 60
+
+_PRINCIPAL_KEY = "principal:{}"
+_SECURITY_VERSION_KEY = "user:secver:{}"
+
+_USER_FIELDS = tuple(c.name for c in User.__table__.columns if c.name != "hashed_password")
+_ROLE_FIELDS = tuple(c.name for c in Role.__table__.columns)
+
+
+def _load_user(db: Session, user_id: int) -> Optional[User]:
+    return db.query(User).options(joinedload(User.role_rel)).filter(User.id == user_id).first()
+
+
+def _dump(user: User, version: str) -> str:
+    return json.dumps({
+        "v": version,
+        "user": {f: getattr(user, f) for f in _USER_FIELDS},
+        "role": {f: getattr(user.role_rel, f) for f in _ROLE_FIELDS} if user.role_rel else None,
+    })
+
+
+def _restore(data: dict) -> User:
+    user = User(**data["user"])
+    if data["role"] is not None:
+        user.role_rel = Role(**data["role"])
+    return user
+
+
+def get_principal(db: Session, user_id: int) -> Optional[User]:
+    """The user with its role; from the cache when the security version still matches."""
+    if not redis_client:
+        return _load_user(db, user_id)
+
+    key = _PRINCIPAL_KEY.format(user_id)
+    try:
+        cached, version = redis_client.mget([key, _SECURITY_VERSION_KEY.format(user_id)])
+    except Exception as e:
+        logger.warning("Redis principal lookup failed: %s", e)
+        return _load_user(db, user_id)
+
+    version = version or "0"
+    if cached:
+        try:
+            data = json.loads(cached)
+            if data.get("v") == version:
+                return _restore(data)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("Corrupt principal cache entry for user %s: %s", user_id, e)
+
+    user = _load_user(db, user_id)
+    if user is not None:
+        # Tagged with the version read BEFORE the load: a bump in between makes it stale at once
+        try:
+            redis_client.setex(key, PRINCIPAL_TTL_SECONDS, _dump(user, version))
+        except Exception as e:
+            logger.warning("Redis principal store failed: %s", e)
+    return user
+
+
+def bump_security_version(*user_ids: int) -> None:
+    """Invalidate cached principals of these users on every worker."""
+    if not redis_client:
+        return
+    for user_id in user_ids:
+        try:
+            redis_client.incr(_SECURITY_VERSION_KEY.format(user_id))
+        except Exception as e:
+            logger.error("Failed to bump security version of user %s: %s", user_id, e)
+
+
+async def bump_security_version_async(*user_ids: int) -> None:
+    """bump_security_version for async endpoints (async Redis client)."""
+    if not async_redis_client:
+        return
+    for user_id in user_ids:
+        try:
+            await async_redis_client.incr(_SECURITY_VERSION_KEY.format(user_id))
+        except Exception as e:
+            logger.error("Failed to bump security version of user %s: %s", user_id, e)
+
+
+def bump_role_security_version(db: Session, role_id: int) -> None:
+    """Role permissions changed: every user holding the role."""
+    user_ids: Iterable[int] = [uid for (uid,) in db.query(User.id).filter(User.role_id == role_id)]
+    bump_security_version(*user_ids)
@@ -0,0 +1,191 @@
+"""
+Recalculation of all gross amounts after a SalaryConfiguration change, as a resumable job.
+
+Three phases, each walked by keyset (id > last_id ORDER BY id LIMIT chunk_size):
+1. planning — every PlanningPosition (live budget and snapshot scenarios);
+2. scenarios — update/add ScenarioLineDelta rows of overlay scenarios (they carry their own
+   gross values); the revision of every touched scenario is bumped in the same chunk;
+3. employees — latest FinancialRecord of every non-dismissed employee, found through the
+   employee_current_compensation projection in the same query (no per-employee lookup).
+
+Each chunk is committed together with its checkpoint (job_service.save_checkpoint).
+The recalculation itself is idempotent (gross is a function of net and config), so even a
+chunk retried after a crash between write and commit gives the same result.
+"""
+import logging
+from typing import List
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from database.models import (
+    BackgroundJob,
+    Employee,
+    EmployeeCurrentCompensation,
+    FinancialRecord,
+    PlanningPosition,
+    SalaryConfiguration,
+    Scenario,
+    ScenarioLineDelta,
+)
+from services.analytics_cache import TAG_FINANCIALS, TAG_PLANNING, invalidate_analytics_cache
+from services.compensation_service import sync_current_compensation
+from services.job_service import enqueue_job, job_handler, save_checkpoint
+from services.salary_config_service import snapshot_from
+from services.salary_service import solve_gross_batch
+from services.scenario_service import DELTA_ADD, DELTA_UPDATE
+
+logger = logging.getLogger("fot.background")
+
+SALARY_RECALC_JOB = "salary_recalc"
+CHUNK_SIZE = 500
+
+PHASE_PLANNING = "planning"
+PHASE_SCENARIOS = "scenarios"
+PHASE_EMPLOYEES = "employees"
+
+_REGROSSED_DELTAS = (DELTA_UPDATE, DELTA_ADD)
+
+
+def enqueue_salary_recalculation(db: Session, config_id: int, user_id: int, commit: bool = True) -> BackgroundJob:
+    """A newer configuration supersedes any recalculation still queued or running."""
+    return enqueue_job(db, SALARY_RECALC_JOB, {"config_id": config_id}, user_id, supersede=True, commit=commit)
+
+
+def _regross(rows: List, config) -> int:
+    """Recompute base/kpi/bonus gross of rows in one batch solve; returns how many changed."""
+    grosses = solve_gross_batch(
+        [v for row in rows for v in (row.base_net, row.kpi_net, row.bonus_net)], config
+    )
+    changed = 0
+    for idx, row in enumerate(rows):
+        old_gross = (row.base_gross or 0) + (row.kpi_gross or 0) + (row.bonus_gross or 0)
+        base_g, kpi_g, bonus_g = grosses[3 * idx:3 * idx + 3]
+        row.base_gross = int(round(base_g))
+        row.kpi_gross = int(round(kpi_g))
+        row.bonus_gross = int(round(bonus_g))
+        if abs(old_gross - (row.base_gross + row.kpi_gross + row.bonus_gross)) > 1:
+            changed += 1
+    return changed
+
+
+def _delta_chunk(db: Session, last_id: int, chunk_size: int) -> List[ScenarioLineDelta]:
+    return (
+        db.query(ScenarioLineDelta)
+        .filter(ScenarioLineDelta.op.in_(_REGROSSED_DELTAS), ScenarioLineDelta.id > last_id)
+        .order_by(ScenarioLineDelta.id)
+        .limit(chunk_size)
+        .all()
+    )
+
+
+def _employee_chunk(db: Session, last_id: int, chunk_size: int) -> List[FinancialRecord]:
+    rows = (
+        db.query(FinancialRecord, EmployeeCurrentCompensation)
+        .join(EmployeeCurrentCompensation, EmployeeCurrentCompensation.financial_record_id == FinancialRecord.id)
+        .join(Employee, Employee.id == EmployeeCurrentCompensation.employee_id)
+        .filter(Employee.status != "Dismissed", EmployeeCurrentCompensation.employee_id > last_id)
+        .order_by(EmployeeCurrentCompensation.employee_id)
+        .limit(chunk_size)
+        .all()
+    )
+    # Projection rows are now in the identity map: sync_current_compensation won't re-query them
+    return [fin for fin, _ in rows]
+
+
+@job_handler(SALARY_RECALC_JOB)
+def recalculate_salaries(db: Session, job: BackgroundJob) -> dict:
+    params = job.params or {}
+    config_row = db.get(SalaryConfiguration, params.get("config_id"))
+    if not config_row:
+        raise ValueError(f"Config {params.get('config_id')} not found")
+    # Frozen copy: commits after every chunk must not reload the row mid-job
+    config = snapshot_from(config_row)
+    chunk_size = int(params.get("chunk_size") or CHUNK_SIZE)
+
+    checkpoint = dict(job.checkpoint or {})
+    phase = checkpoint.get("phase", PHASE_PLANNING)
+    last_id = int(checkpoint.get("last_id", 0))
+    progress = {
+        "plans_processed": 0, "plans_updated": 0,
+        "deltas_processed": 0, "deltas_updated": 0,
+        "employees_processed": 0, "employees_updated": 0,
+        **(job.progress or {}),
+    }
+    if "plans_total" not in progress:
+        progress["plans_total"] = db.query(func.count(PlanningPosition.id)).scalar() or 0
+        progress["employees_total"] = (
+            db.query(func.count(EmployeeCurrentCompensation.employee_id))
+            .join(Employee, Employee.id == EmployeeCurrentCompensation.employee_id)
+            .filter(Employee.status != "Dismissed")
+            .scalar() or 0
+        )
+    if "deltas_total" not in progress:
+        progress["deltas_total"] = (
+            db.query(func.count(ScenarioLineDelta.id))
+            .filter(ScenarioLineDelta.op.in_(_REGROSSED_DELTAS))
+            .scalar() or 0
+        )
+    logger.info(f"Salary recalculation job {job.id}: phase {phase}, resuming after id {last_id}")
+
+    if phase == PHASE_PLANNING:
+        while True:
+            rows = (
+                db.query(PlanningPosition)
+                .filter(PlanningPosition.id > last_id)
+                .order_by(PlanningPosition.id)
+                .limit(chunk_size)
+                .all()
+            )
+            if not rows:
+                break
+            progress["plans_updated"] += _regross(rows, config)
+            progress["plans_processed"] += len(rows)
+            last_id = rows[-1].id
+            save_checkpoint(db, job, {"phase": PHASE_PLANNING, "last_id": last_id}, progress)
+        phase, last_id = PHASE_SCENARIOS, 0
+        save_checkpoint(db, job, {"phase": phase, "last_id": last_id}, progress)
+        invalidate_analytics_cache(TAG_PLANNING)
+
+    if phase == PHASE_SCENARIOS:
+        while True:
+            deltas = _delta_chunk(db, last_id, chunk_size)
+            if not deltas:
+                break
+            progress["deltas_updated"] += _regross(deltas, config)
+            # New revision: cached totals of these scenarios no longer match their lines
+            db.execute(
+                update(Scenario)
+                .where(Scenario.id.in_({d.scenario_id for d in deltas}))
+                .values(revision=Scenario.revision + 1)
+                .execution_options(synchronize_session=False)
+            )
+            progress["deltas_processed"] += len(deltas)
+            last_id = deltas[-1].id
+            save_checkpoint(db, job, {"phase": PHASE_SCENARIOS, "last_id": last_id}, progress)
+        phase, last_id = PHASE_EMPLOYEES, 0
+        save_checkpoint(db, job, {"phase": phase, "last_id": last_id}, progress)
+        invalidate_analytics_cache(TAG_PLANNING)
+
+    while True:
+        fins = _employee_chunk(db, last_id, chunk_size)
+        if not fins:
+            break
+        progress["employees_updated"] += _regross(fins, config)
+        for fin in fins:
+            fin.total_gross = fin.base_gross + fin.kpi_gross + fin.bonus_gross
+            sync_current_compensation(db, fin)
+        progress["employees_processed"] += len(fins)
+        last_id = fins[-1].employee_id
+        save_checkpoint(db, job, {"phase": PHASE_EMPLOYEES, "last_id": last_id}, progress)
+
+    invalidate_analytics_cache(TAG_PLANNING, TAG_FINANCIALS)
+    logger.info(
+        f"Recalculation complete. Updated {progress['plans_updated']} plans, "
+        f"{progress['deltas_updated']} scenario lines and {progress['employees_updated']} employees."
+    )
+    return {
+        "plans_updated": progress["plans_updated"],
+        "deltas_updated": progress["deltas_updated"],
+        "employees_updated": progress["employees_updated"],
+    }
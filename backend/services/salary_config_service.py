@@ -0,0 +1,122 @@
+"""
+Immutable, versioned SalaryConfiguration snapshot cached per process.
+
+The row changes a couple of times a year but is read by every tax computation, so
+readers get a frozen snapshot instead of querying the table. Workers notice an update
+through a generation counter in Redis (bumped by update_config); without Redis the
+counter is process-local.
+
+snapshot.version is a fingerprint of the tax-relevant values (same on every worker),
+so tax results can be cached keyed by it.
+"""
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from database.models import SalaryConfiguration
+from database.redis_client import redis_client
+from services.tax_engine import CONFIG_FIELDS, config_fingerprint
+from utils.date_utils import now_iso, to_utc_datetime
+
+logger = logging.getLogger("fot.salary_config")
+
+CONFIG_GENERATION_KEY = "salary_config:generation"
+
+_cache_lock = threading.Lock()
+_cached: dict = {"generation": None, "snapshot": None}
+_local_generation = 0
+
+
+@dataclass(frozen=True)
+class SalaryConfigSnapshot:
+    id: Optional[int]
+    version: str
+    mrp: int
+    mzp: int
+    opv_rate: float
+    opvr_rate: Optional[float]
+    vosms_rate: float
+    vosms_employer_rate: float
+    so_rate: float
+    sn_rate: float
+    ipn_rate: float
+    opv_limit_mzp: int
+    opvr_limit_mzp: int
+    vosms_limit_mzp: int
+    ipn_deduction_mrp: int
+
+
+def get_or_create_config(db: Session) -> SalaryConfiguration:
+    config = db.query(SalaryConfiguration).first()
+    if not config:
+        now = now_iso()
+        config = SalaryConfiguration(
+            mrp=4325,
+            mzp=85000,
+            opv_rate=0.1,
+            opvr_rate=0.025,
+            vosms_rate=0.02,
+            vosms_employer_rate=0.03,
+            so_rate=0.035,
+            sn_rate=0.095,
+            ipn_rate=0.1,
+            opv_limit_mzp=50,
+            opvr_limit_mzp=50,
+            vosms_limit_mzp=10,
+            ipn_deduction_mrp=14,
+            updated_at=now,
+            updated_at_dt=to_utc_datetime(now),
+        )
+        db.add(config)
+        db.commit()
+    return config
+
+
+def snapshot_from(config: SalaryConfiguration) -> SalaryConfigSnapshot:
+    return SalaryConfigSnapshot(
+        id=config.id,
+        version=config_fingerprint(config),
+        **{name: getattr(config, name) for name in CONFIG_FIELDS},
+    )
+
+
+def _current_generation() -> Optional[str]:
+    if redis_client:
+        try:
+            return redis_client.get(CONFIG_GENERATION_KEY) or "0"
+        except Exception as e:
+            logger.warning("Redis config generation lookup failed: %s", e)
+            return None
+    return str(_local_generation)
+
+
+def get_config_snapshot(db: Session) -> SalaryConfigSnapshot:
+    """Current configuration as a frozen snapshot; hits the DB only after an update."""
+    generation = _current_generation()
+    with _cache_lock:
+        if generation is not None and _cached["generation"] == generation:
+            return _cached["snapshot"]
+
+    snapshot = snapshot_from(get_or_create_config(db))
+    if generation is not None:
+        with _cache_lock:
+            _cached["generation"] = generation
+            _cached["snapshot"] = snapshot
+    return snapshot
+
+
+def invalidate_config_snapshot() -> None:
+    """Called after the configuration row changes: every worker reloads on next read."""
+    global _local_generation
+    with _cache_lock:
+        _local_generation += 1
+        _cached["generation"] = None
+        _cached["snapshot"] = None
+    if redis_client:
+        try:
+            redis_client.incr(CONFIG_GENERATION_KEY)
+        except Exception as e:
+            logger.warning("Redis config generation bump failed: %s", e)
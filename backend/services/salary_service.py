@@ -2,6 +2,8 @@
 FIX #26: Single source of truth for salary/tax calculation.
 This module is the ONLY place where calculate_taxes() and solve_gross_from_net() are defined.
 Uses Decimal for precision in all calculations.
+Batch variants (calculate_taxes_batch / solve_gross_batch) run on the integer engine in
+services/tax_engine.py, which reproduces calculate_taxes() exactly.
 """
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
@@ -9,13 +11,16 @@ from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
 from database.models import SalaryConfiguration, Position, Employee, FinancialRecord, PlanningPosition, AuditLog, User, OrganizationUnit
 from utils.date_utils import now_iso, to_iso_utc, to_utc_datetime
+from services.compensation_service import sync_current_compensation
+from services import tax_engine
 
 # --- Tax Calculation Logic (Decimal precision) ---
 
 def calculate_taxes(gross_val: float, config: SalaryConfiguration, apply_deduction: bool = True):
     """
     Standard RK Calculation (2024) using Decimal for precision.
-    Returns dictionary with all tax components as float values.
+    Returns dictionary with all tax components as float values
+    and the config_version they were computed with.
     """
     gross = Decimal(str(gross_val)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
     mrp = Decimal(str(config.mrp))
@@ -83,14 +88,21 @@ def calculate_taxes(gross_val: float, config: SalaryConfiguration, apply_deducti
         "so": float(so),
         "sn": float(sn),
         "opvr": float(opvr),
-        "deduction": float(deduction_amt)
+        "deduction": float(deduction_amt),
+        "config_version": tax_engine.config_fingerprint(config),
     }
 
 def solve_gross_from_net(target_net_val: float, config: SalaryConfiguration, apply_deduction: bool = True) -> float:
     """
-    Reverse calculation: given target net, find the gross using binary search.
-    Uses Decimal precision for iterative approximation.
+    Reverse calculation: given target net, find the gross.
+    Closed-form on the precomputed segments of the config (O(log segments)), exact to the tiyn:
+    the smallest gross whose net reaches the target. Binary search remains only for configs
+    whose money constants are not whole tiyn.
     """
+    engine = tax_engine.get_engine(config, apply_deduction)
+    if engine.exact:
+        return engine.solve_gross_tiyn(tax_engine.to_tiyn(target_net_val)) / 100
+
     target_net = Decimal(str(target_net_val))
     
     low = target_net
@@ -113,6 +125,36 @@ def solve_gross_from_net(target_net_val: float, config: SalaryConfiguration, app
             
     return float((low + high) / Decimal(2))
 
+def calculate_taxes_batch(gross_values, config: SalaryConfiguration, apply_deduction: bool = True) -> dict:
+    """
+    calculate_taxes() for a whole array in one call.
+    Returns columns: {"gross": [...], "net": [...], ..., "deduction": [...]}
+    and the scalar "config_version".
+    """
+    values = list(gross_values)
+    engine = tax_engine.get_engine(config, apply_deduction)
+    if engine.exact:
+        result = tax_engine.calculate_taxes_batch(values, engine)
+    else:
+        # Money constants with fractions of a tiyn — keep the Decimal path
+        rows = [calculate_taxes(v, config, apply_deduction) for v in values]
+        keys = tax_engine.TAX_COMPONENTS + ("deduction",)
+        result = {k: [r[k] for r in rows] for k in keys}
+    result["config_version"] = tax_engine.config_fingerprint(config)
+    return result
+
+
+def solve_gross_batch(net_values, config: SalaryConfiguration, apply_deduction: bool = True) -> list:
+    """
+    Net → Gross for a whole array, closed-form per value (no bisection).
+    Each gross is the smallest amount (to the tiyn) whose net reaches the target.
+    """
+    values = list(net_values)
+    engine = tax_engine.get_engine(config, apply_deduction)
+    if engine.exact:
+        return tax_engine.solve_gross_batch(values, engine)
+    return [solve_gross_from_net(v, config, apply_deduction) for v in values]
+
 # --- Sync Logic ---
 
 def sync_employee_financials(db: Session, plan: PlanningPosition, changes: dict, user: User, audit_ts: str):
@@ -196,5 +238,7 @@ def sync_employee_financials(db: Session, plan: PlanningPosition, changes: dict,
                 if emp_audit_changes:
                     fin.last_raise_date = now_iso()
                     fin.last_raise_date_dt = to_utc_datetime(fin.last_raise_date)
+
+                sync_current_compensation(db, fin)
     
     return sync_count
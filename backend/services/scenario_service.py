@@ -0,0 +1,479 @@
+"""
+Scenario storage and the set-based commit to the live budget.
+
+Overlay scenarios (copy-on-write) store only ScenarioLineDelta rows against the live
+budget: 'update' holds a copy of one live line with the scenario's values, 'add' a new
+line, 'delete' a tombstone. Creating a scenario writes nothing but the Scenario row; the
+first change of a live line copies it into a delta. resolve_scenario_lines() merges the
+live lines with the deltas on read. Snapshot scenarios (auto-backups and scenarios
+created before overlays) keep full copies in planning_lines.
+
+Commit:
+1. Backup: the live lines are copied into an archived scenario with one INSERT ... SELECT.
+2. Merge: live and scenario lines are matched on the planning slot key
+   (position_title, branch_id, department_id, schedule). The k-th scenario line of a key
+   updates the k-th live line of that key (id order), unmatched scenario lines are
+   created, unmatched live lines deleted. Overlay scenarios skip the matching: their
+   deltas already name the live line they update or delete. Only key and value columns are read (no ORM
+   objects); updates, inserts, deletes and audit rows are each one batched statement.
+3. Employee sync: employees in a changed slot get the new per-unit values on their
+   latest FinancialRecord: one executemany UPDATE per group of changed fields, then a
+   single set-based refresh of the compensation projection.
+"""
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, literal, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from database.models import (
+    AuditLog, Employee, EmployeeCurrentCompensation, FinancialRecord, PlanningPosition, Position, Scenario,
+    ScenarioLineDelta, User,
+)
+from services.compensation_service import refresh_current_compensation
+from services.salary_service import calculate_taxes_batch, solve_gross_batch
+from utils.date_utils import now_iso, to_iso_utc, to_utc_datetime
+
+SLOT_KEY = ("position_title", "branch_id", "department_id", "schedule")
+VALUE_FIELDS = ("count", "base_net", "base_gross", "kpi_net", "kpi_gross", "bonus_net", "bonus_gross", "bonus_count")
+FIN_FIELDS = ("base_net", "base_gross", "kpi_net", "kpi_gross", "bonus_net", "bonus_gross")
+COPIED_FIELDS = SLOT_KEY + VALUE_FIELDS
+
+STORAGE_OVERLAY = "overlay"
+STORAGE_SNAPSHOT = "snapshot"
+
+DELTA_UPDATE = "update"
+DELTA_ADD = "add"
+DELTA_DELETE = "delete"
+
+MASS_UPDATE_PREVIEW_LIMIT = 100
+
+_LINE_COLUMNS = [PlanningPosition.id] + [getattr(PlanningPosition, f) for f in COPIED_FIELDS]
+_DELTA_COLUMNS = [ScenarioLineDelta.id, ScenarioLineDelta.live_line_id, ScenarioLineDelta.op] + [
+    getattr(ScenarioLineDelta, f) for f in COPIED_FIELDS
+]
+
+
+@dataclass(frozen=True)
+class ScenarioLine:
+    """
+    A planning line as seen by a scenario.
+    live_line_id: the live line it is (or overrides); None for lines added by the scenario.
+    delta_id: the overlay row holding its values; None while the line is unchanged.
+    line_id: the planning_lines row of a snapshot scenario.
+    """
+    live_line_id: Optional[int]
+    delta_id: Optional[int]
+    line_id: Optional[int]
+    position_title: str
+    branch_id: Optional[int]
+    department_id: Optional[int]
+    schedule: Optional[str]
+    count: Optional[int]
+    base_net: Optional[int]
+    base_gross: Optional[int]
+    kpi_net: Optional[int]
+    kpi_gross: Optional[int]
+    bonus_net: Optional[int]
+    bonus_gross: Optional[int]
+    bonus_count: Optional[int]
+
+    @property
+    def key(self) -> tuple:
+        """Stable identity of the line within its scenario (API ids, change sets)."""
+        if self.line_id is not None:
+            return ("line", self.line_id)
+        if self.live_line_id is not None:
+            return ("live", self.live_line_id)
+        return ("delta", self.delta_id)
+
+
+def _values(row) -> dict:
+    return {f: getattr(row, f) for f in COPIED_FIELDS}
+
+
+def _scope(scenario_id: Optional[int]):
+    if scenario_id is None:
+        return PlanningPosition.scenario_id.is_(None)
+    return PlanningPosition.scenario_id == scenario_id
+
+
+def backup_live_budget(db: Session, name: str) -> Scenario:
+    """Archived copy of the live lines (INSERT ... SELECT, nothing loaded into Python)."""
+    backup = Scenario(name=name, status="archived", description="Auto-backup before commit", storage=STORAGE_SNAPSHOT)
+    db.add(backup)
+    db.flush()
+    db.execute(
+        insert(PlanningPosition).from_select(
+            ["scenario_id", *COPIED_FIELDS],
+            select(literal(backup.id), *[getattr(PlanningPosition, f) for f in COPIED_FIELDS])
+            .where(_scope(None))
+            .order_by(PlanningPosition.id),
+        )
+    )
+    return backup
+
+
+def load_lines(db: Session, scenario_id: Optional[int]) -> List:
+    return db.execute(select(*_LINE_COLUMNS).where(_scope(scenario_id)).order_by(PlanningPosition.id)).all()
+
+
+def _deltas(db: Session, scenario_id: int) -> List:
+    return db.execute(
+        select(*_DELTA_COLUMNS).where(ScenarioLineDelta.scenario_id == scenario_id).order_by(ScenarioLineDelta.id)
+    ).all()
+
+
+def resolve_scenario_lines(db: Session, scenario: Scenario, live: Optional[List] = None) -> List[ScenarioLine]:
+    """
+    Lines of the scenario: live lines in id order with updates applied and deletions
+    removed, then the added lines. `live` may pass already loaded load_lines(db, None).
+    """
+    if scenario.storage != STORAGE_OVERLAY:
+        return [ScenarioLine(live_line_id=None, delta_id=None, line_id=r.id, **_values(r)) for r in load_lines(db, scenario.id)]
+
+    by_live_id, added = {}, []
+    for d in _deltas(db, scenario.id):
+        if d.op == DELTA_ADD:
+            added.append(ScenarioLine(live_line_id=None, delta_id=d.id, line_id=None, **_values(d)))
+        else:
+            by_live_id[d.live_line_id] = d
+
+    resolved = []
+    for r in (live if live is not None else load_lines(db, None)):
+        d = by_live_id.get(r.id)
+        if d is None:
+            resolved.append(ScenarioLine(live_line_id=r.id, delta_id=None, line_id=None, **_values(r)))
+        elif d.op == DELTA_UPDATE:
+            resolved.append(ScenarioLine(live_line_id=r.id, delta_id=d.id, line_id=None, **_values(d)))
+    return resolved + added
+
+
+def delta_rows(db: Session, scenario: Scenario) -> Tuple[List, List[ScenarioLine]]:
+    """
+    The overlay of a scenario: (live lines it replaces or deletes, lines it contributes
+    instead). Deltas of live lines deleted since are ignored.
+    """
+    deltas = _deltas(db, scenario.id)
+    referenced = [d.live_line_id for d in deltas if d.live_line_id is not None]
+    removed = db.execute(
+        select(*_LINE_COLUMNS).where(_scope(None), PlanningPosition.id.in_(referenced)).order_by(PlanningPosition.id)
+    ).all() if referenced else []
+    existing = {r.id for r in removed}
+
+    contributed = []
+    for d in deltas:
+        if d.op == DELTA_ADD:
+            contributed.append(ScenarioLine(live_line_id=None, delta_id=d.id, line_id=None, **_values(d)))
+        elif d.op == DELTA_UPDATE and d.live_line_id in existing:
+            contributed.append(ScenarioLine(live_line_id=d.live_line_id, delta_id=d.id, line_id=None, **_values(d)))
+    return removed, contributed
+
+
+def bump_revision(db: Session, scenario: Scenario) -> int:
+    """Atomically increment Scenario.revision (versions cached totals). Returns the new value."""
+    return db.execute(
+        update(Scenario)
+        .where(Scenario.id == scenario.id)
+        .values(revision=Scenario.revision + 1)
+        .returning(Scenario.revision)
+        .execution_options(synchronize_session="fetch")
+    ).scalar_one()
+
+
+def write_line_values(db: Session, scenario: Scenario, changes: List[Tuple[ScenarioLine, dict]]) -> List[ScenarioLine]:
+    """
+    Store new values of resolved lines (no commit): snapshot lines are updated in place,
+    overlay lines update their delta, untouched live lines are copied into a new
+    'update' delta. One statement per kind of write. Returns the updated lines.
+    The caller bumps the scenario revision.
+    """
+    if not changes:
+        return []
+    updated = [replace(line, **values) for line, values in changes]
+
+    if scenario.storage != STORAGE_OVERLAY:
+        db.execute(update(PlanningPosition), [
+            {"id": line.line_id, **{f: getattr(line, f) for f in VALUE_FIELDS}} for line in updated
+        ])
+        return updated
+
+    existing = [line for line in updated if line.delta_id is not None]
+    if existing:
+        db.execute(update(ScenarioLineDelta), [
+            {"id": line.delta_id, **{f: getattr(line, f) for f in VALUE_FIELDS}} for line in existing
+        ])
+    copies = [line for line in updated if line.delta_id is None]
+    if copies:
+        # Plain executemany (ordered RETURNING would fall back to one INSERT per row
+        # on some backends), ids read back by (scenario, live line) in one query
+        db.execute(insert(ScenarioLineDelta), [
+            {"scenario_id": scenario.id, "live_line_id": line.live_line_id, "op": DELTA_UPDATE, **_values(line)}
+            for line in copies
+        ])
+        copied = dict(db.execute(
+            select(ScenarioLineDelta.live_line_id, ScenarioLineDelta.id).where(
+                ScenarioLineDelta.scenario_id == scenario.id,
+                ScenarioLineDelta.live_line_id.in_([line.live_line_id for line in copies]),
+            )
+        ).all())
+        updated = [
+            replace(line, delta_id=copied[line.live_line_id]) if line.delta_id is None else line
+            for line in updated
+        ]
+    return updated
+
+
+def filter_lines(
+    lines: List[ScenarioLine],
+    branch_id: Optional[int] = None,
+    department_id: Optional[int] = None,
+    position_filter: Optional[str] = None,
+) -> List[ScenarioLine]:
+    if branch_id:
+        lines = [line for line in lines if line.branch_id == branch_id]
+    if department_id:
+        lines = [line for line in lines if line.department_id == department_id]
+    if position_filter:
+        # Plain substring match (no LIKE wildcards), case-insensitive for Cyrillic too
+        needle = position_filter.casefold()
+        lines = [line for line in lines if needle in (line.position_title or "").casefold()]
+    return lines
+
+
+def plan_mass_update(lines: List[ScenarioLine], field: str, change_type: str, value: float, config) -> List[Tuple[ScenarioLine, dict]]:
+    """
+    New values for a mass change of `field` ('base_net', 'kpi_gross', ...) on the lines:
+    (line, {field: new, paired field: new}) for every line whose value changes.
+    The paired net/gross amounts are solved for all lines in one batch call.
+    """
+    prefix, suffix = field.split("_")
+    other_field = f"{prefix}_{'gross' if suffix == 'net' else 'net'}"
+
+    changed = []
+    for line in lines:
+        current = getattr(line, field) or 0
+        if change_type == "percent":
+            new_val = current * (1 + value / 100.0)
+        elif change_type == "fixed_add":
+            new_val = current + value
+        else:  # fixed_set
+            new_val = value
+        new_val = int(round(new_val))
+        if new_val != current:
+            changed.append((line, new_val))
+    if not changed:
+        return []
+
+    new_values = [new_val for _, new_val in changed]
+    if suffix == "net":
+        others = solve_gross_batch(new_values, config)
+    else:
+        others = calculate_taxes_batch(new_values, config)["net"]
+    return [
+        (line, {field: new_val, other_field: int(round(other))})
+        for (line, new_val), other in zip(changed, others)
+    ]
+
+
+def mass_update_preview(changes: List[Tuple[ScenarioLine, dict]], limit: int = MASS_UPDATE_PREVIEW_LIMIT) -> List[dict]:
+    """First `limit` changed lines with old -> new values of the written fields."""
+    return [
+        {
+            "live_line_id": line.live_line_id,
+            "line_id": line.line_id,
+            "delta_id": line.delta_id,
+            "position_title": line.position_title,
+            "branch_id": line.branch_id,
+            "department_id": line.department_id,
+            "changes": {f: {"old": getattr(line, f), "new": v} for f, v in values.items()},
+        }
+        for line, values in changes[:limit]
+    ]
+
+
+def _overlay_diff(db: Session, scenario: Scenario, live: List) -> Tuple[List[Tuple], List, List]:
+    """diff_lines() for an overlay: the deltas name their live lines, no key matching."""
+    live_by_id = {r.id: r for r in live}
+    updates, creates, deleted = [], [], set()
+    for d in _deltas(db, scenario.id):
+        if d.op == DELTA_ADD:
+            creates.append(d)
+            continue
+        target = live_by_id.get(d.live_line_id)
+        if target is None:
+            # The live line was deleted after the scenario changed it
+            continue
+        if d.op == DELTA_DELETE:
+            deleted.add(target.id)
+            continue
+        changes = {f: (getattr(target, f), getattr(d, f)) for f in VALUE_FIELDS if getattr(target, f) != getattr(d, f)}
+        if changes:
+            updates.append((target, d, changes))
+    return updates, creates, [r for r in live if r.id in deleted]
+
+
+def diff_lines(live: List, scenario: List) -> Tuple[List[Tuple], List, List]:
+    """
+    (updates, creates, deletes): updates are (live_row, scenario_row, {field: (old, new)})
+    for matched pairs with at least one changed value.
+    """
+    by_key: Dict[tuple, List] = defaultdict(list)
+    for row in live:
+        by_key[tuple(getattr(row, f) for f in SLOT_KEY)].append(row)
+    cursor: Dict[tuple, int] = defaultdict(int)
+
+    updates, creates, matched = [], [], set()
+    for row in scenario:
+        key = tuple(getattr(row, f) for f in SLOT_KEY)
+        candidates = by_key.get(key)
+        if candidates and cursor[key] < len(candidates):
+            target = candidates[cursor[key]]
+            cursor[key] += 1
+            matched.add(target.id)
+            changes = {
+                f: (getattr(target, f), getattr(row, f))
+                for f in VALUE_FIELDS
+                if getattr(target, f) != getattr(row, f)
+            }
+            if changes:
+                updates.append((target, row, changes))
+        else:
+            creates.append(row)
+    deletes = [row for row in live if row.id not in matched]
+    return updates, creates, deletes
+
+
+def sync_employees_for_lines(db: Session, slot_values: Dict[Tuple[str, int], Tuple[int, Dict[str, int]]], user: Optional[User], audit_ts: str) -> int:
+    """
+    Set-based counterpart of salary_service.sync_employee_financials for many lines.
+    slot_values: (position_title, org_unit_id) -> (plan line id, {fin field: new per-unit value}).
+    Returns the number of employees whose latest record changed.
+    """
+    if not slot_values:
+        return 0
+
+    fin_cols = [getattr(FinancialRecord, f) for f in FIN_FIELDS]
+    # Latest record through the projection's pointer, not a max(id) GROUP BY over all records
+    rows = db.execute(
+        select(Employee.id.label("employee_id"), Position.title, Employee.org_unit_id, FinancialRecord.id, *fin_cols)
+        .join(Position, Position.id == Employee.position_id)
+        .join(EmployeeCurrentCompensation, EmployeeCurrentCompensation.employee_id == Employee.id)
+        .join(FinancialRecord, FinancialRecord.id == EmployeeCurrentCompensation.financial_record_id)
+        .where(
+            tuple_(Position.title, Employee.org_unit_id).in_(list(slot_values)),
+            Employee.status != "Dismissed",
+        )
+    ).all()
+
+    raise_date = now_iso()
+    raise_date_dt = to_utc_datetime(raise_date)
+    groups: Dict[tuple, List[dict]] = defaultdict(list)
+    audits, synced = [], []
+    for r in rows:
+        plan_id, new_values = slot_values[(r.title, r.org_unit_id)]
+        changed = {f: (getattr(r, f), v) for f, v in new_values.items() if getattr(r, f) != v}
+        if not changed:
+            continue
+        merged = {f: (new_values[f] if f in changed else getattr(r, f)) for f in FIN_FIELDS}
+        total_net = (merged["base_net"] or 0) + (merged["kpi_net"] or 0) + (merged["bonus_net"] or 0)
+        total_gross = (merged["base_gross"] or 0) + (merged["kpi_gross"] or 0) + (merged["bonus_gross"] or 0)
+        groups[tuple(sorted(changed))].append({
+            "id": r.id,
+            **{f: new for f, (_, new) in changed.items()},
+            # FIX #M1 (see sync_employee_financials): total = base + kpi + bonus per employee
+            "total_net": total_net,
+            "total_gross": total_gross,
+            # Legacy Sync (for backward compatibility)
+            "base_salary": merged["base_net"],
+            "kpi_amount": merged["kpi_net"],
+            "total_payment": total_net,
+            "last_raise_date": raise_date,
+            "last_raise_date_dt": raise_date_dt,
+        })
+        synced.append(r.employee_id)
+        if user:
+            audits.append({
+                "user_id": user.id,
+                "target_entity": "employee",
+                "target_entity_id": r.employee_id,
+                "timestamp": to_iso_utc(audit_ts) or audit_ts,
+                "old_values": {**{f: old for f, (old, _) in changed.items()}, "sync_source": ""},
+                "new_values": {**{f: new for f, (_, new) in changed.items()}, "sync_source": f"План (ID: {plan_id})"},
+            })
+
+    # One UPDATE (executemany by primary key) per group of changed fields
+    for params in groups.values():
+        db.execute(update(FinancialRecord), params)
+    if audits:
+        db.execute(insert(AuditLog), audits)
+    if synced:
+        refresh_current_compensation(db, synced)
+    return len(synced)
+
+
+def commit_scenario_to_live(db: Session, scenario: Scenario, user: User) -> dict:
+    """Apply the scenario to the live budget in the caller's transaction (no commit)."""
+    backup = backup_live_budget(db, f"Backup {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+    live = load_lines(db, None)
+    if scenario.storage == STORAGE_OVERLAY:
+        updates, creates, deletes = _overlay_diff(db, scenario, live)
+    else:
+        updates, creates, deletes = diff_lines(live, load_lines(db, scenario.id))
+    now_ts = now_iso()
+    audits: List[dict] = []
+
+    def audit(entity_id, old_values, new_values):
+        audits.append({
+            "user_id": user.id, "target_entity": "planning", "target_entity_id": entity_id,
+            "timestamp": now_ts, "old_values": old_values, "new_values": new_values,
+        })
+
+    # Updates: one executemany by primary key
+    if updates:
+        db.execute(update(PlanningPosition), [
+            {"id": target.id, **{f: getattr(row, f) for f in VALUE_FIELDS}} for target, row, _ in updates
+        ])
+    slot_values: Dict[Tuple[str, int], Tuple[int, Dict[str, int]]] = {}
+    for target, row, changes in updates:
+        audit(target.id, {f: old for f, (old, _) in changes.items()}, {f: new for f, (_, new) in changes.items()})
+        fin_changes = {f: new for f, (_, new) in changes.items() if f in FIN_FIELDS}
+        org_id = target.department_id or target.branch_id
+        if fin_changes and target.position_title and org_id:
+            # Later lines of the same slot win, as with the per-line sync
+            _, values = slot_values.get((target.position_title, org_id), (None, {}))
+            slot_values[(target.position_title, org_id)] = (target.id, {**values, **fin_changes})
+
+    if creates:
+        created = db.execute(
+            insert(PlanningPosition).returning(PlanningPosition.id, PlanningPosition.position_title, sort_by_parameter_order=True),
+            [{"scenario_id": None, **{f: getattr(row, f) for f in COPIED_FIELDS}} for row in creates],
+        ).all()
+        for new_id, title in created:
+            audit(new_id, None, {"Событие": "Создано из сценария", "Название": title})
+
+    if deletes:
+        for row in deletes:
+            audit(row.id, {"Событие": "Удалено сценарием", "Название": row.position_title}, None)
+        db.execute(
+            delete(PlanningPosition)
+            .where(PlanningPosition.id.in_([row.id for row in deletes]))
+            .execution_options(synchronize_session=False)
+        )
+
+    if audits:
+        db.execute(insert(AuditLog), audits)
+    synced = sync_employees_for_lines(db, slot_values, user, now_ts)
+
+    scenario.status = "committed"
+    return {
+        "status": "committed",
+        "backup_id": backup.id,
+        "synced_employees": synced,
+        "updated_rows": len(live) - len(deletes),
+        "changed_rows": len(updates),
+        "created_rows": len(creates),
+        "deleted_rows": len(deletes),
+    }
@@ -0,0 +1,189 @@
+"""
+Scenario comparison totals without recomputing every line on each request.
+
+Per-line cost (net, gross and taxes incl. employer contributions) depends only on the
+line's values and the tax configuration, so it is cached per process by
+(content hash, config version); misses are computed with one calculate_taxes_batch call.
+
+Totals of the live budget and of every scenario are cached in the analytics cache
+(tag planning, so any change of the live budget drops them). Scenario entries are keyed
+by Scenario.revision: a change of the scenario's lines bumps the revision and
+adjust_scenario_totals() derives the new entry from the previous one and the changed
+lines only. A comparison of an unchanged scenario is served from the cache.
+
+Taxes are kept in whole tiyn so incremental adjustments never accumulate float error.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from database.models import Scenario
+from services.analytics_cache import TAG_PLANNING, get_cached, store_cached
+from services.salary_service import calculate_taxes_batch
+from services.scenario_service import STORAGE_OVERLAY, VALUE_FIELDS, delta_rows, load_lines
+from services.tax_engine import config_fingerprint
+
+LINE_CACHE_SIZE = 20000
+TOTALS_TTL = 3600
+_TAGS = (TAG_PLANNING,)
+
+_line_cache: "OrderedDict[tuple, LineCost]" = OrderedDict()
+_line_cache_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class LineCost:
+    net: int
+    gross: int
+    taxes_tiyn: int
+
+
+def line_content_hash(line) -> str:
+    raw = "|".join("" if getattr(line, f) is None else str(getattr(line, f)) for f in VALUE_FIELDS)
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+def _line_amounts(line) -> tuple:
+    count = line.count or 0
+    bonus_count = line.bonus_count if line.bonus_count is not None else count
+    total_net = ((line.base_net or 0) + (line.kpi_net or 0)) * count + (line.bonus_net or 0) * bonus_count
+    total_gross = ((line.base_gross or 0) + (line.kpi_gross or 0)) * count + (line.bonus_gross or 0) * bonus_count
+    return count, total_net, total_gross
+
+
+def line_costs(lines: List, config) -> List[LineCost]:
+    """Cost of every line; only lines not seen with this config version are computed."""
+    version = config_fingerprint(config)
+    keys = [(line_content_hash(line), version) for line in lines]
+    costs: List[Optional[LineCost]] = [None] * len(lines)
+    with _line_cache_lock:
+        for idx, key in enumerate(keys):
+            cost = _line_cache.get(key)
+            if cost is not None:
+                _line_cache.move_to_end(key)
+                costs[idx] = cost
+
+    misses = [idx for idx, cost in enumerate(costs) if cost is None]
+    if misses:
+        amounts = [_line_amounts(lines[idx]) for idx in misses]
+        # Employer contributions of one person earning the line's average gross, times count
+        taxes = calculate_taxes_batch([gross / count if count else 0 for count, _, gross in amounts], config)
+        computed = {}
+        for pos, (idx, (count, total_net, total_gross)) in enumerate(zip(misses, amounts)):
+            employer_tiyn = round((taxes["osms"][pos] + taxes["so"][pos] + taxes["sn"][pos] + taxes["opvr"][pos]) * 100)
+            cost = LineCost(
+                net=total_net,
+                gross=total_gross,
+                taxes_tiyn=(total_gross - total_net) * 100 + employer_tiyn * count,
+            )
+            costs[idx] = cost
+            computed[keys[idx]] = cost
+        with _line_cache_lock:
+            _line_cache.update(computed)
+            while len(_line_cache) > LINE_CACHE_SIZE:
+                _line_cache.popitem(last=False)
+    return costs
+
+
+def clear_line_cache() -> None:
+    with _line_cache_lock:
+        _line_cache.clear()
+
+
+def _sum(costs: Iterable[LineCost]) -> dict:
+    totals = {"net": 0, "gross": 0, "taxes_tiyn": 0}
+    for cost in costs:
+        totals["net"] += cost.net
+        totals["gross"] += cost.gross
+        totals["taxes_tiyn"] += cost.taxes_tiyn
+    return totals
+
+
+def _combine(base: dict, minus: dict, plus: dict) -> dict:
+    return {k: base[k] - minus[k] + plus[k] for k in base}
+
+
+def _live_key(version: str) -> str:
+    return f"scenario_totals:live:{version}"
+
+
+def _scenario_key(scenario_id: int, revision: int, version: str) -> str:
+    return f"scenario_totals:{scenario_id}:r{revision}:{version}"
+
+
+def live_totals(db: Session, config) -> dict:
+    key = _live_key(config_fingerprint(config))
+    totals = get_cached(key, _TAGS)
+    if totals is None:
+        totals = _sum(line_costs(load_lines(db, None), config))
+        store_cached(key, totals, TOTALS_TTL, _TAGS)
+    return totals
+
+
+def scenario_totals(db: Session, scenario: Scenario, config) -> dict:
+    key = _scenario_key(scenario.id, scenario.revision or 0, config_fingerprint(config))
+    totals = get_cached(key, _TAGS)
+    if totals is None:
+        if scenario.storage == STORAGE_OVERLAY:
+            # live - replaced/deleted live lines + the scenario's own lines: only deltas are read
+            removed, contributed = delta_rows(db, scenario)
+            totals = _combine(
+                live_totals(db, config),
+                _sum(line_costs(removed, config)),
+                _sum(line_costs(contributed, config)),
+            )
+        else:
+            totals = _sum(line_costs(load_lines(db, scenario.id), config))
+        store_cached(key, totals, TOTALS_TTL, _TAGS)
+    return totals
+
+
+def adjust_scenario_totals(
+    scenario_id: int,
+    config,
+    old_revision: int,
+    new_revision: int,
+    before: List,
+    after: List,
+) -> None:
+    """
+    After a committed change of some lines (before -> after): derive the totals of
+    new_revision from the cached old_revision entry. Skipped when the entry is missing or
+    another change got in between; the next comparison then recomputes.
+    """
+    if new_revision != old_revision + 1:
+        return
+    version = config_fingerprint(config)
+    old = get_cached(_scenario_key(scenario_id, old_revision, version), _TAGS)
+    if old is None:
+        return
+    totals = _combine(old, _sum(line_costs(before, config)), _sum(line_costs(after, config)))
+    store_cached(_scenario_key(scenario_id, new_revision, version), totals, TOTALS_TTL, _TAGS)
+
+
+def _public(totals: dict) -> dict:
+    total_taxes = totals["taxes_tiyn"] / 100
+    return {
+        "total_net": totals["net"],
+        "total_gross": totals["gross"],
+        "total_taxes": total_taxes,
+        "total_budget": totals["net"] + total_taxes,
+    }
+
+
+def compare_with_live(db: Session, scenario: Scenario, config) -> dict:
+    stats_live = _public(live_totals(db, config))
+    stats_scenario = _public(scenario_totals(db, scenario, config))
+    return {
+        "live": stats_live,
+        "scenario": stats_scenario,
+        "delta": {
+            "net": stats_scenario["total_net"] - stats_live["total_net"],
+            "budget": stats_scenario["total_budget"] - stats_live["total_budget"],
+            "percent": ((stats_scenario["total_budget"] - stats_live["total_budget"]) / stats_live["total_budget"] * 100) if stats_live["total_budget"] else 0
+        }
+    }
@@ -0,0 +1,146 @@
+"""
+Resolved user scope (allowed OrganizationUnit ids), cached.
+
+get_user_scope is called on nearly every request. The scope is derived from the OrgTree
+(no queries) and cached per (user_id, scope version, org tree version):
+- the scope version is a hash of the user's scope inputs (admin flag, scope_branches,
+  scope_departments), so update_user changes the key by itself, whoever edits the row;
+- the org tree version is bumped by every structure edit.
+Stale entries are never addressed again and expire (Redis TTL / LRU eviction).
+
+A process-local LRU sits in front of Redis. The scope is a frozenset: membership checks
+in Python loops are O(1) and the value can be shared between requests safely.
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import FrozenSet, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database.models import User
+from database.redis_client import redis_client
+from services.org_unit_service import OrgTree, get_org_tree, org_tree_version
+
+logger = logging.getLogger("fot.scope")
+
+SCOPE_CACHE_TTL = 3600
+SCOPE_LRU_SIZE = 2048
+
+_SCOPE_KEY = "user_scope:{}:{}:{}"
+
+_lru: "OrderedDict[Tuple[int, str, str], FrozenSet[int]]" = OrderedDict()
+_lru_lock = threading.Lock()
+
+
+def _int_ids(values) -> set:
+    ids = set()
+    for x in values or []:
+        try:
+            ids.add(int(x))
+        except (ValueError, TypeError):
+            pass
+    return ids
+
+
+def is_full_access(user: User) -> bool:
+    perms = user.role_rel.permissions if user.role_rel else None
+    return bool(perms and perms.get("admin_access"))
+
+
+def scope_version(user: User) -> str:
+    """Hash of everything the resolved scope depends on besides the org tree."""
+    raw = json.dumps([sorted(_int_ids(user.scope_branches)), sorted(_int_ids(user.scope_departments))])
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def compute_user_scope(tree: OrgTree, user: User) -> FrozenSet[int]:
+    """Allowed unit ids of a non-admin user (the former get_user_scope logic, on the OrgTree)."""
+    allowed_ids = set()
+
+    user_dept_ids = _int_ids(user.scope_departments)
+    user_branch_ids = _int_ids(user.scope_branches)
+
+    # Always allow explicitly assigned departments
+    allowed_ids.update(user_dept_ids)
+
+    for b_id in user_branch_ids:
+        # Direct departments of this branch
+        branch_dept_ids = {
+            c for c in tree.children.get(b_id, ()) if tree.nodes[c].type == "department"
+        }
+
+        if user_dept_ids.intersection(branch_dept_ids):
+            # User has specific departments selected in THIS branch.
+            # Strictly limit to these departments. DO NOT ADD the branch itself (so they don't see branch directors).
+            # (The structure.py API will automatically load parent branches for the UI tree instead).
+            continue
+        # No departments selected in this branch (or none anywhere): FULL access to this branch.
+        allowed_ids.add(b_id)
+        allowed_ids.update(branch_dept_ids)
+
+    # Note: if a user ONLY has departments and no branches, those departments are granted via user_dept_ids above.
+    return frozenset(allowed_ids)
+
+
+def _lru_get(key) -> Optional[FrozenSet[int]]:
+    with _lru_lock:
+        value = _lru.get(key)
+        if value is not None:
+            _lru.move_to_end(key)
+        return value
+
+
+def _lru_put(key, value: FrozenSet[int]) -> None:
+    with _lru_lock:
+        _lru[key] = value
+        _lru.move_to_end(key)
+        while len(_lru) > SCOPE_LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def resolve_user_scope(db: Session, user: User) -> Optional[FrozenSet[int]]:
+    """Allowed unit ids, or None for full access (admin_access)."""
+    if is_full_access(user):
+        return None
+
+    tree_version = org_tree_version()
+    if tree_version is None:
+        return compute_user_scope(get_org_tree(db), user)
+
+    key = (user.id, scope_version(user), tree_version)
+    scope = _lru_get(key)
+    if scope is not None:
+        return scope
+
+    redis_key = _SCOPE_KEY.format(*key)
+    if redis_client:
+        try:
+            cached = redis_client.get(redis_key)
+            if cached is not None:
+                scope = frozenset(json.loads(cached))
+        except Exception as e:
+            logger.warning("Redis scope lookup failed: %s", e)
+
+    if scope is None:
+        scope = compute_user_scope(get_org_tree(db), user)
+        if redis_client:
+            try:
+                redis_client.setex(redis_key, SCOPE_CACHE_TTL, json.dumps(sorted(scope)))
+            except Exception as e:
+                logger.warning("Redis scope store failed: %s", e)
+
+    _lru_put(key, scope)
+    return scope
+
+
+def invalidate_user_scope(user_id: Optional[int] = None) -> None:
+    """
+    Drop local entries of a user (all users if None). Not needed for correctness, the keys
+    already change with the user's scope and the org tree; frees the LRU after edits.
+    """
+    with _lru_lock:
+        for key in [k for k in _lru if user_id is None or k[0] == user_id]:
+            del _lru[key]
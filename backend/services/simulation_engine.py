@@ -0,0 +1,101 @@
+"""
+Monte Carlo budget simulation kernel (runs inside the simulation process pool).
+
+Kept free of database and web imports so pool workers start fast: it only needs
+the planning lines as plain tuples, the rules as dicts and the tax configuration snapshot.
+
+Cost model (same as the scenario comparison): a line costs (g + employer(g)) * headcount,
+g being the average gross per person incl. the bonus. Per iteration every rule draws one
+raise, attrition and hiring percentage (a shock shared by all lines of the rule):
+g is scaled by (1 + raise) and the headcount by (1 - attrition + hiring).
+"""
+import random
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from services import tax_engine
+
+# (count, average gross per person)
+Line = Tuple[int, float]
+# (rule index or None, lines)
+Group = Tuple[Optional[int], List[Line]]
+
+_EMPLOYER = slice(5, 9)  # osms, so, sn, opvr in TAX_COMPONENTS
+
+
+def sample(dist: Optional[dict], rng: random.Random) -> float:
+    """One draw of a distribution: fixed, uniform, normal (clipped to low/high) or triangular."""
+    if not dist:
+        return 0.0
+    kind = dist.get("kind", "fixed")
+    if kind == "fixed":
+        return float(dist["value"])
+    if kind == "uniform":
+        return rng.uniform(dist["low"], dist["high"])
+    if kind == "triangular":
+        return rng.triangular(dist["low"], dist["high"], dist["mode"])
+    if kind == "normal":
+        value = rng.gauss(dist["mean"], dist["std"])
+        if dist.get("low") is not None:
+            value = max(dist["low"], value)
+        if dist.get("high") is not None:
+            value = min(dist["high"], value)
+        return value
+    raise ValueError(f"Unknown distribution: {kind}")
+
+
+def _employer_cost(config):
+    """Employer contributions (tenge) for a monthly gross, on the integer engine when exact."""
+    engine = tax_engine.get_engine(config)
+    if engine.exact:
+        def cost(gross: float) -> float:
+            return sum(engine.taxes_tiyn(round(gross * 100))[_EMPLOYER]) / 100
+        return cost
+
+    # Money constants with fractions of a tiyn — keep the Decimal path
+    from services.salary_service import calculate_taxes
+
+    def cost(gross: float) -> float:
+        res = calculate_taxes(gross, config)
+        return res["osms"] + res["so"] + res["sn"] + res["opvr"]
+    return cost
+
+
+def simulate_chunk(
+    groups: Sequence[Group],
+    rules: Sequence[dict],
+    config,
+    seed: str,
+    iterations: int,
+) -> List[Tuple[float, float]]:
+    """(total budget, headcount) for each of `iterations` draws, reproducible from `seed`."""
+    rng = random.Random(seed)
+    employer = _employer_cost(config)
+    results = []
+    for _ in range(iterations):
+        budget = 0.0
+        headcount = 0.0
+        for rule_idx, lines in groups:
+            rule = rules[rule_idx] if rule_idx is not None else {}
+            factor = 1 + sample(rule.get("raise_percent"), rng) / 100
+            head_factor = max(0.0, 1 - sample(rule.get("attrition_percent"), rng) / 100 + sample(rule.get("hiring_percent"), rng) / 100)
+            # Lines of a group share the shock: identical grosses are taxed once
+            costs: Dict[float, float] = {}
+            for count, gross in lines:
+                g = gross * factor
+                per_person = costs.get(g)
+                if per_person is None:
+                    per_person = costs[g] = g + employer(g)
+                budget += per_person * count * head_factor
+                headcount += count * head_factor
+        results.append((budget, headcount))
+    return results
+
+
+def percentile(sorted_values: Sequence[float], p: float) -> float:
+    """Linear interpolation between closest ranks (numpy's default)."""
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * p / 100
+    low = int(pos)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
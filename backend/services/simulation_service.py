@@ -0,0 +1,159 @@
+"""
+Monte Carlo budget simulation over the planning lines (live budget or a scenario).
+
+Rules give distributions of raise, attrition and hiring percentages for the lines of a
+branch / department / position (first matching rule wins, unmatched lines stay as they
+are). The iterations are split into fixed-size chunks, each with its own seed, and run
+in a process pool (services/simulation_engine.py), so a result depends only on the
+parameters and the seed, not on the number of workers.
+
+Results are cached in the analytics cache under a hash of the parameters, the tax
+config version and the scenario revision (tag planning: any change of the live budget
+drops them). Without a seed the seed is derived from the parameters, so identical
+requests give identical, cacheable bands.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from statistics import fmean, pstdev
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from database.models import Scenario
+from services.analytics_cache import TAG_PLANNING, get_cached_or_compute
+from services.scenario_service import filter_lines, load_lines, resolve_scenario_lines
+from services.simulation_engine import percentile, simulate_chunk
+from services.tax_engine import config_fingerprint
+
+logger = logging.getLogger("fot.simulation")
+
+SIMULATION_WORKERS = int(os.environ.get("SIMULATION_WORKERS", min(4, os.cpu_count() or 1)))
+CHUNK_ITERATIONS = 250
+RESULT_TTL = 3600
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Optional[ProcessPoolExecutor]:
+    global _executor
+    if SIMULATION_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # spawn: the web process runs threads (Redis listeners, thread pool), fork is unsafe
+            _executor = ProcessPoolExecutor(
+                max_workers=SIMULATION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def shutdown_simulation_pool() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _group_lines(lines, rules: List[dict]) -> List[tuple]:
+    """(rule index | None, [(count, average gross per person)]) with the first matching rule."""
+    groups: Dict[Optional[int], list] = {}
+    assigned = set()
+    for idx, rule in enumerate(rules):
+        for line in filter_lines(lines, rule.get("branch_id"), rule.get("department_id"), rule.get("position_filter")):
+            if id(line) not in assigned:
+                assigned.add(id(line))
+                groups.setdefault(idx, []).append(line)
+    groups[None] = [line for line in lines if id(line) not in assigned]
+
+    result = []
+    for rule_idx, members in groups.items():
+        prepared = []
+        for line in members:
+            count = line.count or 0
+            if not count:
+                continue
+            bonus_count = line.bonus_count if line.bonus_count is not None else count
+            total_gross = ((line.base_gross or 0) + (line.kpi_gross or 0)) * count + (line.bonus_gross or 0) * bonus_count
+            prepared.append((count, total_gross / count))
+        if prepared:
+            result.append((rule_idx, prepared))
+    return result
+
+
+def _run_chunks(groups, rules, config, seed: str, iterations: int) -> List[tuple]:
+    chunks = [
+        (f"{seed}:{idx}", min(CHUNK_ITERATIONS, iterations - start))
+        for idx, start in enumerate(range(0, iterations, CHUNK_ITERATIONS))
+    ]
+    executor = _get_executor()
+    if executor is not None:
+        try:
+            futures = [executor.submit(simulate_chunk, groups, rules, config, s, n) for s, n in chunks]
+            return [draw for f in futures for draw in f.result()]
+        except BrokenProcessPool:
+            logger.error("Simulation pool broken; running inline")
+            shutdown_simulation_pool()
+    return [draw for s, n in chunks for draw in simulate_chunk(groups, rules, config, s, n)]
+
+
+def params_hash(params: dict) -> str:
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def _summary(values: List[float], percentiles: List[float]) -> dict:
+    ordered = sorted(values)
+    return {
+        "mean": fmean(ordered),
+        "std": pstdev(ordered),
+        "min": ordered[0],
+        "max": ordered[-1],
+        "percentiles": {f"p{p:g}": percentile(ordered, p) for p in percentiles},
+    }
+
+
+def run_simulation(
+    db: Session,
+    config,
+    rules: List[dict],
+    iterations: int,
+    percentiles: List[float],
+    seed: Optional[int] = None,
+    scenario: Optional[Scenario] = None,
+) -> dict:
+    """Percentile bands of the monthly budget (gross + employer contributions) and headcount."""
+    params = {
+        "rules": rules,
+        "iterations": iterations,
+        "percentiles": sorted(percentiles),
+        "seed": seed,
+        "scenario": [scenario.id, scenario.revision or 0] if scenario else None,
+        "config": config_fingerprint(config),
+    }
+    key = params_hash(params)
+
+    def compute():
+        lines = resolve_scenario_lines(db, scenario) if scenario else load_lines(db, None)
+        groups = _group_lines(lines, rules)
+        base_seed = str(seed) if seed is not None else key
+        draws = _run_chunks(groups, rules, config, base_seed, iterations)
+        # Deterministic point estimate: every rule at zero change
+        (baseline, baseline_headcount), = simulate_chunk(groups, [{} for _ in rules], config, "baseline", 1)
+        return {
+            "params_hash": key,
+            "iterations": iterations,
+            "lines": sum(len(members) for _, members in groups),
+            "baseline": {"total_budget": baseline, "headcount": baseline_headcount},
+            "total_budget": _summary([d[0] for d in draws], params["percentiles"]),
+            "headcount": _summary([d[1] for d in draws], params["percentiles"]),
+        }
+
+    return get_cached_or_compute(f"simulation:{key}", compute, ttl=RESULT_TTL, tags=[TAG_PLANNING])
@@ -0,0 +1,259 @@
+"""
+Batch tax engine on integer tiyn (1/100 tenge) arithmetic.
+
+Mirrors calculate_taxes() in services/salary_service.py bit for bit:
+- every amount is an int number of tiyn, every rate an exact fraction p/q
+  (taken from Decimal(str(rate)), same as the Decimal implementation);
+- each quantize(0.01, ROUND_HALF_UP) becomes one integer rounding of p*amount/q.
+
+The inverse (net -> gross) is closed-form: net(gross) is piecewise linear with breakpoints
+at the OPV cap, the VOSMS cap and the IPN deduction threshold, so the segment is found
+by bisect over precomputed breakpoints and the gross is the linear inverse on it,
+then snapped to the exact tiyn with a few integer evaluations.
+
+Pure Python by design (no NumPy in requirements): the batch API replaces ~15 Decimal
+objects and up to 25 bisection steps per value with a handful of int operations.
+"""
+import hashlib
+from bisect import bisect_right
+from decimal import Decimal, ROUND_HALF_UP
+from fractions import Fraction
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TAX_COMPONENTS = ("gross", "net", "opv", "vosms", "ipn", "osms", "so", "sn", "opvr")
+
+# SalaryConfiguration columns the engine depends on
+CONFIG_FIELDS = (
+    "mrp", "mzp", "opv_rate", "opvr_rate", "vosms_rate", "vosms_employer_rate",
+    "so_rate", "sn_rate", "ipn_rate", "opv_limit_mzp", "opvr_limit_mzp",
+    "vosms_limit_mzp", "ipn_deduction_mrp",
+)
+
+
+def _ratio(value) -> Tuple[int, int]:
+    return Decimal(str(value)).as_integer_ratio()
+
+
+def _money_tiyn(amount: Decimal) -> Optional[int]:
+    scaled = amount * 100
+    if scaled != scaled.to_integral_value():
+        return None
+    return int(scaled)
+
+
+def _round_half_up(num: int, den: int) -> int:
+    """num/den rounded to int, ties away from zero (Decimal ROUND_HALF_UP). den > 0."""
+    if num >= 0:
+        return (2 * num + den) // (2 * den)
+    return -((-2 * num + den) // (2 * den))
+
+
+def to_tiyn(value) -> int:
+    """Amount in tenge -> int tiyn, same as Decimal(str(value)).quantize(Decimal('0.01'), ROUND_HALF_UP)."""
+    if isinstance(value, int):
+        return value * 100
+    return int((Decimal(str(value)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+class TaxEngine:
+    """
+    Integer tax model for one SalaryConfiguration (and deduction mode).
+    `exact` is False when a money constant is not a whole number of tiyn —
+    then callers must fall back to the Decimal implementation.
+    """
+
+    def __init__(self, config, apply_deduction: bool = True):
+        self.apply_deduction = apply_deduction
+
+        self.opv_rate = _ratio(config.opv_rate)
+        self.opvr_rate = _ratio(config.opvr_rate or 0)
+        self.vosms_rate = _ratio(config.vosms_rate)
+        self.osms_rate = _ratio(config.vosms_employer_rate)
+        self.so_rate = _ratio(config.so_rate)
+        self.sn_rate = _ratio(config.sn_rate)
+        self.ipn_rate = _ratio(config.ipn_rate)
+
+        mrp = Decimal(str(config.mrp))
+        mzp = Decimal(str(config.mzp))
+        deduction = (Decimal(str(config.ipn_deduction_mrp)) * mrp) if apply_deduction else Decimal(0)
+        money = {
+            "opv_cap": Decimal(str(config.opv_limit_mzp)) * mzp,
+            "vosms_cap": Decimal(str(config.vosms_limit_mzp)) * mzp,
+            "opvr_cap": Decimal(str(getattr(config, "opvr_limit_mzp", 50))) * mzp,
+            "so_min": mzp,
+            "so_cap": Decimal(7) * mzp,
+            "deduction": deduction,
+        }
+        tiyn = {name: _money_tiyn(amount) for name, amount in money.items()}
+        self.exact = all(v is not None for v in tiyn.values())
+        self.deduction_amount = float(deduction)
+        if not self.exact:
+            return
+
+        self.opv_cap = tiyn["opv_cap"]
+        self.vosms_cap = tiyn["vosms_cap"]
+        self.opvr_cap = tiyn["opvr_cap"]
+        self.so_min = tiyn["so_min"]
+        self.so_cap = tiyn["so_cap"]
+        self.deduction = tiyn["deduction"]
+        self._build_segments()
+
+    # --- Forward ---
+
+    def net_tiyn(self, gross: int) -> int:
+        opv = _round_half_up(min(gross, self.opv_cap) * self.opv_rate[0], self.opv_rate[1])
+        vosms = _round_half_up(min(gross, self.vosms_cap) * self.vosms_rate[0], self.vosms_rate[1])
+        ipn_base = max(gross - opv - vosms - self.deduction, 0)
+        ipn = _round_half_up(ipn_base * self.ipn_rate[0], self.ipn_rate[1])
+        return gross - opv - vosms - ipn
+
+    def taxes_tiyn(self, gross: int) -> Tuple[int, ...]:
+        """All components in tiyn, ordered as TAX_COMPONENTS."""
+        opv = _round_half_up(min(gross, self.opv_cap) * self.opv_rate[0], self.opv_rate[1])
+        vosms_base = min(gross, self.vosms_cap)
+        vosms = _round_half_up(vosms_base * self.vosms_rate[0], self.vosms_rate[1])
+        ipn_base = max(gross - opv - vosms - self.deduction, 0)
+        ipn = _round_half_up(ipn_base * self.ipn_rate[0], self.ipn_rate[1])
+        net = gross - opv - vosms - ipn
+
+        osms = _round_half_up(vosms_base * self.osms_rate[0], self.osms_rate[1])
+        so_base = max(self.so_min, min(gross - opv, self.so_cap))
+        so = _round_half_up(so_base * self.so_rate[0], self.so_rate[1])
+        sn_calc = _round_half_up((gross - opv) * self.sn_rate[0], self.sn_rate[1])
+        sn = max(0, sn_calc - so)
+        opvr = _round_half_up(min(gross, self.opvr_cap) * self.opvr_rate[0], self.opvr_rate[1])
+        return gross, net, opv, vosms, ipn, osms, so, sn, opvr
+
+    # --- Inverse ---
+
+    def _net_linear(self, gross: Fraction) -> Fraction:
+        """net(gross) without rounding — the piecewise-linear envelope of net_tiyn."""
+        opv = min(gross, self.opv_cap) * Fraction(*self.opv_rate)
+        vosms = min(gross, self.vosms_cap) * Fraction(*self.vosms_rate)
+        ipn_base = max(gross - opv - vosms - self.deduction, Fraction(0))
+        return gross - opv - vosms - ipn_base * Fraction(*self.ipn_rate)
+
+    def _build_segments(self) -> None:
+        points = sorted({0, self.opv_cap, self.vosms_cap})
+
+        # IPN threshold: gross where gross - opv - vosms reaches the deduction
+        def taxable(g: Fraction) -> Fraction:
+            return (
+                g
+                - min(g, self.opv_cap) * Fraction(*self.opv_rate)
+                - min(g, self.vosms_cap) * Fraction(*self.vosms_rate)
+            )
+
+        if self.deduction > 0:
+            bounds = [Fraction(p) for p in points] + [Fraction(points[-1] + 1)]
+            for lo, hi in zip(bounds, bounds[1:]):
+                t_lo, t_hi = taxable(lo), taxable(hi)
+                if t_hi == t_lo:
+                    continue
+                crossing = lo + (self.deduction - t_lo) * (hi - lo) / (t_hi - t_lo)
+                if crossing >= lo and (crossing <= hi or hi == bounds[-1]):
+                    points.append(crossing)
+                    break
+
+        self._points = sorted(set(Fraction(p) for p in points))
+        self._values = [self._net_linear(p) for p in self._points]
+        slopes = []
+        for i, p in enumerate(self._points):
+            nxt = self._points[i + 1] if i + 1 < len(self._points) else p + 1
+            slopes.append((self._net_linear(nxt) - self._net_linear(p)) / (nxt - p))
+        self._slopes = slopes
+        self._monotonic = all(s > 0 for s in slopes)
+
+    @property
+    def breakpoints(self) -> List[Tuple[float, float]]:
+        """(gross, net) at every segment start, in tenge — for diagnostics/UI."""
+        if not self.exact:
+            return []
+        return [(float(p) / 100, float(v) / 100) for p, v in zip(self._points, self._values)]
+
+    def solve_gross_tiyn(self, target_net: int) -> int:
+        """
+        Smallest gross (tiyn) whose net reaches target_net, exact to the tiyn:
+        net_tiyn(g) >= target_net and net_tiyn(g - 1) < target_net.
+        """
+        if target_net <= 0:
+            return target_net
+
+        if self._monotonic:
+            i = max(bisect_right(self._values, target_net) - 1, 0)
+            guess = self._points[i] + (target_net - self._values[i]) / self._slopes[i]
+            g = max(round(guess), 0)
+        else:
+            # Degenerate config (rates sum to >= 100%): integer bisection on the envelope
+            lo, hi = 0, max(target_net, 1)
+            while self.net_tiyn(hi) < target_net:
+                hi *= 2
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.net_tiyn(mid) < target_net:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            g = lo
+
+        while self.net_tiyn(g) < target_net:
+            g += 1
+        while g > 0 and self.net_tiyn(g - 1) >= target_net:
+            g -= 1
+        return g
+
+
+class _ConfigSnapshot:
+    def __init__(self, values: Tuple):
+        for name, value in zip(CONFIG_FIELDS, values):
+            setattr(self, name, value)
+
+
+@lru_cache(maxsize=32)
+def _engine_for(values: Tuple, apply_deduction: bool) -> TaxEngine:
+    return TaxEngine(_ConfigSnapshot(values), apply_deduction)
+
+
+def _config_values(config) -> Tuple:
+    return tuple(
+        getattr(config, name, 50) if name == "opvr_limit_mzp" else getattr(config, name)
+        for name in CONFIG_FIELDS
+    )
+
+
+def config_fingerprint(config) -> str:
+    """
+    Version of a configuration: hash of the values that affect taxes.
+    Snapshots carry it precomputed in `.version`.
+    """
+    version = getattr(config, "version", None)
+    if version:
+        return version
+    raw = "|".join(str(Decimal(str(v))) if v is not None else "" for v in _config_values(config))
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def get_engine(config, apply_deduction: bool = True) -> TaxEngine:
+    """
+    Engine (segments and breakpoints precomputed) shared by every config with the same values.
+    Keyed by value, not by ORM identity, so an edited configuration never hits a stale engine.
+    """
+    return _engine_for(_config_values(config), apply_deduction)
+
+
+def calculate_taxes_batch(
+    gross_values: Iterable, engine: TaxEngine
+) -> Dict[str, List[float]]:
+    """Columnar result: {component: [value per input]} in tenge, plus 'deduction'."""
+    rows = [engine.taxes_tiyn(to_tiyn(v)) for v in gross_values]
+    result = {
+        name: [row[idx] / 100 for row in rows]
+        for idx, name in enumerate(TAX_COMPONENTS)
+    }
+    result["deduction"] = [engine.deduction_amount] * len(rows)
+    return result
+
+
+def solve_gross_batch(net_values: Iterable, engine: TaxEngine) -> List[float]:
+    return [engine.solve_gross_tiyn(to_tiyn(v)) / 100 for v in net_values]
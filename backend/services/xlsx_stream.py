@@ -0,0 +1,234 @@
+"""
+Streaming XLSX writer with constant memory.
+
+openpyxl (even in write_only mode) assembles the zip only in Workbook.save(), after every
+row has been consumed, so nothing can be sent before the whole export is built.
+This writer emits the package parts itself: rows are serialized straight into the deflate
+stream of xl/worksheets/sheet1.xml and the compressed bytes are handed out as soon as
+a buffer fills up. The zip uses data descriptors, so the sink does not need to be seekable.
+
+Cells reference a fixed stylesheet of shared named styles (header / text / number) instead
+of carrying per-cell style objects. Strings are inline (no sharedStrings table to keep in memory).
+"""
+import itertools
+import re
+import zipfile
+from typing import Iterable, Iterator, List, NamedTuple, Sequence
+from xml.sax.saxutils import escape, quoteattr
+
+from fastapi.responses import StreamingResponse
+from openpyxl.utils import get_column_letter
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Indexes into cellXfs of _STYLES_XML
+STYLE_DEFAULT = 0
+STYLE_HEADER = 1
+STYLE_TEXT = 2
+STYLE_NUMBER = 3
+
+FLUSH_BYTES = 64 * 1024
+ROWS_PER_WRITE = 256
+
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+_CONTENT_TYPES_XML = (
+    _XML_DECL
+    + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    "</Types>"
+)
+
+_ROOT_RELS_XML = (
+    _XML_DECL
+    + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+    "</Relationships>"
+)
+
+_WORKBOOK_RELS_XML = (
+    _XML_DECL
+    + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    f'<Relationship Id="rId1" Type="{_NS_REL}/worksheet" Target="worksheets/sheet1.xml"/>'
+    f'<Relationship Id="rId2" Type="{_NS_REL}/styles" Target="styles.xml"/>'
+    "</Relationships>"
+)
+
+_STYLES_XML = (
+    _XML_DECL
+    + f'<styleSheet xmlns="{_NS_MAIN}">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="#,##0"/></numFmts>'
+    '<fonts count="2">'
+    '<font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><color rgb="FFFFFFFF"/><name val="Calibri"/></font>'
+    "</fonts>"
+    '<fills count="3">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FF1F2937"/><bgColor rgb="FF1F2937"/></patternFill></fill>'
+    "</fills>"
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" applyFont="1" applyFill="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" applyAlignment="1"><alignment horizontal="left"/></xf>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" applyNumberFormat="1" applyAlignment="1">'
+    '<alignment horizontal="right"/></xf>'
+    "</cellStyleXfs>"
+    '<cellXfs count="4">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="1" applyFont="1" applyFill="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="2" applyAlignment="1"><alignment horizontal="left"/></xf>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="3" applyNumberFormat="1" applyAlignment="1">'
+    '<alignment horizontal="right"/></xf>'
+    "</cellXfs>"
+    '<cellStyles count="4">'
+    '<cellStyle name="Normal" xfId="0" builtinId="0"/>'
+    '<cellStyle name="FOT Header" xfId="1"/>'
+    '<cellStyle name="FOT Text" xfId="2"/>'
+    '<cellStyle name="FOT Number" xfId="3"/>'
+    "</cellStyles>"
+    "</styleSheet>"
+)
+
+
+class XlsxColumn(NamedTuple):
+    title: str
+    width: float = 14
+    style: int = STYLE_TEXT
+
+
+class _ByteSink:
+    """Unseekable write target for ZipFile; the generator drains it between rows."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def _workbook_xml(sheet_title: str) -> str:
+    # Sheet names: max 31 chars, no []:*?/\
+    name = re.sub(r"[\[\]:*?/\\]", " ", sheet_title)[:31] or "Sheet1"
+    return (
+        _XML_DECL
+        + f'<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}"><sheets>'
+        f'<sheet name={quoteattr(name)} sheetId="1" r:id="rId1"/>'
+        "</sheets></workbook>"
+    )
+
+
+def _cell(ref: str, value, style: int) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return f'<c r="{ref}" s="{style}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}" s="{style}"><v>{value}</v></c>'
+    text = escape(_ILLEGAL_XML_CHARS.sub("", str(value)))
+    return f'<c r="{ref}" s="{style}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _sheet_head(columns: Sequence[XlsxColumn]) -> str:
+    cols = "".join(
+        f'<col min="{i}" max="{i}" width="{c.width}" customWidth="1"/>'
+        for i, c in enumerate(columns, 1)
+    )
+    return (
+        _XML_DECL
+        + f'<worksheet xmlns="{_NS_MAIN}">'
+        '<sheetViews><sheetView workbookViewId="0">'
+        '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+        "</sheetView></sheetViews>"
+        f"<cols>{cols}</cols><sheetData>"
+    )
+
+
+def iter_xlsx(
+    sheet_title: str,
+    columns: Sequence[XlsxColumn],
+    rows: Iterable[Sequence],
+    flush_bytes: int = FLUSH_BYTES,
+) -> Iterator[bytes]:
+    """
+    Yield the .xlsx file as byte chunks while `rows` is being consumed.
+    Memory is bounded by flush_bytes plus the deflate window, whatever the row count.
+    """
+    letters = [get_column_letter(i) for i in range(1, len(columns) + 1)]
+    styles = [c.style for c in columns]
+    sink = _ByteSink()
+
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES_XML)
+        zf.writestr("_rels/.rels", _ROOT_RELS_XML)
+        zf.writestr("xl/workbook.xml", _workbook_xml(sheet_title))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS_XML)
+        zf.writestr("xl/styles.xml", _STYLES_XML)
+
+        with zf.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            header = "".join(_cell(f"{letters[i]}1", c.title, STYLE_HEADER) for i, c in enumerate(columns))
+            sheet.write((_sheet_head(columns) + f'<row r="1">{header}</row>').encode())
+
+            pending: List[str] = []
+            row_num = 1
+            flushed = False
+            for row in rows:
+                row_num += 1
+                cells = "".join(
+                    _cell(f"{letters[i]}{row_num}", value, styles[i]) for i, value in enumerate(row)
+                )
+                pending.append(f'<row r="{row_num}">{cells}</row>')
+                if len(pending) >= ROWS_PER_WRITE:
+                    sheet.write("".join(pending).encode())
+                    pending.clear()
+                    # The first batch goes out right away, then every flush_bytes
+                    if not flushed or len(sink.buffer) >= flush_bytes:
+                        flushed = True
+                        yield sink.drain()
+            if pending:
+                sheet.write("".join(pending).encode())
+            sheet.write(b"</sheetData></worksheet>")
+
+    yield sink.drain()
+
+
+def write_xlsx(fileobj, sheet_title: str, columns: Sequence[XlsxColumn], rows: Iterable[Sequence]) -> None:
+    """Same file as iter_xlsx, written to a file object (worker-side exports)."""
+    for chunk in iter_xlsx(sheet_title, columns, rows):
+        fileobj.write(chunk)
+
+
+def xlsx_streaming_response(chunks: Iterator[bytes], filename: str) -> StreamingResponse:
+    """
+    The first chunk is pulled eagerly: query/setup errors surface while an HTTP error
+    can still be returned, before the streaming response has sent its headers.
+    """
+    first = next(chunks, b"")
+    return StreamingResponse(
+        itertools.chain([first], chunks),
+        media_type=XLSX_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -20,6 +20,10 @@ from database.models import (
     IntegrationSettings, Vacancy, Candidate, Comment
 )
 from security import get_password_hash
+from services.compensation_service import sync_current_compensation
+from services.salary_config_service import invalidate_config_snapshot
+from services.org_unit_service import invalidate_org_tree, rebuild_org_closure
+from services.scope_service import invalidate_user_scope
 from main import app
 
 
@@ -36,6 +40,9 @@ def setup_database():
     """Create all tables before each test, drop after."""
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    invalidate_config_snapshot()
+    invalidate_org_tree()
+    invalidate_user_scope()
     yield
     Base.metadata.drop_all(bind=engine)
 
@@ -266,6 +273,8 @@ def org_structure(db):
 
     dept = OrganizationUnit(name="IT Отдел", type="department", parent_id=branch.id)
     db.add(dept)
+    db.flush()
+    rebuild_org_closure(db)
     db.commit()
     db.refresh(head)
     db.refresh(branch)
@@ -310,6 +319,7 @@ def employee(db, org_structure, position):
         total_payment=350000,
     )
     db.add(fin)
+    sync_current_compensation(db, fin)
     db.commit()
     db.refresh(emp)
     return emp
@@ -0,0 +1,145 @@
+"""
+In-memory stand-in for the synchronous Redis client, shared by the cache, principal,
+blacklist and notification tests. Only the commands the code under test issues are
+implemented; values are stored as strings, like Redis returns them with decode_responses.
+"""
+from services.analytics_cache import _RELEASE_LOCK_LUA
+from services.notification_stream import _INCR_IF_EXISTS_LUA
+
+
+def _encode(value):
+    return value if isinstance(value, (str, bytes)) else str(value)
+
+
+class FakePipeline:
+    """Queues commands and runs them on execute(), like redis-py's pipeline."""
+
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._ops.append((method, args, kwargs))
+            return self
+
+        return queue
+
+    def execute(self):
+        ops, self._ops = self._ops, []
+        return [method(*args, **kwargs) for method, args, kwargs in ops]
+
+
+class FakePubSub:
+    """
+    Delivers messages published on the subscribed channels (including ones published
+    before subscribing). Calls client.on_pubsub_drained when nothing is left to deliver.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._channels = []
+        self._pending = []
+        self._delivered = 0
+
+    def subscribe(self, *channels):
+        for channel in channels:
+            self._channels.append(channel)
+            self._pending.append({"type": "subscribe", "channel": channel, "data": len(self._channels)})
+
+    def get_message(self, timeout=None, ignore_subscribe_messages=False):
+        published = self._client.published[self._delivered:]
+        self._delivered += len(published)
+        self._pending += [
+            {"type": "message", "channel": channel, "data": data}
+            for channel, data in published if channel in self._channels
+        ]
+        while self._pending:
+            message = self._pending.pop(0)
+            if not (ignore_subscribe_messages and message["type"] == "subscribe"):
+                return message
+        if self._client.on_pubsub_drained:
+            self._client.on_pubsub_drained()
+        return None
+
+    def ping(self):
+        self._pending.append({"type": "pong", "channel": None, "data": None})
+
+    def close(self):
+        pass
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+        self.ttls = {}
+        self.published = []
+        self.exists_calls = 0
+        self.scan_calls = 0
+        self.on_pubsub_drained = None
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def mget(self, keys):
+        return [self.store.get(k) for k in keys]
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and key in self.store:
+            return None
+        self.store[key] = _encode(value)
+        if ex is not None:
+            self.ttls[key] = ex
+        return True
+
+    def setex(self, key, ttl, value):
+        self.store[key] = _encode(value)
+        self.ttls[key] = ttl
+        return True
+
+    def ttl(self, key):
+        return self.ttls.get(key, -1)
+
+    def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            self.ttls.pop(key, None)
+            removed += self.store.pop(key, None) is not None
+        return removed
+
+    def exists(self, *keys):
+        self.exists_calls += 1
+        return sum(1 for k in keys if k in self.store)
+
+    def incr(self, key):
+        return self.incrby(key, 1)
+
+    def incrby(self, key, amount):
+        self.store[key] = str(int(self.store.get(key, 0)) + int(amount))
+        return int(self.store[key])
+
+    def scan_iter(self, match=None, count=None):
+        self.scan_calls += 1
+        prefix = (match or "*").rstrip("*")
+        return [k for k in list(self.store) if k.startswith(prefix)]
+
+    def eval(self, script, numkeys, key, arg):
+        if script == _RELEASE_LOCK_LUA:
+            if self.store.get(key) == arg:
+                return self.delete(key)
+            return 0
+        if script == _INCR_IF_EXISTS_LUA:
+            return self.incrby(key, arg) if key in self.store else None
+        raise NotImplementedError("script not supported by FakeRedis")
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+        return 1
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def pubsub(self):
+        return FakePubSub(self)
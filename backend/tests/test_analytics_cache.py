@@ -0,0 +1,137 @@
+"""
+Tests for the tag-versioned analytics cache: scope-hash keys, tag invalidation without SCAN,
+write endpoints bumping only the affected tags, single-flight and early refresh.
+"""
+import json
+import threading
+import time
+
+import pytest
+
+from services import analytics_cache
+from services.analytics_cache import (
+    TAG_FINANCIALS,
+    TAG_MARKET,
+    TAG_ORG_UNIT,
+    TAG_PLANNING,
+    build_cache_key,
+    get_cached_or_compute,
+    invalidate_analytics_cache,
+    scope_fingerprint,
+)
+from tests.fakes import FakeRedis
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(analytics_cache, "redis_client", fake)
+    yield fake
+    assert fake.scan_calls == 0, "analytics cache must not scan the keyspace"
+
+
+def _counting(value):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return value
+
+    return compute, calls
+
+
+def test_scope_fingerprint_is_order_insensitive():
+    assert scope_fingerprint(None) == "all"
+    assert scope_fingerprint([3, 1, 2]) == scope_fingerprint([2, 3, 1, 1])
+    assert scope_fingerprint([1, 2]) != scope_fingerprint([1, 3])
+
+
+def test_identical_scopes_share_entry(fake_redis):
+    compute, calls = _counting({"total": 1})
+    # Two different users, same resolved scope
+    for _ in range(2):
+        key = build_cache_key("summary", [5, 4], None)
+        assert get_cached_or_compute(key, compute, tags=(TAG_PLANNING, TAG_FINANCIALS)) == {"total": 1}
+    assert len(calls) == 1
+
+
+def test_only_affected_tags_invalidate(fake_redis):
+    compute, calls = _counting({"total": 1})
+    key = build_cache_key("summary", None, None)
+    tags = (TAG_ORG_UNIT, TAG_PLANNING, TAG_FINANCIALS)
+
+    get_cached_or_compute(key, compute, tags=tags)
+    invalidate_analytics_cache(TAG_MARKET)
+    get_cached_or_compute(key, compute, tags=tags)
+    assert len(calls) == 1
+
+    invalidate_analytics_cache(TAG_PLANNING)
+    get_cached_or_compute(key, compute, tags=tags)
+    assert len(calls) == 2
+
+
+def _stored_key(fake, name):
+    return next(k for k in fake.store if k.startswith(f"analytics:{name}:") and not k.endswith(":lock"))
+
+
+def test_stale_value_served_while_other_worker_refreshes(fake_redis):
+    compute, calls = _counting("fresh")
+    key = build_cache_key("retention", None)
+    get_cached_or_compute(key, compute, tags=(TAG_MARKET,))
+    redis_key = _stored_key(fake_redis, "retention")
+
+    entry = json.loads(fake_redis.store[redis_key])
+    entry.update(value="stale", exp=time.time() - 1)
+    fake_redis.store[redis_key] = json.dumps(entry)
+    fake_redis.store[f"{redis_key}:lock"] = "other-worker"
+
+    assert get_cached_or_compute(key, compute, tags=(TAG_MARKET,)) == "stale"
+    assert len(calls) == 1
+
+    # Lease released — the next request refreshes
+    del fake_redis.store[f"{redis_key}:lock"]
+    assert get_cached_or_compute(key, compute, tags=(TAG_MARKET,)) == "fresh"
+    assert len(calls) == 2
+    assert f"{redis_key}:lock" not in fake_redis.store
+
+
+def test_cold_miss_waits_for_lease_holder(fake_redis, monkeypatch):
+    monkeypatch.setattr(analytics_cache, "LOCK_POLL_SECONDS", 0.01)
+    compute, calls = _counting("mine")
+    key = build_cache_key("turnover", None, 30)
+    redis_key = f"analytics:{key}:market0"
+    fake_redis.store[f"{redis_key}:lock"] = "other-worker"
+
+    def holder_finishes():
+        analytics_cache._write_entry(redis_key, "theirs", 300, 0.5)
+
+    timer = threading.Timer(0.05, holder_finishes)
+    timer.start()
+    try:
+        assert get_cached_or_compute(key, compute, tags=(TAG_MARKET,)) == "theirs"
+    finally:
+        timer.cancel()
+    assert calls == []
+
+
+def test_hot_key_refreshed_before_expiry(fake_redis):
+    compute, calls = _counting("v")
+    key = build_cache_key("esg", None)
+    get_cached_or_compute(key, compute, tags=(TAG_MARKET,))
+    redis_key = _stored_key(fake_redis, "esg")
+
+    # Expires in 1s but took 1000s to compute: XFetch refreshes now
+    entry = json.loads(fake_redis.store[redis_key])
+    entry.update(exp=time.time() + 1, delta=1000)
+    fake_redis.store[redis_key] = json.dumps(entry)
+
+    get_cached_or_compute(key, compute, tags=(TAG_MARKET,))
+    assert len(calls) == 2
+
+
+def test_planning_write_bumps_planning_tag(client, auth_headers, planning_position, fake_redis):
+    resp = client.patch(f"/api/planning/{planning_position.id}", headers=auth_headers, json={"count": 5})
+    assert resp.status_code == 200
+
+    assert fake_redis.get("analytics:tagver:planning") == "1"
+    assert fake_redis.get("analytics:tagver:market") is None
@@ -136,10 +136,11 @@ def test_forwarded_headers_used_for_trusted_proxy(monkeypatch):
 def test_planning_export_hides_internal_exception_details(client, auth_headers, planning_position, monkeypatch):
     from routers import planning as planning_router
 
-    def _broken_save(*args, **kwargs):
+    def _broken_rows(*args, **kwargs):
         raise RuntimeError("super-secret-export-error")
+        yield
 
-    monkeypatch.setattr(planning_router.Workbook, "save", _broken_save)
+    monkeypatch.setattr(planning_router, "planning_export_rows", _broken_rows)
 
     resp = client.post("/api/planning/export", headers=auth_headers, json={})
     assert resp.status_code == 500
@@ -2,11 +2,19 @@
 Tests for Auth system: login, /me, change-password.
 """
 
+import pytest
 from jose import jwt
 
+from routers import users as users_router
 from security import ALGORITHM, REFRESH_SECRET_KEY
 
 
+@pytest.fixture
+def uploads_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(users_router, "_resolve_uploads_dir", lambda: tmp_path)
+    return tmp_path
+
+
 def _decode_refresh_cookie(resp):
     token = resp.cookies.get("refresh_token")
     assert token
@@ -168,16 +176,17 @@ def test_update_my_profile(client, auth_headers):
     assert data["phone"] == "+77001234567"
 
 
-def test_upload_my_avatar(client, auth_headers):
+def test_upload_my_avatar(client, auth_headers, uploads_dir):
     files = {"file": ("avatar.png", b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR", "image/png")}
     resp = client.post("/api/users/me/avatar", headers=auth_headers, files=files)
     assert resp.status_code == 200
 
     data = resp.json()
     assert data["avatar_url"].startswith("/uploads/avatars/user_")
+    assert (uploads_dir / data["avatar_url"].removeprefix("/uploads/")).is_file()
 
 
-def test_delete_my_avatar(client, auth_headers):
+def test_delete_my_avatar(client, auth_headers, uploads_dir):
     files = {"file": ("avatar.png", b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR", "image/png")}
     upload = client.post("/api/users/me/avatar", headers=auth_headers, files=files)
     assert upload.status_code == 200
@@ -186,3 +195,4 @@ def test_delete_my_avatar(client, auth_headers):
     resp = client.delete("/api/users/me/avatar", headers=auth_headers)
     assert resp.status_code == 200
     assert resp.json()["avatar_url"] is None
+    assert not list((uploads_dir / "avatars").iterdir())
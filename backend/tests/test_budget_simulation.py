@@ -0,0 +1,123 @@
+"""
+Tests for the Monte Carlo budget simulation: distributions, rule matching, percentile
+bands, determinism across workers, parameter-hash caching and input validation.
+"""
+import pytest
+
+from database.models import PlanningPosition
+from services import analytics_cache, simulation_service
+from services.salary_config_service import get_config_snapshot
+from services.salary_service import calculate_taxes
+from services.simulation_engine import percentile
+from tests.fakes import FakeRedis
+
+
+@pytest.fixture(autouse=True)
+def inline_pool(monkeypatch):
+    monkeypatch.setattr(simulation_service, "SIMULATION_WORKERS", 0)
+
+
+def _simulate(client, auth_headers, **payload):
+    resp = client.post("/api/scenarios/simulation", headers=auth_headers, json=payload)
+    assert resp.status_code == 200, resp.text
+    return resp.json()
+
+
+def _cost(db, gross, count):
+    res = calculate_taxes(gross, get_config_snapshot(db))
+    return (gross + res["osms"] + res["so"] + res["sn"] + res["opvr"]) * count
+
+
+def test_fixed_distributions_give_a_point_band(client, auth_headers, db, org_structure, planning_position, salary_config):
+    db.add(PlanningPosition(
+        position_title="Бухгалтер", branch_id=org_structure["branch"].id, schedule="5/2",
+        count=4, base_net=0, base_gross=300000, kpi_net=0, kpi_gross=0, bonus_net=0, bonus_gross=0,
+    ))
+    db.commit()
+    line = planning_position
+    line_gross = line.base_gross + line.kpi_gross + line.bonus_gross * (line.bonus_count if line.bonus_count is not None else line.count) / line.count
+
+    result = _simulate(client, auth_headers, iterations=100, rules=[{
+        "position_filter": "бухгалтер",
+        "raise_percent": {"kind": "fixed", "value": 10},
+        "attrition_percent": {"kind": "fixed", "value": 25},
+    }])
+
+    baseline = _cost(db, line_gross, line.count) + _cost(db, 300000, 4)
+    expected = _cost(db, line_gross, line.count) + _cost(db, 330000, 4) * 0.75
+    assert result["baseline"]["total_budget"] == pytest.approx(baseline)
+    assert result["baseline"]["headcount"] == line.count + 4
+    band = result["total_budget"]
+    assert band["std"] == pytest.approx(0, abs=1e-6)
+    assert band["percentiles"]["p50"] == pytest.approx(expected)
+    assert result["headcount"]["percentiles"]["p5"] == pytest.approx(line.count + 3)
+
+
+def test_bands_are_ordered_and_reproducible(client, auth_headers, planning_position, salary_config):
+    payload = {
+        "iterations": 600,
+        "seed": 7,
+        "percentiles": [5, 50, 95],
+        "rules": [{
+            "raise_percent": {"kind": "normal", "mean": 8, "std": 3, "low": 0},
+            "attrition_percent": {"kind": "uniform", "low": 0, "high": 20},
+            "hiring_percent": {"kind": "triangular", "low": 0, "mode": 5, "high": 15},
+        }],
+    }
+    first = _simulate(client, auth_headers, **payload)
+    bands = first["total_budget"]["percentiles"]
+    assert first["total_budget"]["min"] <= bands["p5"] < bands["p50"] < bands["p95"] <= first["total_budget"]["max"]
+    assert _simulate(client, auth_headers, **payload) == first
+    assert _simulate(client, auth_headers, **{**payload, "seed": 8})["total_budget"] != first["total_budget"]
+
+
+def test_process_pool_matches_inline_run(db, planning_position, salary_config, monkeypatch):
+    rules = [{"raise_percent": {"kind": "uniform", "low": 0, "high": 10}}]
+    config = get_config_snapshot(db)
+    inline = simulation_service.run_simulation(db, config, rules, 300, [50], seed=1)
+
+    monkeypatch.setattr(simulation_service, "SIMULATION_WORKERS", 2)
+    try:
+        pooled = simulation_service.run_simulation(db, config, rules, 300, [50], seed=1)
+    finally:
+        simulation_service.shutdown_simulation_pool()
+    assert pooled == inline
+
+
+def test_results_are_cached_per_parameter_hash(client, auth_headers, planning_position, salary_config, monkeypatch):
+    monkeypatch.setattr(analytics_cache, "redis_client", FakeRedis())
+    calls = []
+    original = simulation_service._run_chunks
+
+    def counting(*args):
+        calls.append(args)
+        return original(*args)
+
+    monkeypatch.setattr(simulation_service, "_run_chunks", counting)
+    payload = {"iterations": 100, "rules": [{"raise_percent": {"kind": "uniform", "low": 0, "high": 5}}]}
+    first = _simulate(client, auth_headers, **payload)
+    assert _simulate(client, auth_headers, **payload) == first
+    assert len(calls) == 1
+    _simulate(client, auth_headers, **{**payload, "iterations": 200})
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("rule", [
+    {"raise_percent": {"kind": "normal", "mean": 5}},
+    {"raise_percent": {"kind": "uniform", "low": 10, "high": 1}},
+    {"raise_percent": {"kind": "triangular", "low": 0, "mode": 20, "high": 10}},
+])
+def test_invalid_distributions_are_rejected(client, auth_headers, rule):
+    resp = client.post("/api/scenarios/simulation", headers=auth_headers, json={"rules": [rule]})
+    assert resp.status_code == 422
+
+
+def test_simulation_requires_scenarios_permission(client, viewer_headers):
+    resp = client.post("/api/scenarios/simulation", headers=viewer_headers, json={})
+    assert resp.status_code == 403
+
+
+def test_percentile_interpolates_between_ranks():
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2, 3, 4], 0) == 1
+    assert percentile([1, 2, 3, 4], 100) == 4
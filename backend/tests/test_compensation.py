@@ -0,0 +1,185 @@
+"""
+Tests for the materialized current-compensation projection and the as-of history:
+write paths keep them in sync, rebuild/backfill, consistency checker, time-travel reads.
+"""
+from datetime import datetime, timezone
+
+from dateutil.relativedelta import relativedelta
+
+from database.models import CompensationHistory, EmployeeCurrentCompensation, FinancialRecord
+from services.compensation_service import (
+    find_compensation_drift,
+    rebuild_compensation_history,
+    refresh_current_compensation,
+)
+
+
+def test_create_employee_populates_projection(client, auth_headers, org_structure, db):
+    resp = client.post("/api/employees", headers=auth_headers, json={
+        "full_name": "Петров Пётр",
+        "position_title": "Аналитик",
+        "department_id": org_structure["department"].id,
+        "base_net": 250000,
+        "base_gross": 320000,
+        "kpi_net": 10000,
+        "kpi_gross": 13000,
+    })
+    assert resp.status_code == 200
+    emp_id = resp.json()["id"]
+
+    row = db.get(EmployeeCurrentCompensation, emp_id)
+    assert row is not None
+    assert row.total_net == 260000
+    assert row.total_gross == 333000
+    assert find_compensation_drift(db) == []
+
+
+def test_plan_sync_updates_projection(client, auth_headers, employee, planning_position, db):
+    resp = client.patch(f"/api/planning/{planning_position.id}", headers=auth_headers, json={
+        "base_net": 320000
+    })
+    assert resp.status_code == 200
+
+    db.expire_all()
+    row = db.get(EmployeeCurrentCompensation, employee.id)
+    assert row.base_net == 320000
+    assert row.total_net == 320000 + 50000
+    assert find_compensation_drift(db) == []
+
+
+def test_drift_detected_and_rebuild_repairs(db, employee):
+    fin = db.query(FinancialRecord).filter_by(employee_id=employee.id).first()
+    fin.total_net = 999
+    db.commit()
+
+    problems = find_compensation_drift(db)
+    assert len(problems) == 1
+    assert problems[0]["issue"] == "mismatch"
+    assert "total_net" in problems[0]["fields"]
+
+    assert refresh_current_compensation(db) == 1
+    db.commit()
+    assert find_compensation_drift(db) == []
+
+
+def test_analytics_summary_reads_projection(client, auth_headers, employee):
+    resp = client.get("/api/analytics/summary", headers=auth_headers)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["fact"]["count"] == 1
+    assert data["fact"]["total_net"] == 350000
+
+
+def _history(db, emp_id):
+    return (
+        db.query(CompensationHistory)
+        .filter_by(employee_id=emp_id)
+        .order_by(CompensationHistory.valid_from)
+        .all()
+    )
+
+
+def test_raise_closes_interval_and_as_of_reads_history(client, auth_headers, org_structure, db):
+    resp = client.post("/api/employees", headers=auth_headers, json={
+        "full_name": "Сидоров Сидор",
+        "position_title": "Аналитик",
+        "department_id": org_structure["department"].id,
+        "base_net": 200000,
+        "base_gross": 260000,
+        "last_raise_date": "2020-01-10",
+    })
+    assert resp.status_code == 200
+    emp_id = resp.json()["id"]
+
+    resp = client.put(f"/api/employees/{emp_id}", headers=auth_headers, json={
+        "full_name": "Сидоров Сидор",
+        "branch_id": org_structure["branch"].id,
+        "department_id": org_structure["department"].id,
+        "position_title": "Аналитик",
+        "base_net": 300000,
+        "base_gross": 390000,
+        "last_raise_date": "2021-06-01",
+    })
+    assert resp.status_code == 200
+
+    db.expire_all()
+    intervals = _history(db, emp_id)
+    assert [(h.total_net, h.valid_to is None) for h in intervals] == [(200000, False), (300000, True)]
+    assert find_compensation_drift(db) == []
+
+    def fact(date):
+        r = client.get("/api/analytics/summary", headers=auth_headers, params={"date": date})
+        assert r.status_code == 200
+        return r.json()["fact"]
+
+    assert fact("2019-12-31")["count"] == 0
+    assert fact("2020-12-31")["total_net"] == 200000
+    assert fact("2021-07-01")["total_net"] == 300000
+
+
+def test_as_of_rejects_invalid_date(client, auth_headers, employee):
+    resp = client.get("/api/analytics/summary", headers=auth_headers, params={"date": "not-a-date"})
+    assert resp.status_code == 400
+
+
+def test_budget_trend_single_pass_over_history(client, auth_headers, employee, db):
+    fin = db.query(FinancialRecord).filter_by(employee_id=employee.id).first()
+    db.query(CompensationHistory).delete()
+    switch = (datetime.now(timezone.utc) - relativedelta(months=3)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    db.add_all([
+        CompensationHistory(
+            employee_id=employee.id, financial_record_id=fin.id, total_net=100,
+            valid_from=datetime(2000, 1, 1, tzinfo=timezone.utc), valid_to=switch,
+        ),
+        CompensationHistory(
+            employee_id=employee.id, financial_record_id=fin.id, total_net=200,
+            valid_from=switch, valid_to=None,
+        ),
+    ])
+    db.commit()
+
+    resp = client.get("/api/analytics/budget-trend", headers=auth_headers)
+    assert resp.status_code == 200
+    actual = [p["value"] for p in resp.json() if p["type"] == "actual"]
+    assert actual == [100, 100, 100, 200, 200, 200, 200]
+
+
+def test_rebuild_history_from_financial_records(db, employee):
+    db.query(CompensationHistory).delete()
+    db.add(FinancialRecord(
+        employee_id=employee.id, total_net=400000,
+        created_at="2999-01-01T00:00:00+00:00",
+    ))
+    db.commit()
+
+    assert rebuild_compensation_history(db) == 2
+    db.commit()
+    first, second = _history(db, employee.id)
+    assert first.total_net == 350000 and first.valid_to == second.valid_from
+    assert second.total_net == 400000 and second.valid_to is None
+
+
+def test_rebuild_dates_intervals_like_live_sync(client, auth_headers, db, org_structure, position):
+    payload = {
+        "full_name": "Петров Пётр",
+        "branch_id": org_structure["branch"].id,
+        "department_id": org_structure["department"].id,
+        "position_title": "Аналитик",
+        "base_net": 200000,
+        "base_gross": 260000,
+        "last_raise_date": "2020-01-10",
+    }
+    emp_id = client.post("/api/employees/", headers=auth_headers, json=payload).json()["id"]
+    client.put(f"/api/employees/{emp_id}", headers=auth_headers, json={
+        **payload, "base_net": 300000, "base_gross": 390000, "last_raise_date": "2021-06-01",
+    })
+    db.expire_all()
+    live = _history(db, emp_id)[-1]
+    live = (live.financial_record_id, live.valid_from, live.valid_to, live.total_net)
+
+    # The raise was applied in place: a rebuild only knows the record's latest values,
+    # which it dates from the raise (not from record creation), like the live sync
+    rebuild_compensation_history(db, [emp_id])
+    db.commit()
+    assert [(h.financial_record_id, h.valid_from, h.valid_to, h.total_net) for h in _history(db, emp_id)] == [live]
+    assert live[1].date().isoformat() == "2021-06-01"
@@ -36,3 +36,120 @@ def test_export_employees_excel(client, auth_headers, employee):
     assert resp.status_code == 200
     assert "spreadsheet" in resp.headers.get("content-type", "")
     assert len(resp.content) > 0
+
+
+def _seed_listing(db, org_structure, position, count=7):
+    from database.models import Employee, FinancialRecord, OrganizationUnit, User
+    from services.compensation_service import sync_current_compensation
+
+    other_branch = OrganizationUnit(name="Филиал Астана", type="branch", parent_id=org_structure["head"].id)
+    db.add(other_branch)
+    db.flush()
+    names = ["Борисов", "Алексеев", "Григорьев", "Алексеев", "Дмитриев", "Власов", "Егоров"]
+    for i in range(count):
+        emp = Employee(
+            full_name=names[i % len(names)],
+            position_id=position.id,
+            org_unit_id=org_structure["department"].id if i % 2 == 0 else other_branch.id,
+            status="Dismissed" if i == 6 else "Активен",
+        )
+        db.add(emp)
+        db.flush()
+        fin = FinancialRecord(employee_id=emp.id, base_net=100000 * (i + 1), base_gross=0,
+                              kpi_net=0, kpi_gross=0, bonus_net=0, bonus_gross=0,
+                              total_net=100000 * (i + 1), total_gross=0)
+        db.add(fin)
+        sync_current_compensation(db, fin)
+        db.add(User(email=f"user{i}@test.com", hashed_password="x", employee_id=emp.id))
+    db.commit()
+    return other_branch
+
+
+def _all_pages(client, headers, **params):
+    items, cursor, pages = [], None, 0
+    while True:
+        query = dict(params, limit=2)
+        if cursor:
+            query["cursor"] = cursor
+        resp = client.get("/api/employees/page", headers=headers, params=query)
+        assert resp.status_code == 200
+        data = resp.json()
+        assert len(data["items"]) <= 2
+        items += data["items"]
+        pages += 1
+        cursor = data["next_cursor"]
+        if not cursor:
+            return items, pages
+
+
+def test_employees_page_walks_keyset_in_order(client, auth_headers, db, org_structure, position):
+    _seed_listing(db, org_structure, position)
+    items, pages = _all_pages(client, auth_headers)
+    assert pages == 4
+    keys = [(e["full_name"], e["id"]) for e in items]
+    assert keys == sorted(keys) and len(set(keys)) == 7
+    assert all(e["linked_user_email"] for e in items)
+
+    items, _ = _all_pages(client, auth_headers, sort="total_net", order="desc")
+    totals = [e["total"]["net"] for e in items]
+    assert totals == sorted(totals, reverse=True)
+
+
+def test_employees_page_filters(client, auth_headers, db, org_structure, position):
+    other_branch = _seed_listing(db, org_structure, position)
+
+    items, _ = _all_pages(client, auth_headers, branch_id=org_structure["branch"].id)
+    assert {e["branch"] for e in items} == {"Филиал Алматы"} and len(items) == 4
+
+    items, _ = _all_pages(client, auth_headers, branch_id=other_branch.id, status="Активен")
+    assert len(items) == 3
+
+    items, _ = _all_pages(client, auth_headers, min_salary=200000, max_salary=400000)
+    assert sorted(e["total"]["net"] for e in items) == [200000, 300000, 400000]
+
+
+def test_employees_page_walks_null_keys(client, auth_headers, db, org_structure, position):
+    from database.models import Employee
+
+    _seed_listing(db, org_structure, position)
+    # No name, no hire date and no financial record: NULL sort keys on every sort
+    for _ in range(3):
+        db.add(Employee(full_name=None, position_id=position.id, org_unit_id=org_structure["department"].id))
+    db.commit()
+
+    for sort in ("full_name", "total_net", "hire_date"):
+        for order in ("asc", "desc"):
+            items, _ = _all_pages(client, auth_headers, sort=sort, order=order)
+            assert len({e["id"] for e in items}) == len(items) == 10, (sort, order)
+    items, _ = _all_pages(client, auth_headers, sort="total_net", order="asc")
+    assert [e["total"]["net"] for e in items][-3:] == [0, 0, 0]
+    items, _ = _all_pages(client, auth_headers, max_salary=100000)
+    assert len(items) == 4
+
+
+def test_employees_page_rejects_foreign_cursor(client, auth_headers, db, org_structure, position):
+    _seed_listing(db, org_structure, position)
+    cursor = client.get("/api/employees/page", headers=auth_headers, params={"limit": 2}).json()["next_cursor"]
+    resp = client.get("/api/employees/page", headers=auth_headers, params={"cursor": cursor, "sort": "total_net"})
+    assert resp.status_code == 400
+    assert client.get("/api/employees/page", headers=auth_headers, params={"cursor": "???"}).status_code == 400
+
+
+def test_employee_listing_query_count_is_constant(client, auth_headers, db, org_structure, position):
+    from sqlalchemy import event
+    from services.employee_service import EmployeeService
+
+    _seed_listing(db, org_structure, position)
+    statements = []
+
+    def count(*args):
+        statements.append(1)
+
+    event.listen(db.get_bind(), "before_cursor_execute", count)
+    try:
+        result = EmployeeService.get_employees(db, None, None)
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", count)
+    assert len(result) == 7
+    # employees+compensation, org units, linked users
+    assert len(statements) == 3
@@ -0,0 +1,96 @@
+"""
+Tests for asynchronous export jobs: worker-built artifacts, download endpoint,
+reuse of unchanged exports keyed by scope/filter/data version, TTL cleanup.
+"""
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+
+from database.models import BackgroundJob
+from services import analytics_cache, export_service
+from services.analytics_cache import TAG_FINANCIALS, TAG_PLANNING, invalidate_analytics_cache
+from services.job_service import run_pending_jobs
+from tests.fakes import FakeRedis
+
+
+@pytest.fixture(autouse=True)
+def exports_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("EXPORTS_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(analytics_cache, "redis_client", fake)
+    return fake
+
+
+def test_export_job_builds_downloadable_artifact(client, auth_headers, db, employee, exports_dir):
+    resp = client.post("/api/employees/export/jobs", headers=auth_headers, json={})
+    assert resp.status_code == 200
+    job = resp.json()
+    assert job["status"] == "pending" and job["download_url"] is None
+    assert client.get(f"/api/exports/{job['id']}/download", headers=auth_headers).status_code == 409
+
+    assert run_pending_jobs(db) == 1
+    status = client.get(f"/api/exports/{job['id']}", headers=auth_headers).json()
+    assert status["status"] == "completed" and status["result"]["rows"] == 1
+    assert "file" not in status["result"]
+    db.expire_all()
+    file_name = db.get(BackgroundJob, job["id"]).result["file"]
+    assert (exports_dir / file_name).is_file()
+    # Not reachable through the unauthenticated static mount
+    assert client.get(f"/uploads/exports/{file_name}").status_code == 404
+
+    resp = client.get(status["download_url"], headers=auth_headers)
+    assert resp.status_code == 200
+    assert "Employees_" in resp.headers["content-disposition"]
+    ws = load_workbook(BytesIO(resp.content)).active
+    assert ws["A2"].value == "Иванов Иван"
+
+
+def test_unchanged_export_reuses_artifact(client, auth_headers, db, planning_position, fake_redis):
+    first = client.post("/api/planning/export/jobs", headers=auth_headers, json={}).json()
+    # Still queued: an identical request joins it
+    assert client.post("/api/planning/export/jobs", headers=auth_headers, json={}).json()["id"] == first["id"]
+    run_pending_jobs(db)
+    assert client.post("/api/planning/export/jobs", headers=auth_headers, json={}).json()["id"] == first["id"]
+
+    # Different filter -> different artifact
+    filtered = client.post("/api/planning/export/jobs", headers=auth_headers, json={"ids": [planning_position.id]})
+    assert filtered.json()["id"] != first["id"]
+
+    # Unrelated data changed -> still reused; planning changed -> rebuilt
+    invalidate_analytics_cache(TAG_FINANCIALS)
+    assert client.post("/api/planning/export/jobs", headers=auth_headers, json={}).json()["id"] == first["id"]
+    invalidate_analytics_cache(TAG_PLANNING)
+    assert client.post("/api/planning/export/jobs", headers=auth_headers, json={}).json()["id"] != first["id"]
+
+
+def test_no_reuse_without_shared_data_version(client, auth_headers, planning_position):
+    first = client.post("/api/planning/export/jobs", headers=auth_headers, json={}).json()
+    second = client.post("/api/planning/export/jobs", headers=auth_headers, json={}).json()
+    assert first["id"] != second["id"]
+
+
+def test_export_job_requires_permission(client, auth_headers, viewer_headers, db, employee):
+    assert client.post("/api/employees/export/jobs", headers=viewer_headers, json={}).status_code == 403
+    job_id = client.post("/api/employees/export/jobs", headers=auth_headers, json={}).json()["id"]
+    assert client.get(f"/api/exports/{job_id}", headers=viewer_headers).status_code == 403
+
+
+def test_expired_artifacts_are_cleaned_up(client, auth_headers, db, employee, exports_dir):
+    job_id = client.post("/api/employees/export/jobs", headers=auth_headers, json={}).json()["id"]
+    run_pending_jobs(db)
+    job = db.get(BackgroundJob, job_id)
+    path = exports_dir / job.result["file"]
+    job.finished_at = "2000-01-01T00:00:00+00:00"
+    db.commit()
+
+    assert export_service.cleanup_expired_exports(db) == 1
+    assert not path.exists()
+    db.refresh(job)
+    assert job.status == "expired"
+    assert client.get(f"/api/exports/{job_id}/download", headers=auth_headers).status_code == 410
@@ -0,0 +1,148 @@
+"""
+Tests for live notifications: publish-after-commit, SSE stream with Last-Event-ID
+replay, and the Redis-backed unread counter.
+"""
+import asyncio
+import json
+
+import pytest
+
+from database.models import Notification
+from services import notification_stream
+from services.notification_service import NotificationBatch
+from services.notification_stream import hub, notification_stream as sse_stream, replay_since
+from tests.fakes import FakeRedis
+
+
+async def _never_disconnected():
+    return False
+
+
+def test_events_are_delivered_only_after_commit(db, admin_user):
+    async def scenario():
+        sub = hub.subscribe(admin_user.id)
+        try:
+            NotificationBatch().add("discarded", user_ids=[admin_user.id]).dispatch(db)
+            db.rollback()
+            NotificationBatch().add("kept", user_ids=[admin_user.id]).dispatch(db)
+            assert sub.queue.empty()
+            db.commit()
+            event = sub.queue.get_nowait()
+            assert sub.queue.empty()
+            return event
+        finally:
+            hub.unsubscribe(sub)
+
+    event = asyncio.run(scenario())
+    assert event["message"] == "kept"
+    assert event["id"] == db.query(Notification.id).scalar()
+
+
+def test_stream_replays_then_continues_without_duplicates(db, admin_user):
+    for i in range(3):
+        NotificationBatch().add(f"n{i}", user_ids=[admin_user.id]).dispatch(db)
+    db.commit()
+    ids = [i for (i,) in db.query(Notification.id).order_by(Notification.id)]
+
+    async def scenario():
+        sub = hub.subscribe(admin_user.id)
+        replay = replay_since(db, admin_user.id, ids[0])
+        # Delivered live as well as in the replay: sent once
+        sub.offer({"id": ids[2], "user_id": admin_user.id, "message": "n2"})
+        sub.offer({"id": ids[2] + 1, "user_id": admin_user.id, "message": "live"})
+        sub.close()
+        return [chunk async for chunk in sse_stream(sub, replay, ids[0], _never_disconnected)]
+
+    chunks = asyncio.run(scenario())
+    events = [c for c in chunks if c.startswith("id:")]
+    assert [c.split("\n")[0] for c in events] == [f"id: {ids[1]}", f"id: {ids[2]}", f"id: {ids[2] + 1}"]
+    assert json.loads(events[-1].split("data: ")[1])["message"] == "live"
+    assert admin_user.id not in hub._subscribers
+
+
+def test_slow_subscriber_is_closed_for_reconnect(monkeypatch):
+    monkeypatch.setattr(notification_stream, "SUBSCRIBER_QUEUE_SIZE", 2)
+
+    async def scenario():
+        sub = hub.subscribe(1)
+        for i in range(5):
+            sub.offer({"id": i + 1, "user_id": 1})
+        return sub
+
+    sub = asyncio.run(scenario())
+    assert sub.closed
+
+
+def test_unread_counter_is_cached_and_adjusted(client, auth_headers, db, admin_user, monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(notification_stream.redis_module, "redis_client", fake)
+    NotificationBatch().add("a", user_ids=[admin_user.id]).dispatch(db)
+    NotificationBatch().add("b", user_ids=[admin_user.id]).dispatch(db)
+    db.commit()
+
+    def unread():
+        resp = client.get("/api/auth/notifications/unread-count", headers=auth_headers)
+        assert resp.status_code == 200
+        return resp.json()["unread"]
+
+    assert unread() == 2
+    key = f"notifications:unread:{admin_user.id}"
+    assert fake.store[key] == "2"
+
+    # New row: counter incremented on commit and the event published
+    NotificationBatch().add("c", user_ids=[admin_user.id]).dispatch(db)
+    db.commit()
+    assert fake.store[key] == "3"
+    assert json.loads(fake.published[-1][1])["message"] == "c"
+    assert unread() == 3
+
+    note_id = db.query(Notification.id).order_by(Notification.id).limit(1).scalar()
+    assert client.patch(f"/api/auth/notifications/{note_id}/read", headers=auth_headers).status_code == 200
+    assert unread() == 2
+
+    assert client.post("/api/auth/notifications/read-all", headers=auth_headers).status_code == 200
+    assert key not in fake.store
+    assert unread() == 0
+
+
+@pytest.mark.parametrize("path", ["/api/auth/notifications/stream", "/api/auth/notifications/unread-count"])
+def test_requires_authentication(client, path):
+    assert client.get(path).status_code == 401
+
+
+def test_stream_does_not_hold_a_session(client, auth_headers, db, monkeypatch):
+    from database.database import get_db
+    from main import app
+    from routers import auth as auth_router
+
+    events = []
+
+    def tracking_get_db():
+        events.append("open")
+        try:
+            yield db
+        finally:
+            events.append("close")
+
+    async def one_chunk(sub, replay, last_event_id, is_disconnected):
+        events.append("body")
+        hub.unsubscribe(sub)
+        yield "retry: 3000\n\n"
+
+    app.dependency_overrides[get_db] = tracking_get_db
+    monkeypatch.setattr(auth_router, "notification_stream", one_chunk)
+    resp = client.get("/api/auth/notifications/stream", headers={**auth_headers, "Last-Event-ID": "1"})
+    assert resp.status_code == 200
+    assert events.index("close") < events.index("body")
+
+
+def test_subscription_released_when_setup_fails(client, auth_headers, admin_user, monkeypatch):
+    from routers import auth as auth_router
+
+    def failing_replay(db, user_id, last_event_id):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(auth_router, "replay_since", failing_replay)
+    with pytest.raises(RuntimeError):
+        client.get("/api/auth/notifications/stream", headers={**auth_headers, "Last-Event-ID": "5"})
+    assert admin_user.id not in hub._subscribers
@@ -0,0 +1,78 @@
+"""
+Tests for org_unit_closure: maintained by the structure endpoints (create / move / delete),
+rebuild and drift check, and the subtree rollups that read it.
+"""
+from database.models import OrgUnitClosure
+from services.org_unit_service import find_closure_drift, rebuild_org_closure
+
+
+def _rows(db):
+    return {(r.ancestor_id, r.descendant_id): r.depth for r in db.query(OrgUnitClosure)}
+
+
+def test_fixture_closure_has_all_ancestor_pairs(db, org_structure):
+    head, branch, dept = (org_structure[k].id for k in ("head", "branch", "department"))
+    assert _rows(db) == {
+        (head, head): 0, (branch, branch): 0, (dept, dept): 0,
+        (head, branch): 1, (branch, dept): 1, (head, dept): 2,
+    }
+
+
+def test_endpoints_keep_closure_in_step(client, auth_headers, db, org_structure):
+    head, branch = org_structure["head"].id, org_structure["branch"].id
+
+    resp = client.post("/api/structure/branch", headers=auth_headers,
+                       json={"name": "Филиал Астана", "type": "branch", "parent_id": head})
+    other = resp.json()["id"]
+    resp = client.post("/api/structure/department", headers=auth_headers,
+                       json={"name": "QA", "type": "department", "parent_id": branch})
+    qa = resp.json()["id"]
+    resp = client.post("/api/structure/department", headers=auth_headers,
+                       json={"name": "QA Auto", "type": "department", "parent_id": qa})
+    qa_auto = resp.json()["id"]
+    assert _rows(db)[(head, qa_auto)] == 3
+    assert find_closure_drift(db) == []
+
+    # Move a subtree to another branch
+    assert client.patch(f"/api/structure/{qa}", headers=auth_headers, json={"parent_id": other}).status_code == 200
+    rows = _rows(db)
+    assert (branch, qa) not in rows and (branch, qa_auto) not in rows
+    assert rows[(other, qa_auto)] == 2 and rows[(head, qa_auto)] == 3
+    assert find_closure_drift(db) == []
+
+    assert client.delete(f"/api/structure/{qa_auto}", headers=auth_headers).status_code == 200
+    assert all(qa_auto not in pair for pair in _rows(db))
+    assert find_closure_drift(db) == []
+
+
+def test_drift_is_detected_and_rebuilt(db, org_structure):
+    db.query(OrgUnitClosure).filter(OrgUnitClosure.depth == 2).delete()
+    db.commit()
+    head, dept = org_structure["head"].id, org_structure["department"].id
+    assert find_closure_drift(db) == [(head, dept, 2, None)]
+
+    assert rebuild_org_closure(db) == 6
+    db.commit()
+    assert find_closure_drift(db) == []
+
+
+def test_rollups_sum_whole_subtree(client, auth_headers, org_structure, employee, planning_position):
+    resp = client.get("/api/analytics/branch-comparison", headers=auth_headers)
+    assert resp.status_code == 200
+    by_id = {row["id"]: row for row in resp.json()["data"]}
+    for key in ("head", "branch", "department"):
+        unit = by_id[org_structure[key].id]
+        assert unit["fact"] == 350000
+        assert unit["plan"] == (300000 + 50000) * 3
+
+    resp = client.get("/api/structure/flat", headers=auth_headers)
+    flat = {u["id"]: u for u in resp.json()}
+    head = flat[org_structure["head"].id]
+    assert head["employee_count"] == 1 and head["direct_count"] == 0
+    assert head["total_salary"] == 350000
+
+    resp = client.get("/api/analytics/turnover", headers=auth_headers)
+    assert resp.status_code == 200
+    gaps = {g["id"]: g for g in resp.json()["staffing_gaps"]}
+    assert gaps[org_structure["head"].id]["plan"] == 3
+    assert gaps[org_structure["head"].id]["fact"] == 1
@@ -0,0 +1,104 @@
+"""
+Tests for the shared OrgTree index: Euler-interval descendant checks, branch resolution,
+cycle/orphan tolerance and versioned invalidation by the structure endpoints.
+"""
+import random
+
+from database.models import OrganizationUnit
+from services import analytics_cache, org_unit_service
+from services.org_unit_service import OrgNode, OrgTree, get_all_descendant_ids, get_org_tree
+from tests.fakes import FakeRedis
+
+
+def _random_tree(n, seed=7):
+    rng = random.Random(seed)
+    nodes = [OrgNode(1, "HQ", "head_office", None, None)]
+    for uid in range(2, n + 1):
+        kind = rng.choice(["branch", "department", "department"])
+        nodes.append(OrgNode(uid, f"U{uid}", kind, rng.randint(1, uid - 1), None))
+    return nodes
+
+
+def test_euler_intervals_match_children_map_walk():
+    tree = OrgTree(_random_tree(300))
+    children_map = tree.children_map
+    for unit_id in tree.nodes:
+        expected = get_all_descendant_ids(unit_id, children_map)
+        assert tree.descendant_ids(unit_id) == expected
+        assert tree.subtree_ids(unit_id)[0] == unit_id
+        for other in (1, 17, 150, 299):
+            assert tree.is_descendant(other, unit_id) == (other == unit_id or other in expected)
+
+
+def test_branch_resolution_and_ancestors():
+    tree = OrgTree([
+        OrgNode(1, "HQ", "head_office", None, None),
+        OrgNode(2, "Алматы", "branch", 1, None),
+        OrgNode(3, "IT", "department", 2, None),
+        OrgNode(4, "Dev", "department", 3, None),
+        OrgNode(5, "Финансы", "department", 1, None),
+        OrgNode(6, "Без филиала", "department", None, None),
+    ])
+    assert tree.branch_of(4).name == "Алматы"
+    assert tree.branch_of(5).name == "HQ"
+    assert tree.branch_of(2).id == 2
+    assert tree.branch_of(6) is None and tree.branch_of(999) is None
+    assert tree.ancestor_ids(4) == [3, 2, 1]
+    assert tree.subtree_ids(999) == [999]
+
+
+def test_cycles_and_dangling_parents_do_not_hang():
+    tree = OrgTree([
+        OrgNode(1, "A", "department", 2, None),
+        OrgNode(2, "B", "department", 1, None),
+        OrgNode(3, "C", "department", 42, None),
+    ])
+    assert sorted(tree.order) == [1, 2, 3]
+    assert tree.is_descendant(2, 1) and not tree.is_descendant(1, 2)
+    assert tree.ancestor_ids(2) == [1]
+    assert tree.subtree_ids(3) == [3]
+
+
+def test_tree_is_cached_until_structure_endpoint_changes_it(client, auth_headers, db, org_structure):
+    tree = get_org_tree(db)
+    assert get_org_tree(db) is tree
+
+    branch = org_structure["branch"]
+    resp = client.post("/api/structure/department", headers=auth_headers,
+                       json={"name": "QA", "type": "department", "parent_id": branch.id})
+    assert resp.status_code == 200
+    new_id = resp.json()["id"]
+
+    fresh = get_org_tree(db)
+    assert fresh is not tree
+    assert fresh.is_descendant(new_id, branch.id)
+    assert fresh.branch_of(new_id).name == branch.name
+
+    resp = client.patch(f"/api/structure/{new_id}", headers=auth_headers, json={"name": "QA & Test"})
+    assert resp.status_code == 200
+    assert get_org_tree(db).name(new_id) == "QA & Test"
+
+
+def test_move_under_own_descendant_is_rejected(client, auth_headers, org_structure):
+    resp = client.patch(
+        f"/api/structure/{org_structure['branch'].id}",
+        headers=auth_headers,
+        json={"parent_id": org_structure["department"].id},
+    )
+    assert resp.status_code == 400
+
+
+def test_version_is_shared_through_redis(db, org_structure, monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(org_unit_service, "redis_client", fake)
+    monkeypatch.setattr(analytics_cache, "redis_client", fake)
+
+    tree = get_org_tree(db)
+    assert get_org_tree(db) is tree
+
+    # Another worker edits the structure: only the shared counter tells this one
+    db.add(OrganizationUnit(name="Новый", type="department", parent_id=org_structure["branch"].id))
+    db.commit()
+    fake.incr(org_unit_service.ORG_TREE_VERSION_KEY)
+
+    assert len(get_org_tree(db).nodes) == len(tree.nodes) + 1
@@ -0,0 +1,87 @@
+"""
+Tests for the principal cache: no User/Role query on a hit, immediate effect of
+block, role and password changes (security version bump), writes to the current user.
+"""
+import pytest
+from sqlalchemy import event
+
+from database.models import User
+from services import principal_cache
+from tests.fakes import FakeRedis
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(principal_cache, "redis_client", fake)
+    return fake
+
+
+def _user_queries(db, fn):
+    statements = []
+
+    def capture(*args):
+        if "FROM users" in args[2]:
+            statements.append(args[2])
+
+    event.listen(db.get_bind(), "before_cursor_execute", capture)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", capture)
+    return result, statements
+
+
+def test_cache_hit_skips_user_query(client, auth_headers, db, fake_redis):
+    assert client.get("/api/auth/me", headers=auth_headers).status_code == 200
+    resp, statements = _user_queries(db, lambda: client.get("/api/auth/me", headers=auth_headers))
+    assert resp.status_code == 200
+    assert resp.json()["permissions"]["admin_access"] is True
+    assert statements == []
+
+
+def test_block_applies_immediately(client, auth_headers, viewer_headers, viewer_user, fake_redis):
+    assert client.get("/api/auth/me", headers=viewer_headers).status_code == 200
+
+    resp = client.patch(f"/api/users/{viewer_user.id}/toggle_block", headers=auth_headers)
+    assert resp.status_code == 200
+    assert client.get("/api/auth/me", headers=viewer_headers).status_code == 403
+
+
+def test_role_permission_change_applies_immediately(client, auth_headers, viewer_headers, viewer_role, fake_redis):
+    assert client.get("/api/auth/me", headers=viewer_headers).json()["permissions"] == {"view_structure": True}
+
+    resp = client.put(f"/api/roles/{viewer_role.id}", headers=auth_headers,
+                      json={"name": viewer_role.name, "permissions": {"view_positions": True}})
+    assert resp.status_code == 200
+    assert client.get("/api/auth/me", headers=viewer_headers).json()["permissions"] == {"view_positions": True}
+
+
+def test_current_user_writes_go_to_the_row(client, auth_headers, admin_user, db, fake_redis):
+    client.get("/api/auth/me", headers=auth_headers)  # warm the cache
+
+    resp = client.put("/api/users/me/profile", headers=auth_headers, json={"full_name": "Новое Имя"})
+    assert resp.status_code == 200
+    db.refresh(admin_user)
+    assert admin_user.full_name == "Новое Имя"
+    assert client.get("/api/auth/me", headers=auth_headers).json()["full_name"] == "Новое Имя"
+
+    resp = client.post("/api/auth/change-password", headers=auth_headers,
+                       json={"old_password": "admin123", "new_password": "NewPassw0rd!"})
+    assert resp.status_code == 200
+    assert client.post("/api/auth/login", json={"username": "admin@test.com", "password": "NewPassw0rd!"}).status_code == 200
+
+
+def test_admin_avatar_removal_applies_immediately(client, auth_headers, viewer_headers, viewer_user, db, fake_redis):
+    viewer_user.avatar_url = "/uploads/avatars/missing.png"
+    db.commit()
+    assert client.get("/api/auth/me", headers=viewer_headers).json()["avatar_url"] == "/uploads/avatars/missing.png"
+
+    assert client.delete(f"/api/users/{viewer_user.id}/avatar", headers=auth_headers).status_code == 200
+    assert client.get("/api/auth/me", headers=viewer_headers).json()["avatar_url"] is None
+
+
+def test_cached_entry_has_no_password_hash(client, auth_headers, admin_user, fake_redis):
+    client.get("/api/auth/me", headers=auth_headers)
+    entry = fake_redis.store[f"principal:{admin_user.id}"]
+    assert "hashed_password" not in entry and "admin@test.com" in entry
@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+from redis.exceptions import NoScriptError
+
+from utils import rate_limiter
+from utils.rate_limiter import POLICIES, RateLimitPolicy, match_route
+
+
+class FakeGcraRedis:
+    """Runs the GCRA script's logic in Python; EVALSHA misses until the script was EVALed once."""
+
+    def __init__(self):
+        self.store = {}
+        self.now_ms = 1_000_000
+        self.loaded = False
+        self.calls = []
+
+    def evalsha(self, sha, numkeys, key, interval, tolerance):
+        self.calls.append("evalsha")
+        if not self.loaded:
+            raise NoScriptError("NOSCRIPT")
+        return self._gcra(key, interval, tolerance)
+
+    def eval(self, script, numkeys, key, interval, tolerance):
+        self.calls.append("eval")
+        self.loaded = True
+        return self._gcra(key, interval, tolerance)
+
+    def _gcra(self, key, interval, tolerance):
+        now = self.now_ms
+        tat = max(self.store.get(key, now), now)
+        new_tat = tat + interval
+        if new_tat - tolerance > now:
+            return [0, new_tat - tolerance - now]
+        self.store[key] = new_tat
+        return [1, 0]
+
+    def delete(self, key):
+        self.store.pop(key, None)
+
+
+class FakeAsyncGcraRedis(FakeGcraRedis):
+    async def evalsha(self, *args):
+        return FakeGcraRedis.evalsha(self, *args)
+
+    async def eval(self, *args):
+        return FakeGcraRedis.eval(self, *args)
+
+
+@pytest.fixture(autouse=True)
+def clean_fallback():
+    rate_limiter._fallback_store.clear()
+    yield
+    rate_limiter._fallback_store.clear()
+
+
+def test_gcra_burst_then_refill(monkeypatch):
+    fake = FakeGcraRedis()
+    monkeypatch.setattr(rate_limiter, "redis_client", fake)
+    policy = RateLimitPolicy("test", 3, 60)
+
+    assert [rate_limiter.hit(policy, "a").allowed for _ in range(4)] == [True, True, True, False]
+    # One cell refills after period / limit
+    denied = rate_limiter.hit(policy, "a")
+    assert denied.retry_after == pytest.approx(20)
+    fake.now_ms += 20_000
+    assert rate_limiter.hit(policy, "a").allowed
+    # Other subjects are independent; one key per subject
+    assert rate_limiter.hit(policy, "b").allowed
+    assert set(fake.store) == {"ratelimit:gcra:test:a", "ratelimit:gcra:test:b"}
+    # Script loaded once, then EVALSHA only
+    assert fake.calls[:3] == ["evalsha", "eval", "evalsha"]
+    assert fake.calls.count("eval") == 1
+
+
+def test_async_hit_uses_async_client(monkeypatch):
+    fake = FakeAsyncGcraRedis()
+    monkeypatch.setattr(rate_limiter, "async_redis_client", fake)
+    policy = RateLimitPolicy("test", 2, 60)
+
+    async def attempts():
+        return [(await rate_limiter.hit_async(policy, "ip")).allowed for _ in range(3)]
+
+    assert asyncio.run(attempts()) == [True, True, False]
+
+
+def test_fallback_is_bounded_lru(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "FALLBACK_MAX_KEYS", 3)
+    policy = RateLimitPolicy("test", 1, 60)
+
+    assert rate_limiter.hit(policy, "hot").allowed
+    for subject in ("k1", "k2"):
+        rate_limiter.hit(policy, subject)
+    # The hot key is touched again (denied), so the next insert evicts k1, not it
+    assert not rate_limiter.hit(policy, "hot").allowed
+    rate_limiter.hit(policy, "k3")
+    assert list(rate_limiter._fallback_store) == [
+        "ratelimit:gcra:test:k2", "ratelimit:gcra:test:hot", "ratelimit:gcra:test:k3",
+    ]
+    assert not rate_limiter.hit(policy, "hot").allowed
+
+
+def test_route_policies():
+    assert match_route("POST", "/api/auth/login") == (POLICIES["login"], None)
+    assert match_route("POST", "/api/offers/public/abc/unlock") == (POLICIES["offer_unlock"], "abc")
+    assert match_route("POST", "/api/offers/public/abc/action") == (POLICIES["offer_action"], "abc")
+    assert match_route("POST", "/api/users/me/avatar")[0] is POLICIES["avatar_upload"]
+    assert match_route("POST", "/api/users/12/avatar")[0] is POLICIES["avatar_upload"]
+    assert match_route("POST", "/api/candidates/5/resume")[0] is POLICIES["resume_upload"]
+    assert match_route("GET", "/api/auth/login") is None
+    assert match_route("POST", "/api/employees") is None
+
+
+def test_policy_env_override(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_LOGIN", "3/60")
+    assert rate_limiter._policy("login", 10, 300) == RateLimitPolicy("login", 3, 60.0)
+    monkeypatch.setenv("RATE_LIMIT_LOGIN", "3/zero")
+    assert rate_limiter._policy("login", 10, 300) == RateLimitPolicy("login", 10, 300)
+
+
+def test_middleware_returns_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setenv("ENVIRONMENT", "development")
+    monkeypatch.setattr(rate_limiter, "async_redis_client", None)
+    monkeypatch.setitem(rate_limiter.POLICIES, "offer_unlock", RateLimitPolicy("offer_unlock", 2, 60))
+
+    codes = [
+        client.post("/api/offers/public/tok/unlock", json={"pin": "0000"}).status_code
+        for _ in range(3)
+    ]
+    assert codes == [404, 404, 429]
+    res = client.post("/api/offers/public/tok/unlock", json={"pin": "0000"})
+    assert res.status_code == 429
+    assert int(res.headers["Retry-After"]) >= 1
+    # Keyed by offer token, not shared across offers
+    assert client.post("/api/offers/public/other/unlock", json={"pin": "0000"}).status_code == 404
+
+
+def test_testing_environment_only_skips_login_limit(client, monkeypatch):
+    monkeypatch.setenv("ENVIRONMENT", "testing")
+    monkeypatch.setattr(rate_limiter, "async_redis_client", None)
+    monkeypatch.setitem(rate_limiter.POLICIES, "login", RateLimitPolicy("login", 1, 60))
+    monkeypatch.setitem(rate_limiter.POLICIES, "offer_unlock", RateLimitPolicy("offer_unlock", 1, 60))
+
+    logins = [
+        client.post("/api/auth/login", data={"username": "nobody", "password": "x"}).status_code
+        for _ in range(2)
+    ]
+    assert 429 not in logins
+    codes = [
+        client.post("/api/offers/public/tok/unlock", json={"pin": "0000"}).status_code
+        for _ in range(2)
+    ]
+    assert codes == [404, 429]
@@ -0,0 +1,211 @@
+"""
+Tests for the persisted salary recalculation job: enqueue on config change, chunked
+progress with checkpoints, resume after a worker crash, supersede and status polling.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from database.models import (
+    BackgroundJob, Employee, EmployeeCurrentCompensation, FinancialRecord, PlanningPosition,
+)
+from services import job_service
+from services.compensation_service import sync_current_compensation
+from services.job_service import claim_next_job, run_pending_jobs
+from services.recalculation_service import SALARY_RECALC_JOB, enqueue_salary_recalculation
+from services.salary_service import solve_gross_from_net
+
+
+def _add_employees(db, org_structure, position, count):
+    for i in range(count):
+        emp = Employee(
+            full_name=f"Сотрудник {i}",
+            position_id=position.id,
+            org_unit_id=org_structure["department"].id,
+            status="Активен",
+        )
+        db.add(emp)
+        db.flush()
+        fin = FinancialRecord(
+            employee_id=emp.id, base_net=200000 + i * 1000, base_gross=1, kpi_net=0, kpi_gross=0,
+            bonus_net=0, bonus_gross=0, total_net=200000 + i * 1000, total_gross=1,
+        )
+        db.add(fin)
+        sync_current_compensation(db, fin)
+    db.commit()
+
+
+def test_config_update_enqueues_job_instead_of_running_inline(client, auth_headers, db, planning_position):
+    resp = client.post("/api/salary-config/", headers=auth_headers, json={"mrp": 4500})
+    assert resp.status_code == 200
+
+    job = db.query(BackgroundJob).one()
+    assert job.kind == SALARY_RECALC_JOB and job.status == "pending"
+    db.refresh(planning_position)
+    assert planning_position.base_gross == 400000  # untouched until a worker runs it
+
+    resp = client.get("/api/salary-config/jobs/latest", headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.json()["id"] == job.id and resp.json()["status"] == "pending"
+
+
+def test_job_runs_in_chunks_and_updates_projection(db, salary_config, org_structure, position, planning_position):
+    _add_employees(db, org_structure, position, 5)
+    job = enqueue_salary_recalculation(db, salary_config.id, None)
+    job.params = {"config_id": salary_config.id, "chunk_size": 2}
+    db.commit()
+
+    assert run_pending_jobs(db) == 1
+    db.refresh(job)
+    assert job.status == "completed"
+    assert job.progress["employees_processed"] == 5
+    assert job.progress["plans_processed"] == 1
+    assert job.checkpoint == {"phase": "employees", "last_id": db.query(Employee.id).order_by(Employee.id.desc()).first()[0]}
+    assert job.result["employees_updated"] == 5
+
+    for fin in db.query(FinancialRecord).all():
+        expected = int(round(solve_gross_from_net(fin.base_net, salary_config)))
+        assert fin.base_gross == expected and fin.total_gross == expected
+        assert db.get(EmployeeCurrentCompensation, fin.employee_id).total_gross == expected
+    db.refresh(planning_position)
+    assert planning_position.base_gross == int(round(solve_gross_from_net(300000, salary_config)))
+
+
+def test_job_regrosses_scenario_overlay_deltas(client, auth_headers, db, salary_config, org_structure, planning_position):
+    from database.models import Scenario, ScenarioLineDelta
+    from services.salary_config_service import get_config_snapshot
+
+    sc_id = client.post("/api/scenarios/", headers=auth_headers, json={"name": "Overlay"}).json()["id"]
+    client.post(f"/api/scenarios/{sc_id}/apply-change", headers=auth_headers, json={
+        "field": "base_net", "change_type": "fixed_set", "value": 500000,
+    })
+    db.add(ScenarioLineDelta(
+        scenario_id=sc_id, op="add", position_title="Аналитик", branch_id=org_structure["branch"].id,
+        schedule="5/2", count=1, base_net=250000, base_gross=1, kpi_net=0, kpi_gross=0, bonus_net=0, bonus_gross=0,
+    ))
+    db.commit()
+    assert db.query(ScenarioLineDelta).filter_by(scenario_id=sc_id).count() == 2
+    revision = db.get(Scenario, sc_id).revision
+
+    resp = client.post("/api/salary-config/", headers=auth_headers, json={"ipn_rate": 0.15, "opv_rate": 0.12})
+    assert resp.status_code == 200
+    assert run_pending_jobs(db) == 1
+
+    db.expire_all()
+    config = get_config_snapshot(db)
+    deltas = db.query(ScenarioLineDelta).filter_by(scenario_id=sc_id).all()
+    for delta in deltas:
+        assert delta.base_gross == int(round(solve_gross_from_net(delta.base_net, config)))
+    assert db.get(Scenario, sc_id).revision > revision
+    job = db.query(BackgroundJob).one()
+    assert job.result["deltas_updated"] == 2 and job.progress["deltas_total"] == 2
+
+
+def test_abandoned_job_resumes_from_checkpoint(db, salary_config, org_structure, position, planning_position):
+    _add_employees(db, org_structure, position, 4)
+    ids = [e.id for e in db.query(Employee).order_by(Employee.id)]
+
+    # Worker died after committing the planning phase and the first two employees
+    job = enqueue_salary_recalculation(db, salary_config.id, None)
+    job.status = "running"
+    job.checkpoint = {"phase": "employees", "last_id": ids[1]}
+    job.progress = {"plans_total": 1, "employees_total": 4, "plans_processed": 1, "plans_updated": 1,
+                    "employees_processed": 2, "employees_updated": 2}
+    job.heartbeat_at = datetime.now(timezone.utc) - timedelta(seconds=job_service.JOB_LEASE_SECONDS + 60)
+    db.commit()
+
+    assert run_pending_jobs(db) == 1
+    db.refresh(job)
+    assert job.status == "completed" and job.attempts == 1
+    assert job.progress["employees_processed"] == 4
+
+    grosses = {f.employee_id: f.base_gross for f in db.query(FinancialRecord)}
+    assert grosses[ids[0]] == 1 and grosses[ids[1]] == 1  # before the checkpoint: not redone
+    assert grosses[ids[2]] > 200000 and grosses[ids[3]] > 200000
+    db.refresh(planning_position)
+    assert planning_position.base_gross == 400000
+
+
+def test_live_running_job_is_not_claimed_twice(db, salary_config):
+    job = enqueue_salary_recalculation(db, salary_config.id, None)
+    assert claim_next_job(db).id == job.id
+    assert claim_next_job(db) is None
+
+
+def test_new_config_supersedes_queued_job(db, salary_config, planning_position):
+    first = enqueue_salary_recalculation(db, salary_config.id, None)
+    second = enqueue_salary_recalculation(db, salary_config.id, None)
+    db.refresh(first)
+    assert first.status == "cancelled"
+
+    assert run_pending_jobs(db) == 1
+    db.refresh(second)
+    assert second.status == "completed"
+
+
+def test_job_superseded_while_running_stays_cancelled(db, salary_config, planning_position, monkeypatch):
+    original = job_service._handlers[SALARY_RECALC_JOB]
+
+    def superseded_midway(session, job):
+        result = original(session, job)
+        # A newer config arrives after the last checkpoint, before completion
+        enqueue_salary_recalculation(db, salary_config.id, None)
+        return result
+
+    monkeypatch.setitem(job_service._handlers, SALARY_RECALC_JOB, superseded_midway)
+    first = enqueue_salary_recalculation(db, salary_config.id, None)
+    assert run_pending_jobs(db, max_jobs=1) == 1
+    db.refresh(first)
+    assert first.status == "cancelled" and first.result is None
+    assert db.query(BackgroundJob).filter(BackgroundJob.status == "pending").count() == 1
+
+
+def test_chunk_of_job_cancelled_midway_is_rolled_back(db, salary_config, planning_position, monkeypatch):
+    from services import recalculation_service
+    from tests.conftest import TestingSessionLocal
+
+    job = enqueue_salary_recalculation(db, salary_config.id, None)
+    original = recalculation_service._regross
+
+    def cancelled_during_chunk(rows, config):
+        changed = original(rows, config)
+        # Another process supersedes the job before this chunk is saved
+        other = TestingSessionLocal()
+        try:
+            other.query(BackgroundJob).filter_by(id=job.id).update({"status": "cancelled"})
+            other.commit()
+        finally:
+            other.close()
+        return changed
+
+    monkeypatch.setattr(recalculation_service, "_regross", cancelled_during_chunk)
+    assert run_pending_jobs(db) == 1
+    db.expire_all()
+    assert db.get(BackgroundJob, job.id).status == "cancelled"
+    assert db.get(PlanningPosition, planning_position.id).base_gross == 400000
+
+
+def test_config_change_and_job_are_committed_together(client, auth_headers, db, planning_position, monkeypatch):
+    import routers.salary_config as salary_config_router
+
+    def broken_enqueue(*args, **kwargs):
+        raise RuntimeError("queue unavailable")
+
+    monkeypatch.setattr(salary_config_router, "enqueue_salary_recalculation", broken_enqueue)
+    with pytest.raises(RuntimeError):
+        client.post("/api/salary-config/", headers=auth_headers, json={"mrp": 4500})
+    db.expire_all()
+    assert client.get("/api/salary-config/", headers=auth_headers).json()["mrp"] != 4500
+    assert db.query(BackgroundJob).count() == 0
+
+
+def test_failed_job_records_error(client, auth_headers, db):
+    job = job_service.enqueue_job(db, SALARY_RECALC_JOB, {"config_id": 999})
+    run_pending_jobs(db)
+    db.refresh(job)
+    assert job.status == "failed" and "999" in job.error
+
+    resp = client.get(f"/api/salary-config/jobs/{job.id}", headers=auth_headers)
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "failed"
+    assert client.get("/api/salary-config/jobs/12345", headers=auth_headers).status_code == 404
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from services import principal_cache
+from tests.test_rate_limiter import FakeAsyncGcraRedis
+from utils import rate_limiter, redis_metrics
+
+
+class FakeAsyncRedis(FakeAsyncGcraRedis):
+    def __init__(self, fail=False):
+        super().__init__()
+        self.counters = {}
+        self.fail = fail
+
+    async def evalsha(self, *args):
+        if self.fail:
+            raise ConnectionError("redis down")
+        return await super().evalsha(*args)
+
+    async def incr(self, key):
+        self.counters[key] = self.counters.get(key, 0) + 1
+        return self.counters[key]
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    redis_metrics.reset()
+    rate_limiter._fallback_store.clear()
+    yield
+    redis_metrics.reset()
+
+
+def test_async_rate_limit_uses_async_client(monkeypatch):
+    fake = FakeAsyncRedis()
+    monkeypatch.setattr(rate_limiter, "async_redis_client", fake)
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+
+    async def attempts():
+        return [await rate_limiter.check_rate_limit_async("login:1.2.3.4", 2, 300) for _ in range(3)]
+
+    results = asyncio.run(attempts())
+    assert results[-1] is True
+    assert "ratelimit:gcra:adhoc:login:1.2.3.4" in fake.store
+
+    op = redis_metrics.snapshot()["operations"][0]
+    assert (op["client"], op["op"], op["count"], op["errors"]) == ("async", "rate_limit", 3, 0)
+
+
+def test_async_rate_limit_falls_back_and_counts_errors(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "async_redis_client", FakeAsyncRedis(fail=True))
+
+    async def attempts():
+        return [await rate_limiter.check_rate_limit_async("login:5.6.7.8", 2, 300) for _ in range(3)]
+
+    assert asyncio.run(attempts()) == [False, False, True]
+    op = redis_metrics.snapshot()["operations"][0]
+    assert op["errors"] == 3
+
+
+def test_async_security_version_bump(monkeypatch):
+    fake = FakeAsyncRedis()
+    monkeypatch.setattr(principal_cache, "async_redis_client", fake)
+    asyncio.run(principal_cache.bump_security_version_async(7, 8))
+    assert fake.counters == {"user:secver:7": 1, "user:secver:8": 1}
+
+
+def test_latency_buckets():
+    redis_metrics.observe("sync", "get", 0.0005)
+    redis_metrics.observe("sync", "get", 0.003)
+    redis_metrics.observe("sync", "get", 5.0, ok=False)
+    op = redis_metrics.snapshot()["operations"][0]
+    assert op["count"] == 3 and op["errors"] == 1
+    assert op["buckets"]["le_1ms"] == 1
+    assert op["buckets"]["le_5ms"] == 1
+    assert op["buckets"]["inf"] == 1
+
+
+def test_metrics_endpoint_is_admin_only(client, auth_headers, viewer_headers):
+    redis_metrics.observe("async", "rate_limit", 0.002)
+
+    assert client.get("/api/admin/redis-metrics", headers=viewer_headers).status_code == 403
+    res = client.get("/api/admin/redis-metrics", headers=auth_headers)
+    assert res.status_code == 200
+    body = res.json()
+    assert body["operations"][0]["op"] == "rate_limit"
+    assert body["pools"] == {"sync": None, "async": None}
+
+
+def test_pool_stats_reads_sync_and_async_pools():
+    import redis
+    import redis.asyncio
+
+    sync_pool = redis.ConnectionPool.from_url("redis://localhost:6379/0", max_connections=5)
+    async_pool = redis.asyncio.ConnectionPool.from_url("redis://localhost:6379/0", max_connections=7)
+    assert redis_metrics.pool_stats(sync_pool) == {"max_connections": 5, "created": 0, "in_use": 0, "idle": 0}
+    assert redis_metrics.pool_stats(async_pool)["max_connections"] == 7
+    assert redis_metrics.pool_stats(None) is None
@@ -0,0 +1,111 @@
+"""
+Tests for batched notification fan-out of the salary request workflow: one recipient
+query, deduplicated recipients, multi-row inserts, and the outbox (job) mode.
+"""
+from sqlalchemy import event
+
+from database.models import ApprovalStep, BackgroundJob, Notification, Role, SalaryRequest, User
+from services import notification_service
+from services.job_service import run_pending_jobs
+from services.notification_service import NOTIFICATION_JOB, NotificationBatch
+
+
+def _approvers(db, count):
+    role = Role(name="Approvers", permissions={"manage_requests": True})
+    db.add(role)
+    db.flush()
+    users = [
+        User(email=f"approver{i}@test.com", hashed_password="x", full_name=f"Approver {i}", role_id=role.id)
+        for i in range(count)
+    ]
+    db.add_all(users)
+    db.commit()
+    return role, users
+
+
+def _create_request(client, auth_headers, employee):
+    return client.post("/api/requests", headers=auth_headers, json={
+        "employee_id": employee.id, "type": "raise",
+        "current_value": 300000, "requested_value": 350000, "reason": "Повышение",
+    })
+
+
+def _capture_statements(db):
+    statements = []
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.get_bind(), "before_cursor_execute", before_execute)
+    return statements, lambda: event.remove(db.get_bind(), "before_cursor_execute", before_execute)
+
+
+def test_role_fan_out_is_deduplicated_and_bulk_inserted(client, auth_headers, db, employee):
+    role, users = _approvers(db, 40)
+    db.add_all([
+        ApprovalStep(step_order=1, role_id=role.id, label="Согласование"),
+        # Step bound to a user who is also a member of the first step's role
+        ApprovalStep(step_order=2, user_id=users[0].id, label="Контроль"),
+    ])
+    db.commit()
+
+    statements, stop = _capture_statements(db)
+    try:
+        resp = _create_request(client, auth_headers, employee)
+    finally:
+        stop()
+    assert resp.status_code == 200
+
+    notes = db.query(Notification).all()
+    assert sorted(n.user_id for n in notes) == sorted(u.id for u in users)
+    assert {n.message for n in notes} == {f"Новая заявка на согласование: {employee.full_name}"}
+    inserts = [s for s in statements if s.lstrip().upper().startswith("INSERT INTO NOTIFICATIONS")]
+    assert len(inserts) == 1
+    user_selects = [s for s in statements if "FROM users" in s and "role_id IN" in s]
+    assert len(user_selects) == 1
+
+
+def test_approval_notifies_next_step(client, auth_headers, db, employee, admin_user):
+    role, users = _approvers(db, 3)
+    db.add_all([
+        ApprovalStep(step_order=1, user_id=admin_user.id, label="Админ"),
+        ApprovalStep(step_order=2, role_id=role.id, label="Финал", is_final=True),
+    ])
+    db.commit()
+    assert _create_request(client, auth_headers, employee).status_code == 200
+    req_id = db.query(SalaryRequest.id).scalar()
+    db.query(Notification).delete()
+    db.commit()
+
+    resp = client.patch(f"/api/requests/{req_id}/status", headers=auth_headers, json={"status": "approved"})
+    assert resp.status_code == 200
+    notes = db.query(Notification).all()
+    assert sorted(n.user_id for n in notes) == sorted(u.id for u in users)
+    assert all("Теперь ваша очередь" in n.message for n in notes)
+
+
+def test_outbox_mode_defers_fan_out_to_worker(client, auth_headers, db, employee, monkeypatch):
+    monkeypatch.setattr(notification_service, "NOTIFICATION_DISPATCH", notification_service.DISPATCH_OUTBOX)
+    role, users = _approvers(db, 25)
+    db.add(ApprovalStep(step_order=1, role_id=role.id, label="Согласование"))
+    db.commit()
+
+    assert _create_request(client, auth_headers, employee).status_code == 200
+    assert db.query(Notification).count() == 0
+    job = db.query(BackgroundJob).filter(BackgroundJob.kind == NOTIFICATION_JOB).one()
+    assert job.params["messages"][0]["role_ids"] == [role.id]
+
+    assert run_pending_jobs(db, kinds=[NOTIFICATION_JOB]) == 1
+    db.refresh(job)
+    assert job.status == "completed"
+    assert job.result == {"notifications": 25}
+    assert db.query(Notification).count() == 25
+
+
+def test_batch_skips_missing_users_and_empty_batches(db, admin_user):
+    assert not NotificationBatch().add("x", user_ids=[None], role_ids=[None])
+
+    written = NotificationBatch().add("hello", user_ids=[admin_user.id, 999_999, admin_user.id]).dispatch(db)
+    db.commit()
+    assert written == 1
+    assert db.query(Notification).one().user_id == admin_user.id
@@ -1,7 +1,8 @@
 """
-Tests for Salary Config API: get, calculate endpoint.
+Tests for Salary Config API: get, calculate endpoint, cached config snapshot.
 Routes are at /api/salary-config/
 """
+from services.salary_config_service import get_config_snapshot, invalidate_config_snapshot
 
 
 def test_get_salary_config(client, auth_headers, salary_config):
@@ -54,3 +55,23 @@ def test_calculate_endpoint_net(client, auth_headers, salary_config):
     data = resp.json()
     assert data["gross"] > 200000  # Gross > Net
     assert abs(data["net"] - 200000) < 1  # Should match target net
+
+
+def test_config_snapshot_cached_until_invalidated(client, auth_headers, salary_config, db):
+    first = get_config_snapshot(db)
+    assert get_config_snapshot(db) is first
+
+    salary_config.mzp = 90000
+    db.commit()
+    assert get_config_snapshot(db).mzp == 85000  # no bump yet — cached
+
+    invalidate_config_snapshot()
+    fresh = get_config_snapshot(db)
+    assert fresh.mzp == 90000
+    assert fresh.version != first.version
+
+    resp = client.post("/api/salary-config/calculate", headers=auth_headers, json={
+        "amount": 300000,
+        "type": "gross"
+    })
+    assert resp.json()["config_version"] == fresh.version
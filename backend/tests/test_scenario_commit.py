@@ -0,0 +1,133 @@
+"""
+Tests for the set-based scenario commit: backup, slot matching (incl. duplicate slots),
+create/delete, batched audit, and employee sync with the compensation projection.
+"""
+from sqlalchemy import event
+
+from database.models import (
+    AuditLog, Employee, EmployeeCurrentCompensation, FinancialRecord, PlanningPosition, Scenario, ScenarioLineDelta,
+)
+from services.compensation_service import find_compensation_drift, sync_current_compensation
+from services.scenario_service import diff_lines
+
+
+def _line(db, org_structure, scenario_id=None, title="Разработчик", base_net=300000, **extra):
+    line = PlanningPosition(
+        scenario_id=scenario_id, position_title=title,
+        branch_id=org_structure["branch"].id, department_id=org_structure["department"].id,
+        schedule="5/2", count=1, base_net=base_net, base_gross=base_net + 100000,
+        kpi_net=50000, kpi_gross=65000, bonus_net=0, bonus_gross=0, **extra,
+    )
+    db.add(line)
+    return line
+
+
+def _create_scenario(client, auth_headers):
+    resp = client.post("/api/scenarios/", headers=auth_headers, json={"name": "Commit"})
+    assert resp.status_code == 200
+    return resp.json()["id"]
+
+
+def test_commit_merges_backs_up_and_syncs_employees(client, auth_headers, db, org_structure, planning_position, employee):
+    sc_id = _create_scenario(client, auth_headers)
+    live_extra_id = _line(db, org_structure, title="Удаляемая")
+    db.commit()
+    live_extra_id = live_extra_id.id
+
+    values = {f: getattr(planning_position, f) for f in ("position_title", "branch_id", "department_id", "schedule", "count", "kpi_net", "kpi_gross", "bonus_net", "bonus_gross")}
+    db.add_all([
+        ScenarioLineDelta(scenario_id=sc_id, live_line_id=planning_position.id, op="update", **{**values, "base_net": 320000, "base_gross": 425000}),
+        ScenarioLineDelta(scenario_id=sc_id, live_line_id=live_extra_id, op="delete"),
+        ScenarioLineDelta(scenario_id=sc_id, op="add", **{**values, "position_title": "Новая", "base_net": 1, "base_gross": 1}),
+    ])
+    db.commit()
+
+    resp = client.post(f"/api/scenarios/{sc_id}/commit", headers=auth_headers)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert (data["changed_rows"], data["created_rows"], data["deleted_rows"]) == (1, 1, 1)
+    assert data["synced_employees"] == 1
+    db.expire_all()
+
+    live = {l.position_title: l for l in db.query(PlanningPosition).filter(PlanningPosition.scenario_id.is_(None))}
+    assert set(live) == {"Разработчик", "Новая"}
+    assert live["Разработчик"].id == planning_position.id
+    assert live["Разработчик"].base_net == 320000
+
+    backup = db.get(Scenario, data["backup_id"])
+    backup_titles = sorted(l.position_title for l in backup.planning_positions)
+    assert backup_titles == ["Разработчик", "Удаляемая"]
+    assert backup.status == "archived"
+    assert db.get(Scenario, sc_id).status == "committed"
+
+    fin = db.query(FinancialRecord).filter_by(employee_id=employee.id).one()
+    assert (fin.base_net, fin.base_gross) == (320000, 425000)
+    assert fin.total_net == 320000 + fin.kpi_net + fin.bonus_net
+    assert fin.base_salary == 320000
+    assert db.get(EmployeeCurrentCompensation, employee.id).base_net == 320000
+    assert find_compensation_drift(db) == []
+
+    planning_audits = db.query(AuditLog).filter_by(target_entity="planning").all()
+    assert len(planning_audits) == 3
+    assert any(a.target_entity_id == live_extra_id and a.new_values is None for a in planning_audits)
+    emp_audit = db.query(AuditLog).filter_by(target_entity="employee", target_entity_id=employee.id).one()
+    assert emp_audit.new_values["base_net"] == 320000
+
+
+def test_duplicate_slots_pair_in_id_order():
+    class Row:
+        def __init__(self, id, count):
+            self.id = id
+            self.position_title, self.branch_id, self.department_id, self.schedule = "A", 1, None, None
+            self.count = count
+            self.base_net = self.base_gross = self.kpi_net = self.kpi_gross = 0
+            self.bonus_net = self.bonus_gross = 0
+            self.bonus_count = None
+
+    live = [Row(1, 1), Row(2, 2), Row(3, 3)]
+    scenario = [Row(10, 1), Row(11, 5)]
+    updates, creates, deletes = diff_lines(live, scenario)
+    assert [(t.id, c) for t, _, c in updates] == [(2, {"count": (2, 5)})]
+    assert creates == []
+    assert [r.id for r in deletes] == [3]
+
+
+def test_statement_count_does_not_grow_with_budget(client, auth_headers, db, org_structure, position, salary_config):
+    def run(size):
+        for i in range(size):
+            _line(db, org_structure, title=f"Линия {i}")
+            emp = Employee(full_name=f"E{i}", position_id=position.id, org_unit_id=org_structure["department"].id, status="Активен")
+            db.add(emp)
+            db.flush()
+            fin = FinancialRecord(employee_id=emp.id, base_net=1, base_gross=1, kpi_net=0, kpi_gross=0, bonus_net=0, bonus_gross=0, total_net=1, total_gross=1)
+            db.add(fin)
+            sync_current_compensation(db, fin)
+        # The position title matches every employee's slot
+        _line(db, org_structure, title=position.title)
+        db.commit()
+        sc_id = _create_scenario(client, auth_headers)
+        resp = client.post(f"/api/scenarios/{sc_id}/apply-change", headers=auth_headers, json={
+            "field": "base_net", "change_type": "fixed_add", "value": 1000,
+        })
+        assert resp.status_code == 200
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.get_bind(), "before_cursor_execute", count)
+        try:
+            resp = client.post(f"/api/scenarios/{sc_id}/commit", headers=auth_headers)
+        finally:
+            event.remove(db.get_bind(), "before_cursor_execute", count)
+        assert resp.status_code == 200
+        assert resp.json()["changed_rows"] == db.query(PlanningPosition).filter(PlanningPosition.scenario_id.is_(None)).count()
+        return len(statements), resp.json()["synced_employees"]
+
+    small, synced_small = run(3)
+    large, synced_large = run(30)
+    assert synced_small == 3
+    # Employees of the first run already have the slot's final value
+    assert synced_large == 30
+    assert large == small
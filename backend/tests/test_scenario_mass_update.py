@@ -0,0 +1,91 @@
+"""
+Tests for the bulk scenario apply-change: batch net/gross solving, dry run with
+preview, and writes that do not grow with the number of lines.
+"""
+from sqlalchemy import event
+
+from database.models import PlanningPosition, ScenarioLineDelta
+from services.salary_config_service import get_config_snapshot
+from services.salary_service import calculate_taxes, solve_gross_from_net
+from services.scenario_service import MASS_UPDATE_PREVIEW_LIMIT
+
+
+def _lines(db, org_structure, count):
+    for i in range(count):
+        db.add(PlanningPosition(
+            scenario_id=None, position_title=f"Линия {i}",
+            branch_id=org_structure["branch"].id, department_id=org_structure["department"].id,
+            schedule="5/2", count=1, base_net=200000 + i * 1000, base_gross=250000 + i * 1000,
+            kpi_net=0, kpi_gross=0, bonus_net=0, bonus_gross=0,
+        ))
+    db.commit()
+
+
+def _scenario(client, auth_headers):
+    return client.post("/api/scenarios/", headers=auth_headers, json={"name": "Bulk"}).json()["id"]
+
+
+def _apply(client, auth_headers, sc_id, **payload):
+    resp = client.post(f"/api/scenarios/{sc_id}/apply-change", headers=auth_headers, json=payload)
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def test_dry_run_previews_without_writing(client, auth_headers, db, org_structure, salary_config):
+    _lines(db, org_structure, 3)
+    sc_id = _scenario(client, auth_headers)
+
+    dry = _apply(client, auth_headers, sc_id, field="base_net", change_type="percent", value=10, dry_run=True)
+    assert (dry["updated"], dry["matched"], dry["dry_run"]) == (3, 3, True)
+    assert db.query(ScenarioLineDelta).count() == 0
+
+    config = get_config_snapshot(db)
+    first = dry["preview"][0]
+    assert first["changes"]["base_net"] == {"old": 200000, "new": 220000}
+    assert first["changes"]["base_gross"]["new"] == int(round(solve_gross_from_net(220000, config)))
+
+    applied = _apply(client, auth_headers, sc_id, field="base_net", change_type="percent", value=10)
+    assert applied["preview"] == dry["preview"]
+    stored = {d.live_line_id: (d.base_net, d.base_gross) for d in db.query(ScenarioLineDelta)}
+    assert stored[first["live_line_id"]] == (220000, first["changes"]["base_gross"]["new"])
+
+
+def test_gross_change_solves_net_in_batch(client, auth_headers, db, org_structure, salary_config):
+    _lines(db, org_structure, 2)
+    sc_id = _scenario(client, auth_headers)
+    result = _apply(client, auth_headers, sc_id, field="base_gross", change_type="fixed_set", value=400000)
+
+    config = get_config_snapshot(db)
+    expected_net = int(round(calculate_taxes(400000, config)["net"]))
+    assert result["updated"] == 2
+    assert all(p["changes"]["base_net"]["new"] == expected_net for p in result["preview"])
+
+
+def test_writes_do_not_grow_with_line_count(client, auth_headers, db, org_structure, salary_config):
+    _lines(db, org_structure, MASS_UPDATE_PREVIEW_LIMIT + 20)
+    sc_id = _scenario(client, auth_headers)
+
+    writes = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("INSERT", "UPDATE")):
+            writes.append(statement)
+
+    def apply():
+        event.listen(db.get_bind(), "before_cursor_execute", count)
+        try:
+            return _apply(client, auth_headers, sc_id, field="base_net", change_type="fixed_add", value=5000)
+        finally:
+            event.remove(db.get_bind(), "before_cursor_execute", count)
+
+    # First change: live lines are copied into deltas; second: the deltas are updated
+    first = apply()
+    assert first["updated"] == MASS_UPDATE_PREVIEW_LIMIT + 20
+    assert len(first["preview"]) == MASS_UPDATE_PREVIEW_LIMIT
+    first_writes = len(writes)
+    writes.clear()
+    second = apply()
+    assert second["updated"] == MASS_UPDATE_PREVIEW_LIMIT + 20
+    # Delta insert or update plus the revision bump, not one statement per line
+    assert first_writes <= 3 and len(writes) <= 3
+    assert db.query(ScenarioLineDelta).count() == MASS_UPDATE_PREVIEW_LIMIT + 20
@@ -0,0 +1,99 @@
+"""
+Tests for copy-on-write scenarios: creation copies nothing, changes are stored as
+deltas against the live budget and resolved on read, comparison uses the deltas only.
+"""
+from database.models import PlanningPosition, Scenario, ScenarioLineDelta
+from services.scenario_service import STORAGE_SNAPSHOT, resolve_scenario_lines
+
+
+def _line(db, org_structure, title, base_net=300000, scenario_id=None):
+    line = PlanningPosition(
+        scenario_id=scenario_id, position_title=title,
+        branch_id=org_structure["branch"].id, department_id=org_structure["department"].id,
+        schedule="5/2", count=2, base_net=base_net, base_gross=base_net + 100000,
+        kpi_net=0, kpi_gross=0, bonus_net=0, bonus_gross=0,
+    )
+    db.add(line)
+    return line
+
+
+def _create(client, auth_headers):
+    resp = client.post("/api/scenarios/", headers=auth_headers, json={"name": "Overlay"})
+    assert resp.status_code == 200
+    return resp.json()["id"]
+
+
+def _apply(client, auth_headers, sc_id, **payload):
+    resp = client.post(f"/api/scenarios/{sc_id}/apply-change", headers=auth_headers, json=payload)
+    assert resp.status_code == 200
+    return resp.json()["updated"]
+
+
+def test_create_copies_nothing_and_sees_later_live_lines(client, auth_headers, db, org_structure, planning_position):
+    sc_id = _create(client, auth_headers)
+    assert db.query(PlanningPosition).filter_by(scenario_id=sc_id).count() == 0
+
+    # Live lines added after the scenario are part of it until the scenario changes them
+    _line(db, org_structure, "Аналитик")
+    db.commit()
+    lines = resolve_scenario_lines(db, db.get(Scenario, sc_id))
+    assert sorted(l.position_title for l in lines) == ["Аналитик", "Разработчик"]
+    assert all(l.delta_id is None for l in lines)
+
+
+def test_changes_copy_only_touched_lines(client, auth_headers, db, org_structure, planning_position, salary_config):
+    _line(db, org_structure, "Аналитик")
+    db.commit()
+    sc_id = _create(client, auth_headers)
+
+    assert _apply(client, auth_headers, sc_id, field="base_net", change_type="fixed_add", value=1000, position_filter="разраб") == 1
+    deltas = db.query(ScenarioLineDelta).filter_by(scenario_id=sc_id).all()
+    assert [(d.op, d.live_line_id, d.base_net) for d in deltas] == [("update", planning_position.id, 301000)]
+
+    # A second change updates the same delta instead of copying again
+    assert _apply(client, auth_headers, sc_id, field="base_net", change_type="fixed_add", value=1000, position_filter="Разраб") == 1
+    db.expire_all()
+    assert [(d.id, d.base_net) for d in db.query(ScenarioLineDelta).filter_by(scenario_id=sc_id)] == [(deltas[0].id, 302000)]
+
+    db.refresh(planning_position)
+    assert planning_position.base_net == 300000
+
+
+def test_comparison_matches_a_full_recalculation(client, auth_headers, db, org_structure, planning_position, salary_config):
+    removed = _line(db, org_structure, "Уборщик", base_net=150000)
+    db.commit()
+    sc_id = _create(client, auth_headers)
+    _apply(client, auth_headers, sc_id, field="base_net", change_type="percent", value=10, position_filter="Разработчик")
+    db.add_all([
+        ScenarioLineDelta(scenario_id=sc_id, live_line_id=removed.id, op="delete"),
+        ScenarioLineDelta(
+            scenario_id=sc_id, op="add", position_title="Новая", branch_id=org_structure["branch"].id,
+            count=3, base_net=200000, base_gross=250000, kpi_net=0, kpi_gross=0, bonus_net=0, bonus_gross=0,
+        ),
+    ])
+    db.commit()
+    overlay = client.get(f"/api/scenarios/{sc_id}/comparison", headers=auth_headers).json()
+
+    # Same lines materialised as a snapshot scenario
+    snapshot = Scenario(name="Snapshot", status="draft", storage=STORAGE_SNAPSHOT)
+    db.add(snapshot)
+    db.flush()
+    for line in resolve_scenario_lines(db, db.get(Scenario, sc_id)):
+        db.add(PlanningPosition(scenario_id=snapshot.id, **{
+            f: getattr(line, f) for f in ("position_title", "branch_id", "department_id", "schedule", "count",
+                                          "base_net", "base_gross", "kpi_net", "kpi_gross", "bonus_net", "bonus_gross", "bonus_count")
+        }))
+    db.commit()
+    full = client.get(f"/api/scenarios/{snapshot.id}/comparison", headers=auth_headers).json()
+
+    assert overlay == full
+    raise_net = (round(planning_position.base_net * 1.1) - planning_position.base_net) * planning_position.count
+    assert overlay["delta"]["net"] == -2 * 150000 + raise_net + 3 * 200000
+
+
+def test_deleting_scenario_drops_its_deltas(client, auth_headers, db, planning_position, salary_config):
+    sc_id = _create(client, auth_headers)
+    _apply(client, auth_headers, sc_id, field="base_net", change_type="fixed_set", value=1)
+    assert client.delete(f"/api/scenarios/{sc_id}", headers=auth_headers).status_code == 200
+    assert db.query(ScenarioLineDelta).count() == 0
+    assert db.query(PlanningPosition).count() == 1
@@ -0,0 +1,117 @@
+"""
+Tests for cached scenario comparison: per-line cost cache keyed by (content, config
+version), cached totals per scenario revision, incremental adjustment on apply-change.
+"""
+import pytest
+from sqlalchemy import event
+
+from services import analytics_cache, scenario_totals
+from services.analytics_cache import TAG_PLANNING, invalidate_analytics_cache
+from services.salary_config_service import get_config_snapshot
+from services.salary_service import calculate_taxes
+from services.scenario_totals import clear_line_cache, line_costs
+from tests.fakes import FakeRedis
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(analytics_cache, "redis_client", fake)
+    return fake
+
+
+@pytest.fixture
+def batch_calls(monkeypatch):
+    clear_line_cache()
+    calls = []
+    original = scenario_totals.calculate_taxes_batch
+
+    def counting(values, config):
+        calls.append(list(values))
+        return original(values, config)
+
+    monkeypatch.setattr(scenario_totals, "calculate_taxes_batch", counting)
+    yield calls
+    clear_line_cache()
+
+
+def _planning_statements(db, fn):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if "planning_lines" in statement or "scenario_line_deltas" in statement:
+            statements.append(statement)
+
+    event.listen(db.get_bind(), "before_cursor_execute", count)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", count)
+    return result, statements
+
+
+def _compare(client, auth_headers, sc_id):
+    resp = client.get(f"/api/scenarios/{sc_id}/comparison", headers=auth_headers)
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def test_line_cost_is_cached_per_content_and_config_version(db, planning_position, salary_config, batch_calls):
+    config = get_config_snapshot(db)
+    first = line_costs([planning_position], config)
+    assert line_costs([planning_position], config) == first
+    assert len(batch_calls) == 1
+
+    # Same value as the per-line Decimal calculation
+    count = planning_position.count
+    per_person_gross = (planning_position.base_gross + planning_position.kpi_gross) + planning_position.bonus_gross
+    res = calculate_taxes(per_person_gross, config)
+    employer = res["osms"] + res["so"] + res["sn"] + res["opvr"]
+    expected_taxes = per_person_gross * count + employer * count - first[0].net
+    assert first[0].taxes_tiyn / 100 == pytest.approx(expected_taxes, abs=0.01)
+
+    class OtherConfig:
+        version = "other"
+
+        def __getattr__(self, name):
+            return getattr(config, name)
+
+    line_costs([planning_position], OtherConfig())
+    assert len(batch_calls) == 2
+
+
+def test_unchanged_scenario_comparison_is_served_from_cache(client, auth_headers, db, planning_position, salary_config, fake_redis):
+    sc_id = client.post("/api/scenarios/", headers=auth_headers, json={"name": "Cached"}).json()["id"]
+    first = _compare(client, auth_headers, sc_id)
+
+    second, statements = _planning_statements(db, lambda: _compare(client, auth_headers, sc_id))
+    assert second == first
+    assert statements == []
+
+    # Any change of the live budget drops the cached totals
+    invalidate_analytics_cache(TAG_PLANNING)
+    _, statements = _planning_statements(db, lambda: _compare(client, auth_headers, sc_id))
+    assert statements
+
+
+def test_apply_change_adjusts_cached_totals_incrementally(client, auth_headers, db, planning_position, salary_config, fake_redis, batch_calls):
+    sc_id = client.post("/api/scenarios/", headers=auth_headers, json={"name": "Incremental"}).json()["id"]
+    _compare(client, auth_headers, sc_id)
+
+    resp = client.post(f"/api/scenarios/{sc_id}/apply-change", headers=auth_headers, json={
+        "field": "base_net", "change_type": "percent", "value": 10,
+    })
+    assert resp.json()["updated"] == 1
+
+    adjusted, statements = _planning_statements(db, lambda: _compare(client, auth_headers, sc_id))
+    assert statements == []
+    assert adjusted["delta"]["net"] == (round(planning_position.base_net * 1.1) - planning_position.base_net) * planning_position.count
+
+    # Same result as a full recomputation
+    fake_redis.store.clear()
+    clear_line_cache()
+    assert _compare(client, auth_headers, sc_id) == adjusted
+
+
+def test_comparison_of_missing_scenario_is_404(client, auth_headers, salary_config):
+    assert client.get("/api/scenarios/999/comparison", headers=auth_headers).status_code == 404
@@ -11,7 +11,9 @@ def test_create_scenario(client, auth_headers, planning_position):
     assert resp.status_code == 200
     data = resp.json()
     assert data["id"] > 0
-    assert data["cloned_positions"] >= 1
+    # Copy-on-write overlay: nothing is cloned up front
+    assert data["storage"] == "overlay"
+    assert data["cloned_positions"] == 0
 
 
 def test_list_scenarios(client, auth_headers, planning_position):
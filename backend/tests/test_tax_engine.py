@@ -0,0 +1,108 @@
+"""
+Property tests for the integer batch tax engine:
+- calculate_taxes_batch agrees bit for bit with the Decimal calculate_taxes
+- solve_gross_batch is an exact (to the tiyn) inverse of the net function
+- one memoized engine (precomputed segments) per configuration
+"""
+import random
+
+import pytest
+
+from database.models import SalaryConfiguration
+from services.salary_service import (
+    calculate_taxes,
+    calculate_taxes_batch,
+    solve_gross_batch,
+    solve_gross_from_net,
+)
+from services.tax_engine import TaxEngine, get_engine, to_tiyn
+
+
+CONFIGS = [
+    dict(mrp=4325, mzp=85000, opv_rate=0.1, opvr_rate=0.025, vosms_rate=0.02, vosms_employer_rate=0.03,
+         so_rate=0.035, sn_rate=0.095, ipn_rate=0.1, opv_limit_mzp=50, opvr_limit_mzp=50,
+         vosms_limit_mzp=10, ipn_deduction_mrp=14),
+    dict(mrp=4615, mzp=100000, opv_rate=0.1, opvr_rate=0.025, vosms_rate=0.02, vosms_employer_rate=0.03,
+         so_rate=0.035, sn_rate=0.095, ipn_rate=0.1, opv_limit_mzp=50, opvr_limit_mzp=50,
+         vosms_limit_mzp=10, ipn_deduction_mrp=14),
+    # Odd rates and tight caps: every breakpoint falls inside the sampled range
+    dict(mrp=3692, mzp=70000, opv_rate=0.115, opvr_rate=None, vosms_rate=0.017, vosms_employer_rate=0.0325,
+         so_rate=0.0355, sn_rate=0.11, ipn_rate=0.125, opv_limit_mzp=3, opvr_limit_mzp=2,
+         vosms_limit_mzp=1, ipn_deduction_mrp=30),
+]
+
+
+def _samples(config, rng):
+    mzp = config["mzp"]
+    deduction = config["ipn_deduction_mrp"] * config["mrp"]
+    edges = [0, mzp, 7 * mzp, deduction, config["opv_limit_mzp"] * mzp,
+             config["vosms_limit_mzp"] * mzp, config["opvr_limit_mzp"] * mzp]
+    values = []
+    for edge in edges:
+        values += [edge + d for d in (-1, -0.01, -0.005, 0, 0.005, 0.01, 1)]
+    values += [rng.randint(0, 20_000_000) for _ in range(400)]
+    values += [round(rng.uniform(0, 3_000_000), rng.choice([1, 2, 3])) for _ in range(400)]
+    return [v for v in values if v >= 0]
+
+
+@pytest.mark.parametrize("params", CONFIGS)
+@pytest.mark.parametrize("apply_deduction", [True, False])
+def test_batch_matches_decimal_bit_for_bit(params, apply_deduction):
+    config = SalaryConfiguration(**params)
+    values = _samples(params, random.Random(26))
+
+    batch = calculate_taxes_batch(values, config, apply_deduction)
+    for idx, gross in enumerate(values):
+        expected = calculate_taxes(gross, config, apply_deduction)
+        assert expected.pop("config_version") == batch["config_version"]
+        actual = {k: batch[k][idx] for k in expected}
+        assert actual == expected, gross
+
+
+@pytest.mark.parametrize("params", CONFIGS)
+@pytest.mark.parametrize("apply_deduction", [True, False])
+def test_inverse_is_exact_to_the_tiyn(params, apply_deduction):
+    config = SalaryConfiguration(**params)
+    engine = TaxEngine(config, apply_deduction)
+    rng = random.Random(6)
+    targets = [rng.randint(1, 15_000_000) for _ in range(300)]
+    targets += [round(rng.uniform(1, 2_000_000), 2) for _ in range(300)]
+
+    grosses = solve_gross_batch(targets, config, apply_deduction)
+    for target, gross in zip(targets, grosses):
+        net = to_tiyn(target)
+        g = to_tiyn(gross)
+        assert engine.net_tiyn(g) == net
+        assert engine.net_tiyn(g - 1) < net
+        assert calculate_taxes(gross, config, apply_deduction)["net"] == net / 100
+
+
+def test_fractional_money_constants_fall_back_to_decimal():
+    params = dict(CONFIGS[0], mzp=85000.125)
+    config = SalaryConfiguration(**params)
+    assert TaxEngine(config).exact is False
+
+    batch = calculate_taxes_batch([123456.78], config)
+    assert batch["net"][0] == calculate_taxes(123456.78, config)["net"]
+    assert solve_gross_batch([100000], config)[0] > 100000
+
+
+def test_engine_is_shared_per_config_values():
+    first = SalaryConfiguration(**CONFIGS[0])
+    same = SalaryConfiguration(**CONFIGS[0])
+    other = SalaryConfiguration(**CONFIGS[1])
+
+    assert get_engine(first) is get_engine(same)
+    assert get_engine(first) is not get_engine(other)
+    assert get_engine(first) is not get_engine(first, apply_deduction=False)
+
+    grosses = [g for g, _ in get_engine(first).breakpoints]
+    # OPV cap, VOSMS cap and the IPN threshold are segment starts
+    assert 50 * 85000 in grosses and 10 * 85000 in grosses
+    assert len(grosses) == 4
+
+
+def test_solve_gross_from_net_uses_closed_form():
+    config = SalaryConfiguration(**CONFIGS[0])
+    targets = [1, 60553, 250000, 1_000_000.55, 7_777_777]
+    assert [solve_gross_from_net(t, config) for t in targets] == solve_gross_batch(targets, config)
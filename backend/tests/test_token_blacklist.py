@@ -0,0 +1,115 @@
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from database import redis_client as rc
+from security import create_access_token
+from tests.fakes import FakeRedis
+
+
+class BrokenRedis:
+    def exists(self, *keys):
+        raise ConnectionError("redis down")
+
+
+@pytest.fixture
+def revocations(monkeypatch):
+    fresh = rc._RevocationSet()
+    monkeypatch.setattr(rc, "_revocations", fresh)
+    monkeypatch.setattr(rc, "ENVIRONMENT", "development")
+    return fresh
+
+
+def _token(**extra):
+    return create_access_token({"sub": "admin", **extra})
+
+
+def _exp():
+    return int((datetime.now(timezone.utc) + timedelta(minutes=30)).timestamp())
+
+
+def test_access_tokens_get_distinct_jti():
+    a, b = _token(), _token()
+    assert rc.token_revocation_id(a) != rc.token_revocation_id(b)
+    assert not rc.token_revocation_id(a).startswith("sha256:")
+    assert rc.token_revocation_id("not-a-jwt") == "sha256:" + hashlib.sha256(b"not-a-jwt").hexdigest()
+
+
+def test_blacklist_is_keyed_by_jti_and_published(revocations, monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(rc, "redis_client", fake)
+    token = _token()
+    rc.blacklist_token(token, _exp())
+
+    jti = rc.token_revocation_id(token)
+    assert f"blacklist:jti:{jti}" in fake.store
+    assert not any(token in key for key in fake.store)
+    channel, message = fake.published[0]
+    assert channel == rc.BLACKLIST_CHANNEL
+    assert json.loads(message)["id"] == jti
+
+    # Not synced yet: Redis lookup
+    assert rc.is_token_blacklisted(token) is True
+    assert rc.is_token_blacklisted(_token()) is False
+    assert fake.exists_calls == 2
+
+
+def test_synced_set_answers_without_redis(revocations, monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(rc, "redis_client", fake)
+    revoked = _token()
+    revocations.replace({rc.token_revocation_id(revoked): _exp()})
+
+    assert rc.is_token_blacklisted(revoked) is True
+    assert rc.is_token_blacklisted(_token()) is False
+    assert fake.exists_calls == 0
+
+    expired = _token()
+    revocations.add(rc.token_revocation_id(expired), rc._now_ts() - 1)
+    assert rc.is_token_blacklisted(expired) is False
+
+
+def test_unsynced_worker_stays_fail_closed(revocations, monkeypatch):
+    monkeypatch.setattr(rc, "redis_client", BrokenRedis())
+    assert rc.is_token_blacklisted(_token()) is True
+
+    monkeypatch.setattr(rc, "redis_client", None)
+    assert rc.is_token_blacklisted(_token()) is True
+
+    revocations.replace({})
+    revocations.mark_unsynced()
+    assert rc.is_token_blacklisted(_token()) is True
+
+
+def test_snapshot_includes_legacy_raw_token_keys(revocations, monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(rc, "redis_client", fake)
+    legacy = _token()
+    fake.setex(f"blacklist:{legacy}", 600, "revoked")
+    fresh = _token()
+    fake.setex(f"blacklist:jti:{rc.token_revocation_id(fresh)}", 600, "revoked")
+
+    revocations.replace(rc._load_blacklist_snapshot())
+    assert rc.is_token_blacklisted(legacy) is True
+    assert rc.is_token_blacklisted(fresh) is True
+    assert rc.is_token_blacklisted(_token()) is False
+    assert fake.exists_calls == 0
+
+
+def test_listener_applies_published_revocations(revocations, monkeypatch):
+    token = _token()
+    event = json.dumps({"id": rc.token_revocation_id(token), "exp": _exp()})
+    stop = threading.Event()
+
+    fake = FakeRedis()
+    fake.publish(rc.BLACKLIST_CHANNEL, event)
+    fake.on_pubsub_drained = stop.set
+    monkeypatch.setattr(rc, "redis_client", fake)
+
+    rc._listen_blacklist(stop)
+    # Listener stopped: the set is no longer trusted, but it kept the event
+    assert revocations.synced is False
+    assert revocations.contains(rc.token_revocation_id(token))
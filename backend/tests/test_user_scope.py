@@ -0,0 +1,99 @@
+"""
+Tests for cached user scope resolution: same semantics as before, frozenset result,
+no queries on a cache hit, new keys after update_user and structure edits, Redis sharing.
+"""
+from sqlalchemy import event
+
+from database.models import OrganizationUnit, User
+from services import org_unit_service, scope_service
+from services.org_unit_service import invalidate_org_tree
+from services.scope_service import invalidate_user_scope, resolve_user_scope
+from tests.fakes import FakeRedis
+
+
+def _scoped_user(db, viewer_role, branches=(), departments=()):
+    user = User(
+        email="scoped@test.com", hashed_password="x", full_name="Scoped", role_id=viewer_role.id,
+        scope_branches=list(branches), scope_departments=list(departments),
+    )
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
+def _count_queries(db, fn):
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    event.listen(db.get_bind(), "before_cursor_execute", count)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", count)
+    return result, statements
+
+
+def test_scope_semantics(db, admin_user, viewer_role, org_structure):
+    branch, dept = org_structure["branch"], org_structure["department"]
+    assert resolve_user_scope(db, admin_user) is None
+
+    full_branch = _scoped_user(db, viewer_role, branches=[branch.id])
+    assert resolve_user_scope(db, full_branch) == frozenset({branch.id, dept.id})
+
+    # Departments selected inside the branch: only those, not the branch itself
+    full_branch.scope_departments = [dept.id]
+    db.commit()
+    scope = resolve_user_scope(db, full_branch)
+    assert isinstance(scope, frozenset) and scope == frozenset({dept.id})
+
+
+def test_cache_hit_runs_no_queries(db, viewer_role, org_structure):
+    user = _scoped_user(db, viewer_role, branches=[org_structure["branch"].id])
+    first = resolve_user_scope(db, user)
+    second, statements = _count_queries(db, lambda: resolve_user_scope(db, user))
+    assert second is first
+    assert statements == []
+
+
+def test_update_user_and_structure_edit_change_the_scope(client, auth_headers, db, viewer_role, org_structure):
+    branch, dept = org_structure["branch"], org_structure["department"]
+    user = _scoped_user(db, viewer_role, departments=[dept.id])
+    assert resolve_user_scope(db, user) == frozenset({dept.id})
+
+    resp = client.put(f"/api/users/{user.id}", headers=auth_headers, json={
+        "full_name": "Scoped", "email": "scoped@test.com", "role_id": viewer_role.id,
+        "scope_branches": [branch.id], "scope_departments": [],
+    })
+    assert resp.status_code == 200
+    db.refresh(user)
+    assert resolve_user_scope(db, user) == frozenset({branch.id, dept.id})
+
+    resp = client.post("/api/structure/department", headers=auth_headers,
+                       json={"name": "QA", "type": "department", "parent_id": branch.id})
+    assert resolve_user_scope(db, user) == frozenset({branch.id, dept.id, resp.json()["id"]})
+
+
+def test_scope_is_shared_through_redis(db, viewer_role, org_structure, monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(scope_service, "redis_client", fake)
+    monkeypatch.setattr(org_unit_service, "redis_client", fake)
+    user = _scoped_user(db, viewer_role, branches=[org_structure["branch"].id])
+
+    expected = resolve_user_scope(db, user)
+    assert any(k.startswith(f"user_scope:{user.id}:") for k in fake.store)
+
+    # Another worker: empty LRU and tree, served from Redis
+    invalidate_user_scope()
+    with org_unit_service._cache_lock:
+        org_unit_service._cached.update(version=None, tree=None)
+    scope, statements = _count_queries(db, lambda: resolve_user_scope(db, user))
+    assert scope == expected and statements == []
+
+    # A structure change elsewhere (new version) is picked up
+    db.add(OrganizationUnit(name="Новый", type="department", parent_id=org_structure["branch"].id))
+    db.commit()
+    invalidate_org_tree()
+    assert len(resolve_user_scope(db, user)) == len(expected) + 1
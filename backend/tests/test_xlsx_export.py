@@ -0,0 +1,106 @@
+"""
+Tests for the streaming XLSX export: output readable by openpyxl with named styles,
+first bytes before the rows are exhausted, endpoint content for employees and planning.
+"""
+from io import BytesIO
+
+from openpyxl import load_workbook
+
+from services.xlsx_stream import STYLE_NUMBER, XlsxColumn, iter_xlsx
+
+
+COLUMNS = [XlsxColumn("Имя", 20), XlsxColumn("Сумма", 14, STYLE_NUMBER)]
+
+
+def _load(content: bytes):
+    return load_workbook(BytesIO(content)).active
+
+
+def test_stream_is_valid_workbook_with_named_styles():
+    rows = [["Иванов <&>", 1000], ["\x01Ctrl", 2.5], [None, 0]]
+    ws = _load(b"".join(iter_xlsx("Лист/1", COLUMNS, rows)))
+
+    assert ws.title == "Лист 1"
+    assert [c.value for c in ws[1]] == ["Имя", "Сумма"]
+    assert [c.value for c in ws[2]] == ["Иванов <&>", 1000]
+    assert ws["A3"].value == "Ctrl" and ws["B3"].value == 2.5
+    assert ws["A4"].value is None and ws["B4"].value == 0
+
+    assert ws["A1"].style == "FOT Header" and ws["A1"].font.b
+    assert ws["B2"].style == "FOT Number" and ws["B2"].number_format == "#,##0"
+    assert ws.freeze_panes == "A2"
+    assert ws.column_dimensions["A"].width == 20
+
+
+def test_first_bytes_go_out_before_rows_are_exhausted():
+    consumed = []
+
+    def rows():
+        for i in range(20_000):
+            consumed.append(i)
+            yield [f"Сотрудник {i}", i * 1000]
+
+    chunks = iter_xlsx("Big", COLUMNS, rows(), flush_bytes=16 * 1024)
+    first = next(chunks)
+    assert first.startswith(b"PK") and len(consumed) < 1000
+
+    rest = list(chunks)
+    assert len(consumed) == 20_000
+    # Bounded chunks: nothing accumulates the whole file
+    assert len(rest) > 2 and max(len(c) for c in rest) < 16 * 1024 * 4
+
+    ws = _load(b"".join([first] + rest))
+    assert ws.max_row == 20_001
+    assert ws["A20001"].value == "Сотрудник 19999"
+
+
+def test_employee_export_content(client, auth_headers, employee):
+    resp = client.post("/api/employees/export", headers=auth_headers, json={})
+    assert resp.status_code == 200
+    ws = _load(resp.content)
+    assert ws.title == "Сотрудники"
+    row = [c.value for c in ws[2]]
+    assert row[:5] == ["Иванов Иван", "Разработчик", "Филиал Алматы", "IT Отдел", "Активен"]
+    assert row[5:] == [300000, 400000, 50000, 65000, 0, 0, 350000, 465000]
+
+
+def test_planning_export_content_and_ids_filter(client, auth_headers, planning_position):
+    resp = client.post("/api/planning/export", headers=auth_headers, json={})
+    assert resp.status_code == 200
+    ws = _load(resp.content)
+    assert ws.max_row == 2
+    row = [c.value for c in ws[2]]
+    assert row[:5] == ["Разработчик", "Филиал Алматы", "IT Отдел", "5/2", 3]
+    assert row[-2:] == [(300000 + 50000) * 3, (400000 + 65000) * 3]
+
+    resp = client.post("/api/planning/export", headers=auth_headers, json={"ids": [planning_position.id + 1]})
+    assert _load(resp.content).max_row == 1
+
+
+def test_request_session_stays_open_while_rows_stream(client, auth_headers, db, employee, monkeypatch):
+    """Rows are read from the request's session while the body streams, not before."""
+    import routers.employees as employees_router
+    from database.database import get_db
+    from main import app
+
+    closed = []
+
+    def tracked_get_db():
+        try:
+            yield db
+        finally:
+            closed.append(True)
+
+    original = employees_router.employee_export_rows
+
+    def rows(*args):
+        for row in original(*args):
+            assert not closed, "request session closed before the export finished streaming"
+            yield row
+
+    monkeypatch.setitem(app.dependency_overrides, get_db, tracked_get_db)
+    monkeypatch.setattr(employees_router, "employee_export_rows", rows)
+    resp = client.post("/api/employees/export", headers=auth_headers, json={})
+    assert resp.status_code == 200
+    assert _load(resp.content)["A2"].value == "Иванов Иван"
+    assert closed
@@ -3,72 +3,206 @@ FIX NEW-3, NEW-4: Redis-based rate limiter.
 Работает корректно в multi-worker/Docker окружении — все воркеры
 используют одно хранилище счётчиков.
 Fallback: in-memory при недоступном Redis (одиночный сервер).
+
+Algorithm: GCRA (generic cell rate algorithm, i.e. a token bucket stored as one
+timestamp). A policy allows `limit` requests in a burst, refilled evenly over
+`period_seconds`. One EVALSHA per check, one small string key per subject, using
+the Redis server clock so workers don't need synchronized clocks.
+
+Policies are configured per route (ROUTE_POLICIES) and can be overridden with env
+RATE_LIMIT_<POLICY>="<limit>/<period_seconds>", e.g. RATE_LIMIT_LOGIN="10/300".
 """
+import os
+import re
 import time
+import hashlib
 import threading
 import logging
-from collections import defaultdict
-from database.redis_client import redis_client
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from redis.exceptions import NoScriptError
+
+from database.redis_client import async_redis_client, redis_client
+from utils.redis_metrics import timed, timed_async
 
 logger = logging.getLogger("fot.ratelimit")
 
-# In-memory fallback (только когда Redis недоступен)
-_fallback_store: dict[str, list[float]] = defaultdict(list)
+_KEY_PREFIX = "ratelimit:gcra:"
+
+# KEYS[1] = bucket key; ARGV[1] = emission interval (ms); ARGV[2] = burst tolerance (ms)
+# Returns {allowed (0/1), retry_after_ms}
+_GCRA_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+local new_tat = tat + interval
+local allow_at = new_tat - tolerance
+if allow_at > now then
+    return {0, allow_at - now}
+end
+redis.call('SET', KEYS[1], string.format('%d', new_tat), 'PX', string.format('%d', new_tat - now))
+return {1, 0}
+"""
+_GCRA_SHA = hashlib.sha1(_GCRA_LUA.encode()).hexdigest()
+
+# In-memory fallback (только когда Redis недоступен): key -> TAT, least recently used first
+FALLBACK_MAX_KEYS = 10000
+_fallback_store: "OrderedDict[str, float]" = OrderedDict()
 _fallback_lock = threading.Lock()
 
 
-def check_rate_limit(key: str, max_attempts: int, window_seconds: int) -> bool:
-    """
-    Проверяет rate limit для ключа (IP, token и т.д.).
-    Возвращает True если лимит превышен (нужно блокировать).
-    
-    Алгоритм: sliding window counter в Redis.
-    """
-    redis_key = f"ratelimit:{key}"
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    name: str
+    limit: int
+    period_seconds: float
 
-    if redis_client:
+    @property
+    def interval_ms(self) -> int:
+        return max(1, int(self.period_seconds * 1000 / self.limit))
+
+    @property
+    def tolerance_ms(self) -> int:
+        return int(self.period_seconds * 1000)
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    retry_after: float = 0.0  # seconds
+
+
+def _policy(name: str, limit: int, period_seconds: float) -> RateLimitPolicy:
+    raw = os.environ.get(f"RATE_LIMIT_{name.upper()}")
+    if raw:
         try:
-            pipe = redis_client.pipeline()
-            now = time.time()
-            window_start = now - window_seconds
+            raw_limit, raw_period = raw.split("/", 1)
+            parsed_limit, parsed_period = int(raw_limit), float(raw_period)
+            if parsed_limit <= 0 or parsed_period <= 0:
+                raise ValueError(raw)
+            limit, period_seconds = parsed_limit, parsed_period
+        except ValueError:
+            logger.warning("Ignoring invalid RATE_LIMIT_%s=%r", name.upper(), raw)
+    return RateLimitPolicy(name, limit, period_seconds)
+
+
+POLICIES = {
+    p.name: p for p in (
+        _policy("login", int(os.environ.get("RATE_LIMIT_MAX", "10")), 300),
+        _policy("offer_unlock", 5, 900),
+        _policy("offer_action", 5, 900),
+        _policy("avatar_upload", 10, 3600),
+        _policy("resume_upload", 60, 3600),
+    )
+}
+
+# (method, path pattern, policy). A named group "subject" keys the bucket by that
+# path segment (the offer token), otherwise by client IP.
+ROUTE_POLICIES = (
+    ("POST", re.compile(r"^/api/auth/login$"), "login"),
+    ("POST", re.compile(r"^/api/offers/public/(?P<subject>[^/]+)/unlock$"), "offer_unlock"),
+    ("POST", re.compile(r"^/api/offers/public/(?P<subject>[^/]+)/action$"), "offer_action"),
+    ("POST", re.compile(r"^/api/users/(me|\d+)/avatar$"), "avatar_upload"),
+    ("POST", re.compile(r"^/api/candidates/\d+/resume$"), "resume_upload"),
+)
 
-            # Sliding window: добавляем текущий timestamp, удаляем старые
-            pipe.zremrangebyscore(redis_key, 0, window_start)
-            pipe.zadd(redis_key, {str(now): now})
-            pipe.zcard(redis_key)
-            pipe.expire(redis_key, window_seconds + 1)
-            results = pipe.execute()
 
-            count = results[2]  # zcard result
-            return count > max_attempts
+def match_route(method: str, path: str) -> Optional[tuple[RateLimitPolicy, Optional[str]]]:
+    """Policy of a request and the path-derived subject (None: key by client IP)."""
+    for route_method, pattern, policy_name in ROUTE_POLICIES:
+        if method != route_method:
+            continue
+        match = pattern.match(path)
+        if match:
+            return POLICIES[policy_name], match.groupdict().get("subject")
+    return None
 
+
+def _result(reply) -> RateLimitResult:
+    allowed, retry_after_ms = int(reply[0]), int(reply[1])
+    return RateLimitResult(allowed == 1, retry_after_ms / 1000)
+
+
+def hit(policy: RateLimitPolicy, subject: str) -> RateLimitResult:
+    """Count one request of `subject` against `policy`. Blocking: sync code only."""
+    key = f"{_KEY_PREFIX}{policy.name}:{subject}"
+    if redis_client:
+        try:
+            with timed("rate_limit"):
+                try:
+                    reply = redis_client.evalsha(_GCRA_SHA, 1, key, policy.interval_ms, policy.tolerance_ms)
+                except NoScriptError:
+                    reply = redis_client.eval(_GCRA_LUA, 1, key, policy.interval_ms, policy.tolerance_ms)
+            return _result(reply)
+        except Exception as e:
+            logger.warning("Redis rate limit check failed: %s — using in-memory fallback", e)
+    return _hit_fallback(key, policy)
+
+
+async def hit_async(policy: RateLimitPolicy, subject: str) -> RateLimitResult:
+    """hit() on the async Redis client: does not block the event loop."""
+    key = f"{_KEY_PREFIX}{policy.name}:{subject}"
+    if async_redis_client:
+        try:
+            async with timed_async("rate_limit"):
+                try:
+                    reply = await async_redis_client.evalsha(_GCRA_SHA, 1, key, policy.interval_ms, policy.tolerance_ms)
+                except NoScriptError:
+                    reply = await async_redis_client.eval(_GCRA_LUA, 1, key, policy.interval_ms, policy.tolerance_ms)
+            return _result(reply)
         except Exception as e:
             logger.warning("Redis rate limit check failed: %s — using in-memory fallback", e)
+    return _hit_fallback(key, policy)
 
-    # Fallback: in-memory (только для одного воркера)
+
+def _hit_fallback(key: str, policy: RateLimitPolicy) -> RateLimitResult:
+    # Fallback: in-memory (только для одного воркера), same GCRA as the Lua script
     now = time.time()
+    interval = policy.interval_ms / 1000
+    tolerance = policy.tolerance_ms / 1000
     with _fallback_lock:
-        _fallback_store[key] = [
-            t for t in _fallback_store[key]
-            if now - t < window_seconds
-        ]
-        if len(_fallback_store[key]) >= max_attempts:
-            return True
-        _fallback_store[key].append(now)
-        # Ограничиваем размер словаря
-        if len(_fallback_store) > 10000:
-            oldest = next(iter(_fallback_store))
-            del _fallback_store[oldest]
-    return False
+        tat = max(_fallback_store.get(key, now), now)
+        new_tat = tat + interval
+        allow_at = new_tat - tolerance
+        if allow_at > now:
+            _fallback_store.move_to_end(key)
+            return RateLimitResult(False, allow_at - now)
+        _fallback_store[key] = new_tat
+        _fallback_store.move_to_end(key)
+        # Bounded: evict the least recently used buckets
+        while len(_fallback_store) > FALLBACK_MAX_KEYS:
+            _fallback_store.popitem(last=False)
+    return RateLimitResult(True)
+
+
+def check_rate_limit(key: str, max_attempts: int, window_seconds: int) -> bool:
+    """
+    Проверяет rate limit для ключа (IP, token и т.д.).
+    Возвращает True если лимит превышен (нужно блокировать).
+    Ad-hoc policy for callers outside ROUTE_POLICIES.
+    """
+    return not hit(RateLimitPolicy("adhoc", max_attempts, window_seconds), key).allowed
+
+
+async def check_rate_limit_async(key: str, max_attempts: int, window_seconds: int) -> bool:
+    """check_rate_limit on the async Redis client."""
+    return not (await hit_async(RateLimitPolicy("adhoc", max_attempts, window_seconds), key)).allowed
 
 
 def reset_rate_limit(key: str):
-    """Сбросить счётчик для ключа (например, после успешного входа)."""
-    redis_key = f"ratelimit:{key}"
+    """Сбросить счётчик для ключа check_rate_limit (например, после успешного входа)."""
+    redis_key = f"{_KEY_PREFIX}adhoc:{key}"
     if redis_client:
         try:
             redis_client.delete(redis_key)
         except Exception:
             pass
     with _fallback_lock:
-        _fallback_store.pop(key, None)
+        _fallback_store.pop(redis_key, None)
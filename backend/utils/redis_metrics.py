@@ -0,0 +1,105 @@
+"""
+In-process Redis metrics: per-operation latency and errors plus connection pool usage,
+for the sync and the async client. Read through GET /api/admin/redis-metrics.
+
+Counters are per worker (each worker has its own pools).
+"""
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Optional
+
+# Upper bounds (ms) of the latency buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_lock = threading.Lock()
+_ops: dict[tuple[str, str], dict[str, Any]] = {}
+
+
+def _new_stats() -> dict[str, Any]:
+    return {
+        "count": 0,
+        "errors": 0,
+        "total_ms": 0.0,
+        "max_ms": 0.0,
+        "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+    }
+
+
+def observe(client: str, op: str, seconds: float, ok: bool = True) -> None:
+    """Record one call of `op` made through `client` ("sync" / "async")."""
+    ms = seconds * 1000
+    bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if ms <= bound), len(LATENCY_BUCKETS_MS))
+    with _lock:
+        stats = _ops.get((client, op))
+        if stats is None:
+            stats = _ops[(client, op)] = _new_stats()
+        stats["count"] += 1
+        stats["total_ms"] += ms
+        stats["max_ms"] = max(stats["max_ms"], ms)
+        stats["buckets"][bucket] += 1
+        if not ok:
+            stats["errors"] += 1
+
+
+@contextmanager
+def timed(op: str):
+    """Time a sync Redis call; exceptions are counted as errors and re-raised."""
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        observe("sync", op, time.perf_counter() - start, ok)
+
+
+@asynccontextmanager
+async def timed_async(op: str):
+    """Async counterpart of timed()."""
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        observe("async", op, time.perf_counter() - start, ok)
+
+
+def pool_stats(pool: Optional[Any]) -> Optional[dict[str, Any]]:
+    """Size and usage of a redis-py connection pool (sync or asyncio)."""
+    if pool is None:
+        return None
+    available = len(getattr(pool, "_available_connections", ()))
+    in_use = len(getattr(pool, "_in_use_connections", ()))
+    return {
+        "max_connections": getattr(pool, "max_connections", None),
+        "created": getattr(pool, "_created_connections", available + in_use),
+        "in_use": in_use,
+        "idle": available,
+    }
+
+
+def snapshot() -> dict[str, Any]:
+    with _lock:
+        ops = [
+            {
+                "client": client,
+                "op": op,
+                "count": s["count"],
+                "errors": s["errors"],
+                "avg_ms": round(s["total_ms"] / s["count"], 3) if s["count"] else 0.0,
+                "max_ms": round(s["max_ms"], 3),
+                "buckets": {
+                    **{f"le_{bound}ms": n for bound, n in zip(LATENCY_BUCKETS_MS, s["buckets"])},
+                    "inf": s["buckets"][-1],
+                },
+            }
+            for (client, op), s in sorted(_ops.items())
+        ]
+    return {"operations": ops}
+
+
+def reset() -> None:
+    with _lock:
+        _ops.clear()